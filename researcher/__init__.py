@@ -0,0 +1,3 @@
+"""Track genealogical research and the conclusions drawn from it."""
+
+default_app_config = 'researcher.apps.ResearcherConfig'
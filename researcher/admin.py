@@ -1,6 +1,8 @@
 """Display the model editing dashboard."""
 from django.contrib import admin
-from researcher import models
+from researcher import jobs, loaders, models
+from researcher.inlines import PaginatedInlinesMixin, PaginatedTabularInline
+from researcher.pagination import ApproximateCountPaginator, KeysetChangeList
 
 
 class ResearcherAdminSite(admin.AdminSite):
@@ -11,32 +13,124 @@ class ResearcherAdminSite(admin.AdminSite):
     site_title = 'Site Admin | Researcher\'s Friend'
     index_title = 'Administration'
 
+
 ADMIN_SITE = ResearcherAdminSite(name='admin')
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+
+    """ Changelist mode for tables with millions of rows.
+
+    Pages by seeking on the primary key instead of OFFSET and shows the
+    planner's row estimate instead of COUNT(*) once a table passes
+    RESEARCHER_APPROXIMATE_COUNT_THRESHOLD rows.  Subclasses should set
+    list_select_related to the relations shown in list_display.
+    """
+
+    paginator = ApproximateCountPaginator
+    change_list_template = 'admin/researcher/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        """Use the keyset changelist."""
+        return KeysetChangeList
+
+
+class BatchedListMixin(object):
+
+    """ Load what a changelist page shows for all its rows at once.
+
+    The relation paths in list_walk (see researcher.loaders) are walked
+    for the whole page through the request's loaders, so the columns
+    that follow them run no queries of their own.  Override load_results
+    to load anything else.
+    """
+
+    list_walk = ()
+
+    def get_changelist(self, request, **kwargs):
+        """Wrap the changelist so that each page is loaded in batches."""
+        changelist = super(BatchedListMixin, self).get_changelist(
+            request,
+            **kwargs
+        )
+
+        class BatchedChangeList(changelist):
+
+            """ The changelist, loading each page's relations at once."""
+
+            def get_results(self, request):
+                """Fetch a page, then what its columns show."""
+                super(BatchedChangeList, self).get_results(request)
+                self.model_admin.load_results(
+                    loaders.current() or loaders.LoaderContext(),
+                    self.result_list
+                )
+
+        return BatchedChangeList
+
+    def load_results(self, context, results):
+        """Load what the columns show for a page of results.
+
+        Arguments:
+            self
+            context -- the LoaderContext to load through
+            results -- the objects on the page
+        """
+        for path in self.list_walk:
+            context.walk(results, path)
+
+
 # Administrative
 
 
-class ResearcherProjectInline(admin.TabularInline):
+class ResearcherProjectInline(PaginatedTabularInline):
 
     """ Inline ResearcherProject for Researcher/Project Admin."""
 
     model = models.ResearcherProject
     extra = 0
+    list_select_related = ['researcher', 'project']
 
 
-class ResearcherAdmin(admin.ModelAdmin):
+class ResearcherAdmin(PaginatedInlinesMixin, admin.ModelAdmin):
 
     """ Custom Researcher Admin."""
 
     inlines = [ResearcherProjectInline]
 
 
-class ProjectAdmin(admin.ModelAdmin):
+def _queue_for_projects(name, description):
+    """Make an admin action that queues a job for each selected project."""
+    def action(modeladmin, request, queryset):
+        """Queue the jobs and say so."""
+        researcher = getattr(request.user, 'researcher', None)
+        for project in queryset.values_list('pk', flat=True):
+            jobs.enqueue(name, researcher=researcher, project=project)
+        modeladmin.message_user(
+            request,
+            '%d jobs queued; see their progress under Jobs.' % len(queryset)
+        )
+    action.__name__ = 'queue_%s' % name.replace('.', '_')
+    action.short_description = description
+    return action
+
 
-    """ Custom Project Admin."""
+class ProjectAdmin(PaginatedInlinesMixin, admin.ModelAdmin):
+
+    """ Custom Project Admin.
+
+    The heavy work on a project is queued as jobs rather than run while
+    the page waits.
+    """
 
     inlines = [ResearcherProjectInline]
+    actions = [
+        _queue_for_projects('sanity.validate', 'Validate selected projects'),
+        _queue_for_projects('gaps.refresh',
+                            'Find research gaps of selected projects'),
+        _queue_for_projects('network.build',
+                            'Export family networks of selected projects'),
+    ]
 
 
 class SuretySchemePartInline(admin.TabularInline):
@@ -54,39 +148,103 @@ class SuretySchemeAdmin(admin.ModelAdmin):
     inlines = [SuretySchemePartInline]
 
 
+class SearchAdmin(LargeTableAdmin):
+
+    """ Custom Search Admin."""
+
+    list_display = ['searched_for', 'researcher', 'status', 'scheduled_date']
+    list_select_related = ['researcher']
+
+
 class ResearchObjectiveAdmin(admin.ModelAdmin):
 
     """ Custom Research Objective Admin."""
 
     filter_horizontal = ['activities']
 
+
 ADMIN_SITE.register(models.Researcher, ResearcherAdmin)
 ADMIN_SITE.register(models.Project, ProjectAdmin)
 ADMIN_SITE.register(models.SuretyScheme, SuretySchemeAdmin)
 ADMIN_SITE.register(models.AdministrativeTask)
-ADMIN_SITE.register(models.Search)
+ADMIN_SITE.register(models.Search, SearchAdmin)
 ADMIN_SITE.register(models.ResearchObjective, ResearchObjectiveAdmin)
 ADMIN_SITE.register(models.SourceGroup)
 
+
+# Jobs
+
+
+class JobAdmin(admin.ModelAdmin):
+
+    """ Job status, with cancel and retry actions.
+
+    Jobs are queued by the code and admin actions that need them, and
+    changed only by their workers, so they are read-only here.
+    """
+
+    list_display = [
+        'id',
+        'task',
+        'status',
+        'progress_percent',
+        'progress_message',
+        'attempts',
+        'researcher',
+        'created',
+        'started',
+        'finished',
+    ]
+    list_filter = ['status', 'task']
+    list_select_related = ['researcher']
+    search_fields = ['task', 'worker']
+    actions = ['cancel_jobs', 'retry_jobs']
+    readonly_fields = [field.name for field in models.Job._meta.fields]
+
+    def has_add_permission(self, request):
+        """Jobs are queued by code, not typed in."""
+        return False
+
+    def progress_percent(self, job):
+        """Show the progress as a percentage."""
+        return '%d%%' % round(job.progress * 100)
+    progress_percent.short_description = 'progress'
+
+    def cancel_jobs(self, request, queryset):
+        """Cancel the selected jobs."""
+        self.message_user(request, '%d jobs cancelled or asked to stop.' %
+                          jobs.cancel(queryset.values_list('pk', flat=True)))
+    cancel_jobs.short_description = 'Cancel selected jobs'
+
+    def retry_jobs(self, request, queryset):
+        """Queue the selected failed or cancelled jobs again."""
+        self.message_user(request, '%d jobs queued again.' %
+                          jobs.retry(queryset.values_list('pk', flat=True)))
+    retry_jobs.short_description = 'Retry selected failed jobs'
+
+
+ADMIN_SITE.register(models.Job, JobAdmin)
+
 # Evidence
 
 
-class RepositorySourceInline(admin.TabularInline):
+class RepositorySourceInline(PaginatedTabularInline):
 
     """ Inline RepositorySource for Repository/Source Admin."""
 
     model = models.RepositorySource
     extra = 0
+    raw_id_fields = ['repository', 'source', 'activity']
 
 
-class RepositoryAdmin(admin.ModelAdmin):
+class RepositoryAdmin(PaginatedInlinesMixin, admin.ModelAdmin):
 
     """ Custom Repository Admin."""
 
     inlines = [RepositorySourceInline]
 
 
-class CitationPartInline(admin.TabularInline):
+class CitationPartInline(PaginatedTabularInline):
 
     """ Inline CitationPart for Source Admin."""
 
@@ -94,35 +252,75 @@ class CitationPartInline(admin.TabularInline):
     extra = 0
 
 
-class SourceAdmin(admin.ModelAdmin):
+class CitationPartAdmin(LargeTableAdmin):
+
+    """ Custom CitationPart Admin."""
+
+    list_display = ['value', 'citation_part_type_name', 'source']
+    list_select_related = ['source']
+
+
+class SourceAdmin(BatchedListMixin, PaginatedInlinesMixin, admin.ModelAdmin):
 
     """ Custom Source Admin."""
 
     inlines = [RepositorySourceInline, CitationPartInline]
+    list_display = ['id', 'citation', 'subject_date_start', 'subject_date_end']
+    list_walk = ['citationpart_set']
+
 
 ADMIN_SITE.register(models.Source, SourceAdmin)
 ADMIN_SITE.register(models.Repository, RepositoryAdmin)
 ADMIN_SITE.register(models.Representation)
 ADMIN_SITE.register(models.RepresentationType)
+ADMIN_SITE.register(models.CitationPart, CitationPartAdmin)
 ADMIN_SITE.register(models.CitationPartType)
 
 # Conclusions
 
 
-class AssertionAssertionInline(admin.TabularInline):
+class AssertionAssertionInline(PaginatedTabularInline):
 
     """ Inline AssertionAssertion for Assertion Admin."""
 
     model = models.AssertionAssertion
     fk_name = 'assertion_high'
     extra = 0
+    raw_id_fields = ['assertion_low']
 
 
-class AssertionAdmin(admin.ModelAdmin):
+class AssertionAdmin(BatchedListMixin, PaginatedInlinesMixin,
+                     LargeTableAdmin):
 
     """ Custom Assertion Admin."""
 
     inlines = [AssertionAssertionInline]
+    list_display = [
+        'id',
+        'subject1_display',
+        'value_role',
+        'subject2_display',
+        'researcher',
+        'source',
+        'surety_scheme_part',
+        'disproved'
+    ]
+    list_select_related = ['researcher', 'source', 'surety_scheme_part']
+
+    def load_results(self, context, results):
+        """Load the subjects of a page of assertions, a query a kind."""
+        super(AssertionAdmin, self).load_results(context, results)
+        context.subjects(results, (1, 2))
+
+    def subject1_display(self, assertion):
+        """Show the first subject."""
+        return assertion.get_subject1()
+    subject1_display.short_description = 'subject 1'
+
+    def subject2_display(self, assertion):
+        """Show the second subject."""
+        return assertion.get_subject2()
+    subject2_display.short_description = 'subject 2'
 
 
 class CharacteristicPartInline(admin.TabularInline):
@@ -170,7 +368,14 @@ class GroupTypeAdmin(admin.ModelAdmin):
     inlines = [GroupTypeRoleInline]
 
 
-class PlacePartInline(admin.TabularInline):
+class PersonaAdmin(LargeTableAdmin):
+
+    """ Custom Persona Admin."""
+
+    list_display = ['id', 'name']
+
+
+class PlacePartInline(PaginatedTabularInline):
 
     """ Inline PlacePart for Place Admin."""
 
@@ -178,11 +383,20 @@ class PlacePartInline(admin.TabularInline):
     extra = 0
 
 
-class PlaceAdmin(admin.ModelAdmin):
+class PlaceAdmin(BatchedListMixin, PaginatedInlinesMixin, admin.ModelAdmin):
 
     """ Custom Place Admin."""
 
     inlines = [PlacePartInline]
+    list_display = ['__str__', 'parts']
+    list_walk = ['placepart_set']
+
+    def parts(self, place):
+        """Show the place parts with their types."""
+        return '; '.join(
+            '%s: %s' % part for part in place.labelled_parts()
+        )
+
 
 ADMIN_SITE.register(models.Assertion, AssertionAdmin)
 ADMIN_SITE.register(models.Characteristic, CharacteristicAdmin)
@@ -191,6 +405,6 @@ ADMIN_SITE.register(models.Event)
 ADMIN_SITE.register(models.EventType, EventTypeAdmin)
 ADMIN_SITE.register(models.Group)
 ADMIN_SITE.register(models.GroupType, GroupTypeAdmin)
-ADMIN_SITE.register(models.Persona)
+ADMIN_SITE.register(models.Persona, PersonaAdmin)
 ADMIN_SITE.register(models.Place, PlaceAdmin)
 ADMIN_SITE.register(models.PlacePartType)
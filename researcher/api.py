@@ -0,0 +1,775 @@
+"""Serve researcher data as read-only JSON.
+
+Each resource is a model exposed at `api/<resource>/` (a page of rows)
+and `api/<resource>/<id>/` (one row).  Lists accept:
+
+    limit -- rows per page (default 50, at most 500)
+    cursor -- the opaque `next` value of the previous page
+    ids -- a comma separated list of ids to fetch
+    fields -- a comma separated list of fields to return (id is always
+        returned)
+    include -- a comma separated list of relations to load alongside
+        the rows, e.g. `include=place.place_parts,event_type`.  Every
+        model at each level of the includes costs one query per
+        request, however many rows and relations lead to it; lookup
+        tables cost none.  An assertion's `subject1` and `subject2`
+        include the persona, event, characteristic or group named by
+        its `subject1_type` and `subject2_type`; nothing can be
+        included beyond them.
+
+Assertions moved to the archive (see researcher.archive) are still
+served by `api/assertions/<id>/` and `ids=`, read from the archive.
+
+Responses carry a weak ETag built from the versions of the tables they
+read (see researcher.versions), so a client repeating a request with
+If-None-Match gets a 304 without touching the database.
+
+`api/personas/<id>/pedigree/` and `api/personas/<id>/descendants/` serve
+a persona's charts (see researcher.charts), `generations` deep, and
+`api/personas/<id>/timeline/` its timeline (see researcher.timeline).
+`api/projects/<id>/gaps/` pages through a project's research gaps (see
+researcher.gaps), filtered by `gap=` kinds and, with `open=1`, to those
+without an objective.  Each entry is an array in the order given by the
+response's `fields`.
+
+Exports:
+    Functions:
+        chart_view
+        detail_view
+        gaps_view
+        list_view
+        register
+        timeline_view
+    Classes:
+        Relation
+        Resource
+"""
+import base64
+import hashlib
+import json
+
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotModified,
+)
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from researcher import (
+    archive,
+    charts,
+    gaps,
+    loaders,
+    models,
+    replicas,
+    timeline,
+)
+from researcher.lookups import is_lookup_model, lookup
+from researcher.versions import table_versions
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+GAP_FIELDS = ['id', 'persona', 'persona_name', 'gap', 'detail', 'objective']
+
+
+class Relation(object):
+
+    """A relation that can be loaded with `include=`.
+
+    Instance Variables:
+        name -- The name used in `include=`.
+        resource -- The name of the related resource.
+        field -- For a to-one relation, the foreign key on this
+            resource; for a to-many relation, the foreign key on the
+            related resource that points back here.
+        many -- Whether this is a to-many relation.
+        kinds -- For a to-one relation whose resource depends on a type
+            code held in `<field>_type`, as an assertion's subjects do,
+            a dict mapping the codes to resource names; None otherwise.
+    """
+
+    def __init__(self, name, resource=None, field=None, many=False,
+                 kinds=None):
+        """Describe the relation."""
+        self.name = name
+        self.resource = resource
+        self.field = field or name
+        self.many = many
+        self.kinds = kinds
+
+    def targets(self):
+        """List the resources the relation can lead to.
+
+        Returns: (type code, resource name) pairs, with a type code of
+            None for a relation to a single resource
+        """
+        if self.kinds is None:
+            return [(None, self.resource)]
+        return sorted(self.kinds.items())
+
+
+class Resource(object):
+
+    """A model exposed through the API.
+
+    Instance Variables:
+        name -- The URL name of the resource, e.g. 'places'.
+        model -- The model class.
+        fields -- The model fields that may be returned.
+        relations -- The Relations that may be included.
+        endpoint -- Whether the resource has its own URLs or can only
+            be included from another resource.
+    """
+
+    def __init__(self, name, model, fields, relations=(), endpoint=True):
+        """Describe the resource."""
+        self.name = name
+        self.model = model
+        self.fields = list(fields)
+        self.relations = dict((rel.name, rel) for rel in relations)
+        self.endpoint = endpoint
+
+    def column(self, field_name):
+        """Map a field name to the column name returned by values().
+
+        Arguments:
+            self
+            field_name -- the model field name
+        Returns: the attribute name, e.g. 'place_id' for 'place'
+        """
+        return self.model._meta.get_field(field_name).attname
+
+    def rows(self, fields, limit=None, **filters):
+        """Fetch rows as dicts keyed by field name, in id order.
+
+        Lookup tables are served from memory; other tables cost one
+        query that selects only the requested columns.
+
+        Arguments:
+            self
+            fields -- the field names to return
+            limit -- the most rows to return (default all)
+            filters -- queryset filter arguments
+        Returns: a list of dicts, each including 'id'
+        """
+        if is_lookup_model(self.model):
+            table = lookup(self.model).all()
+            if 'pk__in' in filters:
+                wanted = set(filters['pk__in'])
+                table = [obj for obj in table if obj.pk in wanted]
+            return self.serialize(table, fields)
+
+        columns = [('id', 'id')] + [
+            (name, self.column(name)) for name in fields if name != 'id'
+        ]
+        queryset = self.model._default_manager.filter(**filters)
+        values = queryset.order_by('pk').values(*[c for _, c in columns])
+        if limit is not None:
+            values = values[:limit]
+        return [
+            dict((name, row[column]) for name, column in columns)
+            for row in values
+        ]
+
+    def serialize(self, objects, fields):
+        """Turn model instances into row dicts as rows() returns them.
+
+        Arguments:
+            self
+            objects -- instances of the resource's model
+            fields -- the field names to return
+        Returns: a list of dicts, each including 'id'
+        """
+        columns = [('id', 'id')] + [
+            (name, self.column(name)) for name in fields if name != 'id'
+        ]
+        return [
+            dict((name, getattr(obj, column)) for name, column in columns)
+            for obj in objects
+        ]
+
+
+RESOURCES = {}
+
+
+def register(resource):
+    """Add a resource to the API."""
+    RESOURCES[resource.name] = resource
+
+
+register(Resource('sources', models.Source, [
+    'higher_source',
+    'subject_place',
+    'jurisdiction_place',
+    'researcher',
+    'subject_date_start',
+    'subject_date_end',
+    'comment',
+], [
+    Relation('higher_source', 'sources'),
+    Relation('subject_place', 'places'),
+    Relation('jurisdiction_place', 'places'),
+    Relation('citation_parts', 'citation_parts', 'source', many=True),
+    Relation(
+        'repository_sources',
+        'repository_sources',
+        'source',
+        many=True
+    ),
+]))
+register(Resource('repositories', models.Repository, [
+    'place',
+    'name',
+    'address',
+    'phone',
+    'hours',
+    'comments',
+], [
+    Relation('place', 'places'),
+    Relation(
+        'repository_sources',
+        'repository_sources',
+        'repository',
+        many=True
+    ),
+]))
+register(Resource('places', models.Place, [
+    'existence_date_start',
+    'existence_date_end',
+    'sort_order',
+], [
+    Relation('place_parts', 'place_parts', 'place', many=True),
+]))
+register(Resource('personas', models.Persona, [
+    'name',
+    'description_comments',
+]))
+register(Resource('events', models.Event, [
+    'event_type',
+    'place',
+    'name',
+    'date_start',
+    'date_end',
+], [
+    Relation('event_type', 'event_types'),
+    Relation('place', 'places'),
+]))
+register(Resource('characteristics', models.Characteristic, [
+    'place',
+    'date_start',
+    'date_end',
+    'sort_order',
+], [
+    Relation('place', 'places'),
+    Relation(
+        'characteristic_parts',
+        'characteristic_parts',
+        'characteristic',
+        many=True
+    ),
+]))
+register(Resource('groups', models.Group, [
+    'group_type',
+    'place',
+    'name',
+    'date_start',
+    'date_end',
+    'criteria',
+], [
+    Relation('group_type', 'group_types'),
+    Relation('place', 'places'),
+]))
+SUBJECT_RESOURCES = {
+    'P': 'personas',
+    'E': 'events',
+    'C': 'characteristics',
+    'G': 'groups',
+}
+
+register(Resource('assertions', models.Assertion, [
+    'surety_scheme_part',
+    'researcher',
+    'source',
+    'subject1_type',
+    'subject1',
+    'subject2_type',
+    'subject2',
+    'value_role',
+    'rationale',
+    'disproved',
+], [
+    Relation('surety_scheme_part', 'surety_scheme_parts'),
+    Relation('source', 'sources'),
+    Relation('subject1', kinds=SUBJECT_RESOURCES),
+    Relation('subject2', kinds=SUBJECT_RESOURCES),
+]))
+
+# Resources that are only reachable through include=.
+register(Resource('citation_parts', models.CitationPart, [
+    'source',
+    'citation_part_type',
+    'value',
+], [
+    Relation('citation_part_type', 'citation_part_types'),
+], endpoint=False))
+register(Resource('repository_sources', models.RepositorySource, [
+    'repository',
+    'source',
+    'activity',
+    'call_number',
+    'description',
+], [
+    Relation('repository', 'repositories'),
+    Relation('source', 'sources'),
+], endpoint=False))
+register(Resource('place_parts', models.PlacePart, [
+    'place_part_type',
+    'place',
+    'name',
+    'sequence_number',
+], [
+    Relation('place_part_type', 'place_part_types'),
+], endpoint=False))
+register(Resource('characteristic_parts', models.CharacteristicPart, [
+    'characteristic',
+    'characteristic_part_type',
+    'name',
+    'sequence_number',
+], [
+    Relation('characteristic_part_type', 'characteristic_part_types'),
+], endpoint=False))
+register(Resource('event_types', models.EventType, ['name'], endpoint=False))
+register(Resource('group_types', models.GroupType, [
+    'name',
+    'sort_order',
+], endpoint=False))
+register(Resource('surety_scheme_parts', models.SuretySchemePart, [
+    'surety_scheme',
+    'name',
+    'description',
+    'sequence_number',
+], endpoint=False))
+register(Resource('citation_part_types', models.CitationPartType, [
+    'name',
+], endpoint=False))
+register(Resource('place_part_types', models.PlacePartType, [
+    'name',
+], endpoint=False))
+register(Resource('characteristic_part_types', models.CharacteristicPartType, [
+    'name',
+], endpoint=False))
+
+
+class BadRequest(Exception):
+
+    """A query string the API cannot satisfy."""
+
+
+def _split(value):
+    """Split a comma separated query parameter into a list."""
+    return [part for part in value.split(',') if part] if value else []
+
+
+def _endpoint(name):
+    """Find a resource that has its own URLs.
+
+    Arguments:
+        name -- the resource name from the URL
+    Returns: the Resource
+    Raises: Http404 if there is no such resource
+    """
+    resource = RESOURCES.get(name)
+    if resource is None or not resource.endpoint:
+        raise Http404('No such resource.')
+    return resource
+
+
+def _fields(resource, request, tree):
+    """Decide which fields to return.
+
+    The foreign keys of included to-one relations are always returned,
+    so that clients can find the included rows.
+
+    Arguments:
+        resource -- the Resource being listed
+        request -- the current request
+        tree -- the include tree from _include_tree
+    Returns: the list of field names
+    Raises: BadRequest for unknown fields
+    """
+    fields = _split(request.GET.get('fields'))
+    if not fields:
+        return resource.fields
+    unknown = set(fields) - set(resource.fields) - set(['id'])
+    if unknown:
+        raise BadRequest('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    for relation in tree:
+        if relation.many:
+            continue
+        wanted = [relation.field]
+        if relation.kinds is not None:
+            wanted.append(relation.field + '_type')
+        fields.extend(name for name in wanted if name not in fields)
+    return fields
+
+
+def _include_tree(resource, request):
+    """Parse include= into a tree of relations.
+
+    Arguments:
+        resource -- the Resource being listed
+        request -- the current request
+    Returns: a dict mapping Relations to nested dicts of the same form
+    Raises: BadRequest for unknown relations
+    """
+    tree = {}
+    for path in _split(request.GET.get('include')):
+        node, current = tree, resource
+        for name in path.split('.'):
+            relation = None if current is None else \
+                current.relations.get(name)
+            if relation is None:
+                raise BadRequest('Cannot include %s.' % path)
+            node = node.setdefault(relation, {})
+            current = RESOURCES.get(relation.resource)
+    return tree
+
+
+def _tables(resource, tree):
+    """List the models whose versions an ETag must cover."""
+    found = [resource.model]
+    for relation, subtree in tree.items():
+        for kind, name in relation.targets():
+            found.extend(_tables(RESOURCES[name], subtree))
+    return found
+
+
+def _load_included(resource, rows, tree, included, context):
+    """Load included relations one level at a time.
+
+    The rows of every relation at a level are queued on the request's
+    loaders (see researcher.loaders) before any is read, so each model
+    at a level costs one IN query, however many relations and rows lead
+    to it; lookup tables are read from memory.  Nested relations are
+    then loaded for all the rows a relation returned.
+
+    Arguments:
+        resource -- the Resource that `rows` belong to
+        rows -- the row dicts to follow relations from
+        tree -- the include tree for this level
+        included -- dict of resource name to {id: row}, filled in place
+        context -- the LoaderContext to load through
+    """
+    queued = []
+    for relation, subtree in tree.items():
+        for kind, name in relation.targets():
+            target = RESOURCES[name]
+            seen = included.setdefault(target.name, {})
+            if relation.many:
+                keys = set(row['id'] for row in rows)
+                pending = context.loader(
+                    target.model,
+                    relation.field,
+                    many=True
+                ).load_many(keys)
+            else:
+                keys = set(
+                    row.get(relation.field) for row in rows
+                    if kind is None or
+                    row.get(relation.field + '_type') == kind
+                )
+                keys.discard(None)
+                keys -= set(seen)
+                pending = None if is_lookup_model(target.model) else \
+                    context.loader(target.model).load_many(keys)
+            queued.append((relation, subtree, target, seen, keys, pending))
+    for relation, subtree, target, seen, keys, pending in queued:
+        if pending is None:
+            found = target.rows(target.fields, pk__in=keys) if keys else []
+        else:
+            objects = []
+            for value in pending:
+                loaded = value.get()
+                objects.extend(loaded if relation.many else [loaded])
+            fields = target.fields
+            if relation.many and relation.field not in fields:
+                fields = fields + [relation.field]
+            found = target.serialize(
+                [obj for obj in objects if obj is not None],
+                fields
+            )
+        for row in found:
+            seen[row['id']] = row
+        if subtree:
+            _load_included(target, found, subtree, included, context)
+
+
+def _loaders(request):
+    """Get the request's LoaderContext, or a new one without it."""
+    return getattr(request, 'loaders', None) or loaders.LoaderContext()
+
+
+def _etag(request, models_read):
+    """Build a weak ETag from the request and the table versions."""
+    digest = hashlib.sha1()
+    digest.update(request.get_full_path().encode('utf-8'))
+    for version in table_versions(models_read):
+        digest.update(str(version).encode('ascii'))
+    return 'W/' + quote_etag(digest.hexdigest())
+
+
+def _not_modified(request, etag):
+    """Check whether the client already holds this representation."""
+    return etag in [
+        tag.strip() for tag in
+        request.META.get('HTTP_IF_NONE_MATCH', '').split(',')
+    ]
+
+
+def _respond(payload, etag):
+    """Serialize a payload as JSON with its ETag.
+
+    Payloads read from a replica may be older than the table versions
+    the ETag names, so they go without one.
+    """
+    response = HttpResponse(
+        json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')),
+        content_type='application/json'
+    )
+    if not replicas.reading_replicas():
+        response['ETag'] = etag
+    response['Vary'] = 'Cookie'
+    return response
+
+
+def _limit(request):
+    """Read the page size asked for, between 1 and MAX_LIMIT."""
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest('Invalid limit.')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _encode_cursor(pk):
+    """Turn the last id on a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(str(pk).encode('ascii')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    """Turn an opaque cursor back into the last id seen."""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError):
+        raise BadRequest('Invalid cursor.')
+
+
+def _archived_rows(resource, fields, pks):
+    """Read archived rows as Resource.rows() would, for assertions."""
+    if resource.model is not models.Assertion or not pks:
+        return []
+    return resource.serialize(
+        [obj for pk, obj in sorted(archive.load(pks).items())],
+        fields
+    )
+
+
+def _api_view(view):
+    """Check permissions and turn BadRequest into a 400 response."""
+    def wrapper(request, *args, **kwargs):
+        """Run the API view for staff users only."""
+        if not (request.user.is_active and request.user.is_staff):
+            return HttpResponseForbidden('Staff login required.')
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return HttpResponseBadRequest(str(error))
+    wrapper.__doc__ = view.__doc__
+    wrapper.__name__ = view.__name__
+    return require_safe(wrapper)
+
+
+@_api_view
+def list_view(request, resource_name):
+    """List one page of a resource.
+
+    Arguments:
+        request -- the current request
+        resource_name -- the resource name from the URL
+    Returns: a JSON response with 'data', 'included' and 'next'
+    """
+    resource = _endpoint(resource_name)
+    tree = _include_tree(resource, request)
+    fields = _fields(resource, request, tree)
+    etag = _etag(request, _tables(resource, tree))
+    if _not_modified(request, etag):
+        return HttpResponseNotModified()
+
+    limit = _limit(request)
+    filters = {}
+    if request.GET.get('cursor'):
+        filters['pk__gt'] = _decode_cursor(request.GET['cursor'])
+    if request.GET.get('ids'):
+        try:
+            filters['pk__in'] = [int(pk) for pk in _split(request.GET['ids'])]
+        except ValueError:
+            raise BadRequest('Invalid ids.')
+
+    data = resource.rows(fields, limit=limit + 1, **filters)
+    if 'pk__in' in filters:
+        found = set(row['id'] for row in data)
+        data = sorted(data + _archived_rows(resource, fields, [
+            pk for pk in filters['pk__in']
+            if pk not in found and pk > filters.get('pk__gt', 0)
+        ]), key=lambda row: row['id'])
+    next_cursor = None
+    if len(data) > limit:
+        data = data[:limit]
+        next_cursor = _encode_cursor(data[-1]['id'])
+
+    included = {}
+    _load_included(resource, data, tree, included, _loaders(request))
+    return _respond({
+        'data': data,
+        'included': dict(
+            (name, list(rows.values())) for name, rows in included.items()
+        ),
+        'next': next_cursor,
+    }, etag)
+
+
+@_api_view
+def detail_view(request, resource_name, pk):
+    """Show one row of a resource.
+
+    Arguments:
+        request -- the current request
+        resource_name -- the resource name from the URL
+        pk -- the id of the row
+    Returns: a JSON response with 'data' and 'included'
+    """
+    resource = _endpoint(resource_name)
+    tree = _include_tree(resource, request)
+    fields = _fields(resource, request, tree)
+    etag = _etag(request, _tables(resource, tree))
+    if _not_modified(request, etag):
+        return HttpResponseNotModified()
+
+    rows = resource.rows(fields, pk=int(pk)) or _archived_rows(
+        resource, fields, [int(pk)]
+    )
+    if not rows:
+        raise Http404('No such %s.' % resource.model._meta.verbose_name)
+    included = {}
+    _load_included(resource, rows, tree, included, _loaders(request))
+    return _respond({
+        'data': rows[0],
+        'included': dict(
+            (name, list(found.values())) for name, found in included.items()
+        ),
+    }, etag)
+
+
+@_api_view
+def chart_view(request, pk, kind):
+    """Show a persona's pedigree or descendancy chart.
+
+    Arguments:
+        request -- the current request
+        pk -- the root persona's id
+        kind -- 'pedigree' or 'descendants'
+    Returns: a JSON response with 'fields' and 'data'
+    """
+    build = charts.pedigree if kind == 'pedigree' else charts.descendants
+    try:
+        generations = int(request.GET.get('generations', 5))
+    except ValueError:
+        raise BadRequest('Invalid generations.')
+    digest = hashlib.sha1()
+    digest.update(request.get_full_path().encode('utf-8'))
+    digest.update(repr(charts.chart_version()).encode('ascii'))
+    etag = 'W/' + quote_etag(digest.hexdigest())
+    if _not_modified(request, etag):
+        return HttpResponseNotModified()
+
+    if not models.Persona.objects.filter(pk=pk).exists():
+        raise Http404('No such persona.')
+    try:
+        chart = build(int(pk), generations)
+    except ValueError as error:
+        raise BadRequest(str(error))
+    return _respond({
+        'fields': list(charts.ChartEntry._fields),
+        'data': {
+            'kind': chart.kind,
+            'root': chart.root,
+            'generations': chart.generations,
+            'entries': [list(entry) for entry in chart.entries],
+        },
+    }, etag)
+
+
+@_api_view
+def timeline_view(request, pk):
+    """Show a persona's timeline.
+
+    Arguments:
+        request -- the current request
+        pk -- the persona's id
+    Returns: a JSON response with 'fields' and 'data'
+    """
+    etag = _etag(request, [
+        getattr(models, name) for name in timeline.SOURCE_MODELS
+    ])
+    if _not_modified(request, etag):
+        return HttpResponseNotModified()
+
+    if not models.Persona.objects.filter(pk=pk).exists():
+        raise Http404('No such persona.')
+    entries = [list(entry) for entry in timeline.timeline(int(pk))]
+    return _respond({
+        'fields': list(timeline.TimelineEntry._fields),
+        'data': entries,
+    }, etag)
+
+
+@_api_view
+def gaps_view(request, pk):
+    """Show a page of a project's research gaps.
+
+    Arguments:
+        request -- the current request
+        pk -- the project's id
+    Returns: a JSON response with 'fields', 'data', 'page' and 'pages'
+    """
+    etag = _etag(request, [
+        getattr(models, name) for name in gaps.SOURCE_MODELS
+    ])
+    if _not_modified(request, etag):
+        return HttpResponseNotModified()
+
+    if not models.Project.objects.filter(pk=pk).exists():
+        raise Http404('No such project.')
+    limit = _limit(request)
+    try:
+        page = gaps.worklist(
+            int(pk),
+            gaps=_split(request.GET.get('gap')) or None,
+            page=request.GET.get('page', 1),
+            per_page=limit,
+            open_only=request.GET.get('open') == '1'
+        )
+    except (ValueError, InvalidPage):
+        raise BadRequest('Invalid page.')
+    return _respond({
+        'fields': GAP_FIELDS,
+        'data': [list(row) for row in page.object_list],
+        'page': page.number,
+        'pages': page.paginator.num_pages,
+    }, etag)
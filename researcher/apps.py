@@ -0,0 +1,39 @@
+"""Configure the researcher application."""
+from django.apps import AppConfig
+from django.core import checks
+
+
+class ResearcherConfig(AppConfig):
+
+    """ Researcher application configuration."""
+
+    name = 'researcher'
+    verbose_name = 'Researcher'
+
+    def ready(self):
+        """Connect the signal handlers once the models are loaded."""
+        from researcher import (
+            conflicts,
+            gaps,
+            history,
+            lookups,
+            participation,
+            queues,
+            relationships,
+            sanity,
+            shards,
+            timeline,
+            versions,
+        )
+        checks.register(versions.check_shared_cache)
+        versions.connect_signals()
+        lookups.connect_signals()
+        relationships.connect_signals()
+        participation.connect_signals()
+        queues.connect_signals()
+        timeline.connect_signals()
+        conflicts.connect_signals()
+        sanity.connect_signals()
+        gaps.connect_signals()
+        shards.connect_signals()
+        history.connect_signals()
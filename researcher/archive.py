@@ -0,0 +1,621 @@
+"""Move disproved reasoning out of the live tables, and back on demand.
+
+Assertions are never deleted, only disproved, so over the years the
+disproved ones and their AssertionAssertion links come to outweigh the
+live conclusions in the tables and their indexes.  archive() moves them
+out: the disproved assertions that nothing live reasons from or to, that
+no conflict names, and that have not changed for
+RESEARCHER_ARCHIVE_AFTER_DAYS (going by researcher.history), together
+with the links between them.  Linked assertions are archived together
+or not at all, so no link ever joins a live assertion to an archived
+one.
+
+Archived rows are kept in three tiers:
+
+    the live tables, for everything that is not archived
+    ArchiveBatch rows, holding batches of rows as compressed JSON
+    files under RESEARCHER_ARCHIVE_DIR, for batches older than
+        RESEARCHER_ARCHIVE_FILE_AFTER_DAYS (move_to_files())
+
+Each archived assertion leaves an ArchivedAssertion stub with its id,
+researcher, source and subjects, so archived reasoning can still be
+found.  load() and provenance() read archived assertions wherever they
+are kept, and rehydrate() puts them back in the live tables with their
+ids, along with everything linked to them, e.g. before a researcher
+revisits a disproved line of reasoning.  The participation rows of
+archived assertions are dropped and rebuilt when they come back; their
+revisions stay where they are.
+
+Archiving and rehydrating delete and insert rows without model signals,
+so do not run them against a project being moved (see
+researcher.shards).
+
+Exports:
+    Functions:
+        archivable
+        archive
+        load
+        move_to_files
+        provenance
+        rehydrate
+"""
+import collections
+import datetime
+import json
+import os
+import zlib
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from researcher.participation import refresh_participation
+from researcher.versions import bump_table_version
+
+# Ids in one IN list, and rows written by one INSERT.
+BATCH_SIZE = 500
+
+# Assertions per ArchiveBatch; linked assertions are never split up.
+BATCH_ASSERTIONS = getattr(settings, 'RESEARCHER_ARCHIVE_BATCH', 2000)
+
+AFTER_DAYS = getattr(settings, 'RESEARCHER_ARCHIVE_AFTER_DAYS', 365)
+
+FILE_AFTER_DAYS = getattr(settings, 'RESEARCHER_ARCHIVE_FILE_AFTER_DAYS',
+                          None)
+
+ARCHIVE_DIR = getattr(
+    settings,
+    'RESEARCHER_ARCHIVE_DIR',
+    os.path.join(getattr(settings, 'BASE_DIR', ''), 'archive')
+)
+
+# The tables archiving and rehydrating change.
+CHANGED_MODELS = (
+    'Assertion',
+    'AssertionAssertion',
+    'EventParticipation',
+    'GroupMembership',
+    'ArchiveBatch',
+    'ArchivedAssertion',
+)
+
+
+def _model(name):
+    """Fetch a researcher model class by name."""
+    return apps.get_model('researcher', name)
+
+
+def _batches(values):
+    """Split values, sorted, into BATCH_SIZE lists."""
+    values = sorted(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def _columns(model):
+    """List the attnames of a model's columns, id first."""
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _candidates(project, before):
+    """Find the disproved assertions that may be archived on their own.
+
+    Returns: a set of assertion ids
+    """
+    Assertion = _model('Assertion')
+    assertions = Assertion.objects.filter(disproved=True)
+    if project is not None:
+        assertions = assertions.filter(
+            researcher__researcherproject__project=project
+        )
+    pks = set(assertions.values_list('pk', flat=True))
+    Revision = _model('Revision')
+    conflicts = _model('Conflict')._meta.get_field('assertions')
+    through = conflicts.rel.through
+    for batch in _batches(pks):
+        pks.difference_update(Revision.objects.filter(
+            model='Assertion',
+            object_id__in=batch,
+            valid_to__isnull=True,
+            valid_from__gte=before
+        ).values_list('object_id', flat=True))
+        pks.difference_update(through.objects.filter(**{
+            conflicts.m2m_reverse_field_name() + '__in': batch
+        }).values_list(conflicts.m2m_reverse_field_name(), flat=True))
+    return pks
+
+
+def _closed(pks, using=None):
+    """Group candidates linked only to each other.
+
+    A candidate linked to an assertion that is not a candidate stays
+    live, and so does everything linked to it.
+
+    Arguments:
+        pks -- the candidate assertion ids
+        using -- the database alias; None asks the routers
+    Returns: a list of (assertion ids, link ids) per group, in id order
+    """
+    AssertionAssertion = _model('AssertionAssertion')
+    links = {}
+    neighbours = collections.defaultdict(set)
+    blocked = set()
+    for batch in _batches(pks):
+        for pk, low, high in AssertionAssertion.objects.db_manager(
+                using).filter(
+                    Q(assertion_low__in=batch) | Q(assertion_high__in=batch)
+                ).values_list('pk', 'assertion_low', 'assertion_high'):
+            links[pk] = (low, high)
+            for one, other in ((low, high), (high, low)):
+                if one not in pks:
+                    continue
+                if other in pks:
+                    neighbours[one].add(other)
+                else:
+                    blocked.add(one)
+    waiting = list(blocked)
+    while waiting:
+        for other in neighbours[waiting.pop()]:
+            if other not in blocked:
+                blocked.add(other)
+                waiting.append(other)
+
+    groups = []
+    group_of = {}
+    for pk in sorted(pks - blocked):
+        if pk in group_of:
+            continue
+        group = set([pk])
+        waiting = [pk]
+        while waiting:
+            for other in neighbours[waiting.pop()]:
+                if other not in group:
+                    group.add(other)
+                    waiting.append(other)
+        for member in group:
+            group_of[member] = len(groups)
+        groups.append((group, set()))
+    for pk, (low, high) in links.items():
+        if low in group_of and high in group_of:
+            groups[group_of[low]][1].add(pk)
+    return [(sorted(group), sorted(link_pks)) for group, link_pks in groups]
+
+
+def archivable(project=None, days=None):
+    """Find the assertions archive() would move.
+
+    Arguments:
+        project -- the Project (or id) whose researchers' assertions to
+            consider; None for every assertion
+        days -- how long an assertion must have gone unchanged; None
+            takes RESEARCHER_ARCHIVE_AFTER_DAYS
+    Returns: a list of (assertion ids, link ids) per group of linked
+        assertions
+    """
+    project = getattr(project, 'pk', project)
+    before = timezone.now() - datetime.timedelta(
+        days=AFTER_DAYS if days is None else days
+    )
+    return _closed(_candidates(project, before))
+
+
+def _pack(groups):
+    """Gather groups into batches of about BATCH_ASSERTIONS assertions."""
+    packed = []
+    size = BATCH_ASSERTIONS
+    for pks, link_pks in groups:
+        if size + len(pks) > BATCH_ASSERTIONS:
+            packed.append(([], []))
+            size = 0
+        packed[-1][0].extend(pks)
+        packed[-1][1].extend(link_pks)
+        size += len(pks)
+    return packed
+
+
+def _read(model, pks, using):
+    """Read rows of a model as lists of column values, in id order."""
+    rows = []
+    for batch in _batches(pks):
+        rows.extend(
+            list(row) for row in model._base_manager.using(using).filter(
+                pk__in=batch
+            ).order_by('pk').values_list(*_columns(model))
+        )
+    return rows
+
+
+def _compress(payload):
+    """Turn a batch's rows into compressed JSON."""
+    return zlib.compress(
+        json.dumps(payload, separators=(',', ':')).encode('utf-8'), 9
+    )
+
+
+def _decompress(batch):
+    """Read a batch's rows from wherever the batch keeps them."""
+    if batch.path:
+        with open(batch.path, 'rb') as archived:
+            data = archived.read()
+    else:
+        data = bytes(batch.data)
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def _delete(model, column, pks, using):
+    """Delete the rows whose column is one of some ids, not cascading."""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for batch in _batches(pks):
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                quote(model._meta.db_table),
+                quote(column),
+                ', '.join(['%s'] * len(batch))
+            ), batch)
+
+
+def _archive_batch(pks, link_pks, using):
+    """Archive one batch of groups, checking them again first.
+
+    Returns: (assertions archived, links archived)
+    """
+    Assertion = _model('Assertion')
+    AssertionAssertion = _model('AssertionAssertion')
+    with transaction.atomic(using=using):
+        locked = Assertion._base_manager.using(using).select_for_update()
+        still = set()
+        for ids in _batches(pks):
+            still.update(locked.filter(
+                pk__in=ids,
+                disproved=True
+            ).values_list('pk', flat=True))
+        groups = _closed(still, using)
+        pks = sorted(pk for group, links in groups for pk in group)
+        link_pks = sorted(pk for group, links in groups for pk in links)
+        if not pks:
+            return 0, 0
+        rows = _read(Assertion, pks, using)
+        columns = _columns(Assertion)
+        data = _compress({
+            'assertion_columns': columns,
+            'assertions': rows,
+            'link_columns': _columns(AssertionAssertion),
+            'links': _read(AssertionAssertion, link_pks, using),
+        })
+        batch = _model('ArchiveBatch').objects.using(using).create(
+            assertions=len(pks),
+            links=len(link_pks),
+            data=data,
+            size=len(data)
+        )
+        ArchivedAssertion = _model('ArchivedAssertion')
+        stubs = []
+        for row in rows:
+            values = dict(zip(columns, row))
+            stubs.append(ArchivedAssertion(
+                id=values['id'],
+                batch=batch,
+                researcher_id=values['researcher_id'],
+                source=values['source_id'],
+                subject1_type=values['subject1_type'],
+                subject1=values['subject1'],
+                subject2_type=values['subject2_type'],
+                subject2=values['subject2']
+            ))
+        ArchivedAssertion.objects.using(using).bulk_create(
+            stubs, batch_size=BATCH_SIZE
+        )
+        for name in ('EventParticipation', 'GroupMembership'):
+            model = _model(name)
+            _delete(model, model._meta.get_field('assertion').column, pks,
+                    using)
+        _delete(AssertionAssertion, AssertionAssertion._meta.pk.column,
+                link_pks, using)
+        _delete(Assertion, Assertion._meta.pk.column, pks, using)
+    return len(pks), len(link_pks)
+
+
+def archive(project=None, days=None, report=None):
+    """Move disproved reasoning nothing live depends on to the archive.
+
+    Arguments:
+        project -- the Project (or id) whose researchers' assertions to
+            archive; None for every assertion
+        days -- how long an assertion must have gone unchanged; None
+            takes RESEARCHER_ARCHIVE_AFTER_DAYS
+        report -- called as report(done, total) after each batch
+    Returns: (assertions archived, links archived)
+    """
+    using = router.db_for_write(_model('Assertion'))
+    packed = _pack(archivable(project, days))
+    archived = [0, 0]
+    try:
+        for done, (pks, link_pks) in enumerate(packed, 1):
+            moved = _archive_batch(pks, link_pks, using)
+            archived[0] += moved[0]
+            archived[1] += moved[1]
+            if report is not None:
+                report(done, len(packed))
+    finally:
+        if archived[0]:
+            for name in CHANGED_MODELS:
+                bump_table_version(_model(name))
+    return tuple(archived)
+
+
+def _write_file(path, data):
+    """Write a file whole or not at all."""
+    partial = path + '.partial'
+    with open(partial, 'wb') as archived:
+        archived.write(data)
+        archived.flush()
+        os.fsync(archived.fileno())
+    os.rename(partial, path)
+
+
+def move_to_files(days=None):
+    """Move old archive batches out of the database into files.
+
+    Arguments:
+        days -- how old a batch must be; None takes
+            RESEARCHER_ARCHIVE_FILE_AFTER_DAYS, and does nothing if that
+            is None too
+    Returns: how many batches were moved
+    """
+    days = FILE_AFTER_DAYS if days is None else days
+    if days is None:
+        return 0
+    ArchiveBatch = _model('ArchiveBatch')
+    using = router.db_for_write(ArchiveBatch)
+    if not os.path.isdir(ARCHIVE_DIR):
+        os.makedirs(ARCHIVE_DIR)
+    moved = 0
+    for pk in ArchiveBatch.objects.using(using).filter(
+            path='',
+            created__lt=timezone.now() - datetime.timedelta(days=days)
+    ).values_list('pk', flat=True):
+        data = ArchiveBatch.objects.using(using).values_list(
+            'data', flat=True
+        ).get(pk=pk)
+        path = os.path.join(ARCHIVE_DIR, '%s-%d.json.z' % (using, pk))
+        _write_file(path, bytes(data))
+        ArchiveBatch.objects.using(using).filter(pk=pk).update(
+            path=path,
+            data=None
+        )
+        moved += 1
+    if moved:
+        bump_table_version(ArchiveBatch)
+    return moved
+
+
+def _instances(model, columns, rows):
+    """Build unsaved instances of a model from archived rows."""
+    fields = dict(
+        (field.attname, field) for field in model._meta.concrete_fields
+    )
+    found = []
+    for row in rows:
+        instance = model(**dict(
+            (name, None if value is None else fields[name].to_python(value))
+            for name, value in zip(columns, row)
+            if name in fields
+        ))
+        instance.archived = True
+        found.append(instance)
+    return found
+
+
+def _archived(pks, using=None):
+    """Read archived assertions and the links touching them.
+
+    Returns: ({id: unsaved Assertion}, [unsaved AssertionAssertion])
+    """
+    wanted = set(pks)
+    batches = set()
+    for batch in _batches(wanted):
+        batches.update(_model('ArchivedAssertion').objects.db_manager(
+            using
+        ).filter(pk__in=batch).values_list('batch', flat=True))
+    assertions = {}
+    links = []
+    for batch in _model('ArchiveBatch').objects.db_manager(using).filter(
+            pk__in=batches):
+        payload = _decompress(batch)
+        for assertion in _instances(
+                _model('Assertion'), payload['assertion_columns'],
+                payload['assertions']):
+            if assertion.pk in wanted:
+                assertions[assertion.pk] = assertion
+        links.extend(
+            link for link in _instances(
+                _model('AssertionAssertion'), payload['link_columns'],
+                payload['links'])
+            if link.assertion_low_id in wanted or
+            link.assertion_high_id in wanted
+        )
+    return assertions, links
+
+
+def load(pks, using=None):
+    """Read archived assertions without bringing them back.
+
+    The instances have `archived` set; saving one would not remove its
+    stub, so use rehydrate() to make them live again.
+
+    Arguments:
+        pks -- the ids of the assertions; ids that are not archived are
+            skipped
+        using -- the database alias; None asks the routers
+    Returns: a dict of {id: unsaved Assertion}
+    """
+    return _archived(pks, using)[0]
+
+
+def provenance(pk, using=None):
+    """Collect an assertion and all the reasoning it rests on.
+
+    Follows the links from each assertion to its input assertions, in
+    the live tables and in the archive alike.
+
+    Arguments:
+        pk -- the assertion's id
+        using -- the database alias; None asks the routers
+    Returns: ({id: Assertion}, [AssertionAssertion]) with the links
+        ordered by output assertion and sequence number; archived rows
+        are unsaved and have `archived` set
+    """
+    Assertion = _model('Assertion')
+    AssertionAssertion = _model('AssertionAssertion')
+    assertions = {}
+    links = []
+    gone = set()
+    waiting = set([pk])
+    while waiting:
+        found = {}
+        for batch in _batches(waiting):
+            found.update(Assertion.objects.db_manager(using).in_bulk(batch))
+            for link in AssertionAssertion.objects.db_manager(using).filter(
+                    assertion_high__in=batch):
+                links.append(link)
+        missing = waiting - set(found)
+        if missing:
+            archived, archived_links = _archived(missing, using)
+            found.update(archived)
+            links.extend(
+                link for link in archived_links
+                if link.assertion_high_id in archived
+            )
+        assertions.update(found)
+        gone.update(missing - set(found))
+        waiting = set(
+            link.assertion_low_id for link in links
+        ) - set(assertions) - gone
+    links.sort(key=lambda link: (link.assertion_high_id,
+                                 link.sequence_number, link.pk))
+    return assertions, links
+
+
+def _linked(wanted, links):
+    """Spread a set of archived assertion ids to everything linked."""
+    neighbours = collections.defaultdict(set)
+    for row in links:
+        neighbours[row[0]].add(row[1])
+        neighbours[row[1]].add(row[0])
+    found = set(wanted)
+    waiting = list(found)
+    while waiting:
+        for other in neighbours[waiting.pop()]:
+            if other not in found:
+                found.add(other)
+                waiting.append(other)
+    return found
+
+
+def rehydrate(pks, using=None):
+    """Bring archived assertions back to the live tables, with their ids.
+
+    Everything linked to them comes back too.  Assertions whose source
+    has since been deleted stay archived, with everything linked to
+    them.
+
+    Arguments:
+        pks -- the ids of the assertions; ids that are not archived are
+            skipped
+        using -- the database alias; None asks the routers
+    Returns: how many assertions were brought back
+    """
+    Assertion = _model('Assertion')
+    AssertionAssertion = _model('AssertionAssertion')
+    ArchiveBatch = _model('ArchiveBatch')
+    ArchivedAssertion = _model('ArchivedAssertion')
+    using = using or router.db_for_write(Assertion)
+    wanted = set(pks)
+    restored = []
+    stale_files = []
+    with transaction.atomic(using=using):
+        batches = set()
+        for batch in _batches(wanted):
+            batches.update(ArchivedAssertion.objects.using(using).filter(
+                pk__in=batch
+            ).values_list('batch', flat=True))
+        locked = ArchiveBatch.objects.using(using).select_for_update()
+        for batch in locked.filter(pk__in=batches):
+            payload = _decompress(batch)
+            columns = payload['assertion_columns']
+            link_columns = payload['link_columns']
+            low = link_columns.index('assertion_low_id')
+            high = link_columns.index('assertion_high_id')
+            ends = [(row[low], row[high]) for row in payload['links']]
+            rows = dict(
+                (row[columns.index('id')], row)
+                for row in payload['assertions']
+            )
+            back = _linked(wanted & set(rows), ends)
+            sources = set(
+                rows[pk][columns.index('source_id')] for pk in back
+            )
+            existing = set()
+            for source_batch in _batches(sources):
+                existing.update(_model('Source')._base_manager.using(
+                    using
+                ).filter(pk__in=source_batch).values_list('pk', flat=True))
+            lost = set(
+                pk for pk in back
+                if rows[pk][columns.index('source_id')] not in existing
+            )
+            back -= _linked(lost, ends)
+            if not back:
+                continue
+
+            Assertion.objects.using(using).bulk_create(
+                _instances(Assertion, columns,
+                           [rows[pk] for pk in sorted(back)]),
+                batch_size=BATCH_SIZE
+            )
+            AssertionAssertion.objects.using(using).bulk_create(
+                _instances(AssertionAssertion, link_columns, [
+                    row for row in payload['links'] if row[low] in back
+                ]),
+                batch_size=BATCH_SIZE
+            )
+            for stub_batch in _batches(back):
+                ArchivedAssertion.objects.using(using).filter(
+                    pk__in=stub_batch
+                ).delete()
+            restored.extend(back)
+
+            payload['assertions'] = [
+                row for pk, row in sorted(rows.items()) if pk not in back
+            ]
+            payload['links'] = [
+                row for row in payload['links'] if row[low] not in back
+            ]
+            if batch.path:
+                stale_files.append(batch.path)
+            if not payload['assertions']:
+                batch.delete()
+                continue
+            # Rewritten batches go back to the database; the file tier
+            # takes them again once move_to_files() comes round.
+            data = _compress(payload)
+            ArchiveBatch.objects.using(using).filter(pk=batch.pk).update(
+                assertions=len(payload['assertions']),
+                links=len(payload['links']),
+                data=data,
+                path='',
+                size=len(data)
+            )
+    for path in stale_files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if restored:
+        refresh_participation(restored)
+        for name in CHANGED_MODELS:
+            bump_table_version(_model(name))
+    return len(restored)
@@ -0,0 +1,9 @@
+"""Django's PostgreSQL backend, capturing slow queries."""
+from django.db.backends.postgresql_psycopg2 import base
+
+from researcher.slowqueries import SlowQueryMixin
+
+
+class DatabaseWrapper(SlowQueryMixin, base.DatabaseWrapper):
+
+    """A PostgreSQL connection whose slow statements are logged."""
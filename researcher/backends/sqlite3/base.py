@@ -0,0 +1,9 @@
+"""Django's SQLite backend, capturing slow queries."""
+from django.db.backends.sqlite3 import base
+
+from researcher.slowqueries import SlowQueryMixin
+
+
+class DatabaseWrapper(SlowQueryMixin, base.DatabaseWrapper):
+
+    """A SQLite connection whose slow statements are logged."""
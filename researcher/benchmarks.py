@@ -0,0 +1,445 @@
+"""Time the hot paths against whatever data the database holds.
+
+Each benchmark is a function registered with @benchmark that runs one
+hot path once: an admin changelist or change form, rendering places,
+assembling citations, listing activities, exporting a project.  The
+data is usually made with researcher.synthetic.generate (or `manage.py
+run_benchmarks --generate`).  run() calls each benchmark `repeat` times
+inside one transaction that is rolled back afterwards, so the runs and
+the throwaway superuser they log in as leave nothing behind, and
+records:
+
+    wall_time -- the best and median seconds of the runs
+    queries -- the SQL queries of one run, how many were duplicates,
+        the storms of repeated statements with where they came from
+        (see researcher.querylog), and whether the run kept to the
+        budget RESEARCHER_QUERY_BUDGETS gives the benchmark's view
+    peak_memory -- the most bytes Python allocated during one more run,
+        traced separately so tracing does not slow the timed runs
+
+with the git commit, database vendor and table sizes, as a dict ready
+for json.dump.  compare() sets two such results side by side, so a
+regression between commits shows up as a ratio.
+
+Exports:
+    Functions:
+        benchmark
+        compare
+        run
+    Classes:
+        Context
+"""
+import collections
+import contextlib
+import datetime
+import os
+import subprocess
+import time
+import tracemalloc
+import uuid
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model, login
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models import Count
+from django.http import HttpRequest
+from django.test import Client
+
+from researcher import querylog, timeline
+from researcher.loaders import LoaderContext
+from researcher.pagination import AFTER_VAR
+from researcher.synthetic import generate
+
+# Rows a rendering benchmark works through.
+SAMPLE_SIZE = 500
+
+# The tables whose sizes are recorded with the results.
+COUNTED_MODELS = (
+    'Assertion',
+    'AssertionAssertion',
+    'Persona',
+    'Event',
+    'Source',
+    'CitationPart',
+    'Place',
+    'PlacePart',
+    'Activity',
+    'Search',
+)
+
+_BENCHMARKS = collections.OrderedDict()
+
+
+class _Rollback(Exception):
+
+    """Raised to undo the writes of a benchmark."""
+
+
+@contextlib.contextmanager
+def _rolled_back():
+    """Run a block in a transaction and undo everything it wrote."""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+
+class Context(object):
+
+    """What the benchmarks share: a logged-in client and sample ids.
+
+    Made inside the transaction run() rolls back, so the superuser it
+    creates never outlives the run.
+
+    Instance Variables:
+        client -- A django.test.Client logged in as a throwaway
+            superuser with no usable password.
+        project -- The id of the project benchmarked.
+    """
+
+    def __init__(self, project=None):
+        """Log in and pick the project.
+
+        Arguments:
+            self
+            project -- the Project or its id; None for the largest
+        """
+        self.client = Client()
+        User = get_user_model()
+        user = User(**{
+            User.USERNAME_FIELD: 'benchmark-%s' % uuid.uuid4().hex[:12]
+        })
+        user.is_staff = user.is_superuser = True
+        user.set_unusable_password()
+        user.save()
+        self._log_in(user)
+        if project is None:
+            ResearcherProject = apps.get_model('researcher',
+                                               'ResearcherProject')
+            project = ResearcherProject.objects.values_list(
+                'project', flat=True
+            ).order_by('-project')[:1]
+            project = project[0] if project else None
+        self.project = getattr(project, 'pk', project)
+        self._samples = {}
+
+    def _log_in(self, user):
+        """Give the client a session for a user, as a login would."""
+        request = HttpRequest()
+        request.session = import_module(
+            settings.SESSION_ENGINE
+        ).SessionStore()
+        user.backend = settings.AUTHENTICATION_BACKENDS[0]
+        login(request, user)
+        request.session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = (
+            request.session.session_key
+        )
+
+    def sample(self, name, ordering='pk'):
+        """Pick the ids of up to SAMPLE_SIZE rows of a table, once.
+
+        Arguments:
+            self
+            name -- the researcher model name
+            ordering -- the field to pick the first rows by
+        Returns: a list of ids
+        """
+        if name not in self._samples:
+            model = apps.get_model('researcher', name)
+            self._samples[name] = list(model.objects.order_by(
+                ordering
+            ).values_list('pk', flat=True)[:SAMPLE_SIZE])
+        return self._samples[name]
+
+    def largest(self, name, child, field):
+        """Find the row of a table with the most child rows.
+
+        Arguments:
+            self
+            name -- the parent model name
+            child -- the child model name
+            field -- the child's foreign key to the parent
+        Returns: the parent's id, or None
+        """
+        key = (name, child, field)
+        if key not in self._samples:
+            model = apps.get_model('researcher', child)
+            found = model.objects.values(field).annotate(
+                rows=Count('pk')
+            ).order_by('-rows').values_list(field, flat=True)[:1]
+            self._samples[key] = found[0] if found else None
+        return self._samples[key]
+
+
+def benchmark(name, view=None, budget=None):
+    """Register a function as a benchmark.
+
+    The function is called with a Context and runs its hot path once.
+
+    Arguments:
+        name -- the benchmark's name in the results
+        view -- the URL name of the view the benchmark requests, whose
+            budget in RESEARCHER_QUERY_BUDGETS one run is held to
+        budget -- the queries one run may make, for benchmarks of code
+            that is not a view
+    """
+    def register(function):
+        """Add the function to the registry."""
+        function.view = view
+        function.budget = budget
+        _BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _budget(function):
+    """Find the queries one run of a benchmark may make, if limited."""
+    view = getattr(function, 'view', None)
+    if view is not None:
+        return querylog.BUDGETS.get(view)
+    return getattr(function, 'budget', None)
+
+
+def _get(context, url):
+    """Fetch a page, failing loudly on anything but a success."""
+    response = context.client.get(url)
+    if response.status_code != 200:
+        raise AssertionError('%s gave HTTP %d' % (url, response.status_code))
+    return response
+
+
+for _model in ('assertion', 'persona', 'citationpart', 'search'):
+    benchmark('admin.%s.changelist' % _model,
+              view='admin:researcher_%s_changelist' % _model)(
+        lambda context, model=_model: _get(
+            context,
+            reverse('admin:researcher_%s_changelist' % model)
+        )
+    )
+
+
+@benchmark('admin.assertion.changelist.deep',
+           view='admin:researcher_assertion_changelist')
+def admin_deep_page(context):
+    """Seek to a page near the end of the assertion changelist."""
+    ids = context.sample('Assertion')
+    url = reverse('admin:researcher_assertion_changelist')
+    _get(context, '%s?%s=%d' % (url, AFTER_VAR, ids[-1]) if ids else url)
+
+
+@benchmark('admin.source.change', view='admin:researcher_source_change')
+def admin_source_change(context):
+    """Open the change form of the source with most citation parts."""
+    pk = context.largest('Source', 'CitationPart', 'source')
+    if pk is not None:
+        _get(context, reverse('admin:researcher_source_change', args=[pk]))
+
+
+@benchmark('admin.assertion.change',
+           view='admin:researcher_assertion_change')
+def admin_assertion_change(context):
+    """Open the change form of the conclusion with most inputs."""
+    pk = context.largest('Assertion', 'AssertionAssertion',
+                         'assertion_high')
+    if pk is not None:
+        _get(context,
+             reverse('admin:researcher_assertion_change', args=[pk]))
+
+
+@benchmark('admin.place.change', view='admin:researcher_place_change')
+def admin_place_change(context):
+    """Open the change form of a place."""
+    ids = context.sample('Place')
+    if ids:
+        _get(context,
+             reverse('admin:researcher_place_change', args=[ids[0]]))
+
+
+@benchmark('render.places', budget=2)
+def render_places(context):
+    """Render places with their parts in display order."""
+    Place = apps.get_model('researcher', 'Place')
+    places = list(Place.objects.filter(pk__in=context.sample('Place')))
+    LoaderContext().walk(places, 'placepart_set')
+    return [str(place) for place in places]
+
+
+@benchmark('render.citations')
+def render_citations(context):
+    """Assemble the full citations of sources, up their chains."""
+    Source = apps.get_model('researcher', 'Source')
+    sources = list(Source.objects.filter(pk__in=context.sample('Source',
+                                                               '-pk')))
+    loaders = LoaderContext()
+    higher = loaders.walk_chain(sources, 'higher_source')
+    loaders.walk(sources + higher, 'citationpart_set')
+    return [source.citation() for source in sources + higher]
+
+
+@benchmark('activities.list', budget=1)
+def list_activities(context):
+    """List the open activities of the project's researchers."""
+    Activity = apps.get_model('researcher', 'Activity')
+    ResearcherProject = apps.get_model('researcher', 'ResearcherProject')
+    return list(Activity.objects.filter(
+        researcher__in=ResearcherProject.objects.filter(
+            project=context.project
+        ).values('researcher')
+    ).exclude(status='Done').select_related('researcher').order_by(
+        'priority', 'scheduled_date'
+    )[:SAMPLE_SIZE])
+
+
+@benchmark('api.assertions.list', view='api:api_list')
+def api_assertions(context):
+    """Page assertions through the JSON API with their sources."""
+    _get(context, reverse('api:api_list', args=['assertions']) +
+         '?limit=500&include=source')
+
+
+@benchmark('timeline')
+def persona_timelines(context):
+    """Assemble the timelines of personas, without their cache."""
+    personas = context.sample('Persona', '-pk')[:50]
+    timeline.invalidate(personas)
+    return [timeline.timeline(persona) for persona in personas]
+
+
+@benchmark('export.network')
+def export_network(context):
+    """Export the project's family network to arrays."""
+    # Imported here: the network needs NumPy, the other benchmarks do not.
+    from researcher.network import build_network
+    if context.project is not None:
+        build_network(context.project)
+
+
+@benchmark('import.synthetic')
+def import_synthetic(context):
+    """Bulk load a small synthetic project, then roll it back."""
+    with _rolled_back():
+        generate(scale=0.01, seed=2, name='Benchmark import')
+
+
+def _measure(function, context, repeat):
+    """Run one benchmark and measure it.
+
+    Returns: a dict of the measurements
+    """
+    times = []
+    with querylog.recording() as recorder:
+        start = time.perf_counter()
+        function(context)
+        times.append(time.perf_counter() - start)
+    for run in range(repeat - 1):
+        start = time.perf_counter()
+        function(context)
+        times.append(time.perf_counter() - start)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    function(context)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    if not tracing:
+        tracemalloc.stop()
+
+    budget = _budget(function)
+    times.sort()
+    return {
+        'wall_time': {
+            'best': times[0],
+            'median': times[len(times) // 2],
+            'runs': len(times),
+        },
+        'queries': {
+            'count': recorder.count,
+            'duplicates': recorder.duplicates,
+            'time': recorder.duration,
+            'storms': recorder.summary()['storms'],
+            'budget': budget,
+            'over_budget': budget is not None and recorder.count > budget,
+        },
+        'peak_memory': peak,
+    }
+
+
+def _commit():
+    """Find the git commit of the code being benchmarked, if any."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, repeat=3, project=None):
+    """Run benchmarks and collect their measurements.
+
+    Arguments:
+        names -- the benchmarks to run, or name prefixes such as
+            'admin.'; None runs them all
+        repeat -- timed runs of each benchmark
+        project -- the Project or its id; None for the largest
+    Returns: a dict of the results and what they were measured on
+    """
+    selected = [
+        (name, function) for name, function in _BENCHMARKS.items()
+        if names is None or any(name.startswith(n) for n in names)
+    ]
+    results = collections.OrderedDict()
+    with _rolled_back():
+        context = Context(project)
+        for name, function in selected:
+            results[name] = _measure(function, context, max(1, repeat))
+        rows = dict(
+            (name, apps.get_model('researcher', name).objects.count())
+            for name in COUNTED_MODELS
+        )
+    return {
+        'commit': _commit(),
+        'when': datetime.datetime.utcnow().isoformat(),
+        'database': connection.vendor,
+        'project': context.project,
+        'rows': rows,
+        'benchmarks': results,
+    }
+
+
+def compare(old, new):
+    """Set the results of two runs side by side.
+
+    Arguments:
+        old -- the results of the earlier run
+        new -- the results of the later run
+    Returns: a list of (name, old best seconds, new best seconds, time
+        ratio, old query count, new query count) for the benchmarks both
+        ran
+    """
+    rows = []
+    for name, after in new['benchmarks'].items():
+        before = old['benchmarks'].get(name)
+        if before is None:
+            continue
+        old_time = before['wall_time']['best']
+        new_time = after['wall_time']['best']
+        rows.append((
+            name,
+            old_time,
+            new_time,
+            new_time / old_time if old_time else None,
+            before['queries']['count'],
+            after['queries']['count'],
+        ))
+    return rows
@@ -0,0 +1,261 @@
+"""Build pedigree and descendancy charts for a persona.
+
+The parent/child links come from the in-memory family graph (see
+researcher.relationships), so walking a chart costs no queries.  The
+personas shown are then fetched a generation at a time: one IN query for
+their names and one for the dates of the events they were born in.  A
+12 generation pedigree therefore costs at most 24 queries however many
+ancestors it holds, and nothing at all once it is cached.
+
+Pedigree entries are numbered with the Ahnentafel system: the root is 1
+and the father and mother of n are 2n and 2n + 1.  Descendancy entries
+get d'Aboville numbers: the root is 1, its children 1.1, 1.2, ... in
+order of birth, their children 1.1.1 and so on.  A persona reached by
+more than one line (pedigree collapse) appears once per line.
+
+Charts are cached per root persona, kind and depth.  A cached chart is
+used only while the 'lineage' version and the Persona and Event table
+versions it was built from are current.
+
+Exports:
+    Functions:
+        chart_version
+        descendants
+        pedigree
+    Classes:
+        Chart
+        ChartEntry
+"""
+import collections
+import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+from researcher import replicas
+from researcher.queues import batches
+from researcher.relationships import graph
+from researcher.versions import table_versions, version
+
+FATHER_ROLES = getattr(settings, 'RESEARCHER_FATHER_ROLES', ('Father',))
+
+MOTHER_ROLES = getattr(settings, 'RESEARCHER_MOTHER_ROLES', ('Mother',))
+
+MAX_GENERATIONS = getattr(settings, 'RESEARCHER_CHART_MAX_GENERATIONS', 16)
+
+CACHE_TIMEOUT = getattr(settings, 'RESEARCHER_CHART_CACHE_TIMEOUT', 86400)
+
+Chart = collections.namedtuple('Chart', 'kind root generations entries')
+Chart.__doc__ = """A pedigree or descendancy chart.
+
+    kind -- 'pedigree' or 'descendants'
+    root -- the root persona's id
+    generations -- the number of generations asked for, root included
+    entries -- ChartEntry tuples, a generation at a time
+    """
+
+ChartEntry = collections.namedtuple(
+    'ChartEntry',
+    'number generation persona name born parent'
+)
+ChartEntry.__doc__ = """One persona's place in a chart.
+
+    number -- the Ahnentafel number (an int) or d'Aboville number (a
+        string such as '1.2.1')
+    generation -- 1 for the root, 2 for its parents or children, ...
+    persona -- the persona's id
+    name -- the persona's name
+    born -- the earliest start date of the lineage events naming the
+        persona as a child, or None
+    parent -- the number of the entry this one hangs from, None for the
+        root
+    """
+
+
+def chart_version():
+    """Read the versions a cached chart depends on."""
+    # Let the family graph catch up first, bumping 'lineage' if the
+    # links changed somewhere else.
+    graph().refresh()
+    Persona = apps.get_model('researcher', 'Persona')
+    Event = apps.get_model('researcher', 'Event')
+    return (version('lineage'),) + tuple(table_versions([Persona, Event]))
+
+
+def _details(personas):
+    """Fetch the names and birth dates of one generation.
+
+    Arguments:
+        personas -- the persona ids
+    Returns: a dict mapping persona ids to (name, born) pairs
+    """
+    Persona = apps.get_model('researcher', 'Persona')
+    Event = apps.get_model('researcher', 'Event')
+    family = graph()
+    names = {}
+    for batch in batches(personas):
+        names.update(Persona.objects.filter(pk__in=batch).values_list(
+            'pk', 'name'
+        ))
+    births = dict(
+        (persona, [pk for kind, pk in family.birth_units(persona)
+                   if kind == 'E'])
+        for persona in personas
+    )
+    dates = {}
+    for batch in batches(set().union(*births.values())):
+        dates.update(Event.objects.filter(pk__in=batch).values_list(
+            'pk', 'date_start'
+        ))
+    details = {}
+    for persona in personas:
+        born = [dates[pk] for pk in births[persona] if pk in dates]
+        details[persona] = (
+            names.get(persona, ''),
+            min(born) if born else None
+        )
+    return details
+
+
+def _check_generations(generations):
+    """Reject chart depths that are not sensible."""
+    if not 1 <= generations <= MAX_GENERATIONS:
+        raise ValueError(
+            'A chart has from 1 to %d generations.' % MAX_GENERATIONS
+        )
+
+
+def _cached(kind, root, generations, build):
+    """Return a cached chart, building and caching it if need be.
+
+    Arguments:
+        kind -- 'pedigree' or 'descendants'
+        root -- the root persona's id
+        generations -- the depth of the chart
+        build -- a function building the chart's entries
+    Returns: the Chart
+    """
+    _check_generations(generations)
+    key = 'researcher:chart:%s:%d:%d' % (kind, root, generations)
+    current = chart_version()
+    found = cache.get(key)
+    if found is not None and found[0] == current:
+        return found[1]
+    chart = Chart(kind, root, generations, build(root, generations))
+    if not replicas.reading_replicas():
+        cache.set(key, (current, chart), CACHE_TIMEOUT)
+    return chart
+
+
+def _number_parents(number, parent_roles):
+    """Give a persona's parents their Ahnentafel numbers.
+
+    Fathers take 2n and mothers 2n + 1.  Parents named in any other
+    role fill whichever of the two places is still free, lowest id
+    first.  Further parents (conflicting assertions) are left out.
+
+    Arguments:
+        number -- the persona's own number
+        parent_roles -- the (parent id, role name) pairs from the graph
+    Returns: a list of (number, parent id) pairs
+    """
+    places = {}
+    for wanted, offset in ((FATHER_ROLES, 0), (MOTHER_ROLES, 1)):
+        for parent, role in parent_roles:
+            if role in wanted and parent not in places.values():
+                places[2 * number + offset] = parent
+                break
+    for parent, role in parent_roles:
+        if parent in places.values():
+            continue
+        for offset in (0, 1):
+            if 2 * number + offset not in places:
+                places[2 * number + offset] = parent
+                break
+    return sorted(places.items())
+
+
+def _build_pedigree(root, generations):
+    """Collect the entries of a pedigree chart."""
+    family = graph()
+    entries = []
+    level = [(1, root, None)]
+    for generation in range(1, generations + 1):
+        details = _details(set(persona for number, persona, child in level))
+        following = []
+        for number, persona, child in level:
+            name, born = details[persona]
+            entries.append(ChartEntry(
+                number, generation, persona, name, born, child
+            ))
+            if generation < generations:
+                following.extend(
+                    (parent_number, parent, number)
+                    for parent_number, parent
+                    in _number_parents(number, family.parent_roles(persona))
+                )
+        if not following:
+            break
+        level = following
+    return entries
+
+
+def _build_descendants(root, generations):
+    """Collect the entries of a descendancy chart."""
+    family = graph()
+    entries = []
+    level = [('1', root, None)]
+    details = _details([root])
+    for generation in range(1, generations + 1):
+        following = []
+        for number, persona, parent in level:
+            name, born = details[persona]
+            entries.append(ChartEntry(
+                number, generation, persona, name, born, parent
+            ))
+            if generation < generations:
+                following.extend(
+                    (number, child) for child in family.children(persona)
+                )
+        if not following:
+            break
+        details = _details(set(child for number, child in following))
+        children_of = collections.OrderedDict()
+        for number, child in following:
+            children_of.setdefault(number, []).append(child)
+        latest = datetime.date.max
+        level = []
+        for parent_number, children in children_of.items():
+            children.sort(
+                key=lambda child: (details[child][1] or latest, child)
+            )
+            level.extend(
+                ('%s.%d' % (parent_number, position), child, parent_number)
+                for position, child in enumerate(children, 1)
+            )
+    return entries
+
+
+def pedigree(persona, generations=5):
+    """Build a persona's pedigree chart.
+
+    Arguments:
+        persona -- the root persona's id
+        generations -- how many generations to show, root included
+    Returns: a Chart of Ahnentafel-numbered entries
+    Raises: ValueError if generations is out of range
+    """
+    return _cached('pedigree', persona, generations, _build_pedigree)
+
+
+def descendants(persona, generations=4):
+    """Build a persona's descendancy chart.
+
+    Arguments:
+        persona -- the root persona's id
+        generations -- how many generations to show, root included
+    Returns: a Chart of d'Aboville-numbered entries
+    Raises: ValueError if generations is out of range
+    """
+    return _cached('descendants', persona, generations, _build_descendants)
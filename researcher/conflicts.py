@@ -0,0 +1,554 @@
+"""Find assertions about a persona that contradict each other.
+
+Two assertions that are not disproved can still disagree: they put a
+persona in two births years apart, give it two fathers, or record its
+sex as both male and female.  The checks look at a persona's assertions
+a group at a time:
+
+    'E' -- the events it takes part in, grouped by event type, read from
+        EventParticipation
+    'C' -- the characteristics asserted of it, grouped by the type of
+        their part, read from the assertions and CharacteristicParts
+    'L' -- its parents, read from the lineage events and groups (see
+        researcher.relationships) it is a child in, through
+        EventParticipation and GroupMembership
+
+The groups of many personas are loaded together with a few indexed IN
+queries, and every rule for a kind of group runs over them.  A rule is
+an object with `name`, `kind` and a check(key, members) method; add one
+with register().  The conflicts found are stored as Conflict rows,
+replacing those found before for the same persona and kind.
+
+Saving or deleting an assertion, event, group or characteristic part
+queues only the groups it may change as PendingConflictCheck rows;
+check_pending() (or `manage.py check_conflicts`) works through them.
+check_all() checks every persona.
+
+Exports:
+    Functions:
+        check_all
+        check_pending
+        connect_signals
+        evaluate
+        queue
+        register
+        rules
+    Classes:
+        CharacteristicValueRule
+        EventDateRule
+        Member
+        ParentsRule
+        Rule
+"""
+import collections
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+from researcher.charts import FATHER_ROLES, MOTHER_ROLES
+from researcher.lookups import lookup
+from researcher.queues import (
+    batches,
+    enqueue,
+    on_assertion_change,
+    personas_named,
+    subjects_of,
+    unit_personas,
+    work_through,
+)
+from researcher.relationships import lineage_roles
+
+# Event types in which a persona can only take part once in the given
+# roles; a persona born twice must have one birth wrong.
+SINGLE_EVENT_ROLES = getattr(
+    settings,
+    'RESEARCHER_SINGLE_EVENT_ROLES',
+    {
+        'Birth': ('Child', 'Principal'),
+        'Death': ('Deceased', 'Principal'),
+    }
+)
+
+# Characteristic part types a persona can only have one value of.
+SINGLE_VALUED_CHARACTERISTICS = getattr(
+    settings,
+    'RESEARCHER_SINGLE_VALUED_CHARACTERISTICS',
+    ('Sex',)
+)
+
+# Personas checked together, and ids in one IN list.
+BATCH_SIZE = 500
+
+KINDS = ('E', 'C', 'L')
+
+Member = collections.namedtuple(
+    'Member',
+    'assertion subject role value date_start date_end'
+)
+Member.__doc__ = """One assertion in a group.
+
+    assertion -- the assertion's id
+    subject -- the event id ('E'), characteristic id ('C') or parent
+        persona id ('L')
+    role -- the persona's role in the event, the assertion's value_role,
+        or the parent's role
+    value -- the characteristic's text ('C') or the lineage unit, as
+        'E12' or 'G5' ('L'); None for events
+    date_start -- the earlier date bound of the event or characteristic
+    date_end -- the later date bound
+    """
+
+
+class Rule(object):
+
+    """A check run over every group of one kind.
+
+    Class Variables:
+        name -- The name the rule's conflicts are stored under.
+        kind -- The kind of group it checks: 'E', 'C' or 'L'.
+    """
+
+    name = None
+    kind = None
+
+    def check(self, key, members):
+        """Find the conflicts in one group.
+
+        Arguments:
+            self
+            key -- the group: the event type name, the characteristic
+                part type name, or 'parents'
+            members -- the group's Members
+        Returns: an iterable of (description, assertion ids) pairs
+        """
+        raise NotImplementedError
+
+
+class EventDateRule(Rule):
+
+    """A persona in several events of a once-only kind, at other dates.
+
+    Births and deaths (see RESEARCHER_SINGLE_EVENT_ROLES) happen once.
+    Several such events are fine as long as their date ranges overlap,
+    since they may be the same event recorded by different sources.
+    """
+
+    name = 'event-dates'
+    kind = 'E'
+
+    def check(self, key, members):
+        """Report events whose date ranges do not all overlap."""
+        roles = SINGLE_EVENT_ROLES.get(key)
+        if not roles:
+            return []
+        events = {}
+        for member in members:
+            if member.role in roles:
+                events.setdefault(member.subject, []).append(member)
+        if len(events) < 2:
+            return []
+        first = [found[0] for found in events.values()]
+        if max(m.date_start for m in first) <= min(m.date_end for m in first):
+            return []
+        ranges = sorted(set(
+            (member.date_start, member.date_end) for member in first
+        ))
+        return [(
+            '%s dates disagree: %s' % (key, ', '.join(
+                str(start) if start == end else '%s to %s' % (start, end)
+                for start, end in ranges
+            )),
+            [m.assertion for found in events.values() for m in found]
+        )]
+
+
+class CharacteristicValueRule(Rule):
+
+    """Different values of a characteristic that only has one value.
+
+    Sex, for instance (see RESEARCHER_SINGLE_VALUED_CHARACTERISTICS).
+    Values are compared ignoring case and surrounding spaces.
+    """
+
+    name = 'characteristic-value'
+    kind = 'C'
+
+    def check(self, key, members):
+        """Report a group holding more than one value."""
+        if key not in SINGLE_VALUED_CHARACTERISTICS:
+            return []
+        values = collections.OrderedDict()
+        for member in members:
+            values.setdefault(member.value.strip().lower(), member.value)
+        if len(values) < 2:
+            return []
+        return [(
+            '%s values disagree: %s' % (key, ', '.join(values.values())),
+            [member.assertion for member in members]
+        )]
+
+
+class ParentsRule(Rule):
+
+    """Too many parents, or two different fathers or mothers."""
+
+    name = 'parents'
+    kind = 'L'
+
+    def check(self, key, members):
+        """Report parents that cannot all be right."""
+        found = []
+        for label, roles in (('fathers', FATHER_ROLES),
+                             ('mothers', MOTHER_ROLES)):
+            named = [member for member in members if member.role in roles]
+            parents = sorted(set(member.subject for member in named))
+            if len(parents) > 1:
+                found.append((
+                    'Different %s: personas %s' % (
+                        label,
+                        ', '.join(str(parent) for parent in parents)
+                    ),
+                    [member.assertion for member in named]
+                ))
+        parents = sorted(set(member.subject for member in members))
+        if len(parents) > 2 and not found:
+            found.append((
+                'More than two parents: personas %s' % ', '.join(
+                    str(parent) for parent in parents
+                ),
+                [member.assertion for member in members]
+            ))
+        return found
+
+
+_RULES = [EventDateRule(), CharacteristicValueRule(), ParentsRule()]
+
+
+def register(rule):
+    """Add a rule to those every check runs.
+
+    Arguments:
+        rule -- a Rule instance
+    """
+    if rule.kind not in KINDS:
+        raise ValueError('A rule checks one of the kinds %s.' % (KINDS,))
+    _RULES.append(rule)
+
+
+def rules(kind=None):
+    """List the registered rules, or those of one kind."""
+    return [rule for rule in _RULES if kind is None or rule.kind == kind]
+
+
+def _event_groups(personas):
+    """Load the event groups of some personas.
+
+    Returns: a dict of Member lists by (persona, event type name)
+    """
+    EventParticipation = apps.get_model('researcher', 'EventParticipation')
+    groups = collections.defaultdict(list)
+    for persona, assertion, event, role, event_type, start, end in \
+            EventParticipation.objects.filter(
+                persona__in=personas,
+                disproved=False).values_list(
+                    'persona', 'assertion', 'event', 'role',
+                    'event__event_type', 'event__date_start',
+                    'event__date_end'):
+        groups[persona, lookup('EventType').get(event_type).name].append(
+            Member(assertion, event, role, None,
+                   min(start, end), max(start, end))
+        )
+    return groups
+
+
+def _characteristic_groups(personas):
+    """Load the characteristic groups of some personas.
+
+    Returns: a dict of Member lists by (persona, part type name)
+    """
+    Assertion = apps.get_model('researcher', 'Assertion')
+    Characteristic = apps.get_model('researcher', 'Characteristic')
+    CharacteristicPart = apps.get_model('researcher', 'CharacteristicPart')
+    asserted = []
+    for pk, type1, id1, id2, role in Assertion.objects.filter(
+            Q(subject1_type='P', subject1__in=personas, subject2_type='C') |
+            Q(subject2_type='P', subject2__in=personas, subject1_type='C'),
+            disproved=False).values_list(
+                'pk', 'subject1_type', 'subject1', 'subject2', 'value_role'):
+        if type1 == 'P':
+            asserted.append((id1, pk, id2, role))
+        else:
+            asserted.append((id2, pk, id1, role))
+
+    characteristics = set(row[2] for row in asserted)
+    details = {}
+    parts = collections.defaultdict(list)
+    for batch in batches(characteristics):
+        for pk, start, end, order in Characteristic.objects.filter(
+                pk__in=batch).values_list(
+                    'pk', 'date_start', 'date_end', 'sort_order'):
+            details[pk] = (min(start, end), max(start, end), order == 'D')
+        for characteristic, part_type, name, number in \
+                CharacteristicPart.objects.filter(
+                    characteristic__in=batch).values_list(
+                        'characteristic', 'characteristic_part_type',
+                        'name', 'sequence_number'):
+            parts[characteristic].append((number, name, part_type))
+
+    groups = collections.defaultdict(list)
+    for persona, assertion, characteristic, role in asserted:
+        if characteristic not in details or not parts[characteristic]:
+            continue
+        start, end, descending = details[characteristic]
+        ordered = sorted(parts[characteristic], reverse=descending)
+        key = lookup('CharacteristicPartType').get(ordered[0][2]).name
+        groups[persona, key].append(Member(
+            assertion, characteristic, role,
+            ' '.join(name for number, name, part_type in ordered),
+            start, end
+        ))
+    return groups
+
+
+def _lineage_groups(personas):
+    """Load the parents of some personas.
+
+    Returns: a dict of Member lists by (persona, 'parents')
+    """
+    groups = collections.defaultdict(list)
+    roles = lineage_roles()
+    for kind, table, unit_field, type_field in (
+            ('E', 'EventParticipation', 'event', 'event__event_type__in'),
+            ('G', 'GroupMembership', 'group', 'group__group_type__in')):
+        type_ids, parent_roles, child_roles = roles[kind]
+        if not type_ids:
+            continue
+        model = apps.get_model('researcher', table)
+        children = collections.defaultdict(list)
+        for persona, unit in model.objects.filter(**{
+                'persona__in': personas,
+                'role__in': child_roles,
+                'disproved': False,
+                type_field: type_ids}).values_list('persona', unit_field):
+            children[unit].append(persona)
+        for batch in batches(children):
+            for unit, parent, role, assertion in model.objects.filter(**{
+                    '%s__in' % unit_field: batch,
+                    'role__in': parent_roles,
+                    'disproved': False}).values_list(
+                        unit_field, 'persona', 'role', 'assertion'):
+                for persona in children[unit]:
+                    if parent != persona:
+                        groups[persona, 'parents'].append(Member(
+                            assertion, parent, role,
+                            '%s%d' % (kind, unit), None, None
+                        ))
+    return groups
+
+
+GROUP_LOADERS = {
+    'E': _event_groups,
+    'C': _characteristic_groups,
+    'L': _lineage_groups,
+}
+
+
+def evaluate(personas, kinds=KINDS):
+    """Check groups of some personas and store the conflicts found.
+
+    Arguments:
+        personas -- persona ids
+        kinds -- the kinds of group to check
+    Returns: the number of conflicts found
+    """
+    Conflict = apps.get_model('researcher', 'Conflict')
+    found = 0
+    for batch in batches(set(personas)):
+        for kind in kinds:
+            conflicts = []
+            for (persona, key), members in sorted(
+                    GROUP_LOADERS[kind](batch).items()):
+                for rule in rules(kind):
+                    for description, assertions in rule.check(key, members):
+                        conflicts.append((
+                            Conflict(
+                                persona_id=persona,
+                                kind=kind,
+                                key=key[:64],
+                                rule=rule.name,
+                                description=description
+                            ),
+                            sorted(set(assertions))
+                        ))
+            with transaction.atomic():
+                Conflict.objects.filter(
+                    persona__in=batch,
+                    kind=kind
+                ).delete()
+                # Saved one by one for their ids; conflicts are rare.
+                links = []
+                for conflict, assertions in conflicts:
+                    conflict.save(force_insert=True)
+                    links.extend(
+                        Conflict.assertions.through(
+                            conflict_id=conflict.pk,
+                            assertion_id=assertion
+                        )
+                        for assertion in assertions
+                    )
+                Conflict.assertions.through.objects.bulk_create(
+                    links,
+                    batch_size=BATCH_SIZE
+                )
+            found += len(conflicts)
+    return found
+
+
+def queue(personas, kinds=KINDS):
+    """Queue groups of some personas to be checked.
+
+    Arguments:
+        personas -- persona ids
+        kinds -- the kinds of group to check
+    """
+    enqueue('PendingConflictCheck', ('persona', 'kind'), [
+        (persona, kind) for persona in set(personas) for kind in kinds
+    ])
+
+
+def _check_queued(pending):
+    """Check a batch of queued (persona, kind) groups."""
+    by_kind = collections.defaultdict(list)
+    for persona, kind in pending:
+        by_kind[kind].append(persona)
+    for kind, personas in by_kind.items():
+        evaluate(personas, kinds=(kind,))
+
+
+def check_pending(limit=None):
+    """Check the queued groups.
+
+    Arguments:
+        limit -- stop after about this many groups; None checks them all
+    Returns: the number of groups checked
+    """
+    return work_through(
+        'PendingConflictCheck',
+        ('persona', 'kind'),
+        _check_queued,
+        limit
+    )
+
+
+def check_all():
+    """Check every group of every persona.
+
+    Returns: the number of conflicts found
+    """
+    Persona = apps.get_model('researcher', 'Persona')
+    found = 0
+    personas = list(Persona.objects.values_list('pk', flat=True))
+    for batch in batches(personas):
+        found += evaluate(batch)
+    return found
+
+
+def _assertion_groups(subject1_type, subject1, subject2_type, subject2):
+    """Work out the groups an assertion belongs to.
+
+    Returns: a list of (persona ids, kinds) pairs
+    """
+    if subject1_type == 'P':
+        persona, kind, other = subject1, subject2_type, subject2
+    elif subject2_type == 'P':
+        persona, kind, other = subject2, subject1_type, subject1
+    else:
+        return []
+    if kind == 'C':
+        return [([persona], ('C',))]
+    if kind in ('E', 'G'):
+        # A new parent changes the parents of everyone in the unit.
+        found = [(unit_personas(kind, other) + [persona], ('L',))]
+        if kind == 'E':
+            found.append(([persona], ('E',)))
+        return found
+    return []
+
+
+def _assertion_changed(instance, before, raw, deleted):
+    """Queue the groups an assertion joins and those it leaves."""
+    if raw:
+        return
+    groups = _assertion_groups(*subjects_of(instance))
+    if before is not None:
+        groups += _assertion_groups(*subjects_of(before))
+    for personas, kinds in groups:
+        queue(personas, kinds)
+
+
+def _event_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved events."""
+    if not raw:
+        queue(unit_personas('E', instance.pk), ('E', 'L'))
+
+
+def _group_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved groups."""
+    if not raw:
+        queue(unit_personas('G', instance.pk), ('L',))
+
+
+def _unit_deleted(sender, instance, **kwargs):
+    """Signal receiver for deleted events and groups.
+
+    Their participations are gone by now, so the personas are read from
+    the assertions naming the unit, which stay.
+    """
+    Assertion = apps.get_model('researcher', 'Assertion')
+    if sender is apps.get_model('researcher', 'Event'):
+        kind, kinds = 'E', ('E', 'L')
+    else:
+        kind, kinds = 'G', ('L',)
+    queue(personas_named(Assertion.objects.filter(
+        Q(subject1_type=kind, subject1=instance.pk) |
+        Q(subject2_type=kind, subject2=instance.pk)
+    )), kinds)
+
+
+def _characteristic_part_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved and deleted characteristic parts."""
+    if raw:
+        return
+    Assertion = apps.get_model('researcher', 'Assertion')
+    queue([
+        id1 if type1 == 'P' else id2
+        for type1, id1, id2 in Assertion.objects.filter(
+            Q(subject1_type='P', subject2_type='C',
+              subject2=instance.characteristic_id) |
+            Q(subject2_type='P', subject1_type='C',
+              subject1=instance.characteristic_id)
+        ).values_list('subject1_type', 'subject1', 'subject2')
+    ], ('C',))
+
+
+def connect_signals():
+    """Queue checks as the rows behind the groups change."""
+    on_assertion_change(_assertion_changed)
+    for name, receivers in (
+            ('Event', ((post_save, _event_changed),
+                       (post_delete, _unit_deleted))),
+            ('Group', ((post_save, _group_changed),
+                       (post_delete, _unit_deleted))),
+            ('CharacteristicPart', ((post_save, _characteristic_part_changed),
+                                    (post_delete,
+                                     _characteristic_part_changed)))):
+        model = apps.get_model('researcher', name)
+        for signal, receiver in receivers:
+            signal.connect(
+                receiver,
+                sender=model,
+                dispatch_uid='researcher.conflicts.%s' % name
+            )
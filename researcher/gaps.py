@@ -0,0 +1,449 @@
+"""Find the gaps in what is known about personas.
+
+A research gap is something a researcher should go and look for:
+
+    birth -- no birth event
+    death -- no death event
+    parents -- no parent in any lineage event or group (see
+        researcher.relationships)
+    sources -- the persona's assertions, with the assertions they were
+        concluded from, cite fewer than MIN_SOURCES sources
+    surety -- even the persona's most reliable assertion ranks above
+        LOW_SURETY_RANK in its surety scheme (higher sequence numbers are
+        less sure, as in researcher.network)
+
+Only assertions that are not disproved count.  Each gap is found for a
+batch of personas with a query or two: the missing events and parents as
+anti-joins (personas NOT IN the participations that would fill the gap),
+the sources and surety as aggregates.  The gaps found are stored as
+ResearchGap rows; rows that are still gaps are kept, along with the
+research objective made for them.
+
+Saving or deleting an assertion, an assertion-assertion link or an event
+queues the personas it concerns as PendingGapCheck rows, and
+check_pending() refreshes them.  worklist() pages through a project's
+gaps from a per-project cache that is current whenever a check has run,
+and create_objectives() turns gaps into ResearchObjective (and, given
+where to look, Search) stubs.
+
+Exports:
+    Functions:
+        check_pending
+        connect_signals
+        create_objectives
+        queue
+        refresh
+        refresh_project
+        worklist
+"""
+import collections
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Min, Q
+from django.db.models.signals import post_delete, post_save
+
+from researcher import replicas
+from researcher.conflicts import SINGLE_EVENT_ROLES
+from researcher.lookups import lookup
+from researcher.queues import (
+    batches,
+    enqueue,
+    on_assertion_change,
+    personas_named,
+    subjects_of,
+    unit_personas,
+    work_through,
+)
+from researcher.relationships import lineage_roles
+from researcher.sanity import project_personas
+from researcher.versions import bump_table_version, table_versions
+
+MIN_SOURCES = getattr(settings, 'RESEARCHER_GAP_MIN_SOURCES', 2)
+
+LOW_SURETY_RANK = getattr(settings, 'RESEARCHER_GAP_LOW_SURETY_RANK', 2)
+
+CACHE_TIMEOUT = getattr(settings, 'RESEARCHER_GAP_CACHE_TIMEOUT', 86400)
+
+# What a research objective for each kind of gap is called.
+OBJECTIVE_NAMES = {
+    'birth': 'Find the birth of %s',
+    'death': 'Find the death of %s',
+    'parents': 'Find the parents of %s',
+    'sources': 'Find more sources for %s',
+    'surety': 'Find better evidence for %s',
+}
+
+# The tables a project's cached worklist is derived from.
+SOURCE_MODELS = ('ResearchGap', 'ResearcherProject')
+
+
+def _without(personas, filled):
+    """Find the personas not in a queryset of participations.
+
+    Arguments:
+        personas -- persona ids
+        filled -- a queryset of the participations that fill the gap
+    Returns: a set of persona ids
+    """
+    Persona = apps.get_model('researcher', 'Persona')
+    return set(Persona.objects.filter(pk__in=personas).exclude(
+        pk__in=filled.values('persona')
+    ).values_list('pk', flat=True))
+
+
+def _missing_event(personas, name):
+    """Find personas in no event of a once-only type, such as 'Birth'.
+
+    Returns: a dict of details by persona id
+    """
+    EventParticipation = apps.get_model('researcher', 'EventParticipation')
+    missing = _without(personas, EventParticipation.objects.filter(
+        event__event_type__in=[
+            row.pk for row in lookup('EventType').filter(name=name)
+        ],
+        role__in=SINGLE_EVENT_ROLES.get(name, ()),
+        disproved=False
+    ))
+    return dict((persona, 'No %s event' % name.lower())
+                for persona in missing)
+
+
+def _missing_parents(personas):
+    """Find personas that are no one's child.
+
+    Returns: a dict of details by persona id
+    """
+    missing = set(personas)
+    roles = lineage_roles()
+    for kind, table, unit_field in (
+            ('E', 'EventParticipation', 'event'),
+            ('G', 'GroupMembership', 'group')):
+        type_ids, parent_roles, child_roles = roles[kind]
+        if not type_ids or not missing:
+            continue
+        model = apps.get_model('researcher', table)
+        parented = model.objects.filter(
+            role__in=parent_roles,
+            disproved=False
+        ).values(unit_field)
+        missing &= _without(missing, model.objects.filter(**{
+            'role__in': child_roles,
+            'disproved': False,
+            '%s__in' % unit_field: parented}))
+    return dict((persona, 'No parents') for persona in missing)
+
+
+def _assertions(personas):
+    """Build a queryset of the live assertions naming some personas."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    return Assertion.objects.filter(
+        Q(subject1_type='P', subject1__in=personas) |
+        Q(subject2_type='P', subject2__in=personas),
+        disproved=False
+    )
+
+
+def _few_sources(personas):
+    """Find personas whose assertions cite too few sources.
+
+    Returns: a dict of details by persona id
+    """
+    AssertionAssertion = apps.get_model('researcher', 'AssertionAssertion')
+    wanted = set(personas)
+    sources = collections.defaultdict(set)
+    derived = collections.defaultdict(set)
+    for pk, type1, id1, type2, id2, source in _assertions(
+            personas).values_list('pk', 'subject1_type', 'subject1',
+                                  'subject2_type', 'subject2', 'source'):
+        for kind, persona in ((type1, id1), (type2, id2)):
+            if kind == 'P' and persona in wanted:
+                if source is not None:
+                    sources[persona].add(source)
+                derived[pk].add(persona)
+    for batch in batches(derived):
+        for high, source in AssertionAssertion.objects.filter(
+                assertion_high__in=batch,
+                assertion_low__disproved=False,
+                assertion_low__source__isnull=False).values_list(
+                    'assertion_high', 'assertion_low__source'):
+            for persona in derived[high]:
+                sources[persona].add(source)
+    return dict(
+        (persona, 'Cited by %d source%s' % (
+            len(sources[persona]),
+            '' if len(sources[persona]) == 1 else 's'
+        ))
+        for persona in wanted if len(sources[persona]) < MIN_SOURCES
+    )
+
+
+def _low_surety(personas):
+    """Find personas with no assertion sure enough.
+
+    Returns: a dict of details by persona id
+    """
+    found = {}
+    for side in ('subject1', 'subject2'):
+        for persona, best in _assertions(personas).filter(**{
+                side + '_type': 'P',
+                side + '__in': personas}).values(side).annotate(
+                    best=Min('surety_scheme_part__sequence_number')
+                ).values_list(side, 'best'):
+            if best is not None:
+                found[persona] = min(best, found.get(persona, best))
+    return dict(
+        (persona, 'Surest assertion ranks %d' % best)
+        for persona, best in found.items() if best > LOW_SURETY_RANK
+    )
+
+
+GAP_FINDERS = (
+    ('birth', lambda personas: _missing_event(personas, 'Birth')),
+    ('death', lambda personas: _missing_event(personas, 'Death')),
+    ('parents', _missing_parents),
+    ('sources', _few_sources),
+    ('surety', _low_surety),
+)
+
+
+def refresh(personas):
+    """Find the gaps of some personas and store them.
+
+    Gaps that are still open keep their rows, and so their objectives.
+
+    Arguments:
+        personas -- persona ids
+    Returns: the number of gaps found
+    """
+    ResearchGap = apps.get_model('researcher', 'ResearchGap')
+    found = 0
+    for batch in batches(set(personas)):
+        gaps = {}
+        for gap, finder in GAP_FINDERS:
+            for persona, detail in finder(batch).items():
+                gaps[persona, gap] = detail
+        with transaction.atomic():
+            stale = []
+            for pk, persona, gap, detail in ResearchGap.objects.filter(
+                    persona__in=batch).values_list(
+                        'pk', 'persona', 'gap', 'detail'):
+                if gaps.get((persona, gap)) == detail:
+                    del gaps[persona, gap]
+                elif (persona, gap) in gaps:
+                    ResearchGap.objects.filter(pk=pk).update(
+                        detail=gaps.pop((persona, gap))
+                    )
+                else:
+                    stale.append(pk)
+            ResearchGap.objects.filter(pk__in=stale).delete()
+            ResearchGap.objects.bulk_create([
+                ResearchGap(persona_id=persona, gap=gap, detail=detail)
+                for (persona, gap), detail in sorted(gaps.items())
+            ])
+        found += ResearchGap.objects.filter(persona__in=batch).count()
+    bump_table_version(ResearchGap)
+    return found
+
+
+def refresh_project(project):
+    """Find the gaps of every persona of a project.
+
+    Arguments:
+        project -- the Project or its id
+    Returns: the number of gaps found
+    """
+    return refresh(project_personas(project))
+
+
+def queue(personas):
+    """Queue some personas to have their gaps refreshed.
+
+    Arguments:
+        personas -- persona ids
+    """
+    enqueue('PendingGapCheck', ('persona',), [
+        (persona,) for persona in personas
+    ])
+
+
+def _refresh_queued(pending):
+    """Refresh the gaps of a batch of queued personas."""
+    refresh(row[0] for row in pending)
+
+
+def check_pending(limit=None):
+    """Refresh the gaps of the queued personas.
+
+    Arguments:
+        limit -- stop after about this many personas; None refreshes
+            them all
+    Returns: the number of personas refreshed
+    """
+    return work_through(
+        'PendingGapCheck',
+        ('persona',),
+        _refresh_queued,
+        limit
+    )
+
+
+def _project_gaps(project):
+    """List a project's gaps, from the cache when it is current.
+
+    Returns: a list of (gap id, persona id, persona name, gap, detail,
+        objective id) tuples, by persona name
+    """
+    ResearchGap = apps.get_model('researcher', 'ResearchGap')
+    key = 'researcher:gaps:%d' % getattr(project, 'pk', project)
+    versions = table_versions([
+        apps.get_model('researcher', name) for name in SOURCE_MODELS
+    ])
+    found = cache.get(key)
+    if found is not None and found[0] == versions:
+        return found[1]
+    rows = []
+    for batch in batches(project_personas(project)):
+        rows.extend(ResearchGap.objects.filter(
+            persona__in=batch
+        ).values_list('pk', 'persona', 'persona__name', 'gap', 'detail',
+                      'objective'))
+    rows.sort(key=lambda row: (row[2], row[1], row[3]))
+    if not replicas.reading_replicas():
+        cache.set(key, (versions, rows), CACHE_TIMEOUT)
+    return rows
+
+
+def worklist(project, gaps=None, page=1, per_page=50, open_only=False):
+    """Page through a project's research gaps.
+
+    Arguments:
+        project -- the Project or its id
+        gaps -- only these kinds of gap (e.g. ['birth']); None for all
+        page -- the page number, from 1
+        per_page -- gaps on a page
+        open_only -- leave out gaps that already have an objective
+    Returns: a django.core.paginator.Page of (gap id, persona id,
+        persona name, gap, detail, objective id) tuples
+    Raises: django.core.paginator.InvalidPage for a page out of range
+    """
+    rows = _project_gaps(project)
+    if gaps is not None or open_only:
+        rows = [
+            row for row in rows
+            if (gaps is None or row[3] in gaps) and
+            not (open_only and row[5] is not None)
+        ]
+    return Paginator(rows, per_page).page(page)
+
+
+def create_objectives(project, gaps, priority=1, status='Open',
+                      search=None):
+    """Make a research objective for each of some gaps.
+
+    Gaps that already have an objective are skipped.
+
+    Arguments:
+        project -- the Project or its id
+        gaps -- ResearchGap ids
+        priority -- the objectives' priority
+        status -- the objectives' status
+        search -- None, or a dict of Search field values (researcher,
+            source, repository, scheduled_date, completed_date, status,
+            priority) to plan a search for each objective with
+    Returns: the ResearchObjectives made
+    """
+    ResearchGap = apps.get_model('researcher', 'ResearchGap')
+    ResearchObjective = apps.get_model('researcher', 'ResearchObjective')
+    Search = apps.get_model('researcher', 'Search')
+    made = []
+    for batch in batches(gaps):
+        rows = list(ResearchGap.objects.filter(
+            pk__in=batch,
+            objective__isnull=True
+        ).values_list('pk', 'persona__name', 'gap', 'detail'))
+        with transaction.atomic():
+            # Saved one by one for their ids, which bulk_create does not
+            # return; one transaction keeps it to one commit.
+            for pk, name, gap, detail in rows:
+                objective = ResearchObjective(
+                    project_id=getattr(project, 'pk', project),
+                    name=(OBJECTIVE_NAMES[gap] % name)[:128],
+                    description=detail,
+                    priority=priority,
+                    status=status
+                )
+                objective.save(force_insert=True)
+                if search is not None:
+                    planned = Search(
+                        description=objective.name,
+                        searched_for=name,
+                        **search
+                    )
+                    planned.save(force_insert=True)
+                    objective.activities.add(planned.pk)
+                ResearchGap.objects.filter(pk=pk).update(
+                    objective=objective
+                )
+                made.append(objective)
+    bump_table_version(ResearchGap)
+    return made
+
+
+def _concerned(subject1_type, subject1, subject2_type, subject2):
+    """List the personas whose gaps an assertion may change.
+
+    A parent named in a lineage unit fills the gap of every child in it.
+    """
+    personas = []
+    for (kind, pk), (other_kind, other) in (
+            ((subject1_type, subject1), (subject2_type, subject2)),
+            ((subject2_type, subject2), (subject1_type, subject1))):
+        if kind == 'P':
+            personas.append(pk)
+            if other_kind in ('E', 'G'):
+                personas.extend(unit_personas(other_kind, other))
+    return personas
+
+
+def _assertion_changed(instance, before, raw, deleted):
+    """Queue the personas an assertion concerns, and those it concerned."""
+    if raw:
+        return
+    queue(_concerned(*subjects_of(instance)) + (
+        _concerned(*subjects_of(before)) if before is not None else []
+    ))
+
+
+def _link_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved and deleted assertion-assertion links."""
+    if not raw:
+        Assertion = apps.get_model('researcher', 'Assertion')
+        queue(personas_named(
+            Assertion.objects.filter(pk=instance.assertion_high_id)
+        ))
+
+
+def _event_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved events."""
+    if not raw:
+        queue(unit_personas('E', instance.pk))
+
+
+def connect_signals():
+    """Queue refreshes as the rows the gaps are found from change."""
+    on_assertion_change(_assertion_changed)
+    AssertionAssertion = apps.get_model('researcher', 'AssertionAssertion')
+    uid = 'researcher.gaps.AssertionAssertion'
+    post_save.connect(_link_changed, sender=AssertionAssertion,
+                      dispatch_uid=uid)
+    post_delete.connect(_link_changed, sender=AssertionAssertion,
+                        dispatch_uid=uid)
+    post_save.connect(
+        _event_changed,
+        sender=apps.get_model('researcher', 'Event'),
+        dispatch_uid='researcher.gaps.Event'
+    )
@@ -0,0 +1,387 @@
+"""Keep an append-only history of the evidence and the conclusions.
+
+Every insert, update and delete of the models in VERSIONED_MODELS adds
+a Revision holding the fields that changed, who changed them and when.
+A revision is valid from its change until the row's next one, so the
+state of any row at any moment is the revision whose valid_from and
+valid_to bracket it, found through their indexes:
+
+    as_of(Assertion, moment)             every assertion at that moment
+    as_of(Assertion, moment, pks=[...])  some of them
+    history(Assertion, pk)               each revision and the state
+                                         it left
+
+Revisions hold only the changed fields, so the history grows with the
+volume of changes, not with the size of the rows.  Every
+RESEARCHER_HISTORY_KEYFRAME-th revision of a row holds all its fields,
+so that no state is rebuilt from more than that many revisions; a
+save reads its row's previous state from those revisions, with the
+query that finds the version to add.  A row saved before history was
+recorded starts its history with a full revision at its next save.
+
+A change is put down to the researcher acting in the thread: the
+logged-in researcher of a request (with HistoryMiddleware), the
+researcher of a job, or whoever is named with acting_as().  Failing
+those, it is put down to the row's own researcher, if it has one.
+
+Bulk operations that bypass model signals (bulk_create, loading
+fixtures) must call record_created with the rows they added;
+QuerySet.update must not be used on the versioned models.
+
+Exports:
+    Functions:
+        acting_as
+        acting_researcher
+        as_of
+        connect_signals
+        history
+        record_created
+    Classes:
+        HistoryMiddleware
+"""
+import collections
+import contextlib
+import json
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.utils import six, timezone
+
+# Rows written by one INSERT, and ids in one IN list.
+BATCH_SIZE = 500
+
+VERSIONED_MODELS = (
+    'Source',
+    'CitationPart',
+    'Representation',
+    'Assertion',
+    'AssertionAssertion',
+)
+
+KEYFRAME_EVERY = max(1, getattr(settings, 'RESEARCHER_HISTORY_KEYFRAME', 16))
+
+# Tries at adding a revision that another process's revision beat.
+ATTEMPTS = 3
+
+_local = threading.local()
+
+
+def _chunks(values):
+    """Split values into BATCH_SIZE lists."""
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def _keyframe(version):
+    """Find the full revision a revision's state is rebuilt from."""
+    return version - (version - 1) % KEYFRAME_EVERY
+
+
+def _fields(model):
+    """List the fields of a model that revisions record."""
+    return [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+
+
+def _encode(field, instance):
+    """Turn a field's value into something JSON keeps exactly."""
+    value = getattr(instance, field.attname)
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, six.integer_types):
+        return value
+    return field.value_to_string(instance)
+
+
+def _state(model, instance):
+    """Encode every recorded field of a row, by attname."""
+    return dict(
+        (field.attname, _encode(field, instance))
+        for field in _fields(model)
+    )
+
+
+def _dump(state):
+    """Write the fields of a revision as compact JSON."""
+    return json.dumps(state, separators=(',', ':'), sort_keys=True)
+
+
+def _instance(model, pk, state):
+    """Build an unsaved-looking instance of a row from its state."""
+    fields = dict((field.attname, field) for field in _fields(model))
+    values = dict(
+        (name, None if value is None else fields[name].to_python(value))
+        for name, value in state.items()
+        if name in fields
+    )
+    instance = model(pk=pk, **values)
+    instance._state.adding = False
+    return instance
+
+
+def _revisions(using=None):
+    """Return the manager of revisions, on a given database if any."""
+    return apps.get_model('researcher', 'Revision').objects.db_manager(
+        using
+    )
+
+
+@contextlib.contextmanager
+def acting_as(researcher):
+    """Put the changes made in the block down to a researcher.
+
+    Arguments:
+        researcher -- the Researcher (or id); None for nobody in
+            particular
+    """
+    previous = getattr(_local, 'researcher', None)
+    _local.researcher = getattr(researcher, 'pk', researcher)
+    try:
+        yield
+    finally:
+        _local.researcher = previous
+
+
+def acting_researcher():
+    """Name the researcher the thread's changes are put down to.
+
+    Returns: a Researcher id, or None
+    """
+    researcher = getattr(_local, 'researcher', None)
+    request = getattr(_local, 'request', None)
+    if researcher is None and request is not None:
+        # Looked up once per request, on its first change.
+        _local.request = None
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated():
+            researcher = _local.researcher = apps.get_model(
+                'researcher', 'Researcher'
+            ).objects.filter(user=user).values_list('pk', flat=True).first()
+    return researcher
+
+
+def _researcher_of(instance):
+    """Name the researcher a change to a row is put down to."""
+    researcher = acting_researcher()
+    if researcher is None:
+        researcher = getattr(instance, 'researcher_id', None)
+    return researcher
+
+
+class HistoryMiddleware(object):
+
+    """Put a request's changes down to its logged-in researcher.
+
+    Must come after the authentication middleware.
+    """
+
+    def process_request(self, request):
+        """Start the request with nobody acting yet."""
+        _local.researcher = None
+        _local.request = request
+
+    def process_response(self, request, response):
+        """Forget the request's researcher."""
+        _local.researcher = None
+        _local.request = None
+        return response
+
+
+def _next(sender, instance, using, deleted):
+    """Add a row's next revision, given the state its last ones leave."""
+    name = sender._meta.object_name
+    after = {} if deleted else _state(sender, instance)
+    # The last KEYFRAME_EVERY revisions always include a full one.
+    recent = list(_revisions(using).filter(
+        model=name,
+        object_id=instance.pk
+    ).order_by('-version')[:KEYFRAME_EVERY])
+    latest = recent[0] if recent else None
+    version = latest.version + 1 if latest is not None else 1
+    if latest is None:
+        # The history starts here; keep everything the row holds.
+        full = True
+        delta = _state(sender, instance)
+    elif latest.deleted or _keyframe(version) == version:
+        full = not deleted
+        delta = after
+    else:
+        before = {}
+        for revision in reversed(recent):
+            _fold(before, revision.full, revision.delta)
+        full = False
+        delta = dict(
+            (attname, value) for attname, value in after.items()
+            if before.get(attname) != value
+        )
+        if not delta and not deleted:
+            return
+    now = timezone.now()
+    if latest is not None:
+        latest.valid_to = now
+        latest.save(update_fields=['valid_to'])
+    _revisions(using).create(
+        model=name,
+        object_id=instance.pk,
+        version=version,
+        full=full,
+        deleted=deleted,
+        delta=_dump(delta),
+        researcher_id=_researcher_of(instance),
+        valid_from=now
+    )
+
+
+def _add(sender, instance, using, deleted=False):
+    """Add a row's next revision, closing the one before it.
+
+    Two processes saving a row at once can pick the same next version;
+    the one that loses reads the winner's revision and tries again.
+    """
+    for attempt in range(ATTEMPTS):
+        try:
+            with transaction.atomic(using=using):
+                _next(sender, instance, using, deleted)
+            return
+        except IntegrityError:
+            if attempt == ATTEMPTS - 1:
+                raise
+
+
+def _record(sender, instance, raw=False, using=None, **kwargs):
+    """Signal receiver that adds a revision for a saved row."""
+    if not raw:
+        _add(sender, instance, using)
+
+
+def _record_deletion(sender, instance, using=None, **kwargs):
+    """Signal receiver that adds a revision for a deleted row."""
+    _add(sender, instance, using, deleted=True)
+
+
+def connect_signals():
+    """Add a revision whenever a versioned row changes."""
+    for name in VERSIONED_MODELS:
+        model = apps.get_model('researcher', name)
+        uid = 'researcher.history.%s' % name
+        post_save.connect(_record, sender=model, dispatch_uid=uid)
+        post_delete.connect(_record_deletion, sender=model,
+                            dispatch_uid=uid)
+
+
+def record_created(model, pks, researcher=None, using=None):
+    """Start the history of rows added without model signals.
+
+    Arguments:
+        model -- the model class, one of VERSIONED_MODELS
+        pks -- the ids of the new rows; ids of missing rows are skipped
+        researcher -- the Researcher (or id) who added them; None takes
+            the acting researcher, or each row's own
+        using -- the rows' database alias; None asks the routers
+    """
+    Revision = apps.get_model('researcher', 'Revision')
+    name = model._meta.object_name
+    researcher = getattr(researcher, 'pk', researcher)
+    now = timezone.now()
+    for batch in _chunks(pks):
+        rows = model._base_manager.db_manager(using).filter(pk__in=batch)
+        _revisions(using).bulk_create([
+            Revision(
+                model=name,
+                object_id=instance.pk,
+                version=1,
+                full=True,
+                delta=_dump(_state(model, instance)),
+                researcher_id=(researcher if researcher is not None
+                               else _researcher_of(instance)),
+                valid_from=now
+            )
+            for instance in rows
+        ])
+
+
+def _fold(state, full, delta):
+    """Apply one revision's fields to a row's state."""
+    if full:
+        state.clear()
+    state.update(json.loads(delta))
+
+
+def history(model, pk, using=None):
+    """List the revisions of a row, oldest first.
+
+    Arguments:
+        model -- the model class, one of VERSIONED_MODELS
+        pk -- the row's id
+        using -- the database alias; None asks the routers
+    Returns: a list of (Revision, instance as the revision left it, or
+        None for a deletion)
+    """
+    state = {}
+    found = []
+    for revision in _revisions(using).filter(
+            model=model._meta.object_name,
+            object_id=pk).order_by('version'):
+        _fold(state, revision.full, revision.delta)
+        found.append((
+            revision,
+            None if revision.deleted else _instance(model, pk, state)
+        ))
+    return found
+
+
+def as_of(model, moment, pks=None, using=None):
+    """Rebuild rows of a versioned model as they stood at a moment.
+
+    The instances are not read from the table; saving one puts the row
+    back as it stood.
+
+    Arguments:
+        model -- the model class, one of VERSIONED_MODELS
+        moment -- an aware datetime
+        pks -- the ids of the rows wanted; None for every row
+        using -- the database alias; None asks the routers
+    Returns: a dict of {id: instance} of the rows that existed then
+    """
+    name = model._meta.object_name
+    current = _revisions(using).filter(
+        model=name,
+        valid_from__lte=moment
+    ).filter(Q(valid_to__isnull=True) | Q(valid_to__gt=moment))
+    batches = [None] if pks is None else _chunks(pks)
+    live = {}
+    for batch in batches:
+        revisions = current
+        if batch is not None:
+            revisions = revisions.filter(object_id__in=batch)
+        for object_id, version, deleted in revisions.values_list(
+                'object_id', 'version', 'deleted'):
+            if not deleted:
+                live[object_id] = version
+
+    starts = collections.defaultdict(list)
+    for object_id, version in live.items():
+        starts[_keyframe(version)].append(object_id)
+    states = collections.defaultdict(dict)
+    for start, object_ids in starts.items():
+        for batch in _chunks(object_ids):
+            for object_id, version, full, delta in _revisions(using).filter(
+                    model=name,
+                    object_id__in=batch,
+                    version__gte=start,
+                    valid_from__lte=moment
+            ).order_by('object_id', 'version').values_list(
+                    'object_id', 'version', 'full', 'delta'):
+                if version <= live[object_id]:
+                    _fold(states[object_id], full, delta)
+    return dict(
+        (object_id, _instance(model, object_id, state))
+        for object_id, state in states.items()
+    )
@@ -0,0 +1,1039 @@
+"""Import GEDCOM and CSV files in parallel.
+
+Parsing and mapping records is the slow part of an import, so it is
+spread over a pool of processes:
+
+1. The file is cut into shards at record boundaries (a line starting
+   `0 ` in GEDCOM, any line in CSV), several per worker so that they
+   finish together.
+2. Each worker parses its shards into rows (personas, events, sources,
+   characteristics and the assertions that tie them together), numbered
+   from 0 within the shard, and pickles them to a scratch directory.
+   It reports back only how many rows of each table it made, the
+   cross-references (`@I12@`, or a CSV row's id) it defines, and the
+   place names it uses.
+3. The parent creates the places, then reserves one block of primary
+   keys per table for the whole import and hands each shard its own
+   range of it, so the shards' ids never collide.
+4. The workers write their shards with bulk_create, each in its own
+   transaction and without talking to each other.  A reference to a
+   record of another shard cannot be resolved by the shard; it is
+   written as a placeholder (the import's root source, or 0 for a
+   subject id) and returned to the parent.
+5. The parent resolves those references against every shard's
+   definitions and corrects them with one UPDATE per batch of rows.
+   Assertions about records the file never defines are deleted.
+
+SQLite takes one writer at a time, so there the shards are written one
+after another by the parent; the parsing is still parallel.  A reserved
+block moves the table's sequence past it (sqlite_sequence on SQLite),
+so rows others insert meanwhile never take its ids, and an import that
+fails deletes only the rows in its own blocks: its places, root source
+and shard rows.  Only PostgreSQL and SQLite are supported.
+
+Every assertion is made by the given researcher, with the given surety,
+and cites the source it came with in the file, or else a root source
+made for the import.  Facts without a place or date get a place named
+UNKNOWN_PLACE and the widest possible dates.
+
+GEDCOM individuals (INDI) become personas with their events (see
+RESEARCHER_IMPORT_EVENTS) and sex; every individual gets a birth event,
+so that families can name its parents.  Families (FAM) give the
+marriage and the Father and Mother roles in each child's birth.  Source
+records (SOUR) become sources with their title, author and publisher,
+and a citation's PAGE a source under them.  CSV files have a header row
+naming any of the columns id, name, sex, birth_date, birth_place,
+death_date, death_place, father, mother and source; father and mother
+give the ids of other rows.  CSV rows may not contain line breaks.
+
+Exports:
+    Functions:
+        import_file
+        parse_date
+"""
+import calendar
+import collections
+import csv
+import datetime
+import io
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from researcher import conflicts, gaps, history, sanity
+from researcher.participation import refresh_participation
+from researcher.queues import batches
+from researcher.relationships import invalidate_graph
+from researcher.timeline import place_names
+from researcher.versions import bump_table_version
+
+# Rows written by one INSERT, and rows corrected by one UPDATE.
+BATCH_SIZE = 500
+
+WORKERS = getattr(settings, 'RESEARCHER_IMPORT_WORKERS', None)
+
+# GEDCOM event tags of individuals: (event type, the individual's role).
+EVENTS = getattr(settings, 'RESEARCHER_IMPORT_EVENTS', {
+    'BIRT': ('Birth', 'Child'),
+    'CHR': ('Christening', 'Child'),
+    'BAPM': ('Baptism', 'Child'),
+    'DEAT': ('Death', 'Deceased'),
+    'BURI': ('Burial', 'Deceased'),
+})
+
+# GEDCOM event tags of families: (event type, husband's role, wife's role).
+FAMILY_EVENTS = getattr(settings, 'RESEARCHER_IMPORT_FAMILY_EVENTS', {
+    'MARR': ('Marriage', 'Groom', 'Bride'),
+})
+
+# Place part types, largest first; a place's last comma-separated part
+# is the first type.
+PLACE_PARTS = getattr(settings, 'RESEARCHER_IMPORT_PLACE_PARTS',
+                      ('Country', 'State', 'County', 'Town'))
+
+# The birth roles of a child's parents.
+PARENT_ROLES = ('Father', 'Mother')
+
+UNKNOWN_PLACE = 'Unknown'
+
+EARLIEST = datetime.date(1, 1, 1)
+LATEST = datetime.date(9999, 12, 31)
+
+# The tables written from shards, in the order they are written.
+SHARD_MODELS = (
+    'Source',
+    'CitationPart',
+    'Persona',
+    'Event',
+    'Characteristic',
+    'CharacteristicPart',
+    'Assertion',
+)
+
+# Shards cut per worker, so that a slow shard does not hold up the end.
+SHARDS_PER_WORKER = 4
+
+# Files smaller than this are imported by one process.
+MIN_PARALLEL_BYTES = 1 << 20
+
+MONTHS = dict(
+    (name, number) for number, name in enumerate(
+        ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+         'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'),
+        1
+    )
+)
+
+_GEDCOM_LINE = re.compile(r'^\s*(\d+)\s+(?:@([^@]+)@\s+)?(\S+)(?: (.*))?$')
+_GEDCOM_POINTER = re.compile(r'^@([^@]+)@$')
+_ISO_DATE = re.compile(r'^(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?$')
+_GEDCOM_DATE = re.compile(r'^(?:(\d{1,2}) )?(?:([A-Z]{3}) )?(\d{1,4})$')
+
+Local = collections.namedtuple('Local', 'model index')
+Local.__doc__ = """A row made by the same shard: its table and number."""
+
+Xref = collections.namedtuple('Xref', 'model key')
+Xref.__doc__ = """A record of the file by its cross-reference, anywhere."""
+
+PlaceName = collections.namedtuple('PlaceName', 'name')
+PlaceName.__doc__ = """A place by its name, made by the parent."""
+
+
+def _date_range(text):
+    """Read one date, exact or partial, as (first day, last day)."""
+    match = _ISO_DATE.match(text)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = _GEDCOM_DATE.match(text)
+        if not match:
+            return None
+        day, month, year = match.groups()
+        if month is not None:
+            if month not in MONTHS:
+                return None
+            month = MONTHS[month]
+    try:
+        year = int(year)
+        if month is None:
+            return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+        month = int(month)
+        if day is None:
+            return (datetime.date(year, month, 1), datetime.date(
+                year, month, calendar.monthrange(year, month)[1]))
+        found = datetime.date(year, month, int(day))
+    except ValueError:
+        return None
+    return found, found
+
+
+def parse_date(text):
+    """Read a GEDCOM or ISO date as the range of days it allows.
+
+    Understands exact and partial dates (`12 MAR 1850`, `MAR 1850`,
+    `1850`, `1850-03-12`), the qualifiers ABT, EST, CAL and INT (read as
+    the date itself), and the ranges BEF, AFT, BET ... AND ... and
+    FROM ... TO ....
+
+    Arguments:
+        text -- the date
+    Returns: (the first day, the last day), or None if it is not a date
+    """
+    words = text.upper().replace(',', ' ').split()
+    if words[:1] in (['ABT'], ['EST'], ['CAL'], ['INT']):
+        words = words[1:]
+    for first, second in (('BET', 'AND'), ('FROM', 'TO')):
+        if words[:1] == [first]:
+            if second in words:
+                split = words.index(second)
+                start = _date_range(' '.join(words[1:split]))
+                end = _date_range(' '.join(words[split + 1:]))
+                if start and end:
+                    return start[0], end[1]
+                return None
+            start = _date_range(' '.join(words[1:]))
+            return start and (start[0], LATEST)
+    if words[:1] in (['BEF'], ['TO']):
+        end = _date_range(' '.join(words[1:]))
+        return end and (EARLIEST, end[1])
+    if words[:1] == ['AFT']:
+        start = _date_range(' '.join(words[1:]))
+        return start and (start[0], LATEST)
+    return _date_range(' '.join(words))
+
+
+class _Node(object):
+
+    """A GEDCOM line and the lines under it."""
+
+    __slots__ = ('tag', 'value', 'xref', 'children')
+
+    def __init__(self, tag, value, xref):
+        """Start a node with no children."""
+        self.tag = tag
+        self.value = value
+        self.xref = xref
+        self.children = []
+
+    def first(self, tag):
+        """Return the value of the first child with a tag, or ''."""
+        for child in self.children:
+            if child.tag == tag:
+                return child.value
+        return ''
+
+
+def _gedcom_records(text):
+    """Parse GEDCOM text into its level 0 records."""
+    record = None
+    stack = []
+    for line in text.splitlines():
+        match = _GEDCOM_LINE.match(line)
+        if match is None:
+            continue
+        level, xref, tag, value = match.groups()
+        level = int(level)
+        value = value or ''
+        if level == 0:
+            if record is not None:
+                yield record
+            record = _Node(tag, value, xref)
+            stack = [record]
+            continue
+        del stack[level:]
+        if len(stack) != level:
+            # A line deeper than any parent; the file is damaged.
+            continue
+        if tag == 'CONT':
+            stack[-1].value += '\n' + value
+        elif tag == 'CONC':
+            stack[-1].value += value
+        else:
+            node = _Node(tag, value, xref)
+            stack[-1].children.append(node)
+            stack.append(node)
+    if record is not None:
+        yield record
+
+
+class _Shard(object):
+
+    """The rows made from one shard of the file.
+
+    Instance Variables:
+        context -- What the parent set up: lookups, researcher, surety,
+            root source and unknown place ids.
+        rows -- Lists of row values by model name.
+        definitions -- The Local row of each cross-reference defined.
+        places -- The place names used.
+    """
+
+    def __init__(self, context):
+        """Start with no rows."""
+        self.context = context
+        self.rows = collections.OrderedDict(
+            (name, []) for name in SHARD_MODELS
+        )
+        self.definitions = {}
+        self.places = set()
+
+    def add(self, model, **values):
+        """Make a row, and return its Local reference."""
+        rows = self.rows[model]
+        rows.append(values)
+        return Local(model, len(rows) - 1)
+
+    def place(self, name):
+        """Refer to a place by name; the unknown place if there is none."""
+        name = ' '.join(name.split())
+        if not name:
+            return self.context['unknown_place']
+        self.places.add(name)
+        return PlaceName(name)
+
+    def source(self, title, higher=None, part_type='Title'):
+        """Make a source with one citation part.
+
+        Arguments:
+            self
+            title -- the citation part's value
+            higher -- the higher source; None makes the source its own
+            part_type -- the citation part's type
+        Returns: the Local reference of the source
+        """
+        source = self.add(
+            'Source',
+            subject_place_id=self.context['unknown_place'],
+            jurisdiction_place_id=self.context['unknown_place'],
+            researcher_id=self.context['researcher'],
+            subject_date_start=EARLIEST,
+            subject_date_end=LATEST,
+            comment=''
+        )
+        self.rows['Source'][source.index]['higher_source_id'] = (
+            higher or source
+        )
+        if title:
+            self.add(
+                'CitationPart',
+                source_id=source,
+                citation_part_type_id=self.context['lookups'][
+                    'CitationPartType', part_type],
+                value=title[:256]
+            )
+        return source
+
+    def event(self, event_type, name, date, place):
+        """Make an event."""
+        start, end = parse_date(date) or (EARLIEST, LATEST)
+        return self.add(
+            'Event',
+            event_type_id=self.context['lookups']['EventType', event_type],
+            place_id=self.place(place),
+            name=('%s of %s' % (event_type, name))[:256],
+            date_start=start,
+            date_end=end
+        )
+
+    def sex(self, persona, value, source):
+        """Record a persona's sex, if the file gives it."""
+        value = {'M': 'Male', 'F': 'Female'}.get(value.strip().upper()[:1])
+        if value is None:
+            return
+        characteristic = self.add(
+            'Characteristic',
+            place_id=self.context['unknown_place'],
+            date_start=EARLIEST,
+            date_end=LATEST,
+            sort_order='A'
+        )
+        self.add(
+            'CharacteristicPart',
+            characteristic_id=characteristic,
+            characteristic_part_type_id=self.context['lookups'][
+                'CharacteristicPartType', 'Sex'],
+            name=value,
+            sequence_number=0
+        )
+        self.assertion(persona, 'C', characteristic, '', source)
+
+    def assertion(self, persona, subject2_type, subject2, role, source):
+        """Make an assertion about a persona."""
+        return self.add(
+            'Assertion',
+            surety_scheme_part_id=self.context['surety'],
+            researcher_id=self.context['researcher'],
+            source_id=source or self.context['root_source'],
+            subject1_type='P',
+            subject1=persona,
+            subject2_type=subject2_type,
+            subject2=subject2,
+            value_role=role,
+            rationale=self.context['rationale'],
+            disproved=False
+        )
+
+
+def _citation(shard, node):
+    """Make or find the source a GEDCOM node cites, if any."""
+    for child in node.children:
+        if child.tag != 'SOUR':
+            continue
+        pointer = _GEDCOM_POINTER.match(child.value)
+        if pointer is None:
+            return shard.source(child.value)
+        cited = Xref('Source', pointer.group(1))
+        page = child.first('PAGE')
+        if page:
+            return shard.source(page, higher=cited, part_type='Page')
+        return cited
+    return None
+
+
+def _gedcom_individual(shard, record):
+    """Map an INDI record."""
+    name = ' '.join(record.first('NAME').replace('/', ' ').split())
+    name = name or 'Unknown'
+    source = _citation(shard, record)
+    persona = shard.add('Persona', name=name[:256], description_comments='')
+    shard.definitions[record.xref] = persona
+    born = False
+    for node in record.children:
+        if node.tag not in EVENTS:
+            continue
+        event_type, role = EVENTS[node.tag]
+        event = shard.event(event_type, name, node.first('DATE'),
+                            node.first('PLAC'))
+        shard.assertion(persona, 'E', event, role,
+                        _citation(shard, node) or source)
+        if node.tag == 'BIRT' and not born:
+            shard.definitions[record.xref + '#birth'] = event
+            born = True
+    if not born:
+        event = shard.event('Birth', name, '', '')
+        shard.assertion(persona, 'E', event, EVENTS['BIRT'][1], source)
+        shard.definitions[record.xref + '#birth'] = event
+    shard.sex(persona, record.first('SEX'), source)
+
+
+def _gedcom_family(shard, record):
+    """Map a FAM record."""
+    source = _citation(shard, record)
+    parents = []
+    for tag in ('HUSB', 'WIFE'):
+        pointer = _GEDCOM_POINTER.match(record.first(tag))
+        parents.append(pointer and Xref('Persona', pointer.group(1)))
+    for node in record.children:
+        if node.tag in FAMILY_EVENTS:
+            event_type = FAMILY_EVENTS[node.tag][0]
+            event = shard.event(event_type, 'family %s' % record.xref,
+                                node.first('DATE'), node.first('PLAC'))
+            for parent, role in zip(parents, FAMILY_EVENTS[node.tag][1:]):
+                if parent:
+                    shard.assertion(parent, 'E', event, role,
+                                    _citation(shard, node) or source)
+        elif node.tag == 'CHIL':
+            pointer = _GEDCOM_POINTER.match(node.value)
+            if pointer is None:
+                continue
+            birth = Xref('Event', pointer.group(1) + '#birth')
+            for parent, role in zip(parents, PARENT_ROLES):
+                if parent:
+                    shard.assertion(parent, 'E', birth, role, source)
+
+
+def _gedcom_source(shard, record):
+    """Map a SOUR record."""
+    source = shard.source(record.first('TITL') or record.xref)
+    for tag, part_type in (('AUTH', 'Author'), ('PUBL', 'Publisher')):
+        if record.first(tag):
+            shard.add(
+                'CitationPart',
+                source_id=source,
+                citation_part_type_id=shard.context['lookups'][
+                    'CitationPartType', part_type],
+                value=record.first(tag)[:256]
+            )
+    shard.definitions[record.xref] = source
+
+
+GEDCOM_RECORDS = {
+    'INDI': _gedcom_individual,
+    'FAM': _gedcom_family,
+    'SOUR': _gedcom_source,
+}
+
+
+def _map_gedcom(shard, text):
+    """Map the records of a GEDCOM shard."""
+    for record in _gedcom_records(text):
+        mapper = GEDCOM_RECORDS.get(record.tag)
+        if mapper is not None and record.xref:
+            mapper(shard, record)
+
+
+def _map_csv(shard, text, header):
+    """Map the rows of a CSV shard."""
+    for row in csv.DictReader(io.StringIO(text), fieldnames=header):
+        key = (row.get('id') or '').strip()
+        name = ' '.join((row.get('name') or '').split()) or 'Unknown'
+        source = None
+        if row.get('source'):
+            source = shard.source(row['source'])
+        persona = shard.add('Persona', name=name[:256],
+                            description_comments='')
+        birth = shard.event('Birth', name, row.get('birth_date') or '',
+                            row.get('birth_place') or '')
+        shard.assertion(persona, 'E', birth, EVENTS['BIRT'][1], source)
+        if key:
+            shard.definitions[key] = persona
+            shard.definitions[key + '#birth'] = birth
+        if row.get('death_date') or row.get('death_place'):
+            death = shard.event('Death', name, row.get('death_date') or '',
+                                row.get('death_place') or '')
+            shard.assertion(persona, 'E', death, EVENTS['DEAT'][1], source)
+        shard.sex(persona, row.get('sex') or '', source)
+        for column, role in zip(('father', 'mother'), PARENT_ROLES):
+            parent = (row.get(column) or '').strip()
+            if parent:
+                shard.assertion(Xref('Persona', parent), 'E', birth, role,
+                                source)
+
+
+def _read(path, start, end):
+    """Read a byte range of a file as text."""
+    with open(path, 'rb') as stream:
+        stream.seek(start)
+        data = stream.read(end - start)
+    if start == 0 and data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+    return data.decode('utf-8', 'replace')
+
+
+def _parse_shard(task):
+    """Parse one shard and pickle its rows (run in a worker).
+
+    Returns: (shard number, rows by model name, definitions, place names)
+    """
+    number, path, kind, start, end, header, context, scratch = task
+    shard = _Shard(context)
+    text = _read(path, start, end)
+    if kind == 'gedcom':
+        _map_gedcom(shard, text)
+    else:
+        _map_csv(shard, text, header)
+    with open(os.path.join(scratch, '%d.pickle' % number), 'wb') as stream:
+        pickle.dump((shard.rows, shard.definitions), stream,
+                    pickle.HIGHEST_PROTOCOL)
+    return (
+        number,
+        dict((model, len(rows)) for model, rows in shard.rows.items()),
+        shard.definitions,
+        shard.places,
+    )
+
+
+def _write_shard(task):
+    """Write one parsed shard with its reserved ids (run in a worker).
+
+    Returns: a list of (model name, id, attname, Xref) for the references
+        the shard could not resolve
+    """
+    number, scratch, bases, places, placeholders = task
+    with open(os.path.join(scratch, '%d.pickle' % number), 'rb') as stream:
+        rows, definitions = pickle.load(stream)
+
+    def resolve(value):
+        """Turn a reference into an id, or None if it is elsewhere."""
+        if isinstance(value, Local):
+            return bases[value.model] + value.index
+        if isinstance(value, PlaceName):
+            return places[value.name]
+        found = definitions.get(value.key)
+        if found is None or found.model != value.model:
+            return None
+        return bases[found.model] + found.index
+
+    unresolved = []
+    with transaction.atomic():
+        for name in SHARD_MODELS:
+            model = apps.get_model('researcher', name)
+            objects = []
+            for index, values in enumerate(rows[name]):
+                pk = bases[name] + index
+                for attname, value in values.items():
+                    if isinstance(value, (Local, Xref, PlaceName)):
+                        found = resolve(value)
+                        if found is None:
+                            unresolved.append((name, pk, attname, value))
+                            found = placeholders[value.model]
+                        values[attname] = found
+                objects.append(model(id=pk, **values))
+            model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    return unresolved
+
+
+def _cut(path, kind):
+    """Find where the records of a file begin.
+
+    Returns: (the offset of the first record, the CSV header or None)
+    """
+    if kind == 'gedcom':
+        return 0, None
+    with open(path, 'rb') as stream:
+        first = stream.readline()
+    header = next(csv.reader([first.decode('utf-8-sig')]))
+    return len(first), [column.strip().lower() for column in header]
+
+
+def _shards(path, kind, start, count):
+    """Cut a file into about `count` byte ranges at record boundaries."""
+    size = os.path.getsize(path)
+    marker = b'\n0 ' if kind == 'gedcom' else b'\n'
+    bounds = [start]
+    with open(path, 'rb') as stream:
+        for number in range(1, count):
+            offset = max(bounds[-1], start + (size - start) * number // count)
+            stream.seek(max(offset - 1, 0))
+            position = stream.tell()
+            found = -1
+            while found < 0:
+                block = stream.read(1 << 16)
+                if not block:
+                    break
+                found = block.find(marker)
+                if found < 0:
+                    # Keep the tail: the marker may straddle two blocks.
+                    position += len(block) - len(marker) + 1
+                    stream.seek(position)
+            if found < 0:
+                break
+            boundary = position + found + 1
+            if boundary > bounds[-1]:
+                bounds.append(boundary)
+    bounds.append(size)
+    return [
+        (bounds[index], bounds[index + 1])
+        for index in range(len(bounds) - 1)
+        if bounds[index] < bounds[index + 1]
+    ]
+
+
+def _reserve(model, count):
+    """Reserve a block of primary keys of a table.
+
+    The table's sequence (sqlite_sequence on SQLite) is moved past the
+    block, so inserts by anyone else take ids after it.
+
+    Returns: the first id of the block
+    Raises: ValueError on databases other than PostgreSQL and SQLite
+    """
+    alias = router.db_for_write(model)
+    connection = connections[alias]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        raise ValueError('Imports can reserve ids only on PostgreSQL and '
+                         'SQLite, not %s.' % connection.vendor)
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    column = model._meta.pk.column
+    count = max(count, 1)
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # The UPDATE takes SQLite's write lock until the transaction
+            # ends, and AUTOINCREMENT keys never go back below the
+            # sequence, so the block is ours alone.
+            top = 'SELECT COALESCE(MAX(%s), 0) FROM %s' % (quote(column),
+                                                           quote(table))
+            cursor.execute(
+                'UPDATE sqlite_sequence SET seq = MAX(seq, (%s)) + %%s '
+                'WHERE name = %%s' % top,
+                [count, table]
+            )
+            if not cursor.rowcount:
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) '
+                    'SELECT %%s, (%s) + %%s' % top,
+                    [table, count]
+                )
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s',
+                           [table])
+            return cursor.fetchone()[0] - count + 1
+        # Inserts wait for the lock, so nobody takes an id of the
+        # block between reading the sequence and moving it on.
+        cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % quote(table))
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)',
+                       [table, column])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT GREATEST(nextval(%%s), COALESCE(MAX(%s), 0) + 1) '
+            'FROM %s' % (quote(column), quote(table)),
+            [sequence]
+        )
+        first = cursor.fetchone()[0]
+        cursor.execute('SELECT setval(%s, %s)',
+                       [sequence, first + count - 1])
+    return first
+
+
+def _lookups():
+    """Find or create the type rows imported data refers to."""
+    EventType = apps.get_model('researcher', 'EventType')
+    EventTypeRole = apps.get_model('researcher', 'EventTypeRole')
+    found = {}
+    roles = collections.defaultdict(set)
+    for event_type, role in EVENTS.values():
+        roles[event_type].add(role)
+    for event_type in FAMILY_EVENTS.values():
+        roles[event_type[0]].update(event_type[1:])
+    roles['Birth'].update(PARENT_ROLES)
+    roles['Death'].add(EVENTS['DEAT'][1])
+    for event_type, names in roles.items():
+        row = EventType.objects.filter(name=event_type).first()
+        if row is None:
+            row = EventType.objects.create(name=event_type)
+        found['EventType', event_type] = row.pk
+        known = set(EventTypeRole.objects.filter(
+            event_type=row
+        ).values_list('name', flat=True))
+        for name in names - known:
+            EventTypeRole.objects.create(event_type=row, name=name)
+    for table, names in (
+            ('CharacteristicPartType', ['Sex']),
+            ('CitationPartType', ['Title', 'Author', 'Publisher', 'Page']),
+            ('PlacePartType', PLACE_PARTS)):
+        model = apps.get_model('researcher', table)
+        for name in names:
+            row = model.objects.filter(name=name).first()
+            if row is None:
+                row = model.objects.create(name=name)
+            found[table, name] = row.pk
+    return found
+
+
+def _pieces(name):
+    """Split a place name into its parts, the most specific first."""
+    return [piece.strip()[:128] for piece in name.split(',')
+            if piece.strip()]
+
+
+def _existing_places(names):
+    """Find the places already in the database that have some names.
+
+    A place has a name if its display name (see
+    researcher.timeline.place_names) lists the same parts.
+
+    Returns: a dict of place ids by name; the oldest of several places
+        with one name
+    """
+    PlacePart = apps.get_model('researcher', 'PlacePart')
+    wanted = collections.defaultdict(list)
+    for name in names:
+        wanted[', '.join(_pieces(name))].append(name)
+    candidates = set()
+    specific = set(piece for name in names for piece in _pieces(name)[:1])
+    for batch in batches(specific):
+        candidates.update(PlacePart.objects.filter(
+            name__in=batch
+        ).values_list('place', flat=True))
+    found = {}
+    for place, display in sorted(place_names(candidates).items()):
+        for name in wanted.get(display, ()):
+            found.setdefault(name, place)
+    return found
+
+
+def _create_places(names, lookups):
+    """Find or create a place, with its parts, for each name.
+
+    Returns: (a dict of place ids by name, the (first id, count) block
+        of the places created)
+    """
+    Place = apps.get_model('researcher', 'Place')
+    PlacePart = apps.get_model('researcher', 'PlacePart')
+    names = sorted(names)
+    places = _existing_places(names) if names else {}
+    names = [name for name in names if name not in places]
+    if not names:
+        return places, (0, 0)
+    first = _reserve(Place, len(names))
+    parts = []
+    for offset, name in enumerate(names):
+        places[name] = first + offset
+        for number, piece in enumerate(reversed(_pieces(name))):
+            part_type = PLACE_PARTS[min(number, len(PLACE_PARTS) - 1)]
+            parts.append(PlacePart(
+                place_id=first + offset,
+                place_part_type_id=lookups['PlacePartType', part_type],
+                name=piece,
+                sequence_number=number
+            ))
+    with transaction.atomic():
+        Place.objects.bulk_create([
+            Place(id=places[name], existence_date_start=EARLIEST,
+                  existence_date_end=LATEST, sort_order='D')
+            for name in names
+        ], batch_size=BATCH_SIZE)
+        PlacePart.objects.bulk_create(parts, batch_size=BATCH_SIZE)
+    return places, (first, len(names))
+
+
+def _set_many(model, attname, pairs):
+    """Set a column of many rows with one UPDATE per batch."""
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    column = quote(model._meta.get_field_by_name(
+        attname[:-3] if attname.endswith('_id') else attname
+    )[0].column)
+    pk = quote(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), BATCH_SIZE):
+            batch = pairs[start:start + BATCH_SIZE]
+            params = []
+            for row, value in batch:
+                params.extend([row, value])
+            params.extend(row for row, value in batch)
+            cursor.execute(
+                'UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+                    quote(model._meta.db_table),
+                    column,
+                    pk,
+                    ' '.join(['WHEN %s THEN %s'] * len(batch)),
+                    pk,
+                    ', '.join(['%s'] * len(batch)),
+                ),
+                params
+            )
+
+
+def _fix_references(unresolved, resolved):
+    """Correct the references shards could not resolve themselves.
+
+    Arguments:
+        unresolved -- (model name, id, attname, Xref) tuples
+        resolved -- ids by cross-reference key and model
+    Returns: the number of assertions deleted for naming records the
+        file does not define
+    """
+    updates = collections.defaultdict(list)
+    dangling = set()
+    for name, pk, attname, xref in unresolved:
+        found = resolved.get((xref.model, xref.key))
+        if found is not None:
+            updates[name, attname].append((pk, found))
+        elif name == 'Assertion' and attname in ('subject1', 'subject2'):
+            dangling.add(pk)
+        # A source citing an undefined source keeps the root source.
+    with transaction.atomic():
+        for (name, attname), pairs in updates.items():
+            _set_many(apps.get_model('researcher', name), attname, pairs)
+        Assertion = apps.get_model('researcher', 'Assertion')
+        dangling = sorted(dangling)
+        for start in range(0, len(dangling), BATCH_SIZE):
+            Assertion.objects.filter(
+                pk__in=dangling[start:start + BATCH_SIZE]
+            ).delete()
+    return len(dangling)
+
+
+def _discard(blocks, made):
+    """Delete the rows an import wrote, after a failure.
+
+    Only ids in the import's reserved blocks are deleted; nobody else
+    can have written any of them.
+
+    Arguments:
+        blocks -- the (first id, count) block of each shard table, by
+            model name
+        made -- (model name, first id, count) of the rows made outside
+            the shards (places and the root source), in the order made
+    """
+    ranges = [
+        (name,) + blocks[name] for name in reversed(SHARD_MODELS)
+        if name in blocks
+    ] + list(reversed(made))
+    with transaction.atomic():
+        for name, first, count in ranges:
+            if count:
+                apps.get_model('researcher', name).objects.filter(
+                    pk__gte=first,
+                    pk__lt=first + count
+                ).delete()
+
+
+def import_file(path, researcher, surety_scheme_part=None, kind=None,
+                workers=None, report=None):
+    """Import a GEDCOM or CSV file.
+
+    Arguments:
+        path -- the file
+        researcher -- the Researcher (or id) the assertions are made by
+        surety_scheme_part -- the SuretySchemePart (or id) the
+            assertions carry; None takes the least sure part of the
+            researcher's first project's scheme
+        kind -- 'gedcom' or 'csv'; None goes by the file's extension
+        workers -- the processes parsing and writing; None takes
+            RESEARCHER_IMPORT_WORKERS, or one per CPU
+        report -- called as report(done, total, message) as shards finish
+    Returns: (the root Source, a dict of rows written by model name)
+    Raises: ValueError when no surety scheme part is given and the
+        researcher has no project with a surety scheme, or when the
+        database is neither PostgreSQL nor SQLite
+    """
+    kind = kind or ('csv' if path.lower().endswith('.csv') else 'gedcom')
+    researcher = getattr(researcher, 'pk', researcher)
+    surety = getattr(surety_scheme_part, 'pk', surety_scheme_part)
+    if surety is None:
+        SuretySchemePart = apps.get_model('researcher', 'SuretySchemePart')
+        surety = SuretySchemePart.objects.filter(
+            surety_scheme__project__researcherproject__researcher=researcher
+        ).order_by('-sequence_number').values_list('pk', flat=True).first()
+        if surety is None:
+            raise ValueError(
+                'Researcher %s has no project with a surety scheme; give '
+                'a surety scheme part.' % researcher
+            )
+    workers = workers or WORKERS or multiprocessing.cpu_count()
+    report = report or (lambda done, total, message: None)
+
+    lookups = _lookups()
+    name = os.path.basename(path)
+    Source = apps.get_model('researcher', 'Source')
+    CitationPart = apps.get_model('researcher', 'CitationPart')
+    start, header = _cut(path, kind)
+    size = os.path.getsize(path)
+    if size < MIN_PARALLEL_BYTES:
+        workers = 1
+    ranges = _shards(path, kind, start, workers * SHARDS_PER_WORKER
+                     if workers > 1 else 1)
+    scratch = tempfile.mkdtemp(prefix='researcher-import-')
+    pool = None
+    blocks = {}
+    made = []
+    try:
+        places, block = _create_places([UNKNOWN_PLACE], lookups)
+        made.append(('Place',) + block)
+        unknown = places[UNKNOWN_PLACE]
+        with transaction.atomic():
+            pk = _reserve(Source, 1)
+            source = Source.objects.create(
+                id=pk,
+                higher_source_id=pk,
+                subject_place_id=unknown,
+                jurisdiction_place_id=unknown,
+                researcher_id=researcher,
+                subject_date_start=EARLIEST,
+                subject_date_end=LATEST,
+                comment='Imported from %s' % name
+            )
+            CitationPart.objects.create(
+                source=source,
+                citation_part_type_id=lookups['CitationPartType', 'Title'],
+                value=name[:256]
+            )
+        made.append(('Source', pk, 1))
+        context = {
+            'lookups': lookups,
+            'researcher': researcher,
+            'surety': surety,
+            'root_source': source.pk,
+            'unknown_place': unknown,
+            'rationale': 'Imported from %s' % name,
+        }
+
+        tasks = [
+            (number, path, kind, first, last, header, context, scratch)
+            for number, (first, last) in enumerate(ranges)
+        ]
+        if workers > 1:
+            # Forked workers must open their own connections.
+            for connection in connections.all():
+                connection.close()
+            pool = multiprocessing.Pool(min(workers, len(tasks)))
+            parsed = []
+            for found in pool.imap_unordered(_parse_shard, tasks):
+                parsed.append(found)
+                report(len(parsed), 2 * len(tasks), 'Parsing')
+        else:
+            parsed = [_parse_shard(task) for task in tasks]
+        parsed.sort()
+
+        places, block = _create_places(
+            set().union(*[found[3] for found in parsed]), lookups
+        )
+        made.append(('Place',) + block)
+        places[UNKNOWN_PLACE] = unknown
+        bases = [{} for found in parsed]
+        for model_name in SHARD_MODELS:
+            total = sum(found[1][model_name] for found in parsed)
+            if not total:
+                continue
+            first = _reserve(apps.get_model('researcher', model_name), total)
+            blocks[model_name] = (first, total)
+            for number, found in enumerate(parsed):
+                bases[number][model_name] = first
+                first += found[1][model_name]
+        resolved = {}
+        for number, found in enumerate(parsed):
+            for key, local in found[2].items():
+                resolved[local.model, key] = (
+                    bases[number][local.model] + local.index
+                )
+        placeholders = {'Source': source.pk, 'Persona': 0, 'Event': 0}
+        writes = [
+            (number, scratch, bases[number], places, placeholders)
+            for number in range(len(parsed))
+        ]
+        unresolved = []
+        # SQLite takes one writer at a time.
+        parallel = pool is not None and connections[
+            router.db_for_write(Source)
+        ].vendor != 'sqlite'
+        if parallel:
+            for connection in connections.all():
+                connection.close()
+            results = pool.imap_unordered(_write_shard, writes)
+        else:
+            results = (_write_shard(write) for write in writes)
+        for number, found in enumerate(results, 1):
+            unresolved.extend(found)
+            report(len(tasks) + number, 2 * len(tasks), 'Writing')
+        deleted = _fix_references(unresolved, resolved)
+    except BaseException:
+        _discard(blocks, made)
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    written = dict(
+        (model_name, count) for model_name, (first, count) in blocks.items()
+    )
+    written['Assertion'] = written.get('Assertion', 0) - deleted
+    written['Place'] = sum(
+        count for model_name, first, count in made if model_name == 'Place'
+    )
+    for model_name in SHARD_MODELS + ('Place', 'PlacePart'):
+        bump_table_version(apps.get_model('researcher', model_name))
+    invalidate_graph()
+    for model_name in history.VERSIONED_MODELS:
+        if model_name in blocks:
+            first, count = blocks[model_name]
+            history.record_created(apps.get_model('researcher', model_name),
+                                   range(first, first + count), researcher)
+    first, count = blocks.get('Assertion', (0, 0))
+    refresh_participation(range(first, first + count))
+    first, count = blocks.get('Persona', (0, 0))
+    personas = range(first, first + count)
+    sanity.queue(personas)
+    gaps.queue(personas)
+    conflicts.queue(personas)
+    return source, written
@@ -0,0 +1,264 @@
+"""Paginate admin inlines for parents with very many children.
+
+A Source can hold thousands of RepositorySource rows and a conclusion
+can rest on hundreds of input assertions.  Rendering each of them as an
+inline form builds an enormous page and runs queries for every row.
+The inlines here show one page of children at a time, fetch further
+pages in the background, and share related lookups across the page.
+
+Exports:
+    Classes:
+        BatchedRawIdWidget
+        PaginatedInlineFormSet
+        PaginatedTabularInline
+        PaginatedInlinesMixin
+"""
+from django.conf.urls import patterns, url
+from django.contrib.admin import TabularInline
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.core.exceptions import PermissionDenied
+from django.forms.models import BaseInlineFormSet, ModelChoiceField
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.html import escape
+from django.utils.text import Truncator
+
+from researcher.lookups import is_lookup_model, lookup
+
+INLINE_PAGE_VAR = 'page'
+
+
+class BatchedRawIdWidget(ForeignKeyRawIdWidget):
+
+    """A raw id widget whose labels are looked up once per page.
+
+    The stock widget runs one query per row to show the related object's
+    name next to the id.  The formset fills `labels` for the whole page
+    with a single query instead.
+    """
+
+    labels = None
+
+    def label_for_value(self, value):
+        """Label the related object from the page's batch.
+
+        Arguments:
+            self
+            value -- the related object's key
+        Returns: the HTML label for the related object
+        """
+        if self.labels is None:
+            return super(BatchedRawIdWidget, self).label_for_value(value)
+        try:
+            obj = self.labels[self.rel.to._meta.pk.to_python(value)]
+        except (KeyError, ValueError):
+            return ''
+        return '&nbsp;<strong>%s</strong>' % escape(
+            Truncator(obj).words(14, truncate='...')
+        )
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+
+    """An inline formset that holds one page of the parent's children.
+
+    Only the children on the requested page get forms, so saving the
+    formset can only touch those rows; of these, unchanged rows are
+    neither validated nor saved.  Choice lists and raw id labels are
+    fetched once for the page rather than once per row.
+    """
+
+    per_page = 20
+    select_related = ()
+    page_data = {}
+
+    def __init__(self, *args, **kwargs):
+        """Read the requested page number."""
+        super(PaginatedInlineFormSet, self).__init__(*args, **kwargs)
+        try:
+            self.page = max(
+                int(self.page_data.get(self.add_prefix(INLINE_PAGE_VAR), 1)),
+                1
+            )
+        except ValueError:
+            self.page = 1
+        self._choices = {}
+        self._labels = {}
+
+    def get_queryset(self):
+        """Fetch the children on the current page.
+
+        Arguments:
+            self
+        Returns: the sliced queryset of children on this page
+        """
+        if not hasattr(self, '_page_queryset'):
+            queryset = super(PaginatedInlineFormSet, self).get_queryset()
+            if self.select_related:
+                queryset = queryset.select_related(*self.select_related)
+            self.child_count = queryset.count()
+            self.num_pages = max(
+                (self.child_count + self.per_page - 1) // self.per_page,
+                1
+            )
+            self.page = min(self.page, self.num_pages)
+            start = (self.page - 1) * self.per_page
+            self._page_queryset = queryset[start:start + self.per_page]
+        return self._page_queryset
+
+    @property
+    def page_range(self):
+        """List the page numbers for the pager."""
+        self.get_queryset()
+        return range(1, self.num_pages + 1)
+
+    def _raw_id_labels(self, name, widget):
+        """Look up the raw id labels for one field across the page.
+
+        Arguments:
+            self
+            name -- the field name
+            widget -- the field's BatchedRawIdWidget
+        Returns: a dict mapping related keys to related objects
+        """
+        if name not in self._labels:
+            attname = self.model._meta.get_field(name).attname
+            keys = set(
+                getattr(obj, attname) for obj in self.get_queryset()
+            )
+            keys.discard(None)
+            self._labels[name] = widget.rel.to._default_manager.in_bulk(keys)
+        return self._labels[name]
+
+    @staticmethod
+    def _field_choices(field):
+        """List a choice field's choices, from memory for lookup tables.
+
+        Arguments:
+            field -- the ModelChoiceField
+        Returns: a list of (value, label) pairs
+        """
+        model = field.queryset.model
+        if not is_lookup_model(model) or field.queryset.query.where:
+            return list(field.choices)
+        choices = [(obj.pk, field.label_from_instance(obj))
+                   for obj in lookup(model).all()]
+        if field.empty_label is not None:
+            choices.insert(0, ('', field.empty_label))
+        return choices
+
+    def _construct_form(self, i, **kwargs):
+        """Build a form that shares the page's related lookups.
+
+        Arguments:
+            self
+            i -- the index of the form in the formset
+        Returns: the form
+        """
+        form = super(PaginatedInlineFormSet, self)._construct_form(i, **kwargs)
+        if i < self.initial_form_count():
+            # Rows the user did not touch are skipped by validation.
+            form.empty_permitted = True
+        for name, field in form.fields.items():
+            if name == self._pk_field.name:
+                continue
+            if isinstance(field.widget, BatchedRawIdWidget):
+                field.widget.labels = self._raw_id_labels(name, field.widget)
+            elif isinstance(field, ModelChoiceField):
+                if name not in self._choices:
+                    self._choices[name] = self._field_choices(field)
+                field.choices = self._choices[name]
+        return form
+
+
+class PaginatedTabularInline(TabularInline):
+
+    """A tabular inline that shows one page of children at a time.
+
+    Use with a ModelAdmin that includes PaginatedInlinesMixin so that
+    the pager can load other pages without reloading the change form.
+    Fields named in raw_id_fields get batched labels.
+    """
+
+    formset = PaginatedInlineFormSet
+    template = 'admin/researcher/edit_inline/paginated_tabular.html'
+    per_page = 20
+    list_select_related = ()
+
+    def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
+        """Use the batched raw id widget for raw id fields."""
+        formfield = super(
+            PaginatedTabularInline,
+            self
+        ).formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name in self.raw_id_fields:
+            formfield.widget = BatchedRawIdWidget(
+                db_field.rel,
+                self.admin_site,
+                using=kwargs.get('using')
+            )
+            formfield.widget.is_required = formfield.required
+        return formfield
+
+    def get_formset(self, request, obj=None, **kwargs):
+        """Build a formset class that knows the requested page."""
+        formset = super(PaginatedTabularInline, self).get_formset(
+            request,
+            obj,
+            **kwargs
+        )
+        formset.per_page = self.per_page
+        formset.select_related = self.list_select_related
+        formset.page_data = request.POST if request.method == 'POST' \
+            else request.GET
+        return formset
+
+
+class PaginatedInlinesMixin(object):
+
+    """Serve single pages of paginated inlines for a ModelAdmin.
+
+    Adds an `<object_id>/inline/<prefix>/` view returning just the
+    inline's HTML for the page given in the query string.  The pager in
+    the paginated inline template fetches it and swaps it in place.
+    """
+
+    def get_urls(self):
+        """Add the inline page view to the admin URLs."""
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = patterns(
+            '',
+            url(
+                r'^(.+)/inline/([\w-]+)/$',
+                self.admin_site.admin_view(self.inline_page_view),
+                name='%s_%s_inline_page' % info
+            ),
+        )
+        return urls + super(PaginatedInlinesMixin, self).get_urls()
+
+    def inline_page_view(self, request, object_id, prefix):
+        """Render one page of one inline.
+
+        Arguments:
+            self
+            request -- the current request
+            object_id -- the parent object's primary key
+            prefix -- the formset prefix of the inline
+        Returns: the rendered inline
+        """
+        obj = self.get_object(request, object_id)
+        if obj is None:
+            raise Http404
+        if not self.has_change_permission(request, obj):
+            raise PermissionDenied
+
+        formsets, inline_instances = self._create_formsets(request, obj, True)
+        for inline_admin_formset in self.get_inline_formsets(
+                request, formsets, inline_instances, obj):
+            if inline_admin_formset.formset.prefix == prefix:
+                return render(request, inline_admin_formset.opts.template, {
+                    'inline_admin_formset': inline_admin_formset,
+                    'opts': self.model._meta,
+                    'original': obj,
+                })
+        raise Http404
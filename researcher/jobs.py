@@ -0,0 +1,521 @@
+"""Run heavy operations in background workers, with no broker but the database.
+
+Imports, exports, rebuilding derived tables and validating projects take
+minutes, so web requests queue them as Jobs instead of running them:
+
+    enqueue('sanity.validate', project=project.pk)
+
+A task is a function registered with @task(name) and called as
+`function(job, **arguments)`; its arguments are stored as JSON, so they
+are ids and plain values, not model instances.  `manage.py run_jobs`
+starts worker processes that claim queued jobs, lowest priority number
+first, and run them.  Two workers never claim the same job: on
+PostgreSQL a claim is one UPDATE of the row picked with FOR UPDATE SKIP
+LOCKED, so workers pass over each other's rows instead of waiting for
+them; on other databases the workers of a machine take turns holding
+RESEARCHER_JOB_LOCK_FILE while they claim.
+
+A running task calls progress() now and then.  It records how far the
+job has got, shows the worker is alive, and raises JobCancelled once
+cancel() has been asked for the job, so the task stops at a clean point.
+Workers also keep a heartbeat of their own; a job whose heartbeat is
+older than RESEARCHER_JOB_STALE_SECONDS lost its worker and is queued
+again.  A task that raises is retried after RESEARCHER_JOB_RETRY_DELAY
+seconds, doubled at each attempt, until its attempts are used up.
+
+Exports:
+    Functions:
+        cancel
+        claim
+        enqueue
+        progress
+        requeue_stale
+        retry
+        run
+        task
+        work
+    Classes:
+        JobCancelled
+"""
+import contextlib
+import datetime
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+from django.db.models import F
+from django.utils import timezone
+
+from researcher import history, replicas, shards, versions
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAX_ATTEMPTS = getattr(settings, 'RESEARCHER_JOB_MAX_ATTEMPTS', 3)
+
+RETRY_DELAY = getattr(settings, 'RESEARCHER_JOB_RETRY_DELAY', 60)
+
+STALE_SECONDS = getattr(settings, 'RESEARCHER_JOB_STALE_SECONDS', 300)
+
+# Seconds an idle worker waits before looking for jobs again.
+POLL_INTERVAL = getattr(settings, 'RESEARCHER_JOB_POLL_INTERVAL', 2)
+
+LOCK_FILE = getattr(
+    settings,
+    'RESEARCHER_JOB_LOCK_FILE',
+    os.path.join(tempfile.gettempdir(), 'researcher-jobs.lock')
+)
+
+# Seconds between the writes of a task's progress.
+PROGRESS_INTERVAL = 1
+
+BATCH_SIZE = 500
+
+TASKS = {}
+
+_CLAIM_SQL = """
+    UPDATE %(table)s SET
+        status = 'running',
+        worker = %%s,
+        started = %%s,
+        heartbeat = %%s,
+        attempts = attempts + 1,
+        progress = 0,
+        progress_message = ''
+    WHERE id = (
+        SELECT id FROM %(table)s
+        WHERE status = 'queued' AND run_after <= %%s
+        ORDER BY priority, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+"""
+
+
+class JobCancelled(Exception):
+
+    """Raised by progress() in a job cancelled or taken from its worker."""
+
+
+def task(name, replica=False):
+    """Register a function as a task that jobs can run.
+
+    Arguments:
+        name -- the task's name, as jobs give it
+        replica -- whether the task reads from read replicas (see
+            researcher.replicas)
+    """
+    def register(function):
+        """Add the function to the registry."""
+        function.replica = replica
+        TASKS[name] = function
+        return function
+    return register
+
+
+def enqueue(name, researcher=None, priority=0, run_after=None,
+            max_attempts=None, **arguments):
+    """Queue a job.
+
+    Arguments:
+        name -- the registered task to run
+        researcher -- the Researcher asking for it, if any
+        priority -- jobs with a lower number run first
+        run_after -- do not start before this time; None for now
+        max_attempts -- the times it may be started; None for
+            RESEARCHER_JOB_MAX_ATTEMPTS
+        arguments -- the task's keyword arguments, as plain JSON values
+    Returns: the Job
+    Raises: ValueError when there is no such task
+    """
+    if name not in TASKS:
+        raise ValueError('No task named %r.' % name)
+    Job = apps.get_model('researcher', 'Job')
+    return Job.objects.create(
+        task=name,
+        arguments=json.dumps(arguments),
+        priority=priority,
+        run_after=run_after or timezone.now(),
+        max_attempts=max_attempts or MAX_ATTEMPTS,
+        researcher=researcher
+    )
+
+
+def cancel(jobs):
+    """Cancel jobs: queued ones at once, running ones at their next progress.
+
+    Arguments:
+        jobs -- Job ids
+    Returns: the number of jobs cancelled or asked to stop
+    """
+    Job = apps.get_model('researcher', 'Job')
+    jobs = list(jobs)
+    return Job.objects.filter(pk__in=jobs, status='queued').update(
+        status='cancelled',
+        finished=timezone.now()
+    ) + Job.objects.filter(pk__in=jobs, status='running').update(
+        cancel_requested=True
+    )
+
+
+def retry(jobs):
+    """Queue failed or cancelled jobs again, with fresh attempts.
+
+    Arguments:
+        jobs -- Job ids
+    Returns: the number of jobs queued
+    """
+    Job = apps.get_model('researcher', 'Job')
+    return Job.objects.filter(
+        pk__in=list(jobs),
+        status__in=['failed', 'cancelled']
+    ).update(
+        status='queued',
+        run_after=timezone.now(),
+        attempts=0,
+        cancel_requested=False,
+        progress=0,
+        progress_message='',
+        finished=None
+    )
+
+
+def _held(job):
+    """Select a job while its worker still holds this attempt at it."""
+    return apps.get_model('researcher', 'Job').objects.filter(
+        pk=job.pk,
+        worker=job.worker,
+        attempts=job.attempts,
+        status='running'
+    )
+
+
+def progress(job, done, total=None, message=''):
+    """Report how far a running job has got.
+
+    Writes at most once every PROGRESS_INTERVAL seconds, so tasks may call
+    it as often as they like.  Inside a transaction the report is only
+    seen when the transaction commits.
+
+    Arguments:
+        job -- the running Job
+        done -- the work done, or with no total the fraction done
+        total -- the work there is to do, if done is a count
+        message -- what the job is doing
+    Raises: JobCancelled when the job has been cancelled, or taken from
+        its worker by requeue_stale()
+    """
+    now = time.time()
+    if now - getattr(job, '_reported', 0) < PROGRESS_INTERVAL:
+        return
+    job._reported = now
+    if total is not None:
+        done = float(done) / total if total else 1.0
+    Job = apps.get_model('researcher', 'Job')
+    if not _held(job).update(
+            progress=max(0.0, min(done, 1.0)),
+            progress_message=message[:255],
+            heartbeat=timezone.now()):
+        raise JobCancelled()
+    if Job.objects.filter(pk=job.pk, cancel_requested=True).exists():
+        raise JobCancelled()
+
+
+@contextlib.contextmanager
+def _claim_lock():
+    """Hold the machine's claim lock file, where file locks exist."""
+    if fcntl is None:
+        yield
+        return
+    with open(LOCK_FILE, 'a') as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(stream, fcntl.LOCK_UN)
+
+
+def claim(worker):
+    """Take the next queued job that may start.
+
+    Arguments:
+        worker -- the name of the worker taking it
+    Returns: the Job, now running, or None when there is none
+    """
+    Job = apps.get_model('researcher', 'Job')
+    now = timezone.now()
+    database = connections[router.db_for_write(Job)]
+    if database.vendor == 'postgresql':
+        with database.cursor() as cursor:
+            cursor.execute(_CLAIM_SQL % {
+                'table': database.ops.quote_name(Job._meta.db_table),
+            }, [worker, now, now, now])
+            row = cursor.fetchone()
+        return Job.objects.get(pk=row[0]) if row else None
+    with _claim_lock():
+        candidates = Job.objects.filter(
+            status='queued',
+            run_after__lte=now
+        ).order_by('priority', 'pk').values_list('pk', flat=True)[:5]
+        for pk in candidates:
+            # The status test keeps a worker on another machine from
+            # taking the job twice.
+            if Job.objects.filter(pk=pk, status='queued').update(
+                    status='running',
+                    worker=worker,
+                    started=now,
+                    heartbeat=now,
+                    attempts=F('attempts') + 1,
+                    progress=0,
+                    progress_message=''):
+                return Job.objects.get(pk=pk)
+    return None
+
+
+class _Heartbeat(threading.Thread):
+
+    """A thread showing that a worker is still running its job."""
+
+    def __init__(self, job):
+        """Prepare to beat for a job."""
+        super(_Heartbeat, self).__init__(name='researcher-heartbeat')
+        self.daemon = True
+        self.job = job
+        self._done = threading.Event()
+
+    def run(self):
+        """Touch the job's heartbeat until stopped."""
+        Job = apps.get_model('researcher', 'Job')
+        try:
+            while not self._done.wait(STALE_SECONDS / 3.0):
+                try:
+                    _held(self.job).update(heartbeat=timezone.now())
+                except DatabaseError:
+                    # Busy (SQLite locks the whole file); try next time.
+                    pass
+        finally:
+            # The thread's own connection, which nothing else will close.
+            connections[router.db_for_write(Job)].close()
+
+    def stop(self):
+        """Stop beating."""
+        self._done.set()
+        self.join()
+
+
+def run(job):
+    """Run a claimed job and record how it ended.
+
+    A job requeue_stale() took from this worker may be running again
+    elsewhere; how it ended here is then dropped, so as not to overwrite
+    the other run's.
+
+    Arguments:
+        job -- the Job, as claim() returned it
+    Returns: the job's status afterwards; None if it was taken away
+    """
+    now = timezone.now
+    mine = _held(job)
+    heartbeat = _Heartbeat(job)
+    heartbeat.start()
+    try:
+        function = TASKS.get(job.task)
+        if function is None:
+            raise LookupError('No task named %r.' % job.task)
+        arguments = json.loads(job.arguments)
+        with shards.project_scope(arguments.get('project')), \
+                replicas.replica_reads(function.replica), \
+                history.acting_as(job.researcher_id):
+            result = function(job, **arguments)
+    except JobCancelled:
+        status = 'cancelled'
+        updated = mine.update(status=status, finished=now())
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            status = 'queued'
+            updated = mine.update(
+                status=status,
+                error=error,
+                run_after=now() + datetime.timedelta(
+                    seconds=RETRY_DELAY * 2 ** (job.attempts - 1)
+                )
+            )
+        else:
+            status = 'failed'
+            updated = mine.update(
+                status=status,
+                error=error,
+                finished=now()
+            )
+    else:
+        status = 'done'
+        updated = mine.update(
+            status=status,
+            result=json.dumps(result, default=str),
+            progress=1,
+            finished=now()
+        )
+    finally:
+        heartbeat.stop()
+        versions.bump_committed()
+    return status if updated else None
+
+
+def requeue_stale():
+    """Queue again the running jobs whose workers stopped answering.
+
+    Jobs that have used up their attempts fail instead.
+
+    Returns: the number of jobs queued again or failed
+    """
+    Job = apps.get_model('researcher', 'Job')
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status='running',
+        heartbeat__lt=now - datetime.timedelta(seconds=STALE_SECONDS)
+    )
+    error = 'The worker stopped answering.'
+    return stale.filter(attempts__lt=F('max_attempts')).update(
+        status='queued',
+        run_after=now,
+        error=error
+    ) + stale.update(status='failed', finished=now, error=error)
+
+
+def work(worker=None, until_empty=False, stop=None):
+    """Claim and run jobs, one at a time.
+
+    Arguments:
+        worker -- the worker's name; None for host:process id
+        until_empty -- return once no job is waiting, instead of polling
+        stop -- an Event; the worker returns between jobs once it is set
+    Returns: the number of jobs run
+    """
+    worker = worker or '%s:%d' % (socket.gethostname(), os.getpid())
+    ran = 0
+    checked = 0
+    while stop is None or not stop.is_set():
+        if time.time() - checked > STALE_SECONDS:
+            requeue_stale()
+            checked = time.time()
+        job = claim(worker)
+        if job is None:
+            if until_empty:
+                break
+            if stop is None:
+                time.sleep(POLL_INTERVAL)
+            else:
+                stop.wait(POLL_INTERVAL)
+            continue
+        run(job)
+        ran += 1
+    return ran
+
+
+def _in_batches(job, ids, function, message):
+    """Apply a function to batches of ids, reporting progress."""
+    found = 0
+    for start in range(0, len(ids), BATCH_SIZE):
+        progress(job, start, len(ids), message)
+        found += function(ids[start:start + BATCH_SIZE])
+    return found
+
+
+# The heavy operations of the researcher modules.  They are imported when
+# they run: the network needs NumPy, and the rest need not be loaded by
+# every process that only queues jobs.
+@task('sanity.validate')
+def validate_project(job, project):
+    """Check every persona of a project for impossibilities."""
+    from researcher import sanity
+    return _in_batches(job, sanity.project_personas(project),
+                       sanity.evaluate, 'Checking personas')
+
+
+@task('gaps.refresh')
+def refresh_gaps(job, project):
+    """Find the research gaps of every persona of a project."""
+    from researcher import gaps, sanity
+    return _in_batches(job, sanity.project_personas(project), gaps.refresh,
+                       'Finding gaps')
+
+
+@task('conflicts.check_all')
+def check_conflicts(job):
+    """Check every group of every persona for conflicts."""
+    from researcher import conflicts
+    Persona = apps.get_model('researcher', 'Persona')
+    return _in_batches(
+        job,
+        list(Persona.objects.values_list('pk', flat=True)),
+        conflicts.evaluate,
+        'Checking groups'
+    )
+
+
+@task('participation.rebuild')
+def rebuild_participation(job):
+    """Rebuild the participation and membership tables."""
+    from researcher.participation import rebuild_participation
+    progress(job, 0, message='Rebuilding')
+    rebuild_participation()
+
+
+@task('network.build', replica=True)
+def build_network(job, project, max_surety_rank=None,
+                  include_disproved=False):
+    """Export a project's family network."""
+    from researcher.network import build_network
+    progress(job, 0, message='Exporting the network')
+    return build_network(project, max_surety_rank, include_disproved).path
+
+
+@task('kinship.inbreeding', replica=True)
+def compute_inbreeding(job, project, max_surety_rank=None,
+                       include_disproved=False):
+    """Compute and store the inbreeding coefficients of a project."""
+    from researcher.kinship import compute_inbreeding
+    progress(job, 0, message='Computing coefficients')
+    compute_inbreeding(project, max_surety_rank, include_disproved)
+
+
+@task('archive.assertions')
+def archive_assertions(job, project=None, days=None):
+    """Archive disproved reasoning and move old archive batches to files."""
+    from researcher.archive import archive, move_to_files
+
+    def report(done, total):
+        """Pass the archiver's progress on to the job."""
+        progress(job, done, total, 'Archiving')
+
+    assertions, links = archive(project, days, report=report)
+    return {
+        'assertions': assertions,
+        'links': links,
+        'files': move_to_files(),
+    }
+
+
+@task('import.file')
+def import_file(job, path, surety_scheme_part=None, kind=None):
+    """Import a GEDCOM or CSV file as assertions of the job's researcher."""
+    from researcher.importer import import_file
+
+    def report(done, total, message):
+        """Pass the importer's progress on to the job."""
+        progress(job, done, total, message)
+
+    source, written = import_file(path, job.researcher_id,
+                                  surety_scheme_part, kind, report=report)
+    return {'source': source.pk, 'written': written}
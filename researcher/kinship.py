@@ -0,0 +1,430 @@
+"""Compute kinship and inbreeding coefficients over a project's family network.
+
+The kinship coefficient of two personas is the probability that an
+allele drawn at random from each is identical by descent; a persona's
+inbreeding coefficient is the kinship coefficient of its parents.  In
+endogamous communities, where everybody descends from the same few
+couples in several ways, they say more about how closely two people are
+related than the name of the nearest relationship does.
+
+The textbook recursion visits the pedigree persona by persona.  Here the
+coefficients come from the decomposition of the additive relationship
+matrix A = T D T' (A is twice the kinship matrix), with the personas
+ordered by generation:
+
+    T -- (I - P)^-1, where P holds 1/2 for each child and parent
+    D -- the diagonal of Mendelian sampling variances: 1 for a persona
+        with no known parents, 3/4 - F(p)/4 with one known parent p and
+        1/2 - (F(s) + F(d))/4 with two
+
+Neither A nor T is ever formed; deep endogamous pedigrees would make T
+hold most of the project for every persona.  Instead columns of A are
+computed for a batch of personas at once (J. J. Colleau's indirect
+method): a pass up the generations multiplies by T', a pass down by T,
+and each generation's step is one sparse matrix product over the links
+into it.  The inbreeding coefficients of the children of a generation's
+parents come from those parents' columns, so they are known before the
+children's own variances are needed.  Batches run in threads; SciPy's
+sparse kernels and NumPy release the GIL while they work.
+
+The parent/child links are those of the project's saved family network
+(see researcher.network).  The model allows two parents, which are kept
+whatever roles they were named in.  Where more are asserted (competing
+hypotheses), the first parent named in each role comes before the rest,
+and the first two are kept.  Personas caught in a loop of parentage,
+and their descendants, are treated as having no known parents.
+
+Requires NumPy and SciPy.
+
+Exports:
+    Functions:
+        compute_inbreeding
+        compute_kinship
+    Classes:
+        KinshipCalculator
+"""
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+
+from researcher.network import network
+
+WORKERS = getattr(settings, 'RESEARCHER_KINSHIP_WORKERS', None)
+
+# Columns of A computed together; each batch holds a dense array of this
+# many columns by (at most) the number of personas.
+BATCH_COLUMNS = 128
+
+# Rows written by one INSERT, and ids in one IN list.
+BATCH_SIZE = 500
+
+
+def _in_chunks(function, count, size, workers):
+    """Run a function over consecutive ranges of items, in threads.
+
+    Arguments:
+        function -- called as function(start, stop) for each range
+        count -- the number of items
+        size -- the number of items in a range
+        workers -- the number of threads
+    Returns: the results, in order of range
+    """
+    ranges = [
+        (start, min(start + size, count))
+        for start in range(0, count, size)
+    ]
+    if workers < 2 or len(ranges) < 2:
+        return [function(start, stop) for start, stop in ranges]
+    pool = ThreadPool(min(workers, len(ranges)))
+    try:
+        return pool.map(lambda bounds: function(*bounds), ranges)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class KinshipCalculator(object):
+
+    """Kinship and inbreeding coefficients over one family network.
+
+    The inbreeding coefficients and variances are computed when the
+    calculator is made; kinship coefficients are computed when asked for.
+
+    Instance Variables:
+        network -- The FamilyNetwork the coefficients describe.
+        workers -- The number of threads to use.
+    """
+
+    def __init__(self, family_network, workers=None):
+        """Compute D and the inbreeding coefficient of every persona."""
+        self.network = family_network
+        self.workers = workers or WORKERS or multiprocessing.cpu_count()
+        size = family_network.size
+
+        # Treat the personas in loops of parentage as founders.
+        depth = family_network.generations()
+        depth = numpy.where(depth < 0, 0, depth)
+        order = numpy.argsort(depth, kind='stable')
+        self._position = numpy.empty(size, dtype=numpy.int64)
+        self._position[order] = numpy.arange(size)
+        self._bounds = numpy.searchsorted(
+            depth[order],
+            numpy.arange(int(depth.max(initial=0)) + 2)
+        )
+
+        first, second = self._parents(family_network, depth)
+        self._links(first, second)
+
+        # A couple's coefficient comes from the column of the parent in
+        # the later position, which is in the later (or the same)
+        # generation.
+        couples = numpy.flatnonzero(second >= 0)
+        later = numpy.maximum(first[couples], second[couples])
+        earlier = numpy.minimum(first[couples], second[couples])
+        by_generation = numpy.searchsorted(self._bounds, later, 'right') - 1
+
+        self._variance = numpy.ones(size, dtype=numpy.float64)
+        self._inbreeding = numpy.zeros(size, dtype=numpy.float64)
+        for generation in range(len(self._bounds) - 1):
+            members = numpy.arange(
+                self._bounds[generation],
+                self._bounds[generation + 1]
+            )
+            single = members[(first[members] >= 0) & (second[members] < 0)]
+            self._variance[single] = \
+                0.75 - self._inbreeding[first[single]] / 4
+            pair = members[second[members] >= 0]
+            self._variance[pair] = 0.5 - (
+                self._inbreeding[first[pair]] +
+                self._inbreeding[second[pair]]
+            ) / 4
+
+            chosen = by_generation == generation
+            if chosen.any():
+                self._inbreeding[couples[chosen]] = self._kinship_of_positions(
+                    later[chosen],
+                    earlier[chosen]
+                )
+
+    def _parents(self, family_network, depth):
+        """Choose at most two parents for each persona.
+
+        Arguments:
+            self
+            family_network -- the FamilyNetwork
+            depth -- the generation of each node, loops counted as 0
+        Returns: (first, second), the positions of each position's
+            parents, or -1 where there are fewer
+        """
+        size = family_network.size
+        counts = numpy.diff(family_network.up_indptr)
+        children = numpy.repeat(numpy.arange(size), counts)
+        parents = numpy.asarray(family_network.up_indices, dtype=numpy.int64)
+        roles = numpy.asarray(family_network.up_roles, dtype=numpy.int64)
+        usable = depth[parents] < depth[children]
+        children, parents, roles = \
+            children[usable], parents[usable], roles[usable]
+
+        # The network holds each child and parent pair once, so every
+        # candidate is a distinct parent.  Candidates after the first in
+        # their role only count when a child has fewer than two others.
+        order = numpy.lexsort((parents, roles, children))
+        children, parents, roles = \
+            children[order], parents[order], roles[order]
+        repeated = numpy.zeros(len(children), dtype=bool)
+        repeated[1:] = (children[1:] == children[:-1]) & \
+            (roles[1:] == roles[:-1])
+        order = numpy.lexsort((parents, roles, repeated, children))
+        children, parents = children[order], parents[order]
+        rank = numpy.arange(len(children)) - numpy.searchsorted(
+            children,
+            children
+        )
+
+        first = numpy.full(size, -1, dtype=numpy.int64)
+        second = numpy.full(size, -1, dtype=numpy.int64)
+        chosen = rank == 0
+        first[self._position[children[chosen]]] = \
+            self._position[parents[chosen]]
+        chosen = rank == 1
+        second[self._position[children[chosen]]] = \
+            self._position[parents[chosen]]
+        return first, second
+
+    def _links(self, first, second):
+        """Split the parent matrix P into one block per generation.
+
+        For each generation h, self._parent_rows[h] lists the positions
+        of the parents of its members, and self._down[h] is the block of
+        P from those parents to the members.
+
+        Arguments:
+            self
+            first -- the first parent of each position, or -1
+            second -- the second parent of each position, or -1
+        """
+        self._parent_rows = []
+        self._down = []
+        for generation in range(len(self._bounds) - 1):
+            start = self._bounds[generation]
+            stop = self._bounds[generation + 1]
+            children = numpy.concatenate([
+                numpy.flatnonzero(first[start:stop] >= 0),
+                numpy.flatnonzero(second[start:stop] >= 0),
+            ])
+            parents = numpy.concatenate([
+                first[start:stop][first[start:stop] >= 0],
+                second[start:stop][second[start:stop] >= 0],
+            ])
+            rows, columns = numpy.unique(parents, return_inverse=True)
+            self._parent_rows.append(rows)
+            self._down.append(sparse.csr_matrix(
+                (numpy.full(len(children), 0.5), (children, columns)),
+                shape=(stop - start, len(rows))
+            ))
+        self._up = [block.T.tocsr() for block in self._down]
+
+    def _columns(self, seeds):
+        """Compute columns of A.
+
+        Only the rows up to the end of the last seed's generation are
+        computed; the rows below need the variances of later
+        generations, which may not be known yet.
+
+        Arguments:
+            self
+            seeds -- an ascending array of positions
+        Returns: a dense array of A[row, seed] by row and seed
+        """
+        bounds = self._bounds
+        top = int(numpy.searchsorted(bounds, seeds[-1], 'right')) - 1
+        columns = numpy.zeros((bounds[top + 1], len(seeds)))
+        columns[seeds, numpy.arange(len(seeds))] = 1.0
+        # Up: x = T' e, adding half of each child's value to its parents.
+        for generation in range(top, 0, -1):
+            rows = self._parent_rows[generation]
+            if len(rows):
+                columns[rows] += self._up[generation].dot(
+                    columns[bounds[generation]:bounds[generation + 1]]
+                )
+        columns *= self._variance[:bounds[top + 1], numpy.newaxis]
+        # Down: T x, adding half of each parent's value to its children.
+        for generation in range(1, top + 1):
+            rows = self._parent_rows[generation]
+            if len(rows):
+                columns[bounds[generation]:bounds[generation + 1]] += \
+                    self._down[generation].dot(columns[rows])
+        return columns
+
+    def _kinship_of_positions(self, seeds, others):
+        """Compute the kinship of pairs of positions.
+
+        Arguments:
+            self
+            seeds -- an array of positions
+            others -- an array of positions, as long as seeds, each no
+                later than its seed's generation
+        Returns: an array of kinship coefficients
+        """
+        order = numpy.argsort(seeds, kind='stable')
+        unique, inverse = numpy.unique(seeds[order], return_inverse=True)
+        starts = numpy.searchsorted(inverse, numpy.arange(len(unique) + 1))
+        others = others[order]
+
+        def batch(low, high):
+            """Compute the pairs of a range of the distinct seeds."""
+            columns = self._columns(unique[low:high])
+            chosen = slice(starts[low], starts[high])
+            return columns[others[chosen], inverse[chosen] - low] / 2
+
+        values = numpy.zeros(len(seeds), dtype=numpy.float64)
+        found = _in_chunks(batch, len(unique), BATCH_COLUMNS, self.workers)
+        if found:
+            values[order] = numpy.concatenate(found)
+        return values
+
+    def _locate(self, personas):
+        """Find the positions of personas, or -1 for those not in it."""
+        personas = numpy.asarray(personas, dtype=numpy.int64)
+        if not self.network.size:
+            return numpy.full(len(personas), -1, dtype=numpy.int64)
+        nodes = numpy.minimum(
+            numpy.searchsorted(self.network.ids, personas),
+            self.network.size - 1
+        )
+        found = numpy.asarray(self.network.ids)[nodes] == personas
+        return numpy.where(found, self._position[nodes], -1)
+
+    def inbreeding(self):
+        """Give the inbreeding coefficient of every persona.
+
+        Returns: an array of coefficients by node of the network
+        """
+        return self._inbreeding[self._position]
+
+    def kinship(self, pairs):
+        """Compute the kinship coefficients of pairs of personas.
+
+        A persona's kinship with itself is (1 + F) / 2.  Personas with no
+        links in the network are unrelated to everybody else.
+
+        Arguments:
+            self
+            pairs -- a sequence of (persona id, persona id) pairs
+        Returns: an array of coefficients, in the order of pairs
+        """
+        pairs = numpy.asarray(pairs, dtype=numpy.int64).reshape(-1, 2)
+        first = self._locate(pairs[:, 0])
+        second = self._locate(pairs[:, 1])
+        values = numpy.where(pairs[:, 0] == pairs[:, 1], 0.5, 0.0)
+        known = (first >= 0) & (second >= 0)
+        values[known] = self._kinship_of_positions(
+            numpy.maximum(first[known], second[known]),
+            numpy.minimum(first[known], second[known])
+        )
+        return values
+
+
+def compute_inbreeding(project, max_surety_rank=None,
+                       include_disproved=False, workers=None):
+    """Compute and store the inbreeding coefficients of a project.
+
+    Every persona in the project's family network gets a coefficient;
+    those stored before are replaced.
+
+    Arguments:
+        project -- the Project or its id
+        max_surety_rank -- see researcher.network.build_network
+        include_disproved -- see researcher.network.build_network
+        workers -- the number of threads to use
+    Returns: the KinshipCalculator, for further questions
+    """
+    InbreedingCoefficient = apps.get_model('researcher',
+                                           'InbreedingCoefficient')
+    project_id = getattr(project, 'pk', project)
+    calculator = KinshipCalculator(
+        network(project, max_surety_rank, include_disproved),
+        workers
+    )
+    ids = calculator.network.ids.tolist()
+    values = calculator.inbreeding().tolist()
+    with transaction.atomic():
+        InbreedingCoefficient.objects.filter(project=project_id).delete()
+        InbreedingCoefficient.objects.bulk_create(
+            [
+                InbreedingCoefficient(
+                    project_id=project_id,
+                    persona_id=persona,
+                    coefficient=value
+                )
+                for persona, value in zip(ids, values)
+            ],
+            batch_size=BATCH_SIZE
+        )
+    return calculator
+
+
+def compute_kinship(project, pairs, max_surety_rank=None,
+                    include_disproved=False, calculator=None, workers=None):
+    """Compute and store the kinship coefficients of pairs of personas.
+
+    Each pair is stored with the lower persona id first, replacing any
+    coefficient stored for it before.
+
+    Arguments:
+        project -- the Project or its id
+        pairs -- a sequence of (persona id, persona id) pairs
+        max_surety_rank -- see researcher.network.build_network
+        include_disproved -- see researcher.network.build_network
+        calculator -- a KinshipCalculator for the same network, to save
+            building another
+        workers -- the number of threads to use
+    Returns: a dict of coefficients by (lower id, higher id)
+    """
+    KinshipCoefficient = apps.get_model('researcher', 'KinshipCoefficient')
+    project_id = getattr(project, 'pk', project)
+    pairs = sorted(set(
+        (min(first, second), max(first, second)) for first, second in pairs
+    ))
+    if not pairs:
+        return {}
+    if calculator is None:
+        calculator = KinshipCalculator(
+            network(project, max_surety_rank, include_disproved),
+            workers
+        )
+    found = dict(zip(pairs, calculator.kinship(pairs).tolist()))
+
+    with transaction.atomic():
+        stale = []
+        firsts = sorted(set(first for first, second in pairs))
+        for start in range(0, len(firsts), BATCH_SIZE):
+            stale.extend(
+                pk for pk, first, second in KinshipCoefficient.objects.filter(
+                    project=project_id,
+                    persona1__in=firsts[start:start + BATCH_SIZE]
+                ).values_list('pk', 'persona1', 'persona2')
+                if (first, second) in found
+            )
+        for start in range(0, len(stale), BATCH_SIZE):
+            KinshipCoefficient.objects.filter(
+                pk__in=stale[start:start + BATCH_SIZE]
+            ).delete()
+        KinshipCoefficient.objects.bulk_create(
+            [
+                KinshipCoefficient(
+                    project_id=project_id,
+                    persona1_id=first,
+                    persona2_id=second,
+                    coefficient=value
+                )
+                for (first, second), value in sorted(found.items())
+            ],
+            batch_size=BATCH_SIZE
+        )
+    return found
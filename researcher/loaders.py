@@ -0,0 +1,418 @@
+"""Batch the lookups made while walking the model graph.
+
+Views and exports walk the same paths again and again: an Assertion to
+its Source, up the higher_source chain and across to the CitationParts,
+or a Persona to its Assertions, their Events, the Events' Places and
+the PlaceParts.  Done object by object, every hop is a query per row.
+
+A LoaderContext collects the loads asked for during a request.  Loads
+of the same model and key field wait in a queue until a value is
+actually needed (the "tick"); then every queued key is fetched with one
+IN query and remembered for the rest of the request.  walk() applies
+this a level at a time to a whole list of objects and primes Django's
+own related-object caches, so the ordinary accessors (`event.place`,
+`place.placepart_set.all()`) answer from memory afterwards.  The query
+count of a walk therefore grows with the depth of the path, not with
+the number of rows.
+
+LoaderMiddleware gives each request its own context, available as
+`request.loaders` and through current() while the request runs.
+
+Exports:
+    Functions:
+        activate
+        current
+        deactivate
+        load_persona_assertions
+        load_subject
+    Classes:
+        Loader
+        LoaderContext
+        LoaderMiddleware
+        Pending
+"""
+import threading
+
+from django.apps import apps
+from django.db.models import Q
+
+SUBJECT_MODELS = {
+    'P': 'Persona',
+    'E': 'Event',
+    'C': 'Characteristic',
+    'G': 'Group',
+}
+
+_state = threading.local()
+
+
+class Pending(object):
+
+    """A value that a Loader will fetch in its next batch.
+
+    Instance Variables:
+        loader -- The Loader that owns the key.
+        key -- The key to fetch.
+    """
+
+    def __init__(self, loader, key):
+        """Remember the key until the batch runs."""
+        self.loader = loader
+        self.key = key
+
+    def get(self):
+        """Run the batch if needed and return the loaded value.
+
+        Arguments:
+            self
+        Returns: the object (or list of objects for a to-many loader),
+            or None (an empty list) if nothing matched
+        """
+        return self.loader.resolve(self.key)
+
+
+class Loader(object):
+
+    """Load rows of one model by one key field, in batches.
+
+    Instance Variables:
+        model -- The model class to load.
+        field -- The field the keys are matched against (default 'pk').
+        many -- Whether a key may match many rows (e.g. loading
+            PlaceParts by place) rather than at most one.
+    """
+
+    def __init__(self, model, field='pk', many=False):
+        """Set up an empty queue and memo."""
+        self.model = model
+        self.field = field
+        self.many = many
+        self.queries = 0
+        self._queue = set()
+        self._memo = {}
+
+    def load(self, key):
+        """Queue a key for the next batch.
+
+        Arguments:
+            self
+            key -- the key to load
+        Returns: a Pending for the key
+        """
+        if key not in self._memo:
+            self._queue.add(key)
+        return Pending(self, key)
+
+    def load_many(self, keys):
+        """Queue several keys for the next batch.
+
+        Arguments:
+            self
+            keys -- the keys to load
+        Returns: a list of Pendings, in the order of `keys`
+        """
+        return [self.load(key) for key in keys]
+
+    def prime(self, key, value):
+        """Record a value fetched some other way."""
+        self._memo[key] = value
+        self._queue.discard(key)
+
+    def dispatch(self):
+        """Fetch every queued key with a single query."""
+        keys = [key for key in self._queue if key is not None]
+        self._queue = set()
+        if not keys:
+            return
+        queryset = self.model._default_manager.filter(
+            **{'%s__in' % self.field: keys}
+        )
+        self.queries += 1
+        # Keyed by the column's value: a ForeignKey's id, not the
+        # related instance its name would fetch.
+        opts = self.model._meta
+        attname = opts.pk.attname if self.field == 'pk' else \
+            opts.get_field(self.field).attname
+        if self.many:
+            found = dict((key, []) for key in keys)
+            for obj in queryset.order_by('pk'):
+                found[getattr(obj, attname)].append(obj)
+        else:
+            found = dict((key, None) for key in keys)
+            for obj in queryset:
+                found[getattr(obj, attname)] = obj
+        self._memo.update(found)
+
+    def resolve(self, key):
+        """Return the value for a key, running the batch if needed.
+
+        Arguments:
+            self
+            key -- the key to look up
+        Returns: the loaded value
+        """
+        if key not in self._memo:
+            if key not in self._queue:
+                self._queue.add(key)
+            self.dispatch()
+        return self._memo.get(key, [] if self.many else None)
+
+
+class LoaderContext(object):
+
+    """The loaders for one request (or one management command run)."""
+
+    def __init__(self):
+        """Start with no loaders."""
+        self._loaders = {}
+        self._persona_assertions = {}
+
+    def loader(self, model, field='pk', many=False):
+        """Get the loader for a model and key field, creating it once.
+
+        Arguments:
+            self
+            model -- the model class or 'researcher.Model' label
+            field -- the field keys are matched against
+            many -- whether a key may match many rows
+        Returns: the Loader
+        """
+        if isinstance(model, str):
+            model = apps.get_model(model)
+        key = (model, field, many)
+        if key not in self._loaders:
+            self._loaders[key] = Loader(model, field, many)
+        return self._loaders[key]
+
+    @property
+    def queries(self):
+        """The number of batch queries run so far."""
+        return sum(loader.queries for loader in self._loaders.values())
+
+    def load(self, model, key):
+        """Queue one object for loading by primary key.
+
+        Arguments:
+            self
+            model -- the model class
+            key -- the primary key
+        Returns: a Pending
+        """
+        return self.loader(model).load(key)
+
+    def walk(self, objects, path):
+        """Follow a dotted relation path from a list of objects.
+
+        Each step is a forward ForeignKey (e.g. 'source') or a reverse
+        ForeignKey accessor (e.g. 'citationpart_set') and costs at most
+        one query for all the objects at that level.  The loaded objects
+        are stored in Django's related-object caches, so afterwards
+        `obj.source` and `obj.citationpart_set.all()` need no query.
+
+        Arguments:
+            self
+            objects -- model instances of one model
+            path -- e.g. 'source.higher_source' or
+                'place.placepart_set'
+        Returns: the list of distinct objects reached by the last step
+        """
+        level = [obj for obj in objects if obj is not None]
+        for name in path.split('.'):
+            if not level:
+                return []
+            level = self._step(level, name)
+        return level
+
+    def walk_chain(self, objects, name):
+        """Follow a self-referencing ForeignKey as far as it goes.
+
+        Used for chains such as Source.higher_source, this costs one
+        query per level of the deepest chain.
+
+        Arguments:
+            self
+            objects -- model instances of one model
+            name -- the ForeignKey name, e.g. 'higher_source'
+        Returns: the distinct objects reached, not including `objects`
+        """
+        reached = {}
+        level = [obj for obj in objects if obj is not None]
+        while level:
+            level = [
+                obj for obj in self._step(level, name)
+                if obj.pk not in reached
+            ]
+            for obj in level:
+                reached[obj.pk] = obj
+        return list(reached.values())
+
+    def _step(self, objects, name):
+        """Follow one relation from a list of objects of one model.
+
+        Arguments:
+            self
+            objects -- the model instances
+            name -- a forward ForeignKey name or reverse accessor name
+        Returns: the distinct related objects
+        """
+        opts = objects[0]._meta
+        for related in opts.get_all_related_objects():
+            if related.get_accessor_name() == name:
+                return self._step_reverse(objects, related)
+
+        field = opts.get_field(name)
+        loader = self.loader(field.rel.to)
+        pending = [
+            (obj, loader.load(getattr(obj, field.attname)))
+            for obj in objects
+        ]
+        reached = {}
+        for obj, value in pending:
+            target = value.get()
+            setattr(obj, field.get_cache_name(), target)
+            if target is not None:
+                reached[target.pk] = target
+        return list(reached.values())
+
+    def _step_reverse(self, objects, related):
+        """Follow a reverse ForeignKey from a list of objects.
+
+        Arguments:
+            self
+            objects -- the model instances on the ForeignKey's target side
+            related -- the RelatedObject describing the reverse relation
+        Returns: all the child objects
+        """
+        loader = self.loader(related.field.model, related.field.name,
+                             many=True)
+        pending = [(obj, loader.load(obj.pk)) for obj in objects]
+        cache_name = related.field.related_query_name()
+        children = []
+        for obj, value in pending:
+            found = value.get()
+            manager = getattr(obj, related.get_accessor_name())
+            queryset = manager.get_queryset()
+            queryset._result_cache = found
+            queryset._prefetch_done = True
+            if not hasattr(obj, '_prefetched_objects_cache'):
+                obj._prefetched_objects_cache = {}
+            obj._prefetched_objects_cache[cache_name] = queryset
+            children.extend(found)
+        return children
+
+    def subjects(self, assertions, which=1):
+        """Load the subjects of many assertions at once.
+
+        Arguments:
+            self
+            assertions -- the Assertions
+            which -- 1 for subject1, 2 for subject2, or (1, 2) for both
+        Returns: a list of (assertion, subject) pairs, for each assertion
+            in turn and each side asked for; one query per kind of
+            subject present
+        """
+        pending = [
+            (assertion, self.load(
+                'researcher.' + SUBJECT_MODELS[
+                    getattr(assertion, 'subject%d_type' % side)
+                ],
+                getattr(assertion, 'subject%d' % side)
+            ))
+            for assertion in assertions
+            for side in (which if isinstance(which, tuple) else (which,))
+        ]
+        return [(assertion, value.get()) for assertion, value in pending]
+
+    def persona_assertions(self, personas):
+        """Load the assertions naming any of several personas.
+
+        Arguments:
+            self
+            personas -- the Personas, or their ids
+        Returns: a dict mapping persona ids to lists of Assertions in id
+            order, from a single query for the personas not loaded yet
+        """
+        wanted = [getattr(persona, 'pk', persona) for persona in personas]
+        missing = [pk for pk in set(wanted)
+                   if pk not in self._persona_assertions]
+        if missing:
+            found = dict((pk, []) for pk in missing)
+            assertion_loader = self.loader('researcher.Assertion')
+            queryset = apps.get_model(
+                'researcher',
+                'Assertion'
+            ).objects.filter(
+                Q(subject1_type='P', subject1__in=missing) |
+                Q(subject2_type='P', subject2__in=missing)
+            ).order_by('pk')
+            assertion_loader.queries += 1
+            for assertion in queryset:
+                assertion_loader.prime(assertion.pk, assertion)
+                named = set(
+                    key for kind, key in (
+                        (assertion.subject1_type, assertion.subject1),
+                        (assertion.subject2_type, assertion.subject2))
+                    if kind == 'P' and key in found
+                )
+                for key in named:
+                    found[key].append(assertion)
+            self._persona_assertions.update(found)
+        return dict((pk, self._persona_assertions[pk]) for pk in wanted)
+
+
+def current():
+    """Return the active LoaderContext, or None outside of one."""
+    return getattr(_state, 'context', None)
+
+
+def activate(context):
+    """Make a LoaderContext the active one for this thread."""
+    _state.context = context
+
+
+def deactivate():
+    """Leave the active LoaderContext."""
+    _state.context = None
+
+
+def load_subject(subject_type, subject_id):
+    """Fetch an assertion subject, through the active context if any.
+
+    Arguments:
+        subject_type -- 'P', 'E', 'C' or 'G'
+        subject_id -- the subject's id
+    Returns: the Persona, Event, Characteristic or Group, or None if it
+        no longer exists
+    """
+    model = apps.get_model('researcher', SUBJECT_MODELS[subject_type])
+    return (current() or LoaderContext()).load(model, subject_id).get()
+
+
+def load_persona_assertions(persona_id):
+    """Fetch the assertions naming a persona, through the active context.
+
+    Arguments:
+        persona_id -- the persona's id
+    Returns: a list of Assertions in id order
+    """
+    context = current() or LoaderContext()
+    return context.persona_assertions([persona_id])[persona_id]
+
+
+class LoaderMiddleware(object):
+
+    """Give every request its own LoaderContext."""
+
+    def process_request(self, request):
+        """Start a fresh context for the request."""
+        request.loaders = LoaderContext()
+        activate(request.loaders)
+
+    def process_response(self, request, response):
+        """Drop the request's context."""
+        deactivate()
+        return response
+
+    def process_exception(self, request, exception):
+        """Drop the request's context when the view fails."""
+        deactivate()
@@ -0,0 +1,210 @@
+"""Keep small, rarely changing tables in memory.
+
+Type tables such as PlacePartType or CitationPartType hold a few dozen
+rows but are joined into nearly every query that renders a place, a
+citation or a characteristic.  Each worker process loads them once and
+serves lookups by id or by name from memory.  Saving or deleting a row
+bumps a version counter in the Django cache, and every process reloads
+its copy when it sees the counter move (see researcher.versions).  A
+row that is not in a process's copy makes the process check the counter
+at once rather than after CHECK_INTERVAL, so rows another process has
+just added can be used straight away; a row that is missing from an
+unchanged table fails without reading the table again.
+
+Exports:
+    Functions:
+        connect_signals
+        is_lookup_model
+        lookup
+    Classes:
+        LookupTable
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from researcher import replicas
+from researcher.versions import bump_table_version, table_version
+
+LOOKUP_MODELS = (
+    'RepresentationType',
+    'CitationPartType',
+    'PlacePartType',
+    'CharacteristicPartType',
+    'EventType',
+    'EventTypeRole',
+    'GroupType',
+    'GroupTypeRole',
+    'SuretyScheme',
+    'SuretySchemePart',
+)
+
+CHECK_INTERVAL = getattr(
+    settings,
+    'RESEARCHER_LOOKUP_CACHE_CHECK_INTERVAL',
+    1.0
+)
+
+
+class LookupTable(object):
+
+    """An in-memory copy of one lookup table.
+
+    The cached instances are shared by every thread in the process and
+    must be treated as read-only.
+
+    Instance Variables:
+        model_name -- The name of the researcher model held in the table.
+    """
+
+    def __init__(self, model_name):
+        """Prepare an empty table; rows load on first use."""
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0
+        # (rows by id, rows by name), replaced whole so that readers
+        # outside the lock always see two maps of the same load.
+        self._maps = None
+
+    @property
+    def model(self):
+        """The model class held in the table."""
+        return apps.get_model('researcher', self.model_name)
+
+    def _rows(self, check=False):
+        """Return the maps, reloading them if the table has changed.
+
+        Arguments:
+            self
+            check -- True to read the table version now rather than
+                after CHECK_INTERVAL, as after a miss on a row another
+                process may have added
+        Returns: (a dict of instances by primary key, a dict of
+            instances by name)
+        """
+        now = time.time()
+        maps = self._maps
+        if (maps is not None and not check and
+                now - self._checked < CHECK_INTERVAL):
+            return maps
+        with self._lock:
+            version = table_version(self.model)
+            if self._maps is None or version != self._version:
+                with replicas.primary_reads():
+                    rows = list(self.model._default_manager.order_by('pk'))
+                by_name = {}
+                for row in rows:
+                    by_name.setdefault(row.name, row)
+                self._maps = (dict((row.pk, row) for row in rows), by_name)
+                self._version = version
+            self._checked = now
+            return self._maps
+
+    def _find(self, index, key):
+        """Find a row in one of the maps, checking the version on a miss."""
+        found = self._rows()[index].get(key)
+        if found is None:
+            found = self._rows(check=True)[index].get(key)
+        if found is None:
+            raise self.model.DoesNotExist(
+                '%s %r does not exist.' % (self.model_name, key)
+            )
+        return found
+
+    def get(self, pk):
+        """Find a row by primary key.
+
+        Arguments:
+            self
+            pk -- the primary key of the row
+        Returns: the cached instance
+        Raises: the model's DoesNotExist if there is no such row
+        """
+        return self._find(0, pk)
+
+    def get_by_name(self, name):
+        """Find a row by name.
+
+        Arguments:
+            self
+            name -- the name of the row; the lowest id wins on duplicates
+        Returns: the cached instance
+        Raises: the model's DoesNotExist if there is no such row
+        """
+        return self._find(1, name)
+
+    def all(self):
+        """List every row in primary key order."""
+        rows = self._rows()[0]
+        return [rows[pk] for pk in sorted(rows)]
+
+    def filter(self, **kwargs):
+        """List the rows whose attributes equal the given values.
+
+        Arguments:
+            self
+            kwargs -- attribute names (such as event_type_id) and values
+        Returns: the matching instances in primary key order
+        """
+        return [
+            row for row in self.all()
+            if all(getattr(row, attr) == value
+                   for attr, value in kwargs.items())
+        ]
+
+    def clear(self):
+        """Drop this process's copy so the next lookup reloads it."""
+        with self._lock:
+            self._maps = None
+
+    def invalidate(self):
+        """Drop this process's copy and tell other processes to reload."""
+        bump_table_version(self.model)
+        self.clear()
+
+
+_TABLES = dict((name, LookupTable(name)) for name in LOOKUP_MODELS)
+
+
+def lookup(model):
+    """Get the in-memory table for a lookup model.
+
+    Arguments:
+        model -- the model's name, e.g. 'PlacePartType', or, where the
+            model is only known at run time, its class
+    Returns: the LookupTable for the model
+    Raises: KeyError if the model is not a cached lookup table
+    """
+    if not isinstance(model, str):
+        model = model.__name__
+    return _TABLES[model]
+
+
+def is_lookup_model(model):
+    """Report whether a model class is served from memory."""
+    return (
+        model._meta.app_label == 'researcher' and
+        model.__name__ in _TABLES
+    )
+
+
+def _clear(sender, **kwargs):
+    """Signal receiver that drops this process's copy of a table.
+
+    The table version itself is bumped by researcher.versions, which
+    is how the other processes find out.
+    """
+    lookup(sender).clear()
+
+
+def connect_signals():
+    """Reload lookup tables whenever one of their rows changes."""
+    for name in LOOKUP_MODELS:
+        model = apps.get_model('researcher', name)
+        uid = 'researcher.lookups.%s' % name
+        post_save.connect(_clear, sender=model, dispatch_uid=uid)
+        post_delete.connect(_clear, sender=model, dispatch_uid=uid)
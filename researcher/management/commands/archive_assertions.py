@@ -0,0 +1,71 @@
+"""Archive disproved reasoning, or bring archived assertions back."""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from researcher import shards
+from researcher.models import Project
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Move disproved assertions between the live tables and the archive."""
+
+    args = '[<project_id>]'
+    help = (
+        'Archives the disproved assertions nothing live depends on, of a '
+        'project or of every project, and moves old archive batches to '
+        'files.  With --rehydrate, brings archived assertions back.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--days',
+            type='int',
+            dest='days',
+            default=None,
+            help='How many days an assertion must have gone unchanged.'
+        ),
+        make_option(
+            '--files-after',
+            type='int',
+            dest='files_after',
+            default=None,
+            help='Move archive batches this many days old to files.'
+        ),
+        make_option(
+            '--rehydrate',
+            dest='rehydrate',
+            default=None,
+            help='Bring back these archived assertion ids, comma '
+                 'separated.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Archive or rehydrate, and report how many rows moved."""
+        from researcher.archive import archive, move_to_files, rehydrate
+
+        if len(args) > 1:
+            raise CommandError('Give at most one project id.')
+        project = None
+        if args:
+            try:
+                project = Project.objects.get(pk=int(args[0]))
+            except (ValueError, Project.DoesNotExist):
+                raise CommandError('No project with id %s.' % args[0])
+            shards.activate(project)
+        if options['rehydrate']:
+            try:
+                pks = [int(pk) for pk in options['rehydrate'].split(',')]
+            except ValueError:
+                raise CommandError('Give assertion ids to --rehydrate.')
+            self.stdout.write('%d assertions rehydrated' % rehydrate(pks))
+            return
+        assertions, links = archive(project, options['days'])
+        self.stdout.write('%d assertions and %d links archived' % (
+            assertions, links
+        ))
+        moved = move_to_files(options['files_after'])
+        if moved:
+            self.stdout.write('%d archive batches moved to files' % moved)
@@ -0,0 +1,84 @@
+"""Build the family network arrays of one or more projects."""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from researcher import shards
+from researcher.models import Project
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Export projects' family networks and summarize them."""
+
+    args = '<project_id project_id ...>'
+    use_replica = True
+    help = (
+        'Builds the memory-mapped family network arrays of the given '
+        'projects and prints a summary of each.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--max-surety-rank',
+            type='int',
+            dest='max_surety_rank',
+            default=None,
+            help='Keep only assertions whose surety scheme part has at '
+                 'most this sequence number.'
+        ),
+        make_option(
+            '--include-disproved',
+            action='store_true',
+            dest='include_disproved',
+            default=False,
+            help='Keep disproved assertions.'
+        ),
+        make_option(
+            '--top',
+            type='int',
+            dest='top',
+            default=10,
+            help='How many of the most connected ancestors to list.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Build and summarize each project's network."""
+        from researcher.network import build_network
+
+        if not args:
+            raise CommandError('Give at least one project id.')
+        for project_id in args:
+            try:
+                project = Project.objects.get(pk=int(project_id))
+            except (ValueError, Project.DoesNotExist):
+                raise CommandError('No project with id %s.' % project_id)
+            shards.activate(project)
+            network = build_network(
+                project,
+                options['max_surety_rank'],
+                options['include_disproved']
+            )
+            sizes = network.component_sizes()
+            generations = network.generations()
+            self.stdout.write('%s: %d personas, %d links, saved in %s' % (
+                project,
+                network.size,
+                len(network.down_indices),
+                network.path
+            ))
+            self.stdout.write('  %d families, the largest of %d personas' % (
+                len(sizes),
+                sizes[0][1] if sizes else 0
+            ))
+            self.stdout.write('  %d generations, %d personas in loops' % (
+                generations.max(initial=-1) + 1,
+                (generations < 0).sum()
+            ))
+            for persona, count in network.most_connected_ancestors(
+                    options['top']):
+                self.stdout.write('  persona %d: about %d descendants' % (
+                    persona,
+                    count
+                ))
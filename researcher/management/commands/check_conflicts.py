@@ -0,0 +1,32 @@
+"""Check queued groups of assertions for conflicts."""
+from optparse import make_option
+
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Run the conflict rules over queued or all groups of assertions."""
+
+    help = (
+        'Checks the groups of assertions queued by changes for conflicts, '
+        'or with --all every persona\'s groups.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Check every persona, not only the queued groups.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Check the groups and report what was done."""
+        from researcher.conflicts import check_all, check_pending
+
+        if options['all']:
+            self.stdout.write('%d conflicts' % check_all())
+        else:
+            self.stdout.write('%d groups checked' % check_pending())
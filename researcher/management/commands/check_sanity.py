@@ -0,0 +1,48 @@
+"""Check personas for genealogical impossibilities."""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from researcher import shards
+from researcher.models import Project
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Run the sanity rules over queued personas or a whole project."""
+
+    args = '[<project_id>]'
+    help = (
+        'Checks the personas queued by changes for genealogical '
+        'impossibilities, or with a project id every persona of the '
+        'project.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=None,
+            help='How many processes to check a project with.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Check the personas and report what was found."""
+        from researcher.sanity import check_pending, validate_project
+
+        if not args:
+            self.stdout.write('%d personas checked' % check_pending())
+            return
+        if len(args) != 1:
+            raise CommandError('Give at most one project id.')
+        try:
+            project = Project.objects.get(pk=int(args[0]))
+        except (ValueError, Project.DoesNotExist):
+            raise CommandError('No project with id %s.' % args[0])
+        shards.activate(project)
+        self.stdout.write('%s: %d problems' % (
+            project,
+            validate_project(project, workers=options['workers'])
+        ))
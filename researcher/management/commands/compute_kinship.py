@@ -0,0 +1,108 @@
+"""Compute the inbreeding and kinship coefficients of a project."""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from researcher import shards
+from researcher.models import Project
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Store a project's inbreeding coefficients and any pairs asked for."""
+
+    args = '<project_id>'
+    use_replica = True
+    help = (
+        'Computes and stores the inbreeding coefficient of every persona '
+        'in the project\'s family network, and the kinship coefficients of '
+        'the pairs given with --pair.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--pair',
+            action='append',
+            dest='pairs',
+            default=[],
+            metavar='PERSONA,PERSONA',
+            help='Also compute the kinship of these two personas '
+                 '(may be repeated).'
+        ),
+        make_option(
+            '--max-surety-rank',
+            type='int',
+            dest='max_surety_rank',
+            default=None,
+            help='Keep only assertions whose surety scheme part has at '
+                 'most this sequence number.'
+        ),
+        make_option(
+            '--include-disproved',
+            action='store_true',
+            dest='include_disproved',
+            default=False,
+            help='Keep disproved assertions.'
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=None,
+            help='How many threads to compute with.'
+        ),
+        make_option(
+            '--top',
+            type='int',
+            dest='top',
+            default=10,
+            help='How many of the most inbred personas to list.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Compute, store and summarize the coefficients."""
+        from researcher.kinship import compute_inbreeding, compute_kinship
+
+        if len(args) != 1:
+            raise CommandError('Give one project id.')
+        try:
+            project = Project.objects.get(pk=int(args[0]))
+        except (ValueError, Project.DoesNotExist):
+            raise CommandError('No project with id %s.' % args[0])
+        shards.activate(project)
+        pairs = []
+        for pair in options['pairs']:
+            try:
+                first, second = [int(part) for part in pair.split(',')]
+            except ValueError:
+                raise CommandError('A pair is two persona ids: %s.' % pair)
+            pairs.append((first, second))
+
+        calculator = compute_inbreeding(
+            project,
+            options['max_surety_rank'],
+            options['include_disproved'],
+            workers=options['workers']
+        )
+        inbreeding = calculator.inbreeding()
+        self.stdout.write('%s: %d personas, %d inbred' % (
+            project,
+            len(inbreeding),
+            (inbreeding > 0).sum()
+        ))
+        ids = calculator.network.ids
+        for node in inbreeding.argsort()[::-1][:options['top']]:
+            if inbreeding[node] <= 0:
+                break
+            self.stdout.write('  persona %d: F = %.6f' % (
+                ids[node],
+                inbreeding[node]
+            ))
+        found = compute_kinship(project, pairs, calculator=calculator)
+        for (first, second), value in sorted(found.items()):
+            self.stdout.write('  personas %d and %d: kinship %.6f' % (
+                first,
+                second,
+                value
+            ))
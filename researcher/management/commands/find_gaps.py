@@ -0,0 +1,39 @@
+"""Find the research gaps of queued personas or a whole project."""
+from django.core.management.base import CommandError
+
+from researcher import shards
+from researcher.models import Project
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Refresh research gaps and summarize a project's worklist."""
+
+    args = '[<project_id>]'
+    help = (
+        'Refreshes the research gaps of the personas queued by changes, '
+        'or with a project id of every persona of the project.'
+    )
+
+    def handle(self, *args, **options):
+        """Refresh the gaps and report how many there are."""
+        from researcher.gaps import check_pending, refresh_project, worklist
+
+        if not args:
+            self.stdout.write('%d personas refreshed' % check_pending())
+            return
+        if len(args) != 1:
+            raise CommandError('Give at most one project id.')
+        try:
+            project = Project.objects.get(pk=int(args[0]))
+        except (ValueError, Project.DoesNotExist):
+            raise CommandError('No project with id %s.' % args[0])
+        shards.activate(project)
+        refresh_project(project)
+        counts = {}
+        for row in worklist(project, per_page=1 << 30).object_list:
+            counts[row[3]] = counts.get(row[3], 0) + 1
+        self.stdout.write('%s: %s' % (project, ', '.join(
+            '%d %s' % (count, gap) for gap, count in sorted(counts.items())
+        ) or 'no gaps'))
@@ -0,0 +1,97 @@
+"""Import a GEDCOM or CSV file."""
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from researcher.models import Researcher
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Import a file now, or queue it for the job workers."""
+
+    args = '<path>'
+    help = (
+        'Imports the personas, events and sources of a GEDCOM or CSV file '
+        'as assertions of a researcher, parsing and writing it with '
+        'several processes.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--researcher',
+            type='int',
+            dest='researcher',
+            help='The id of the researcher making the assertions.'
+        ),
+        make_option(
+            '--surety',
+            type='int',
+            dest='surety',
+            default=None,
+            help='The id of the surety scheme part of the assertions; '
+                 'the least sure part of the researcher\'s scheme if left '
+                 'out.'
+        ),
+        make_option(
+            '--format',
+            dest='kind',
+            choices=['gedcom', 'csv'],
+            default=None,
+            help='gedcom or csv; by default the file extension decides.'
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=None,
+            help='How many processes to import with.'
+        ),
+        make_option(
+            '--queue',
+            action='store_true',
+            dest='queue',
+            default=False,
+            help='Queue the import as a job instead of running it.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Import or queue the file and report what was written."""
+        from researcher import jobs
+        from researcher.importer import import_file
+
+        if len(args) != 1:
+            raise CommandError('Give the path of one file.')
+        if not Researcher.objects.filter(
+                pk=options['researcher']).exists():
+            raise CommandError('Give the id of a researcher.')
+        if options['queue']:
+            job = jobs.enqueue(
+                'import.file',
+                researcher=Researcher.objects.get(pk=options['researcher']),
+                path=args[0],
+                surety_scheme_part=options['surety'],
+                kind=options['kind']
+            )
+            self.stdout.write('Queued job %s' % job)
+            return
+
+        def report(done, total, message):
+            """Show the progress of the import."""
+            self.stderr.write('%s: %d of %d shards' % (message, done, total))
+
+        try:
+            source, written = import_file(
+                args[0],
+                options['researcher'],
+                options['surety'],
+                options['kind'],
+                options['workers'],
+                report
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write('Imported as %s' % source)
+        for name, count in sorted(written.items()):
+            self.stdout.write('%s: %d' % (name, count))
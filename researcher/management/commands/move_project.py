@@ -0,0 +1,36 @@
+"""Move a project's data to another database."""
+from django.core.management.base import CommandError
+
+from researcher.models import Project
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Move a project to another shard while it stays in use."""
+
+    args = '<project_id> <alias>'
+    help = (
+        'Copies a project\'s data to another of RESEARCHER_SHARDS, '
+        'catches up with the edits made meanwhile, switches the project '
+        'over and removes its data from the old database.  Edits are '
+        'refused for a few seconds at the switch.'
+    )
+
+    def handle(self, *args, **options):
+        """Move the project, reporting each step."""
+        from researcher.shards import move_project
+
+        if len(args) != 2:
+            raise CommandError('Give a project id and a database alias.')
+        try:
+            project = Project.objects.get(pk=int(args[0]))
+        except (ValueError, Project.DoesNotExist):
+            raise CommandError('No project with id %s.' % args[0])
+        try:
+            copied = move_project(project, args[1], self.stdout.write)
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write('%s: %d rows moved to %s' % (
+            project, copied, args[1]
+        ))
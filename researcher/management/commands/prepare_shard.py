@@ -0,0 +1,31 @@
+"""Ready a database to hold projects."""
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Migrate a shard, copy the shared rows to it and set its id range."""
+
+    args = '<alias>'
+    help = (
+        'Migrates one of RESEARCHER_SHARDS, copies the researchers, '
+        'projects, surety schemes and type tables to it, and starts its '
+        'id sequences at its own range.'
+    )
+
+    def handle(self, *args, **options):
+        """Prepare the shard and report what was copied."""
+        from researcher.shards import prepare_shard
+
+        if len(args) != 1:
+            raise CommandError('Give one database alias.')
+        call_command('migrate', database=args[0], interactive=False,
+                     verbosity=0)
+        try:
+            copied = prepare_shard(args[0])
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write('%s: %d shared rows copied' % (args[0], copied))
@@ -0,0 +1,18 @@
+"""Rebuild the participation and membership tables from the assertions."""
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Rebuild the derived tables after bulk changes to assertions."""
+
+    help = (
+        'Rebuilds the event participation and group membership tables '
+        'from the assertions that pair personas with events and groups.'
+    )
+
+    def handle(self, *args, **options):
+        """Rebuild the tables and report their size."""
+        from researcher.participation import rebuild_participation
+
+        self.stdout.write('%d rows' % rebuild_participation())
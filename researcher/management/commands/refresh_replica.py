@@ -0,0 +1,30 @@
+"""Copy a primary database over its local stand-in replica."""
+from django.core.management.base import CommandError
+
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Refresh a stand-in replica for testing replica routing."""
+
+    args = '<alias>'
+    help = (
+        'Replaces a stand-in replica of RESEARCHER_REPLICAS with a copy of '
+        'its primary: a SQLite file, or a PostgreSQL database on the same '
+        'server, created from the primary as a template.'
+    )
+
+    def handle(self, *args, **options):
+        """Copy the primary and say so."""
+        from researcher.replicas import primary_of, refresh_standin
+
+        if len(args) != 1:
+            raise CommandError('Give one replica alias.')
+        try:
+            refresh_standin(args[0])
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write('%s is a copy of %s' % (
+            args[0], primary_of(args[0])
+        ))
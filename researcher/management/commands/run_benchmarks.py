@@ -0,0 +1,117 @@
+"""Time the hot paths and record the results as JSON."""
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+
+class Command(BaseCommand):
+
+    """Run the benchmark suite, optionally on fresh synthetic data."""
+
+    help = (
+        'Times the admin views, rendering, listing, import and export hot '
+        'paths, and writes wall times, query counts and peak memory as '
+        'JSON.  Use a database set aside for benchmarking.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--generate',
+            type='float',
+            dest='scale',
+            default=None,
+            metavar='SCALE',
+            help='First generate a synthetic project of this scale '
+                 '(1.0 is about a million assertions).'
+        ),
+        make_option(
+            '--seed',
+            type='int',
+            dest='seed',
+            default=1,
+            help='The random seed of the synthetic data.'
+        ),
+        make_option(
+            '--only',
+            action='append',
+            dest='names',
+            default=None,
+            metavar='PREFIX',
+            help='Run only benchmarks whose names start with this '
+                 '(may be repeated).'
+        ),
+        make_option(
+            '--repeat',
+            type='int',
+            dest='repeat',
+            default=3,
+            help='Timed runs of each benchmark.'
+        ),
+        make_option(
+            '--output',
+            dest='output',
+            default=None,
+            help='Write the results to this JSON file.'
+        ),
+        make_option(
+            '--compare',
+            dest='compare',
+            default=None,
+            metavar='FILE',
+            help='Compare with the results in this JSON file.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Run the benchmarks and report them."""
+        from researcher.benchmarks import compare, run
+        from researcher.synthetic import generate
+
+        earlier = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as stream:
+                    earlier = json.load(stream)
+            except (IOError, ValueError) as error:
+                raise CommandError('Cannot read %s: %s' % (
+                    options['compare'], error
+                ))
+        project = None
+        if options['scale'] is not None:
+            project, written = generate(options['scale'], options['seed'])
+            self.stdout.write('Generated %s: %s' % (project, ', '.join(
+                '%d %s' % (count, name)
+                for name, count in sorted(written.items())
+            )))
+        # The test client's requests come from a host named testserver.
+        setup_test_environment()
+        results = run(options['names'], options['repeat'], project)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(results, stream, indent=2, sort_keys=True)
+        for name, found in results['benchmarks'].items():
+            self.stdout.write('%-36s %9.4fs %6d queries %6d dup %10d B%s' % (
+                name,
+                found['wall_time']['best'],
+                found['queries']['count'],
+                found['queries']['duplicates'],
+                found['peak_memory'],
+                '  OVER BUDGET of %d' % found['queries']['budget']
+                if found['queries']['over_budget'] else ''
+            ))
+            for storm in found['queries']['storms']:
+                self.stdout.write('    %dx %s' % (storm['count'],
+                                                  storm['sql'][:100]))
+                for origin, times in storm['from']:
+                    self.stdout.write('        %dx from %s' % (times, origin))
+        if earlier is not None:
+            self.stdout.write('')
+            for name, old, new, ratio, old_count, new_count in compare(
+                    earlier, results):
+                self.stdout.write('%-36s %9.4fs -> %9.4fs %6s  %d -> %d '
+                                  'queries' % (
+                                      name, old, new,
+                                      '%.2fx' % ratio if ratio else '-',
+                                      old_count, new_count
+                                  ))
@@ -0,0 +1,77 @@
+"""Run queued background jobs in worker processes."""
+import multiprocessing
+import signal
+from optparse import make_option
+
+from django.db import connections
+
+from researcher.querylog import RecordedCommand
+
+
+def _work(stop, until_empty):
+    """Run jobs in a worker process until told to stop."""
+    from researcher.jobs import work
+
+    # Ctrl-C reaches every process; the parent sets stop for them all.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    work(until_empty=until_empty, stop=stop)
+
+
+class Command(RecordedCommand):
+
+    """Start workers that claim and run queued jobs."""
+
+    help = (
+        'Runs queued jobs (imports, exports, validation) in worker '
+        'processes until interrupted, or with --until-empty until no job '
+        'is waiting.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--processes',
+            type='int',
+            dest='processes',
+            default=1,
+            help='Worker processes to start.'
+        ),
+        make_option(
+            '--until-empty',
+            action='store_true',
+            dest='until_empty',
+            default=False,
+            help='Stop once no job is waiting.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Start the workers and wait for them."""
+        from researcher.jobs import work
+
+        stop = multiprocessing.Event()
+
+        def finish(number, frame):
+            """Stop taking jobs, but finish the running ones."""
+            self.stderr.write('Stopping after the running jobs...')
+            stop.set()
+
+        signal.signal(signal.SIGINT, finish)
+        signal.signal(signal.SIGTERM, finish)
+        if options['processes'] < 2:
+            work(until_empty=options['until_empty'], stop=stop)
+            return
+        # Forked workers must open their own connections.
+        for connection in connections.all():
+            connection.close()
+        # Not daemons: tasks such as validation start processes of their own.
+        workers = [
+            multiprocessing.Process(
+                target=_work,
+                args=(stop, options['until_empty'])
+            )
+            for number in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
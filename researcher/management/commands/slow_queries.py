@@ -0,0 +1,82 @@
+"""Report the slowest logged queries and the indexes they lack."""
+from optparse import make_option
+
+from researcher.querylog import RecordedCommand
+
+
+class Command(RecordedCommand):
+
+    """Explain the top slow statements and suggest migrations for them."""
+
+    help = (
+        'Groups the statements in the slow-query log, explains the ones '
+        'that took most time, and suggests indexes for the tables they '
+        'read in full.'
+    )
+    option_list = RecordedCommand.option_list + (
+        make_option(
+            '--top',
+            type='int',
+            dest='top',
+            default=10,
+            help='How many statements to report.'
+        ),
+        make_option(
+            '--analyze',
+            action='store_true',
+            dest='analyze',
+            default=False,
+            help='Run EXPLAIN ANALYZE on PostgreSQL (the statements run, '
+                 'then are rolled back).'
+        ),
+        make_option(
+            '--log',
+            dest='log',
+            default=None,
+            help='Read this log instead of RESEARCHER_SLOW_QUERY_LOG.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Print the offenders, their plans and the suggested operations."""
+        from researcher.slowqueries import (
+            explain,
+            offenders,
+            operations,
+            suggest,
+        )
+
+        found = offenders(options['log'], options['top'])
+        if not found:
+            self.stdout.write('No slow queries logged.')
+            return
+        suggestions = []
+        for rank, offender in enumerate(found, 1):
+            self.stdout.write(
+                '%d. %d runs, %.1f ms in all, %.1f ms at most' % (
+                    rank, offender.count, offender.total_ms, offender.max_ms
+                )
+            )
+            self.stdout.write('   %s' % offender.signature[:300])
+            for origin, runs in offender.origins:
+                self.stdout.write('   %dx from %s' % (runs, origin))
+            plan = explain(offender, options['analyze'])
+            if plan is None:
+                self.stdout.write(
+                    '   (not explained: the database cannot be, or its '
+                    'parameters were not logged)'
+                )
+                continue
+            for line in plan.lines:
+                self.stdout.write('     %s' % line)
+            for suggestion in suggest(offender, plan):
+                self.stdout.write('   missing index: %s' % suggestion)
+                if suggestion not in suggestions:
+                    suggestions.append(suggestion)
+        written = operations(suggestions)
+        if written:
+            self.stdout.write('')
+            self.stdout.write('Operations for a new researcher migration:')
+            for source in written:
+                self.stdout.write('')
+                self.stdout.write(source)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0007_auto_20150109_2221'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='comments',
+            field=models.TextField(verbose_name='comments', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='description',
+            field=models.TextField(verbose_name='description'),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='priority',
+            field=models.PositiveSmallIntegerField(verbose_name='priority'),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='researcher',
+            field=models.ForeignKey(verbose_name='researcher', to='researcher.Researcher'),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='status',
+            field=models.CharField(verbose_name='status', max_length=64),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='surety_scheme',
+            field=models.ForeignKey(verbose_name='surety scheme used by the project', blank=True, null=True, to='researcher.SuretyScheme'),
+            preserve_default=True,
+        ),
+    ]
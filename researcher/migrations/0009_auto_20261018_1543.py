@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0008_alter_activity_project'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assertion',
+            name='subject1',
+            field=models.IntegerField(verbose_name='id of subject 1', default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='assertion',
+            name='subject1_type',
+            field=models.CharField(verbose_name='type of first assertion subject', max_length=1, default='P', choices=[('P', 'Persona'), ('E', 'Event'), ('C', 'Characteristic'), ('G', 'Group')]),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='assertion',
+            name='subject2',
+            field=models.IntegerField(verbose_name='id of subject 2', default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='assertion',
+            name='subject2_type',
+            field=models.CharField(verbose_name='type of second assertion subject', max_length=1, default='P', choices=[('P', 'Persona'), ('E', 'Event'), ('C', 'Characteristic'), ('G', 'Group')]),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='assertion',
+            name='value_role',
+            field=models.CharField(verbose_name='value of object in the assertion', max_length=64, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='assertion',
+            index_together=set([('subject1_type', 'subject1'), ('subject2_type', 'subject2')]),
+        ),
+    ]
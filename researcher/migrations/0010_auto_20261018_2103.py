@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0009_auto_20261018_1543'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InbreedingCoefficient',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('coefficient', models.FloatField(verbose_name='inbreeding coefficient')),
+                ('computed', models.DateTimeField(auto_now=True, verbose_name='when computed')),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+                ('project', models.ForeignKey(to='researcher.Project', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='KinshipCoefficient',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('coefficient', models.FloatField(verbose_name='kinship coefficient')),
+                ('computed', models.DateTimeField(auto_now=True, verbose_name='when computed')),
+                ('persona1', models.ForeignKey(to='researcher.Persona', related_name='+')),
+                ('persona2', models.ForeignKey(to='researcher.Persona', related_name='+')),
+                ('project', models.ForeignKey(to='researcher.Project', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='kinshipcoefficient',
+            unique_together=set([('project', 'persona1', 'persona2')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='inbreedingcoefficient',
+            unique_together=set([('project', 'persona')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='inbreedingcoefficient',
+            index_together=set([('project', 'coefficient')]),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def rebuild(apps, schema_editor):
+    """Fill the table from the assertions already stored."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    EventParticipation = apps.get_model('researcher', 'EventParticipation')
+    rows = Assertion.objects.filter(
+        models.Q(subject1_type='P', subject2_type='E') |
+        models.Q(subject1_type='E', subject2_type='P')
+    ).values_list(
+        'pk', 'subject1_type', 'subject1', 'subject2', 'value_role',
+        'surety_scheme_part_id', 'disproved'
+    )
+    EventParticipation.objects.bulk_create(
+        [
+            EventParticipation(
+                assertion_id=pk,
+                persona_id=subject1 if subject1_type == 'P' else subject2,
+                event_id=subject2 if subject1_type == 'P' else subject1,
+                role=role,
+                surety_scheme_part_id=surety,
+                disproved=disproved
+            )
+            for pk, subject1_type, subject1, subject2, role, surety, disproved
+            in rows.iterator()
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0010_auto_20261018_2103'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventParticipation',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=64, blank=True, verbose_name='role in the event')),
+                ('disproved', models.BooleanField(default=False)),
+                ('assertion', models.OneToOneField(to='researcher.Assertion', related_name='+')),
+                ('event', models.ForeignKey(to='researcher.Event', related_name='+')),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+                ('surety_scheme_part', models.ForeignKey(to='researcher.SuretySchemePart', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='eventparticipation',
+            index_together=set([('event', 'role', 'disproved'), ('persona', 'role', 'disproved')]),
+        ),
+        migrations.RunPython(rebuild, migrations.RunPython.noop),
+    ]
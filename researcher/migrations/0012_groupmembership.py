@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def rebuild(apps, schema_editor):
+    """Fill the table from the assertions already stored."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    Group = apps.get_model('researcher', 'Group')
+    GroupMembership = apps.get_model('researcher', 'GroupMembership')
+    dates = dict(
+        (pk, (start, end)) for pk, start, end in
+        Group.objects.values_list('pk', 'date_start', 'date_end').iterator()
+    )
+    rows = Assertion.objects.filter(
+        models.Q(subject1_type='P', subject2_type='G') |
+        models.Q(subject1_type='G', subject2_type='P')
+    ).values_list(
+        'pk', 'subject1_type', 'subject1', 'subject2', 'value_role',
+        'surety_scheme_part_id', 'disproved'
+    )
+    memberships = []
+    for pk, subject1_type, subject1, subject2, role, surety, disproved in \
+            rows.iterator():
+        if subject1_type == 'P':
+            persona, group = subject1, subject2
+        else:
+            persona, group = subject2, subject1
+        if group in dates:
+            memberships.append(GroupMembership(
+                assertion_id=pk,
+                persona_id=persona,
+                group_id=group,
+                role=role,
+                date_start=dates[group][0],
+                date_end=dates[group][1],
+                surety_scheme_part_id=surety,
+                disproved=disproved
+            ))
+    GroupMembership.objects.bulk_create(memberships, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0011_eventparticipation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupMembership',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=64, blank=True, verbose_name='role in the group')),
+                ('date_start', models.DateField(verbose_name='group start date')),
+                ('date_end', models.DateField(verbose_name='group end date')),
+                ('disproved', models.BooleanField(default=False)),
+                ('assertion', models.OneToOneField(to='researcher.Assertion', related_name='+')),
+                ('group', models.ForeignKey(to='researcher.Group', related_name='+')),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+                ('surety_scheme_part', models.ForeignKey(to='researcher.SuretySchemePart', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='groupmembership',
+            index_together=set([('group', 'role', 'persona'), ('persona', 'date_start', 'date_end')]),
+        ),
+        migrations.RunPython(rebuild, migrations.RunPython.noop),
+    ]
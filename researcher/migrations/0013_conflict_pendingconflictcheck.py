@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0012_groupmembership'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conflict',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=1, choices=[('E', 'Events'), ('C', 'Characteristics'), ('L', 'Parents')], verbose_name='kind of group')),
+                ('key', models.CharField(max_length=64, verbose_name='group')),
+                ('rule', models.CharField(max_length=64, verbose_name='rule that found the conflict')),
+                ('description', models.TextField(verbose_name='what disagrees')),
+                ('detected', models.DateTimeField(auto_now_add=True, verbose_name='when detected')),
+                ('assertions', models.ManyToManyField(to='researcher.Assertion', related_name='+')),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='conflict',
+            index_together=set([('persona', 'kind'), ('rule', 'detected')]),
+        ),
+        migrations.CreateModel(
+            name='PendingConflictCheck',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=1, choices=[('E', 'Events'), ('C', 'Characteristics'), ('L', 'Parents')], verbose_name='kind of group')),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pendingconflictcheck',
+            unique_together=set([('persona', 'kind')]),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0013_conflict_pendingconflictcheck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SanityProblem',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('rule', models.CharField(max_length=64, verbose_name='rule that found the problem')),
+                ('description', models.TextField(verbose_name='what cannot have happened')),
+                ('detected', models.DateTimeField(auto_now_add=True, verbose_name='when detected')),
+                ('event', models.ForeignKey(to='researcher.Event', related_name='+', blank=True, null=True)),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='sanityproblem',
+            index_together=set([('persona', 'rule'), ('rule', 'detected')]),
+        ),
+        migrations.CreateModel(
+            name='PendingSanityCheck',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('persona', models.OneToOneField(to='researcher.Persona', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
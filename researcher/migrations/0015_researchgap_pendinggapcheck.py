@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0014_sanityproblem_pendingsanitycheck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResearchGap',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('gap', models.CharField(max_length=8, choices=[('birth', 'No birth'), ('death', 'No death'), ('parents', 'No parents'), ('sources', 'Too few sources'), ('surety', 'No sure assertion')], verbose_name='what is missing')),
+                ('detail', models.CharField(max_length=128, verbose_name='how it was found wanting')),
+                ('found', models.DateTimeField(auto_now_add=True, verbose_name='when found')),
+                ('objective', models.ForeignKey(to='researcher.ResearchObjective', related_name='+', blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL)),
+                ('persona', models.ForeignKey(to='researcher.Persona', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='researchgap',
+            unique_together=set([('persona', 'gap')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='researchgap',
+            index_together=set([('gap', 'persona')]),
+        ),
+        migrations.CreateModel(
+            name='PendingGapCheck',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('persona', models.OneToOneField(to='researcher.Persona', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
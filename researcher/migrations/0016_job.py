@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0015_researchgap_pendinggapcheck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=64, verbose_name='task name')),
+                ('arguments', models.TextField(default='{}', verbose_name='task arguments')),
+                ('status', models.CharField(max_length=9, default='queued', choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], verbose_name='status')),
+                ('priority', models.SmallIntegerField(default=0, verbose_name='priority')),
+                ('run_after', models.DateTimeField(verbose_name='do not start before')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts made')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3, verbose_name='attempts allowed')),
+                ('progress', models.FloatField(default=0, verbose_name='progress')),
+                ('progress_message', models.CharField(max_length=255, blank=True, verbose_name='what it is doing')),
+                ('cancel_requested', models.BooleanField(default=False, verbose_name='cancel requested')),
+                ('result', models.TextField(blank=True, verbose_name='result')),
+                ('error', models.TextField(blank=True, verbose_name='last error')),
+                ('worker', models.CharField(max_length=128, blank=True, verbose_name='worker')),
+                ('heartbeat', models.DateTimeField(blank=True, null=True, verbose_name='last heartbeat')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='when queued')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='when started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='when finished')),
+                ('researcher', models.ForeignKey(to='researcher.Researcher', related_name='+', blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('status', 'priority', 'run_after'), ('status', 'heartbeat')]),
+        ),
+    ]
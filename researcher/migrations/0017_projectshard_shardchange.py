@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0016_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectShard',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=64, verbose_name='database alias')),
+                ('state', models.CharField(max_length=7, default='active', choices=[('active', 'Active'), ('copying', 'Copying to another database'), ('frozen', 'Frozen for the last of a move')], verbose_name='state')),
+                ('target', models.CharField(max_length=64, blank=True, verbose_name='moving to')),
+                ('changed', models.DateTimeField(auto_now=True, verbose_name='when changed')),
+                ('project', models.OneToOneField(to='researcher.Project', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='ShardChange',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64, verbose_name='model name')),
+                ('object_id', models.IntegerField(verbose_name='row id')),
+                ('project', models.ForeignKey(to='researcher.Project', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
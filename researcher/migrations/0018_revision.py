@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0017_projectshard_shardchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Revision',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=32, verbose_name='model name')),
+                ('object_id', models.IntegerField(verbose_name='row id')),
+                ('version', models.PositiveIntegerField(verbose_name='revision number')),
+                ('full', models.BooleanField(default=False, verbose_name='holds every field')),
+                ('deleted', models.BooleanField(default=False, verbose_name='row deleted')),
+                ('delta', models.TextField(verbose_name='changed fields')),
+                ('valid_from', models.DateTimeField(verbose_name='valid from')),
+                ('valid_to', models.DateTimeField(blank=True, null=True, verbose_name='valid until')),
+                ('researcher', models.ForeignKey(to='researcher.Researcher', related_name='+', blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='revision',
+            unique_together=set([('model', 'object_id', 'version')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='revision',
+            index_together=set([('model', 'valid_from'), ('model', 'valid_to')]),
+        ),
+    ]
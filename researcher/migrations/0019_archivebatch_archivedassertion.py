@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher', '0018_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveBatch',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='when archived')),
+                ('assertions', models.PositiveIntegerField(verbose_name='assertions held')),
+                ('links', models.PositiveIntegerField(verbose_name='links held')),
+                ('data', models.BinaryField(blank=True, null=True, verbose_name='compressed rows')),
+                ('path', models.CharField(max_length=255, blank=True, verbose_name='archive file')),
+                ('size', models.PositiveIntegerField(verbose_name='compressed size')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='ArchivedAssertion',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False, verbose_name='assertion id')),
+                ('source', models.IntegerField(blank=True, null=True, db_index=True, verbose_name='id of cited source')),
+                ('subject1_type', models.CharField(max_length=1, choices=[('P', 'Persona'), ('E', 'Event'), ('C', 'Characteristic'), ('G', 'Group')], verbose_name='type of first assertion subject')),
+                ('subject1', models.IntegerField(verbose_name='id of subject 1')),
+                ('subject2_type', models.CharField(max_length=1, choices=[('P', 'Persona'), ('E', 'Event'), ('C', 'Characteristic'), ('G', 'Group')], verbose_name='type of second assertion subject')),
+                ('subject2', models.IntegerField(verbose_name='id of subject 2')),
+                ('batch', models.ForeignKey(to='researcher.ArchiveBatch', related_name='stubs')),
+                ('researcher', models.ForeignKey(to='researcher.Researcher', related_name='+')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedassertion',
+            index_together=set([('subject1_type', 'subject1'), ('subject2_type', 'subject2')]),
+        ),
+    ]
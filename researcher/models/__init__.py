@@ -3,3 +3,8 @@
 from researcher.models.administrative import *
 from researcher.models.conclusions import *
 from researcher.models.evidence import *
+from researcher.models.derived import *
+from researcher.models.jobs import *
+from researcher.models.shards import *
+from researcher.models.history import *
+from researcher.models.archive import *
@@ -0,0 +1,105 @@
+"""Create the researcher models holding archived assertions.
+
+Exports:
+    Classes:
+        ArchiveBatch
+        ArchivedAssertion
+"""
+from django.db import models
+
+from researcher.models.conclusions import ASSERTION_SUBJECT_TYPES
+
+
+# Archive Models
+class ArchiveBatch(models.Model):
+
+    """Assertions and links moved out of the live tables together.
+
+    researcher.archive moves disproved assertions that nothing live
+    reasons from, with the AssertionAssertion rows between them, into
+    batches.  A batch holds its rows as compressed JSON, first in the
+    database and later, once it is old enough, in a file under
+    RESEARCHER_ARCHIVE_DIR.
+
+    Instance Variables:
+        created -- When the rows were archived.
+        assertions -- How many assertions the batch holds.
+        links -- How many assertion links the batch holds.
+        data -- The compressed rows, while kept in the database.
+        path -- The file holding the compressed rows, once moved there.
+        size -- The size of the compressed rows in bytes.
+    """
+
+    created = models.DateTimeField('when archived', auto_now_add=True)
+    assertions = models.PositiveIntegerField('assertions held')
+    links = models.PositiveIntegerField('links held')
+    data = models.BinaryField('compressed rows', blank=True, null=True)
+    path = models.CharField('archive file', max_length=255, blank=True)
+    size = models.PositiveIntegerField('compressed size')
+
+    def __str__(self):
+        """Stringify the batch.
+
+        Arguments:
+            self
+        Returns: the batch id and how many rows it holds
+        """
+        return 'archive %d (%d assertions, %d links)' % (
+            self.pk, self.assertions, self.links
+        )
+
+
+class ArchivedAssertion(models.Model):
+
+    """The stub left behind by an archived assertion.
+
+    Keeps the assertion's id and what it is about, so that archived
+    reasoning can be found and brought back.  The rest of the assertion
+    is in its batch.
+
+    Instance Variables:
+        id -- The id the assertion had, and gets back when restored.
+        batch -- (foreign key) The batch holding the assertion.
+        researcher -- (foreign key) The researcher who made it.
+        source -- The id of the source it cited, if any.
+        subject1_type -- The type of its first subject.
+        subject1 -- The id of its first subject.
+        subject2_type -- The type of its second subject.
+        subject2 -- The id of its second subject.
+    """
+
+    id = models.IntegerField('assertion id', primary_key=True)
+    batch = models.ForeignKey(ArchiveBatch, related_name='stubs')
+    researcher = models.ForeignKey('Researcher', related_name='+')
+    source = models.IntegerField('id of cited source', blank=True,
+                                 null=True, db_index=True)
+    subject1_type = models.CharField(
+        'type of first assertion subject',
+        max_length=1,
+        choices=ASSERTION_SUBJECT_TYPES
+    )
+    subject1 = models.IntegerField('id of subject 1')
+    subject2_type = models.CharField(
+        'type of second assertion subject',
+        max_length=1,
+        choices=ASSERTION_SUBJECT_TYPES
+    )
+    subject2 = models.IntegerField('id of subject 2')
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['subject1_type', 'subject1'],
+            ['subject2_type', 'subject2'],
+        ]
+
+    def __str__(self):
+        """Stringify the stub.
+
+        Arguments:
+            self
+        Returns: the assertion id and its batch
+        """
+        return 'assertion %d in archive %d' % (self.pk, self.batch_id)
@@ -20,6 +20,9 @@ Exports:
 """
 from django.db import models
 
+from researcher.loaders import load_persona_assertions, load_subject
+from researcher.lookups import lookup
+
 
 # Conclusions Models
 ASSERTION_SUBJECT_TYPES = (
@@ -126,22 +129,57 @@ class Assertion(models.Model):
         'type of first assertion subject',
         max_length=1,
         choices=ASSERTION_SUBJECT_TYPES
-    ),
-    subject1 = models.IntegerField('id of subject 1'),
+    )
+    subject1 = models.IntegerField('id of subject 1')
     subject2_type = models.CharField(
         'type of second assertion subject',
         max_length=1,
         choices=ASSERTION_SUBJECT_TYPES
-    ),
-    subject2 = models.IntegerField('id of subject 2'),
+    )
+    subject2 = models.IntegerField('id of subject 2')
     value_role = models.CharField(
         'value of object in the assertion',
         max_length=64,
         blank=True
-    ),
+    )
     rationale = models.TextField('basis for the assertion')
     disproved = models.BooleanField(default=False)
 
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['subject1_type', 'subject1'],
+            ['subject2_type', 'subject2'],
+        ]
+
+    def get_subject1(self):
+        """Fetch the first subject of the assertion.
+
+        Within a loader context (see researcher.loaders) the subjects of
+        a page of assertions are fetched together and remembered.
+
+        Arguments:
+            self
+        Returns: the Persona, Event, Characteristic or Group, or None if
+            it no longer exists
+        """
+        return load_subject(self.subject1_type, self.subject1)
+
+    def get_subject2(self):
+        """Fetch the second subject of the assertion.
+
+        Within a loader context (see researcher.loaders) the subjects of
+        a page of assertions are fetched together and remembered.
+
+        Arguments:
+            self
+        Returns: the Persona, Event, Characteristic or Group, or None if
+            it no longer exists
+        """
+        return load_subject(self.subject2_type, self.subject2)
+
 
 class AssertionAssertion(models.Model):
 
@@ -228,6 +266,18 @@ class Persona(models.Model):
     name = models.CharField('name of the person', max_length=256)
     description_comments = models.TextField('about this person')
 
+    def assertions(self):
+        """Find the assertions that name this persona as a subject.
+
+        Within a loader context (see researcher.loaders) they are
+        fetched once per request.
+
+        Arguments:
+            self
+        Returns: a list of Assertions in id order
+        """
+        return load_persona_assertions(self.pk)
+
     def __str__(self):
         """Stringify the persona.
 
@@ -414,6 +464,32 @@ class Characteristic(models.Model):
         choices=SORT_ORDER_CHOICES
     )
 
+    def __str__(self):
+        """Stringify the characteristic.
+
+        Arguments:
+            self
+        Returns: the names of the characteristic parts, in order
+        """
+        return " ".join([p.name for p in self.ordered_characteristic_parts()])
+
+    def ordered_characteristic_parts(self):
+        """List the characteristic parts in display order.
+
+        Sorted here rather than with order_by() so that parts loaded in
+        advance (see researcher.loaders) are used without a query.
+
+        Arguments:
+            self
+        Returns: the CharacteristicParts sorted by sequence number
+        """
+        # pylint: disable=E1101
+        return sorted(
+            self.characteristicpart_set.all(),
+            key=lambda p: p.sequence_number,
+            reverse=self.sort_order == 'D'
+        )
+
 
 class CharacteristicPart(models.Model):
 
@@ -473,6 +549,13 @@ class CharacteristicPart(models.Model):
         """
         return self.name
 
+    @property
+    def characteristic_part_type_name(self):
+        """The name of the characteristic part type, without a query."""
+        return lookup('CharacteristicPartType').get(
+            self.characteristic_part_type_id
+        ).name
+
 
 class CharacteristicPartType(models.Model):
 
@@ -730,15 +813,40 @@ class Place(models.Model):
             self
         Returns: the name of the place part
         """
+        return ", ".join([p.name for p in self.ordered_place_parts()])
+
+    def ordered_place_parts(self):
+        """List the place parts in display order.
+
+        Sorted here rather than with order_by() so that parts loaded in
+        advance (see researcher.loaders) are used without a query.
+
+        Arguments:
+            self
+        Returns: the PlaceParts sorted by sequence number
+        """
         # pylint: disable=E1101
-        orderby = 'sequence_number'
+        return sorted(
+            self.placepart_set.all(),
+            key=lambda p: p.sequence_number,
+            reverse=self.sort_order == 'D'
+        )
 
-        if self.sort_order == 'D':
-            orderby = '-' + orderby
+    def labelled_parts(self):
+        """List the place parts with the names of their types.
 
-        ordered_place_parts = self.placepart_set.order_by(orderby)
+        The type names come from the in-memory lookup table, so this
+        costs a single query for the place parts, or none if they were
+        loaded in advance.
 
-        return ", ".join([p.name for p in ordered_place_parts])
+        Arguments:
+            self
+        Returns: (place part type name, place part name) pairs in order
+        """
+        return [
+            (p.place_part_type_name, p.name)
+            for p in self.ordered_place_parts()
+        ]
 
 
 class PlacePart(models.Model):
@@ -805,6 +913,11 @@ class PlacePart(models.Model):
         """
         return self.name
 
+    @property
+    def place_part_type_name(self):
+        """The name of the place part type, without a query."""
+        return lookup('PlacePartType').get(self.place_part_type_id).name
+
 
 class PlacePartType(models.Model):
 
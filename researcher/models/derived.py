@@ -0,0 +1,425 @@
+"""Create the researcher derived data models.
+
+These tables hold results computed from the conclusions, so that they
+can be queried and reported on without computing them again.  They can
+be rebuilt from the other tables at any time.
+
+Exports:
+    Classes:
+        Conflict
+        EventParticipation
+        GroupMembership
+        InbreedingCoefficient
+        KinshipCoefficient
+        PendingConflictCheck
+        PendingGapCheck
+        PendingSanityCheck
+        ResearchGap
+        SanityProblem
+"""
+from django.db import models
+
+CONFLICT_KINDS = (
+    ('E', 'Events'),
+    ('C', 'Characteristics'),
+    ('L', 'Parents'),
+)
+
+GAPS = (
+    ('birth', 'No birth'),
+    ('death', 'No death'),
+    ('parents', 'No parents'),
+    ('sources', 'Too few sources'),
+    ('surety', 'No sure assertion'),
+)
+
+
+# Derived Models
+class KinshipCoefficient(models.Model):
+
+    """The kinship coefficient of two personas in a project.
+
+    The probability that an allele drawn at random from one persona and
+    one drawn from the other are identical by descent, computed from the
+    parent/child links the project's assertions support.  Only the pairs
+    somebody asked about are stored.
+
+    Instance Variables:
+        project -- (foreign key) The project whose assertions were used.
+        persona1 -- (foreign key) The persona with the lower id.
+        persona2 -- (foreign key) The persona with the higher (or the
+            same) id.
+        coefficient -- The kinship coefficient, from 0 to 1.
+        computed -- When the coefficient was computed.
+    """
+
+    project = models.ForeignKey('Project', related_name='+')
+    persona1 = models.ForeignKey('Persona', related_name='+')
+    persona2 = models.ForeignKey('Persona', related_name='+')
+    coefficient = models.FloatField('kinship coefficient')
+    computed = models.DateTimeField('when computed', auto_now=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        unique_together = [['project', 'persona1', 'persona2']]
+
+    def __str__(self):
+        """Stringify the kinship coefficient.
+
+        Arguments:
+            self
+        Returns: the two persona ids and the coefficient
+        """
+        return '%d ~ %d: %.6f' % (
+            self.persona1_id,
+            self.persona2_id,
+            self.coefficient
+        )
+
+
+class InbreedingCoefficient(models.Model):
+
+    """The inbreeding coefficient of a persona in a project.
+
+    The kinship coefficient of the persona's parents: the probability
+    that the two alleles the persona carries at a locus are identical by
+    descent.  Every persona in the project's family network gets one;
+    those with unrelated or unknown parents get 0.
+
+    Instance Variables:
+        project -- (foreign key) The project whose assertions were used.
+        persona -- (foreign key) The persona.
+        coefficient -- The inbreeding coefficient, from 0 to 1.
+        computed -- When the coefficient was computed.
+    """
+
+    project = models.ForeignKey('Project', related_name='+')
+    persona = models.ForeignKey('Persona', related_name='+')
+    coefficient = models.FloatField('inbreeding coefficient')
+    computed = models.DateTimeField('when computed', auto_now=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        unique_together = [['project', 'persona']]
+        index_together = [['project', 'coefficient']]
+
+    def __str__(self):
+        """Stringify the inbreeding coefficient.
+
+        Arguments:
+            self
+        Returns: the persona id and the coefficient
+        """
+        return '%d: %.6f' % (self.persona_id, self.coefficient)
+
+
+class EventParticipation(models.Model):
+
+    """A persona's part in an event, as one assertion states it.
+
+    An assertion pairing a persona with an event says that the persona
+    took part, with the role in its value_role ("Groom", "Witness").
+    Each such assertion has one row here, kept current as assertions
+    are saved (see researcher.participation), so that the participants
+    of an event or the events of a persona are one indexed query.
+
+    Instance Variables:
+        assertion -- (foreign key) The assertion stating the part.
+        persona -- (foreign key) The persona taking part.
+        event -- (foreign key) The event taken part in.
+        role -- The assertion's value_role.
+        surety_scheme_part -- (foreign key) The assertion's surety.
+        disproved -- Whether the assertion is disproved.
+    """
+
+    assertion = models.OneToOneField('Assertion', related_name='+')
+    persona = models.ForeignKey('Persona', related_name='+')
+    event = models.ForeignKey('Event', related_name='+')
+    role = models.CharField('role in the event', max_length=64, blank=True)
+    surety_scheme_part = models.ForeignKey(
+        'SuretySchemePart',
+        related_name='+'
+    )
+    disproved = models.BooleanField(default=False)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['event', 'role', 'disproved'],
+            ['persona', 'role', 'disproved'],
+        ]
+
+    def __str__(self):
+        """Stringify the participation.
+
+        Arguments:
+            self
+        Returns: the persona id, role and event id
+        """
+        return '%d %s in %d' % (
+            self.persona_id,
+            self.role or '(no role)',
+            self.event_id
+        )
+
+
+class GroupMembership(models.Model):
+
+    """A persona's membership of a group, as one assertion states it.
+
+    An assertion pairing a persona with a group says that the persona
+    belonged to it, with the GroupTypeRole named in its value_role
+    ("Head", "Private").  Each such assertion has one row here, carrying
+    the group's dates so that membership at a date needs no join, and
+    kept current as assertions and groups are saved (see
+    researcher.participation).
+
+    Instance Variables:
+        assertion -- (foreign key) The assertion stating the membership.
+        persona -- (foreign key) The member.
+        group -- (foreign key) The group.
+        role -- The assertion's value_role.
+        date_start -- The group's start date.
+        date_end -- The group's end date.
+        surety_scheme_part -- (foreign key) The assertion's surety.
+        disproved -- Whether the assertion is disproved.
+    """
+
+    assertion = models.OneToOneField('Assertion', related_name='+')
+    persona = models.ForeignKey('Persona', related_name='+')
+    group = models.ForeignKey('Group', related_name='+')
+    role = models.CharField('role in the group', max_length=64, blank=True)
+    date_start = models.DateField('group start date')
+    date_end = models.DateField('group end date')
+    surety_scheme_part = models.ForeignKey(
+        'SuretySchemePart',
+        related_name='+'
+    )
+    disproved = models.BooleanField(default=False)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['group', 'role', 'persona'],
+            ['persona', 'date_start', 'date_end'],
+        ]
+
+    def __str__(self):
+        """Stringify the membership.
+
+        Arguments:
+            self
+        Returns: the persona id, role and group id
+        """
+        return '%d %s of %d' % (
+            self.persona_id,
+            self.role or '(no role)',
+            self.group_id
+        )
+
+
+class Conflict(models.Model):
+
+    """Assertions about a persona that cannot all be right.
+
+    Found by the rules in researcher.conflicts, which look at a
+    persona's assertions a group at a time: the events of one type, the
+    characteristics of one part type, or the parents.  The rows for a
+    persona and kind of group are replaced whenever the group is checked
+    again.
+
+    Instance Variables:
+        persona -- (foreign key) The persona the assertions are about.
+        kind -- The kind of group: events, characteristics or parents.
+        key -- The group within the kind, e.g. the event type name.
+        rule -- The name of the rule that found the conflict.
+        description -- What disagrees.
+        assertions -- (many to many) The assertions that disagree.
+        detected -- When the conflict was found.
+    """
+
+    persona = models.ForeignKey('Persona', related_name='+')
+    kind = models.CharField(
+        'kind of group',
+        max_length=1,
+        choices=CONFLICT_KINDS
+    )
+    key = models.CharField('group', max_length=64)
+    rule = models.CharField('rule that found the conflict', max_length=64)
+    description = models.TextField('what disagrees')
+    assertions = models.ManyToManyField('Assertion', related_name='+')
+    detected = models.DateTimeField('when detected', auto_now_add=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['persona', 'kind'],
+            ['rule', 'detected'],
+        ]
+
+    def __str__(self):
+        """Stringify the conflict.
+
+        Arguments:
+            self
+        Returns: the persona id and the description
+        """
+        return '%d: %s' % (self.persona_id, self.description)
+
+
+class PendingConflictCheck(models.Model):
+
+    """A group of a persona's assertions waiting to be checked.
+
+    Saving an assertion, event, group or characteristic part queues the
+    groups it may change; researcher.conflicts.check_pending works
+    through the queue.
+
+    Instance Variables:
+        persona -- (foreign key) The persona.
+        kind -- The kind of group to check.
+    """
+
+    persona = models.ForeignKey('Persona', related_name='+')
+    kind = models.CharField(
+        'kind of group',
+        max_length=1,
+        choices=CONFLICT_KINDS
+    )
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        unique_together = [['persona', 'kind']]
+
+
+class SanityProblem(models.Model):
+
+    """Something a persona's assertions say that cannot have happened.
+
+    Found by the rules in researcher.sanity: a death before the birth, a
+    birth after the mother's death, an event outside its place's
+    existence.  A persona's rows are replaced whenever it is checked
+    again.
+
+    Instance Variables:
+        persona -- (foreign key) The persona the problem is about.
+        rule -- The name of the rule that found the problem.
+        description -- What cannot have happened.
+        event -- (foreign key) The event at fault, if there is one.
+        detected -- When the problem was found.
+    """
+
+    persona = models.ForeignKey('Persona', related_name='+')
+    rule = models.CharField('rule that found the problem', max_length=64)
+    description = models.TextField('what cannot have happened')
+    event = models.ForeignKey(
+        'Event',
+        related_name='+',
+        blank=True,
+        null=True
+    )
+    detected = models.DateTimeField('when detected', auto_now_add=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['persona', 'rule'],
+            ['rule', 'detected'],
+        ]
+
+    def __str__(self):
+        """Stringify the problem.
+
+        Arguments:
+            self
+        Returns: the persona id and the description
+        """
+        return '%d: %s' % (self.persona_id, self.description)
+
+
+class PendingSanityCheck(models.Model):
+
+    """A persona waiting to be checked by the sanity rules.
+
+    Saving an assertion, event, place or source queues the personas it
+    concerns; researcher.sanity.check_pending works through the queue.
+
+    Instance Variables:
+        persona -- (foreign key) The persona.
+    """
+
+    persona = models.OneToOneField('Persona', related_name='+')
+
+
+class ResearchGap(models.Model):
+
+    """Something missing from what is known about a persona.
+
+    Found by researcher.gaps: no birth, no death, no parents, too few
+    sources or no sure assertion.  A row lasts as long as the gap is
+    open, so the research objective made for it stays attached.
+
+    Instance Variables:
+        persona -- (foreign key) The persona.
+        gap -- What is missing.
+        detail -- How it was found wanting, e.g. "Cited by 1 source".
+        objective -- (foreign key) The research objective made to fill
+            the gap, if there is one.
+        found -- When the gap was first found.
+    """
+
+    persona = models.ForeignKey('Persona', related_name='+')
+    gap = models.CharField('what is missing', max_length=8, choices=GAPS)
+    detail = models.CharField('how it was found wanting', max_length=128)
+    objective = models.ForeignKey(
+        'ResearchObjective',
+        related_name='+',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    found = models.DateTimeField('when found', auto_now_add=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        unique_together = [['persona', 'gap']]
+        index_together = [['gap', 'persona']]
+
+    def __str__(self):
+        """Stringify the gap.
+
+        Arguments:
+            self
+        Returns: the persona id and the detail
+        """
+        return '%d: %s' % (self.persona_id, self.detail)
+
+
+class PendingGapCheck(models.Model):
+
+    """A persona waiting to have its research gaps refreshed.
+
+    Saving an assertion or event queues the personas it concerns;
+    researcher.gaps.check_pending works through the queue.
+
+    Instance Variables:
+        persona -- (foreign key) The persona.
+    """
+
+    persona = models.OneToOneField('Persona', related_name='+')
@@ -12,6 +12,8 @@ Exports:
 """
 from django.db import models
 
+from researcher.lookups import lookup
+
 
 # Evidence Models
 class Source(models.Model):
@@ -172,6 +174,33 @@ class Source(models.Model):
         blank=True
     )
 
+    def citation(self):
+        """Assemble the citation for this level of the source.
+
+        The part type names come from the in-memory lookup table, so
+        this costs a single query for the citation parts, or none if
+        they were loaded in advance.
+
+        Arguments:
+            self
+        Returns: the citation parts as "type: value" joined by "; "
+        """
+        # pylint: disable=E1101
+        return self.format_citation(self.citationpart_set.all())
+
+    @staticmethod
+    def format_citation(parts):
+        """Assemble a citation from a source level's citation parts.
+
+        Arguments:
+            parts -- the CitationParts, in any order
+        Returns: the citation parts as "type: value" joined by "; "
+        """
+        return "; ".join([
+            "%s: %s" % (part.citation_part_type_name, part.value)
+            for part in sorted(parts, key=lambda p: p.pk)
+        ])
+
 
 class Repository(models.Model):
 
@@ -550,3 +579,10 @@ class CitationPart(models.Model):
         Returns: the value of the citation part type
         """
         return self.value
+
+    @property
+    def citation_part_type_name(self):
+        """The name of the citation part type, without a query."""
+        return lookup('CitationPartType').get(
+            self.citation_part_type_id
+        ).name
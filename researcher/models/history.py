@@ -0,0 +1,70 @@
+"""Create the researcher model holding the history of evidence.
+
+Exports:
+    Classes:
+        Revision
+"""
+from django.db import models
+
+
+# History Models
+class Revision(models.Model):
+
+    """One change to a row of a versioned model.
+
+    Assertions should never be lost, nor should the sources and
+    reasoning behind them, so researcher.history records every insert,
+    update and delete of Assertion, AssertionAssertion, Source,
+    CitationPart and Representation as a revision.  Revisions are only
+    ever added; the one thing that changes is the valid_to of the
+    previous revision, which is closed when the next one is added.  A
+    revision holds only the fields that changed, except for every
+    KEYFRAME_EVERY-th revision of a row, which holds them all so that a
+    row's state at any moment is rebuilt from a handful of revisions.
+
+    Instance Variables:
+        model -- The name of the versioned model.
+        object_id -- The id of the changed row.
+        version -- The row's revision number, from 1.
+        full -- Whether delta holds every field, not only changed ones.
+        deleted -- Whether the row was deleted.
+        delta -- The changed fields and their new values, as JSON.
+        researcher -- (foreign key) Who made the change, if known.
+        valid_from -- When the change was made.
+        valid_to -- When the next change was made; empty for the latest.
+    """
+
+    model = models.CharField('model name', max_length=32)
+    object_id = models.IntegerField('row id')
+    version = models.PositiveIntegerField('revision number')
+    full = models.BooleanField('holds every field', default=False)
+    deleted = models.BooleanField('row deleted', default=False)
+    delta = models.TextField('changed fields')
+    researcher = models.ForeignKey(
+        'Researcher',
+        related_name='+',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    valid_from = models.DateTimeField('valid from')
+    valid_to = models.DateTimeField('valid until', blank=True, null=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        unique_together = [['model', 'object_id', 'version']]
+        index_together = [
+            ['model', 'valid_from'],
+            ['model', 'valid_to'],
+        ]
+
+    def __str__(self):
+        """Stringify the revision.
+
+        Arguments:
+            self
+        Returns: the model, row id and revision number
+        """
+        return '%s #%d v%d' % (self.model, self.object_id, self.version)
@@ -0,0 +1,99 @@
+"""Create the researcher background job models.
+
+Exports:
+    Classes:
+        Job
+"""
+from django.db import models
+
+JOB_STATUSES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+    ('cancelled', 'Cancelled'),
+)
+
+
+# Job Models
+class Job(models.Model):
+
+    """A heavy operation waiting for, or run by, a background worker.
+
+    Imports, exports, rebuilding derived tables and validating projects
+    take too long for a web request.  They are queued as jobs by
+    researcher.jobs.enqueue and run by `manage.py run_jobs` workers,
+    which take the queued jobs in priority order.  A failed job is
+    queued again, later, until it has used up its attempts.
+
+    Instance Variables:
+        task -- The name of the registered task to run.
+        arguments -- The task's keyword arguments, as JSON.
+        status -- Queued, running, done, failed or cancelled.
+        priority -- Jobs with a lower number run first.
+        run_after -- The job is not started before this time.
+        attempts -- How many times the job has been started.
+        max_attempts -- How many times it may be started.
+        progress -- How far the running job has got, from 0 to 1.
+        progress_message -- What the running job is doing.
+        cancel_requested -- The running job should stop when it next
+            reports progress.
+        result -- What the task returned, as JSON.
+        error -- The traceback of the last failure.
+        worker -- The worker running or last to run the job.
+        heartbeat -- When the worker last showed it is alive.
+        researcher -- (foreign key) Who asked for the job, if anyone.
+        created -- When the job was queued.
+        started -- When the job last started.
+        finished -- When the job was done, failed or cancelled.
+    """
+
+    task = models.CharField('task name', max_length=64)
+    arguments = models.TextField('task arguments', default='{}')
+    status = models.CharField(
+        'status',
+        max_length=9,
+        choices=JOB_STATUSES,
+        default='queued'
+    )
+    priority = models.SmallIntegerField('priority', default=0)
+    run_after = models.DateTimeField('do not start before')
+    attempts = models.PositiveSmallIntegerField('attempts made', default=0)
+    max_attempts = models.PositiveSmallIntegerField('attempts allowed',
+                                                    default=3)
+    progress = models.FloatField('progress', default=0)
+    progress_message = models.CharField('what it is doing', max_length=255,
+                                        blank=True)
+    cancel_requested = models.BooleanField('cancel requested', default=False)
+    result = models.TextField('result', blank=True)
+    error = models.TextField('last error', blank=True)
+    worker = models.CharField('worker', max_length=128, blank=True)
+    heartbeat = models.DateTimeField('last heartbeat', blank=True, null=True)
+    researcher = models.ForeignKey(
+        'Researcher',
+        related_name='+',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    created = models.DateTimeField('when queued', auto_now_add=True)
+    started = models.DateTimeField('when started', blank=True, null=True)
+    finished = models.DateTimeField('when finished', blank=True, null=True)
+
+    class Meta:
+
+        """Metadata for the model."""
+
+        index_together = [
+            ['status', 'priority', 'run_after'],
+            ['status', 'heartbeat'],
+        ]
+
+    def __str__(self):
+        """Stringify the job.
+
+        Arguments:
+            self
+        Returns: the job id, task and status
+        """
+        return '#%d %s (%s)' % (self.pk, self.task, self.status)
@@ -0,0 +1,83 @@
+"""Create the researcher models recording where projects' data lives.
+
+Exports:
+    Classes:
+        ProjectShard
+        ShardChange
+"""
+from django.db import models
+
+SHARD_STATES = (
+    ('active', 'Active'),
+    ('copying', 'Copying to another database'),
+    ('frozen', 'Frozen for the last of a move'),
+)
+
+
+# Shard Models
+class ProjectShard(models.Model):
+
+    """The database holding a project's data, if not the default one.
+
+    Kept in the default database only and read by
+    researcher.shards.ProjectRouter.  A project without a row lives in
+    the default database.
+
+    Instance Variables:
+        project -- (foreign key) The project.
+        alias -- The DATABASES alias holding its data.
+        state -- Active, or which stage of a move to another database
+            the project is in.
+        target -- The alias the project is being moved to, if it is.
+        changed -- When the row last changed.
+    """
+
+    project = models.OneToOneField('Project', related_name='+')
+    alias = models.CharField('database alias', max_length=64)
+    state = models.CharField(
+        'state',
+        max_length=7,
+        choices=SHARD_STATES,
+        default='active'
+    )
+    target = models.CharField('moving to', max_length=64, blank=True)
+    changed = models.DateTimeField('when changed', auto_now=True)
+
+    def __str__(self):
+        """Stringify the project shard.
+
+        Arguments:
+            self
+        Returns: the project id, alias and state
+        """
+        return 'project %d on %s (%s)' % (
+            self.project_id, self.alias, self.state
+        )
+
+
+class ShardChange(models.Model):
+
+    """A row of a project changed while the project is being moved.
+
+    Recorded in the default database by researcher.shards while the
+    project's data is copied, and replayed on the new database before
+    the move completes.
+
+    Instance Variables:
+        project -- (foreign key) The project being moved.
+        model -- The name of the changed row's model.
+        object_id -- The changed row's primary key.
+    """
+
+    project = models.ForeignKey('Project', related_name='+')
+    model = models.CharField('model name', max_length=64)
+    object_id = models.IntegerField('row id')
+
+    def __str__(self):
+        """Stringify the change.
+
+        Arguments:
+            self
+        Returns: the model name and row id
+        """
+        return '%s #%d' % (self.model, self.object_id)
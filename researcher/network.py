@@ -0,0 +1,520 @@
+"""Export a project's family network to arrays for whole-project analytics.
+
+Questions about a whole project (how many separate families does it
+hold, how deep do the generations go, who has the most descendants)
+touch every parent/child link at once.  Answering them with
+Persona and Assertion instances would need gigabytes and minutes.  The
+builder here streams the project's lineage assertions (see
+researcher.relationships) as plain tuples and stores the network as
+NumPy compressed sparse row (CSR) arrays, in both directions:
+
+    ids -- the persona ids, sorted; a persona's node number is its index
+    down_indptr, down_indices -- node i's children are
+        down_indices[down_indptr[i]:down_indptr[i + 1]]
+    down_roles -- for each of those edges, the index in the network's
+        `roles` of the role the parent was named in
+    up_indptr, up_indices, up_roles -- the same, from children to parents
+
+A project's assertions are those made by its researchers.  Disproved
+assertions are left out unless asked for, and assertions can be limited
+to the more reliable surety levels.  The arrays are saved as .npy files
+under RESEARCHER_NETWORK_DIR and opened memory-mapped, so several worker
+processes share one copy through the page cache and opening a network
+reads almost nothing.  Each build writes a directory of its own, and the
+network's path is a symbolic link swapped onto it in one os.replace, so
+readers see the old network or the new one, never a mixture.
+
+The analytics work on whole arrays a generation or a pass at a time
+instead of visiting personas one by one.
+
+Requires NumPy.
+
+Exports:
+    Functions:
+        build_network
+        network
+        network_path
+    Classes:
+        FamilyNetwork
+"""
+import array
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+
+from researcher.relationships import lineage_assertions, lineage_roles
+from researcher.versions import table_versions
+
+NETWORK_DIR = getattr(
+    settings,
+    'RESEARCHER_NETWORK_DIR',
+    os.path.join(getattr(settings, 'BASE_DIR', ''), 'network')
+)
+
+ARRAYS = (
+    'ids',
+    'down_indptr',
+    'down_indices',
+    'down_roles',
+    'up_indptr',
+    'up_indices',
+    'up_roles',
+)
+
+# The tables a saved network is derived from.
+SOURCE_MODELS = (
+    'Assertion',
+    'Event',
+    'Group',
+    'EventTypeRole',
+    'GroupTypeRole',
+    'SuretySchemePart',
+    'ResearcherProject',
+)
+
+
+def network_path(project, max_surety_rank=None, include_disproved=False):
+    """Find the directory a network is saved in.
+
+    Arguments:
+        project -- the Project or its id
+        max_surety_rank -- see build_network
+        include_disproved -- see build_network
+    Returns: the directory path
+    """
+    name = 'project-%d' % getattr(project, 'pk', project)
+    if max_surety_rank is not None:
+        name += '-surety-%d' % max_surety_rank
+    if include_disproved:
+        name += '-disproved'
+    return os.path.join(NETWORK_DIR, name)
+
+
+def _source_versions():
+    """Read the versions of the tables a network is derived from."""
+    models = [apps.get_model('researcher', name) for name in SOURCE_MODELS]
+    return table_versions(models)
+
+
+def _csr(sources, targets, roles, size):
+    """Sort edges by source node into CSR arrays.
+
+    Arguments:
+        sources -- the source node of each edge
+        targets -- the target node of each edge
+        roles -- the role code of each edge
+        size -- the number of nodes
+    Returns: (indptr, indices, roles)
+    """
+    order = numpy.lexsort((targets, sources))
+    indptr = numpy.zeros(size + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sources, minlength=size), out=indptr[1:])
+    return (
+        indptr,
+        targets[order].astype(numpy.int32),
+        roles[order].astype(numpy.int16),
+    )
+
+
+def _edges(project, max_surety_rank, include_disproved):
+    """Read the parent/child edges of a project.
+
+    Arguments:
+        project -- the Project or its id
+        max_surety_rank -- see build_network
+        include_disproved -- see build_network
+    Returns: (parent ids, child ids, role codes, roles), where roles
+        lists the [kind, role name] pair of each role code
+    """
+    ResearcherProject = apps.get_model('researcher', 'ResearcherProject')
+    extra = Q(researcher__in=ResearcherProject.objects.filter(
+        project=project
+    ).values('researcher'))
+    if max_surety_rank is not None:
+        extra &= Q(surety_scheme_part__sequence_number__lte=max_surety_rank)
+
+    codes = {}
+    columns = dict(
+        (name, array.array('q')) for name in ('unit', 'persona', 'role')
+    )
+    parent_flags = array.array('b')
+    for (kind, unit), pk, persona, is_parent, role in lineage_assertions(
+            extra,
+            roles=lineage_roles(),
+            include_disproved=include_disproved):
+        # Events and groups share one unit number space: even and odd.
+        columns['unit'].append(unit * 2 + (kind == 'G'))
+        columns['persona'].append(persona)
+        columns['role'].append(codes.setdefault((kind, role), len(codes)))
+        parent_flags.append(is_parent)
+
+    unit, persona, role = [
+        numpy.frombuffer(columns[name], dtype=numpy.int64)
+        if len(columns[name]) else numpy.zeros(0, dtype=numpy.int64)
+        for name in ('unit', 'persona', 'role')
+    ]
+    is_parent = numpy.array(parent_flags, dtype=bool)
+
+    # Pair every parent in a unit with every child in it.
+    parents = numpy.flatnonzero(is_parent)
+    parents = parents[numpy.argsort(unit[parents], kind='stable')]
+    children = numpy.flatnonzero(~is_parent)
+    parent_units = unit[parents]
+    first = numpy.searchsorted(parent_units, unit[children], 'left')
+    counts = numpy.searchsorted(parent_units, unit[children], 'right') - first
+    total = int(counts.sum())
+    offsets = numpy.arange(total) - numpy.repeat(
+        numpy.cumsum(counts) - counts,
+        counts
+    )
+    parent_rows = parents[numpy.repeat(first, counts) + offsets]
+    child_rows = numpy.repeat(children, counts)
+
+    edges = numpy.stack([
+        persona[parent_rows],
+        persona[child_rows],
+        role[parent_rows],
+    ])
+    edges = edges[:, edges[0] != edges[1]]
+    # A pair asserted in several units or roles is one edge, typed by the
+    # lowest of its role codes.
+    edges = edges[:, numpy.lexsort((edges[2], edges[1], edges[0]))]
+    keep = numpy.ones(edges.shape[1], dtype=bool)
+    keep[1:] = numpy.any(edges[:2, 1:] != edges[:2, :-1], axis=0)
+    edges = edges[:, keep]
+    roles = [list(key) for key, code in sorted(codes.items(),
+                                               key=lambda item: item[1])]
+    return edges[0], edges[1], edges[2], roles
+
+
+def build_network(project, max_surety_rank=None, include_disproved=False):
+    """Build and save the CSR arrays of a project's family network.
+
+    Arguments:
+        project -- the Project or its id
+        max_surety_rank -- keep only assertions whose surety scheme part
+            has at most this sequence number (the most reliable parts
+            sort first); None keeps every assertion
+        include_disproved -- whether to keep disproved assertions
+    Returns: the FamilyNetwork, opened from the saved files
+    """
+    versions = _source_versions()
+    parents, children, roles, role_names = _edges(
+        project,
+        max_surety_rank,
+        include_disproved
+    )
+    ids = numpy.unique(numpy.concatenate([parents, children]))
+    parent_nodes = numpy.searchsorted(ids, parents)
+    child_nodes = numpy.searchsorted(ids, children)
+    arrays = {'ids': ids}
+    arrays['down_indptr'], arrays['down_indices'], arrays['down_roles'] = \
+        _csr(parent_nodes, child_nodes, roles, len(ids))
+    arrays['up_indptr'], arrays['up_indices'], arrays['up_roles'] = \
+        _csr(child_nodes, parent_nodes, roles, len(ids))
+    meta = {
+        'project': getattr(project, 'pk', project),
+        'max_surety_rank': max_surety_rank,
+        'include_disproved': include_disproved,
+        'roles': role_names,
+        'versions': versions,
+    }
+
+    # Write into a fresh directory and swap the link onto it, so that
+    # readers never see half a network.  Readers holding the old files
+    # keep them open.
+    path = network_path(project, max_surety_rank, include_disproved)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    staging = tempfile.mkdtemp(dir=parent,
+                               prefix=os.path.basename(path) + '.')
+    for name in ARRAYS:
+        numpy.save(os.path.join(staging, name + '.npy'), arrays[name])
+    with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    retired = None
+    if os.path.islink(path):
+        retired = os.path.realpath(path)
+    elif os.path.isdir(path):
+        # Saved before networks were linked; it cannot be swapped.
+        shutil.rmtree(path, ignore_errors=True)
+    link = staging + '.link'
+    os.symlink(os.path.basename(staging), link)
+    os.replace(link, path)
+    if retired:
+        shutil.rmtree(retired, ignore_errors=True)
+    return FamilyNetwork(path)
+
+
+def network(project, max_surety_rank=None, include_disproved=False):
+    """Open a project's saved network, rebuilding it if it is stale.
+
+    Arguments:
+        project -- the Project or its id
+        max_surety_rank -- see build_network
+        include_disproved -- see build_network
+    Returns: the FamilyNetwork
+    """
+    path = network_path(project, max_surety_rank, include_disproved)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        opened = FamilyNetwork(path)
+        if opened.is_current():
+            return opened
+    return build_network(project, max_surety_rank, include_disproved)
+
+
+def _gather(indptr, indices, nodes):
+    """Collect the neighbours of many nodes at once.
+
+    Arguments:
+        indptr -- the CSR row pointers
+        indices -- the CSR column indices
+        nodes -- an array of node numbers
+    Returns: (owners, neighbours): for each edge leaving `nodes`, the
+        position in `nodes` it leaves from and the node it reaches
+    """
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    owners = numpy.repeat(numpy.arange(len(nodes)), counts)
+    offsets = numpy.arange(total) - numpy.repeat(
+        numpy.cumsum(counts) - counts,
+        counts
+    )
+    return owners, indices[numpy.repeat(starts, counts) + offsets]
+
+
+class FamilyNetwork(object):
+
+    """A saved family network, opened memory-mapped.
+
+    Instance Variables:
+        path -- The directory holding the arrays.
+        meta -- The network's description: project, filters, roles and
+            the table versions it was built from.
+        size -- The number of personas (nodes) in the network.
+    """
+
+    def __init__(self, path):
+        """Open the arrays in a network directory.
+
+        The link is followed once, so a build swapping it meanwhile
+        cannot mix the arrays of two networks.
+        """
+        self.path = os.path.realpath(path)
+        with open(os.path.join(self.path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        for name in ARRAYS:
+            setattr(self, name, numpy.load(
+                os.path.join(self.path, name + '.npy'),
+                mmap_mode='r'
+            ))
+        self.size = len(self.ids)
+
+    def is_current(self):
+        """Report whether the network's source tables are unchanged."""
+        return self.meta['versions'] == _source_versions()
+
+    def node(self, persona):
+        """Find a persona's node number.
+
+        Arguments:
+            self
+            persona -- the persona id
+        Returns: the node number
+        Raises: KeyError if the persona is not in the network
+        """
+        position = int(numpy.searchsorted(self.ids, persona))
+        if position == self.size or self.ids[position] != persona:
+            raise KeyError(persona)
+        return position
+
+    def children(self, persona):
+        """List the ids of a persona's children in the network."""
+        node = self.node(persona)
+        return self.ids[self.down_indices[
+            self.down_indptr[node]:self.down_indptr[node + 1]
+        ]].tolist()
+
+    def parents(self, persona):
+        """List the ids of a persona's parents in the network."""
+        node = self.node(persona)
+        return self.ids[self.up_indices[
+            self.up_indptr[node]:self.up_indptr[node + 1]
+        ]].tolist()
+
+    def edge_sources(self):
+        """Give the parent node of every down edge, in edge order."""
+        return numpy.repeat(
+            numpy.arange(self.size, dtype=numpy.int32),
+            numpy.diff(self.down_indptr)
+        )
+
+    def components(self):
+        """Split the network into separate families.
+
+        Two personas are in the same component when a chain of parent
+        and child links joins them.  Labels spread along every edge at
+        once and then jump to their label's label, so the number of
+        passes grows with the logarithm of the longest chain.
+
+        Arguments:
+            self
+        Returns: an array giving each node the smallest node number in
+            its component
+        """
+        labels = numpy.arange(self.size, dtype=numpy.int64)
+        sources = self.edge_sources()
+        targets = numpy.asarray(self.down_indices)
+        while True:
+            previous = labels.copy()
+            low = numpy.minimum(labels[sources], labels[targets])
+            numpy.minimum.at(labels, labels[sources], low)
+            numpy.minimum.at(labels, labels[targets], low)
+            while True:
+                jumped = labels[labels]
+                if numpy.array_equal(jumped, labels):
+                    break
+                labels = jumped
+            if numpy.array_equal(labels, previous):
+                return labels
+
+    def component_sizes(self):
+        """Count the personas in each component, largest first.
+
+        Returns: a list of (smallest persona id, size) pairs
+        """
+        labels, sizes = numpy.unique(self.components(), return_counts=True)
+        order = numpy.argsort(-sizes, kind='stable')
+        return [
+            (int(self.ids[labels[i]]), int(sizes[i])) for i in order
+        ]
+
+    def generations(self):
+        """Number the generations from the earliest known ancestors.
+
+        Personas with no parents in the network are generation 0; every
+        other persona is one generation below its latest-generation
+        parent.  Personas caught in a loop of parentage (an error in the
+        data) are given -1.
+
+        Arguments:
+            self
+        Returns: an array of generation numbers by node
+        """
+        depth = numpy.full(self.size, -1, dtype=numpy.int64)
+        waiting = numpy.diff(self.up_indptr).astype(numpy.int64)
+        level = numpy.flatnonzero(waiting == 0)
+        generation = 0
+        while len(level):
+            depth[level] = generation
+            owners, reached = _gather(self.down_indptr, self.down_indices,
+                                      level)
+            waiting -= numpy.bincount(reached, minlength=self.size)
+            reached = numpy.unique(reached)
+            level = reached[waiting[reached] == 0]
+            generation += 1
+        return depth
+
+    def descendant_counts(self, samples=64):
+        """Estimate how many descendants each persona has in the network.
+
+        Counting distinct descendants exactly would mean holding a set
+        per persona.  Instead every persona draws `samples` random
+        exponential ranks, each persona takes the minimum of each rank
+        over itself and its descendants (pushed up the generations a
+        level at a time), and the size of the set is estimated from the
+        minima (E. Cohen's size estimator).  The relative error is about
+        1 / sqrt(samples - 2).  Personas in a loop of parentage get 0.
+
+        Arguments:
+            self
+            samples -- the number of ranks per persona
+        Returns: an array of estimated descendant counts by node
+        """
+        depth = self.generations()
+        ranks = numpy.random.RandomState(0).exponential(
+            size=(self.size, samples)
+        )
+        sources = self.edge_sources()
+        targets = numpy.asarray(self.down_indices)
+        usable = (depth[sources] >= 0) & (depth[targets] >= 0)
+        sources, targets = sources[usable], targets[usable]
+        order = numpy.argsort(depth[sources], kind='stable')
+        sources, targets = sources[order], targets[order]
+        bounds = numpy.searchsorted(
+            depth[sources],
+            numpy.arange(int(depth.max(initial=-1)) + 2)
+        )
+        for generation in range(len(bounds) - 2, -1, -1):
+            chosen = slice(bounds[generation], bounds[generation + 1])
+            numpy.minimum.at(
+                ranks,
+                sources[chosen],
+                ranks[targets[chosen]]
+            )
+        counts = (samples - 1) / ranks.sum(axis=1) - 1
+        counts[depth < 0] = 0
+        return numpy.maximum(counts, 0)
+
+    def most_connected_ancestors(self, limit=20):
+        """Find the personas with the most descendants in the network.
+
+        Arguments:
+            self
+            limit -- how many personas to return
+        Returns: a list of (persona id, estimated descendants) pairs,
+            most descendants first
+        """
+        counts = self.descendant_counts()
+        limit = min(limit, self.size)
+        if not limit:
+            return []
+        top = numpy.argpartition(-counts, limit - 1)[:limit]
+        top = top[numpy.lexsort((self.ids[top], -counts[top]))]
+        return [(int(self.ids[node]), int(round(counts[node])))
+                for node in top]
+
+    def pedigree_collapse(self, persona, generations=10):
+        """Measure how often the same ancestors fill a persona's pedigree.
+
+        Each generation has 2**g places.  Where cousins married, one
+        ancestor fills several of them; collapse is the share of known
+        places taken by a repeated ancestor.
+
+        Arguments:
+            self
+            persona -- the persona id
+            generations -- how many generations above the persona to look
+        Returns: a list of dicts, one per generation reached, with
+            'generation', 'places' (filled places), 'distinct' (distinct
+            ancestors) and 'collapse'
+        """
+        level = numpy.array([self.node(persona)])
+        weights = numpy.ones(1, dtype=numpy.float64)
+        found = []
+        for generation in range(1, generations + 1):
+            owners, reached = _gather(self.up_indptr, self.up_indices, level)
+            if not len(reached):
+                break
+            level, inverse = numpy.unique(reached, return_inverse=True)
+            weights = numpy.bincount(
+                inverse,
+                weights=weights[owners],
+                minlength=len(level)
+            )
+            places = float(weights.sum())
+            found.append({
+                'generation': generation,
+                'places': int(places),
+                'distinct': len(level),
+                'collapse': 1 - len(level) / places,
+            })
+        return found
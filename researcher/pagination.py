@@ -0,0 +1,317 @@
+"""Paginate very large admin changelists.
+
+The stock admin changelist counts every row with COUNT(*) and walks to
+deep pages with OFFSET, both of which scan the table.  The classes here
+replace the count with the planner's estimate once a table is large and
+replace OFFSET paging with keyset (seek) paging on the primary key, or
+on a sorted column with the primary key breaking ties, so that every
+page costs the same as the first.
+
+Exports:
+    Functions:
+        approximate_count
+    Classes:
+        ApproximateCountPaginator
+        KeysetChangeList
+"""
+import json
+
+from django.conf import settings
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import FieldDoesNotExist, Q
+from django.utils import six
+
+
+APPROXIMATE_COUNT_THRESHOLD = getattr(
+    settings,
+    'RESEARCHER_APPROXIMATE_COUNT_THRESHOLD',
+    100000
+)
+
+# Changelist query string parameters used by keyset paging.
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+KEYSET_VARS = (AFTER_VAR, BEFORE_VAR)
+
+
+def _boundary(request, name):
+    """Read a keyset boundary id; anything but one starts from page one."""
+    value = request.GET.get(name, '')
+    return int(value) if value.isdigit() else None
+
+
+def _estimated_rows(queryset):
+    """Ask PostgreSQL how many rows it expects a queryset to return.
+
+    Arguments:
+        queryset -- the queryset to estimate
+    Returns: the planner's row estimate, or None if it is unavailable
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    query = queryset.query
+    cursor = connection.cursor()
+    if not query.where and not query.having:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+    else:
+        sql, params = query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if isinstance(row[0], (int, float)):
+        return int(row[0])
+
+    plan = row[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def approximate_count(queryset, threshold=None):
+    """Count a queryset, estimating when the result is large.
+
+    Small results are counted exactly.  When the planner estimates at
+    least `threshold` rows, the estimate is returned instead, because
+    an exact count would need a full scan.  Backends without planner
+    statistics always count exactly.
+
+    Arguments:
+        queryset -- the queryset to count
+        threshold -- the row estimate above which the estimate is
+            trusted (default RESEARCHER_APPROXIMATE_COUNT_THRESHOLD)
+    Returns: a tuple of (count, is_approximate)
+    """
+    if threshold is None:
+        threshold = APPROXIMATE_COUNT_THRESHOLD
+
+    estimate = _estimated_rows(queryset)
+    if estimate is not None and estimate >= threshold:
+        return estimate, True
+    return queryset.count(), False
+
+
+class ApproximateCountPaginator(Paginator):
+
+    """A paginator that trusts planner estimates for large tables."""
+
+    approximate = False
+
+    def _get_count(self):
+        """Count the objects, estimating above the threshold.
+
+        Arguments:
+            self
+        Returns: the exact or estimated number of objects
+        """
+        if self._count is None:
+            try:
+                self._count, self.approximate = approximate_count(
+                    self.object_list
+                )
+            except AttributeError:
+                self._count = len(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+
+class KeysetChangeList(ChangeList):
+
+    """An admin changelist that pages by seeking instead of OFFSET.
+
+    When the list is ordered by primary key alone (the admin default), or
+    by one column of the model's own with the primary key breaking ties
+    (what a click on a column header gives), pages are fetched with
+    `(column, pk) > (last seen column, last seen pk)` rather than an
+    OFFSET, and the previous/next links carry the boundary keys.  Sorting
+    by several columns, by a nullable column or across a relation falls
+    back to ordinary numbered pages, still using the approximate
+    paginator so the count stays cheap.
+    """
+
+    def get_filters_params(self, params=None):
+        """Drop the keyset parameters before building lookups.
+
+        Arguments:
+            self
+            params -- the query string parameters (default self.params)
+        Returns: the parameters that should filter the queryset
+        """
+        lookup_params = super(KeysetChangeList, self).get_filters_params(
+            params
+        )
+        for var in KEYSET_VARS:
+            lookup_params.pop(var, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        """Build a changelist URL that starts again from the first page.
+
+        Sorting and filtering links must not carry a stale seek position,
+        so the keyset parameters are dropped unless explicitly given.
+
+        Arguments:
+            self
+            new_params -- parameters to add or (when None) remove
+            remove -- parameter prefixes to remove
+        Returns: the query string, starting with '?'
+        """
+        new_params = dict(new_params or {})
+        for var in KEYSET_VARS:
+            new_params.setdefault(var, None)
+        return super(KeysetChangeList, self).get_query_string(
+            new_params,
+            remove
+        )
+
+    def keyset_ordering(self):
+        """Find the keys the list is ordered by, if it can seek on them.
+
+        Arguments:
+            self
+        Returns: a list of (field name, descending) pairs, the sort
+            column if any and then 'pk', or None if keyset paging does
+            not apply
+        """
+        ordering = list(self.queryset.query.order_by)
+        if not 0 < len(ordering) <= 2 or not all(
+                isinstance(name, six.string_types) for name in ordering):
+            return None
+        keys = [(name.lstrip('-'), name.startswith('-'))
+                for name in ordering]
+        opts = self.lookup_opts
+        if keys[-1][0] not in ('pk', opts.pk.name, opts.pk.attname):
+            return None
+        keys[-1] = ('pk', keys[-1][1])
+        if len(keys) == 2 and not self._seekable(keys[0][0]):
+            return None
+        return keys
+
+    def _seekable(self, name):
+        """Find whether a column can be sought on.
+
+        Only non-null columns of the model's own table qualify: a NULL
+        compares as neither before nor after the boundary, and a related
+        model's ordering would need a join per page.
+
+        Arguments:
+            self
+            name -- the ordering field name
+        Returns: True if pages can seek on the column
+        """
+        if '__' in name:
+            return False
+        try:
+            field = self.lookup_opts.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return field.concrete and field.rel is None and not field.null
+
+    def _seek(self, keys, boundary, forwards):
+        """Build the filter for the rows past a boundary row.
+
+        Arguments:
+            self
+            keys -- the keyset_ordering() of the list
+            boundary -- the primary key of the boundary row
+            forwards -- True for the rows after it in list order, False
+                for those before it
+        Returns: a Q, or None if the boundary row no longer exists
+        """
+        def lookup(name, descending):
+            """Name the comparison that moves along one key."""
+            return '%s__%s' % (name, 'lt' if descending == forwards
+                               else 'gt')
+
+        name, descending = keys[-1]
+        past = Q(**{lookup(name, descending): boundary})
+        if len(keys) == 1:
+            return past
+        column, descending = keys[0]
+        values = self.root_queryset.filter(pk=boundary).values_list(
+            column,
+            flat=True
+        )
+        if not values:
+            return None
+        value = values[0]
+        return Q(**{lookup(column, descending): value}) | (
+            Q(**{column: value}) & past
+        )
+
+    def get_results(self, request):
+        """Fetch one page of results.
+
+        Arguments:
+            self
+            request -- the current request
+        Returns: None; the results and paging state are set on self
+        """
+        ordering = self.keyset_ordering()
+        if ordering is None or self.show_all:
+            self.keyset = False
+            super(KeysetChangeList, self).get_results(request)
+            self.approximate = getattr(self.paginator, 'approximate', False)
+            return
+
+        self.keyset = True
+        paginator = self.model_admin.get_paginator(
+            request,
+            self.queryset,
+            self.list_per_page
+        )
+        self.result_count = paginator.count
+        self.approximate = getattr(paginator, 'approximate', False)
+        if self.get_filters_params() or self.query:
+            self.full_result_count, _ = approximate_count(self.root_queryset)
+        else:
+            self.full_result_count = self.result_count
+        self.paginator = paginator
+        self.can_show_all = False
+        self.multi_page = self.result_count > self.list_per_page
+
+        after = _boundary(request, AFTER_VAR)
+        before = _boundary(request, BEFORE_VAR)
+        queryset = self.queryset
+        if before:
+            # Walk backwards from the boundary and flip the page around.
+            seek = self._seek(ordering, before, forwards=False)
+            if seek is None:
+                before = None
+            else:
+                queryset = queryset.filter(seek).reverse()
+        elif after:
+            seek = self._seek(ordering, after, forwards=True)
+            if seek is None:
+                after = None
+            else:
+                queryset = queryset.filter(seek)
+
+        result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        result_list = result_list[:self.list_per_page]
+        if before:
+            result_list.reverse()
+
+        self.result_list = result_list
+        self.has_next = bool(result_list) and (has_more or bool(before))
+        self.has_previous = bool(result_list) and (
+            bool(after) or (bool(before) and has_more)
+        )
+        self.first_url = self.get_query_string()
+        self.next_url = self.previous_url = None
+        if self.has_next:
+            self.next_url = self.get_query_string(
+                {AFTER_VAR: result_list[-1].pk}
+            )
+        if self.has_previous:
+            self.previous_url = self.get_query_string(
+                {BEFORE_VAR: result_list[0].pk}
+            )
@@ -0,0 +1,388 @@
+"""Keep the participation and membership tables in step with the assertions.
+
+An assertion pairing a Persona with an Event, in either order, states
+that the persona took part in the event in the role given by its
+value_role; one pairing a Persona with a Group states that the persona
+belonged to the group, in the GroupTypeRole named by its value_role.
+Decoding those pairs on every question ("who witnessed this marriage?",
+"every group this persona belonged to in 1850") means scanning
+assertions from both sides.  Instead EventParticipation and
+GroupMembership hold one row per such assertion, indexed by the event or
+group and by the persona.  Memberships carry their group's dates.
+
+Saving an assertion updates, adds or removes its row (through the
+shared dispatcher in researcher.queues, so a save that changes none of
+its subjects, role, surety or disproved flag costs nothing), and saving a
+group updates the dates of its memberships.  An assertion saved before
+the persona, event or group it names gets its row when that is
+created.  Deleting an assertion, persona, event or group removes the
+rows that point at it.  Bulk operations that bypass model signals
+(QuerySet.update, bulk_create, loading fixtures) must call
+refresh_participation with the assertions they touched, or
+rebuild_participation afterwards.
+
+Exports:
+    Functions:
+        connect_signals
+        members
+        memberships
+        participants
+        participations
+        rebuild_participation
+        refresh_participation
+"""
+import datetime
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+
+from researcher.queues import on_assertion_change
+from researcher.versions import bump_table_version
+
+# Rows written by one INSERT, and ids in one IN list.
+BATCH_SIZE = 500
+
+FIELDS = (
+    'pk',
+    'subject1_type',
+    'subject1',
+    'subject2_type',
+    'subject2',
+    'value_role',
+    'surety_scheme_part_id',
+    'disproved',
+)
+
+# The subject type code of each model an assertion can pair.
+SUBJECT_KINDS = {
+    'Persona': 'P',
+    'Event': 'E',
+    'Group': 'G',
+}
+
+# The derived table for each kind of subject paired with a persona.
+TABLES = (
+    ('E', 'EventParticipation'),
+    ('G', 'GroupMembership'),
+)
+
+
+def _models():
+    """Get the derived model classes."""
+    return [apps.get_model('researcher', name) for kind, name in TABLES]
+
+
+def _existing(name, ids):
+    """Find which of some ids name rows of a model."""
+    if not ids:
+        return set()
+    return set(
+        apps.get_model('researcher', name).objects.filter(
+            pk__in=set(ids)
+        ).values_list('pk', flat=True)
+    )
+
+
+def _rows(assertions):
+    """Make the rows some assertions describe.
+
+    Arguments:
+        assertions -- tuples of the assertions' FIELDS
+    Returns: a list of unsaved EventParticipation and GroupMembership
+        instances, one for each assertion that pairs an existing persona
+        with an existing event or group
+    """
+    EventParticipation, GroupMembership = _models()
+    pairs = []
+    for (pk, subject1_type, subject1, subject2_type, subject2, role,
+         surety, disproved) in assertions:
+        if subject1_type == 'P' and subject2_type in ('E', 'G'):
+            kind, persona, subject = subject2_type, subject1, subject2
+        elif subject2_type == 'P' and subject1_type in ('E', 'G'):
+            kind, persona, subject = subject1_type, subject2, subject1
+        else:
+            continue
+        pairs.append((kind, pk, persona, subject, role, surety, disproved))
+
+    dates = {}
+    groups = [pair[3] for pair in pairs if pair[0] == 'G']
+    if groups:
+        dates = dict(
+            (pk, (start, end)) for pk, start, end in
+            apps.get_model('researcher', 'Group').objects.filter(
+                pk__in=groups
+            ).values_list('pk', 'date_start', 'date_end')
+        )
+    # Subject ids are not foreign keys, so they may name deleted rows.
+    personas = _existing('Persona', [pair[2] for pair in pairs])
+    events = _existing('Event', [
+        pair[3] for pair in pairs if pair[0] == 'E'
+    ])
+
+    rows = []
+    for kind, pk, persona, subject, role, surety, disproved in pairs:
+        if persona not in personas:
+            continue
+        if kind == 'E':
+            if subject not in events:
+                continue
+            rows.append(EventParticipation(
+                assertion_id=pk,
+                persona_id=persona,
+                event_id=subject,
+                role=role,
+                surety_scheme_part_id=surety,
+                disproved=disproved
+            ))
+        elif subject in dates:
+            rows.append(GroupMembership(
+                assertion_id=pk,
+                persona_id=persona,
+                group_id=subject,
+                role=role,
+                date_start=dates[subject][0],
+                date_end=dates[subject][1],
+                surety_scheme_part_id=surety,
+                disproved=disproved
+            ))
+    return rows
+
+
+def _assertions():
+    """Build a queryset of the assertions pairing personas and others."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    return Assertion.objects.filter(
+        Q(subject1_type='P', subject2_type__in=('E', 'G')) |
+        Q(subject1_type__in=('E', 'G'), subject2_type='P')
+    )
+
+
+def _insert(rows):
+    """Insert rows of the derived tables, each into its own table."""
+    for model in _models():
+        model.objects.bulk_create(
+            [row for row in rows if type(row) is model]
+        )
+
+
+def refresh_participation(assertions):
+    """Bring the rows of some assertions up to date.
+
+    Arguments:
+        assertions -- the ids of the assertions, including any that were
+            deleted or no longer pair a persona with an event or group
+    """
+    assertions = sorted(set(assertions))
+    with transaction.atomic():
+        for start in range(0, len(assertions), BATCH_SIZE):
+            batch = assertions[start:start + BATCH_SIZE]
+            for model in _models():
+                model.objects.filter(assertion__in=batch).delete()
+            _insert(_rows(
+                _assertions().filter(pk__in=batch).values_list(*FIELDS)
+            ))
+    for model in _models():
+        bump_table_version(model)
+
+
+def rebuild_participation():
+    """Rebuild the derived tables from the assertions.
+
+    Returns: the number of rows written
+    """
+    written = 0
+    with transaction.atomic():
+        for model in _models():
+            model.objects.all().delete()
+        batch = []
+        for row in _assertions().values_list(*FIELDS).iterator():
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                rows = _rows(batch)
+                _insert(rows)
+                written += len(rows)
+                batch = []
+        rows = _rows(batch)
+        _insert(rows)
+        written += len(rows)
+    for model in _models():
+        bump_table_version(model)
+    return written
+
+
+def participants(event, role=None, include_disproved=False):
+    """Build a queryset of the participations in an event.
+
+    Arguments:
+        event -- the Event or its id
+        role -- only this role (e.g. 'Witness'), or None for any
+        include_disproved -- whether to include disproved assertions
+    Returns: an EventParticipation queryset
+    """
+    EventParticipation = apps.get_model('researcher', 'EventParticipation')
+    queryset = EventParticipation.objects.filter(event=event)
+    if role is not None:
+        queryset = queryset.filter(role=role)
+    if not include_disproved:
+        queryset = queryset.filter(disproved=False)
+    return queryset
+
+
+def participations(persona, role=None, include_disproved=False):
+    """Build a queryset of a persona's participations in events.
+
+    Arguments:
+        persona -- the Persona or its id
+        role -- only this role, or None for any
+        include_disproved -- whether to include disproved assertions
+    Returns: an EventParticipation queryset
+    """
+    EventParticipation = apps.get_model('researcher', 'EventParticipation')
+    queryset = EventParticipation.objects.filter(persona=persona)
+    if role is not None:
+        queryset = queryset.filter(role=role)
+    if not include_disproved:
+        queryset = queryset.filter(disproved=False)
+    return queryset
+
+
+def _during(queryset, when):
+    """Keep the memberships whose group's dates overlap a period.
+
+    Arguments:
+        queryset -- a GroupMembership queryset
+        when -- a date, a year, or a (first date, last date) pair in
+            which either date may be None for a period without that end
+    Returns: the filtered queryset
+    """
+    if isinstance(when, int):
+        when = (datetime.date(when, 1, 1), datetime.date(when, 12, 31))
+    elif not isinstance(when, tuple):
+        when = (when, when)
+    if when[1] is not None:
+        queryset = queryset.filter(date_start__lte=when[1])
+    if when[0] is not None:
+        queryset = queryset.filter(date_end__gte=when[0])
+    return queryset
+
+
+def members(group, role=None, when=None, include_disproved=False):
+    """Build a queryset of the memberships of a group.
+
+    Arguments:
+        group -- the Group or its id
+        role -- only this role (e.g. 'Head'), or None for any
+        when -- only if the group existed at this date, in this year or
+            in this (first date, last date) period, either end of which
+            may be None; None for any time
+        include_disproved -- whether to include disproved assertions
+    Returns: a GroupMembership queryset
+    """
+    GroupMembership = apps.get_model('researcher', 'GroupMembership')
+    queryset = GroupMembership.objects.filter(group=group)
+    if role is not None:
+        queryset = queryset.filter(role=role)
+    if when is not None:
+        queryset = _during(queryset, when)
+    if not include_disproved:
+        queryset = queryset.filter(disproved=False)
+    return queryset
+
+
+def memberships(persona, role=None, when=None, include_disproved=False):
+    """Build a queryset of a persona's memberships of groups.
+
+    Arguments:
+        persona -- the Persona or its id
+        role -- only this role, or None for any
+        when -- only groups that existed at this date, in this year or in
+            this (first date, last date) period, either end of which may
+            be None; None for any time
+        include_disproved -- whether to include disproved assertions
+    Returns: a GroupMembership queryset
+    """
+    GroupMembership = apps.get_model('researcher', 'GroupMembership')
+    queryset = GroupMembership.objects.filter(persona=persona)
+    if role is not None:
+        queryset = queryset.filter(role=role)
+    if when is not None:
+        queryset = _during(queryset, when)
+    if not include_disproved:
+        queryset = queryset.filter(disproved=False)
+    return queryset
+
+
+def _assertion_changed(instance, before, raw, deleted):
+    """Update the row of a saved assertion.
+
+    A deleted assertion's row goes with it, by the foreign key.
+    """
+    if raw or deleted:
+        return
+    created = before is None
+    rows = _rows([[getattr(instance, name) for name in FIELDS]])
+    if not created:
+        for model in _models():
+            if not rows or type(rows[0]) is not model:
+                model.objects.filter(assertion=instance.pk).delete()
+    if not rows:
+        return
+    row = rows[0]
+    values = dict(
+        (field.name, getattr(row, field.attname))
+        for field in row._meta.concrete_fields
+        if not field.primary_key and field.name != 'assertion'
+    )
+    if created or not type(row).objects.filter(
+            assertion=instance.pk).update(**values):
+        row.save(force_insert=True)
+
+
+def _subject_saved(sender, instance, created=False, raw=False, **kwargs):
+    """Signal receiver that adds rows waiting for a new subject.
+
+    Assertions naming a persona, event or group that did not exist yet
+    were saved without a row.
+    """
+    if raw or not created:
+        return
+    kind = SUBJECT_KINDS[sender.__name__]
+    waiting = list(_assertions().filter(
+        Q(subject1_type=kind, subject1=instance.pk) |
+        Q(subject2_type=kind, subject2=instance.pk)
+    ).values_list('pk', flat=True))
+    if waiting:
+        refresh_participation(waiting)
+
+
+def _group_saved(sender, instance, created=False, raw=False, **kwargs):
+    """Signal receiver that copies a saved group's dates."""
+    if raw or created:
+        _subject_saved(sender, instance, created, raw)
+        return
+    apps.get_model('researcher', 'GroupMembership').objects.filter(
+        group=instance.pk
+    ).exclude(
+        date_start=instance.date_start,
+        date_end=instance.date_end
+    ).update(date_start=instance.date_start, date_end=instance.date_end)
+
+
+def connect_signals():
+    """Keep the derived tables current as assertions and groups change.
+
+    Rows of deleted assertions, personas, events and groups go with
+    them, by the foreign keys' cascade.
+    """
+    on_assertion_change(_assertion_changed)
+    for name, receiver in (
+            ('Persona', _subject_saved),
+            ('Event', _subject_saved),
+            ('Group', _group_saved)):
+        post_save.connect(
+            receiver,
+            sender=apps.get_model('researcher', name),
+            dispatch_uid='researcher.participation.%s' % name
+        )
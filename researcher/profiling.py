@@ -0,0 +1,302 @@
+"""Profile requests and commands on demand, as flamegraphs.
+
+A Profile samples the stack of one thread every PROFILE_INTERVAL seconds
+from a helper thread (a statistical profiler: the profiled code runs at
+full speed, and only the sampler pays for looking) while recording the
+thread's SQL with researcher.querylog.  Saving it writes two files to
+RESEARCHER_PROFILE_DIR:
+
+    <stamp>-<label>.folded -- the samples as collapsed stacks, one
+        `outer;inner;innermost count` line per distinct stack, ready for
+        flamegraph.pl, speedscope or inferno
+    <stamp>-<label>.json -- the SQL timeline: each query's offset and
+        duration in milliseconds, its statement and where it came from,
+        with the querylog summary of the run
+
+Only the newest RESEARCHER_PROFILE_KEEP profiles are kept; older ones
+are deleted as new ones are saved.
+
+ProfileMiddleware profiles a request when it carries an
+`X-Researcher-Profile` header matching RESEARCHER_PROFILE_TOKEN, and a
+random RESEARCHER_PROFILE_SAMPLE_RATE share of all requests.  With no
+token and no sample rate the middleware does nothing at all.  The
+researcher management commands take `--profile`, for long imports,
+exports and validation runs.
+
+Exports:
+    Functions:
+        profiling
+    Classes:
+        Profile
+        ProfileMiddleware
+        Sampler
+"""
+import collections
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from researcher import querylog
+
+# Seconds between stack samples.
+PROFILE_INTERVAL = getattr(settings, 'RESEARCHER_PROFILE_INTERVAL', 0.005)
+
+PROFILE_DIR = getattr(
+    settings,
+    'RESEARCHER_PROFILE_DIR',
+    os.path.join(tempfile.gettempdir(), 'researcher-profiles')
+)
+
+PROFILE_KEEP = getattr(settings, 'RESEARCHER_PROFILE_KEEP', 100)
+
+PROFILE_TOKEN = getattr(settings, 'RESEARCHER_PROFILE_TOKEN', None)
+
+PROFILE_SAMPLE_RATE = getattr(settings, 'RESEARCHER_PROFILE_SAMPLE_RATE',
+                              0.0)
+
+PROFILE_HEADER = 'HTTP_X_RESEARCHER_PROFILE'
+
+# Frames kept from the innermost end of a deep stack.
+MAX_DEPTH = 256
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _frame_name(code):
+    """Name a frame for a flamegraph: its file, shortened, and function."""
+    filename = code.co_filename
+    if filename.startswith(querylog.PROJECT_ROOT):
+        filename = os.path.relpath(filename, querylog.PROJECT_ROOT)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[-1]
+    else:
+        filename = os.path.basename(filename)
+    return '%s:%s' % (filename, code.co_name)
+
+
+def _collapse(frame):
+    """Turn a stack into one `outer;...;innermost` line."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class Sampler(threading.Thread):
+
+    """A thread that samples another thread's stack at intervals.
+
+    Instance Variables:
+        target -- The ident of the thread sampled.
+        interval -- Seconds between samples.
+        stacks -- A Counter of collapsed stacks.
+    """
+
+    def __init__(self, target, interval=None):
+        """Prepare to sample a thread.
+
+        Arguments:
+            self
+            target -- the ident of the thread to sample
+            interval -- seconds between samples; None for PROFILE_INTERVAL
+        """
+        super(Sampler, self).__init__(name='researcher-profiler')
+        self.daemon = True
+        self.target = target
+        self.interval = interval or PROFILE_INTERVAL
+        self.stacks = collections.Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        """Sample until stopped or until the target thread ends."""
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                break
+            self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the last sample."""
+        self._done.set()
+        self.join()
+
+
+class Profile(object):
+
+    """The stack samples and SQL of one thread over a stretch of work.
+
+    Instance Variables:
+        label -- What is profiled, e.g. a path or command name.
+        sampler -- The Sampler, once started.
+        recorder -- The querylog.QueryRecorder, once started.
+        started -- When profiling began, from time.time().
+        elapsed -- Seconds profiled, once stopped.
+        path -- The .folded file, once saved.
+    """
+
+    def __init__(self, label):
+        """Prepare to profile the current thread."""
+        self.label = label
+        self.sampler = None
+        self.recorder = None
+        self.started = None
+        self.elapsed = None
+        self.path = None
+        self._recording = None
+
+    def start(self):
+        """Start sampling and recording the current thread."""
+        self._recording = querylog.recording(self.label)
+        self.recorder = self._recording.__enter__()
+        self.started = time.time()
+        self.sampler = Sampler(threading.current_thread().ident)
+        self.sampler.start()
+
+    def stop(self):
+        """Stop sampling and recording."""
+        self.sampler.stop()
+        self.elapsed = time.time() - self.started
+        self._recording.__exit__(None, None, None)
+
+    def folded(self):
+        """Return the samples as collapsed-stack lines."""
+        return ''.join(
+            '%s %d\n' % (stack, count)
+            for stack, count in sorted(self.sampler.stacks.items())
+        )
+
+    def timeline(self):
+        """Return the SQL timeline and summary, ready for json.dump."""
+        return {
+            'label': self.label,
+            'started': self.started,
+            'ms': round(self.elapsed * 1000, 1),
+            'samples': sum(self.sampler.stacks.values()),
+            'interval_ms': self.sampler.interval * 1000,
+            'summary': self.recorder.summary(),
+            'queries': [
+                {
+                    'at_ms': round((query.started - self.started) * 1000, 2),
+                    'ms': round(query.duration * 1000, 2),
+                    'sql': query.sql,
+                    'from': query.origin,
+                }
+                for query in self.recorder.queries
+            ],
+        }
+
+    def save(self, directory=None):
+        """Write the flamegraph and SQL timeline, then rotate old files.
+
+        Arguments:
+            self
+            directory -- where to write; None for PROFILE_DIR
+        Returns: the path of the .folded file
+        """
+        directory = directory or PROFILE_DIR
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # It exists already, or another process just made it.
+            if not os.path.isdir(directory):
+                raise
+        base = os.path.join(directory, '%s-%s' % (
+            time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.started)) +
+            '-%06d' % int(self.started % 1 * 1000000),
+            _UNSAFE.sub('_', self.label).strip('_')[:80] or 'profile'
+        ))
+        with open(base + '.folded', 'w') as stream:
+            stream.write(self.folded())
+        with open(base + '.json', 'w') as stream:
+            json.dump(self.timeline(), stream, separators=(',', ':'))
+        self.path = base + '.folded'
+        _rotate(directory)
+        return self.path
+
+
+def _rotate(directory):
+    """Delete all but the newest PROFILE_KEEP profiles of a directory."""
+    stems = sorted(
+        name[:-len('.folded')] for name in os.listdir(directory)
+        if name.endswith('.folded')
+    )
+    for stem in stems[:-PROFILE_KEEP or None]:
+        for extension in ('.folded', '.json'):
+            try:
+                os.remove(os.path.join(directory, stem + extension))
+            except OSError:
+                pass
+
+
+@contextlib.contextmanager
+def profiling(label, directory=None):
+    """Profile the block and save the result.
+
+    Arguments:
+        label -- what is profiled, for the file name
+        directory -- where to write; None for PROFILE_DIR
+    Yields: the Profile; its files are written when the block ends
+    """
+    profile = Profile(label)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        profile.save(directory)
+
+
+class ProfileMiddleware(object):
+
+    """Profile requests that ask for it, and a sample of the rest.
+
+    A profiled response names its flamegraph file in an
+    X-Researcher-Profile header.
+    """
+
+    def process_request(self, request):
+        """Start profiling, if the request asks or is sampled."""
+        if not (PROFILE_TOKEN or PROFILE_SAMPLE_RATE):
+            return
+        token = request.META.get(PROFILE_HEADER)
+        if ((PROFILE_TOKEN and token and
+                constant_time_compare(token, PROFILE_TOKEN)) or
+                (PROFILE_SAMPLE_RATE and
+                 random.random() < PROFILE_SAMPLE_RATE)):
+            request._profile = Profile(request.path_info)
+            request._profile.start()
+
+    def _finish(self, request):
+        """Stop profiling and return the Profile, if there was one."""
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return None
+        del request._profile
+        profile.stop()
+        return profile
+
+    def process_response(self, request, response):
+        """Save the request's profile."""
+        profile = self._finish(request)
+        if profile is not None:
+            response['X-Researcher-Profile'] = os.path.basename(
+                profile.save()
+            )
+        return response
+
+    def process_exception(self, request, exception):
+        """Save the profile of a failed view too; failures are often slow."""
+        profile = self._finish(request)
+        if profile is not None:
+            profile.save()
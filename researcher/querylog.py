@@ -0,0 +1,515 @@
+"""Record the SQL queries of a request or command, and hold them to budgets.
+
+A QueryRecorder, started with recording(), sees every query run on any
+database connection of its thread: the statement, its duration, and
+where it came from, as the innermost frames of the project's own code
+(so a query issued from `Place.__str__` inside an admin template is
+reported as `researcher/models/conclusions.py:800 in __str__`).
+Statements are also reduced to a signature, with literals replaced by
+`?`, and a signature seen DUPLICATE_THRESHOLD times or more is reported
+as a storm: the mark of an N+1 loop.
+
+Tests and benchmarks hold code to a budget with query_budget(), which
+raises QueryBudgetExceeded, naming the storms, when the code runs more
+queries than allowed.  Views are given budgets by URL name in
+RESEARCHER_QUERY_BUDGETS.
+
+QueryLogMiddleware records a sample of requests (RESEARCHER_QUERY_SAMPLE_RATE)
+and writes one compact JSON summary per request to the
+'researcher.queries' logger, at WARNING when the view went over its
+budget and at INFO otherwise; with RESEARCHER_QUERY_BUDGET_STRICT (for
+test settings) going over raises instead.  Management commands built
+on RecordedCommand write the same summary for every run when
+RESEARCHER_QUERY_LOG_COMMANDS is set.
+
+Recording works by giving each connection a recording debug cursor while
+a recorder is active; when none is, connections are untouched and cost
+nothing.
+
+Exports:
+    Functions:
+        current
+        origin
+        query_budget
+        recording
+        signature
+    Classes:
+        Query
+        QueryBudgetExceeded
+        QueryLogMiddleware
+        QueryRecorder
+        RecordedCommand
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import Resolver404, resolve
+from django.db import connections
+
+try:
+    from django.db.backends.utils import CursorWrapper
+except ImportError:
+    from django.db.backends.util import CursorWrapper
+
+from researcher import replicas, shards, versions
+
+SAMPLE_RATE = getattr(settings, 'RESEARCHER_QUERY_SAMPLE_RATE', 0.0)
+
+BUDGETS = getattr(settings, 'RESEARCHER_QUERY_BUDGETS', {})
+
+BUDGET_STRICT = getattr(settings, 'RESEARCHER_QUERY_BUDGET_STRICT', False)
+
+LOG_COMMANDS = getattr(settings, 'RESEARCHER_QUERY_LOG_COMMANDS', False)
+
+# Repeats of one statement signature that count as a storm.
+DUPLICATE_THRESHOLD = getattr(
+    settings,
+    'RESEARCHER_QUERY_DUPLICATE_THRESHOLD',
+    5
+)
+
+# Frames of the project's own code kept as a query's origin.
+ORIGIN_DEPTH = 3
+
+# Storms named in a summary.
+SUMMARY_STORMS = 5
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The project's own instrumentation, never reported as a query's origin.
+INSTRUMENTATION_FILES = set([__file__])
+
+logger = logging.getLogger('researcher.queries')
+
+_state = threading.local()
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+Query = collections.namedtuple('Query',
+                               'sql signature started duration origin')
+Query.__doc__ = """One query seen by a recorder.
+
+    sql -- the statement, with its parameters' placeholders
+    signature -- the statement with literals and IN lists reduced to ?
+    started -- when the statement was sent, from time.time()
+    duration -- seconds the database took
+    origin -- 'file:line in function' of the innermost frames of the
+        project's code, innermost first
+    """
+
+
+def signature(sql):
+    """Reduce a statement to its shape."""
+    shape = _LITERALS.sub('?', sql.replace('%s', '?'))
+    return _LISTS.sub('(...)', shape)
+
+
+def origin():
+    """Find the frames of the project's own code running a query.
+
+    Returns: a tuple of 'file:line in function', innermost first
+    """
+    found = []
+    frame = sys._getframe(1)
+    while frame is not None and len(found) < ORIGIN_DEPTH:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(PROJECT_ROOT) and
+                filename not in INSTRUMENTATION_FILES and
+                'site-packages' not in filename):
+            found.append('%s:%d in %s' % (
+                os.path.relpath(filename, PROJECT_ROOT),
+                frame.f_lineno,
+                frame.f_code.co_name
+            ))
+        frame = frame.f_back
+    return tuple(found)
+
+
+class QueryRecorder(object):
+
+    """The queries run in one thread while recording.
+
+    Instance Variables:
+        label -- What is being recorded, e.g. a URL name.
+        queries -- The Query tuples, in order.
+        started -- When recording began, from time.time().
+        elapsed -- Seconds recorded, once stopped.
+    """
+
+    def __init__(self, label=''):
+        """Start with no queries.
+
+        Arguments:
+            self
+            label -- what is being recorded
+        """
+        self.label = label
+        self.queries = []
+        self.started = time.time()
+        self.elapsed = None
+
+    def add(self, sql, started, duration):
+        """Record one query."""
+        self.queries.append(
+            Query(sql, signature(sql), started, duration, origin())
+        )
+
+    @property
+    def count(self):
+        """The number of queries."""
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        """The seconds the database took over all the queries."""
+        return sum(query.duration for query in self.queries)
+
+    def storms(self, threshold=None):
+        """Find the statements repeated threshold times or more.
+
+        Arguments:
+            self
+            threshold -- repeats that count; None for DUPLICATE_THRESHOLD
+        Returns: a list of (signature, count, seconds, origins) tuples,
+            most repeated first, where origins counts the places the
+            statement came from
+        """
+        threshold = threshold or DUPLICATE_THRESHOLD
+        groups = collections.OrderedDict()
+        for query in self.queries:
+            groups.setdefault(query.signature, []).append(query)
+        found = [
+            (
+                signature,
+                len(queries),
+                sum(query.duration for query in queries),
+                collections.Counter(
+                    query.origin[0] if query.origin else '?'
+                    for query in queries
+                ).most_common(),
+            )
+            for signature, queries in groups.items()
+            if len(queries) >= threshold
+        ]
+        found.sort(key=lambda storm: -storm[1])
+        return found
+
+    @property
+    def duplicates(self):
+        """The number of queries repeating an earlier statement."""
+        return self.count - len(set(query.signature for query in self.queries))
+
+    def summary(self, budget=None):
+        """Describe the recording compactly, for a log line.
+
+        Arguments:
+            self
+            budget -- the queries allowed, if any
+        Returns: a dict ready for json.dumps
+        """
+        found = {
+            'label': self.label,
+            'queries': self.count,
+            'duplicates': self.duplicates,
+            'db_ms': round(self.duration * 1000, 1),
+            'storms': [
+                {
+                    'count': count,
+                    'sql': signature[:200],
+                    'from': origins[:3],
+                }
+                for signature, count, seconds, origins in
+                self.storms()[:SUMMARY_STORMS]
+            ],
+        }
+        if self.elapsed is not None:
+            found['ms'] = round(self.elapsed * 1000, 1)
+        if budget is not None:
+            found['budget'] = budget
+        return found
+
+    def report(self):
+        """Describe the storms for a person reading a failure."""
+        lines = ['%d queries, %d repeated' % (self.count, self.duplicates)]
+        for signature, count, seconds, origins in self.storms():
+            lines.append('  %dx %s' % (count, signature[:200]))
+            for origin, times in origins[:3]:
+                lines.append('      %dx from %s' % (times, origin))
+        return '\n'.join(lines)
+
+
+class _RecordingCursor(CursorWrapper):
+
+    """A cursor that reports its queries to the thread's recorders."""
+
+    def _record(self, method, sql, params):
+        """Run a statement and record it."""
+        start = time.time()
+        try:
+            return method(sql, params)
+        finally:
+            duration = time.time() - start
+            for recorder in getattr(_state, 'recorders', ()):
+                recorder.add(sql, start, duration)
+
+    def execute(self, sql, params=None):
+        """Run and record a statement."""
+        return self._record(super(_RecordingCursor, self).execute, sql,
+                            params)
+
+    def executemany(self, sql, param_list):
+        """Run and record a statement for many parameter sets."""
+        return self._record(super(_RecordingCursor, self).executemany, sql,
+                            param_list)
+
+
+def _debug_flag(connection):
+    """Name the attribute that forces a connection's debug cursor."""
+    if hasattr(connection, 'force_debug_cursor'):
+        return 'force_debug_cursor'
+    return 'use_debug_cursor'
+
+
+def _instrument():
+    """Give this thread's connections recording cursors."""
+    for connection in connections.all():
+        if '_querylog_saved' in connection.__dict__:
+            continue
+        flag = _debug_flag(connection)
+        connection._querylog_saved = (
+            flag,
+            getattr(connection, flag),
+            connection.__dict__.get('make_debug_cursor'),
+        )
+        setattr(connection, flag, True)
+        connection.make_debug_cursor = (
+            lambda cursor, db=connection: _RecordingCursor(cursor, db)
+        )
+
+
+def _restore():
+    """Give this thread's connections their own cursors back."""
+    for connection in connections.all():
+        saved = connection.__dict__.pop('_querylog_saved', None)
+        if saved is None:
+            continue
+        flag, value, make = saved
+        setattr(connection, flag, value)
+        if make is None:
+            del connection.make_debug_cursor
+        else:
+            connection.make_debug_cursor = make
+
+
+def current():
+    """Return the innermost active QueryRecorder, or None."""
+    recorders = getattr(_state, 'recorders', None)
+    return recorders[-1] if recorders else None
+
+
+@contextlib.contextmanager
+def recording(label=''):
+    """Record the queries this thread runs inside the block.
+
+    Recordings nest; each sees every query run while it is active.
+
+    Arguments:
+        label -- what is being recorded
+    Yields: the QueryRecorder
+    """
+    recorder = QueryRecorder(label)
+    recorders = getattr(_state, 'recorders', None)
+    if recorders is None:
+        recorders = _state.recorders = []
+    if not recorders:
+        _instrument()
+    recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.elapsed = time.time() - recorder.started
+        recorders.remove(recorder)
+        if not recorders:
+            _restore()
+
+
+class QueryBudgetExceeded(AssertionError):
+
+    """Code ran more queries than its budget allows.
+
+    Instance Variables:
+        recorder -- The QueryRecorder of the code.
+        budget -- The queries allowed.
+    """
+
+    def __init__(self, recorder, budget):
+        """Describe the overrun and its storms."""
+        self.recorder = recorder
+        self.budget = budget
+        super(QueryBudgetExceeded, self).__init__(
+            '%s ran %d queries, over its budget of %d.\n%s' % (
+                recorder.label or 'Code',
+                recorder.count,
+                budget,
+                recorder.report()
+            )
+        )
+
+
+@contextlib.contextmanager
+def query_budget(budget, label=''):
+    """Fail if the block runs more than `budget` queries.
+
+    Arguments:
+        budget -- the queries allowed
+        label -- what is being checked, for the failure message
+    Yields: the QueryRecorder
+    Raises: QueryBudgetExceeded after the block, if over budget
+    """
+    with recording(label) as recorder:
+        yield recorder
+    if recorder.count > budget:
+        raise QueryBudgetExceeded(recorder, budget)
+
+
+def _url_name(request):
+    """Name the URL pattern a request resolved to, with its namespace."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return request.path_info
+    return match.view_name or request.path_info
+
+
+class QueryLogMiddleware(object):
+
+    """Record a sample of requests and log what their queries cost.
+
+    Requests to views with a budget are always recorded when
+    RESEARCHER_QUERY_BUDGET_STRICT is set, so tests catch every overrun.
+    """
+
+    def process_request(self, request):
+        """Start recording, if this request is sampled."""
+        if BUDGET_STRICT or (SAMPLE_RATE and random.random() < SAMPLE_RATE):
+            request._querylog = recording(request.path_info)
+            request._querylog.__enter__()
+
+    def _finish(self, request):
+        """Stop recording and return the recorder, if there was one."""
+        manager = getattr(request, '_querylog', None)
+        if manager is None:
+            return None
+        del request._querylog
+        recorder = current()
+        manager.__exit__(None, None, None)
+        return recorder
+
+    def process_response(self, request, response):
+        """Log the request's queries, or fail it when strictly over budget."""
+        recorder = self._finish(request)
+        if recorder is None:
+            return response
+        recorder.label = _url_name(request)
+        budget = BUDGETS.get(recorder.label)
+        over = budget is not None and recorder.count > budget
+        if over and BUDGET_STRICT:
+            raise QueryBudgetExceeded(recorder, budget)
+        summary = recorder.summary(budget)
+        summary['status'] = response.status_code
+        logger.log(
+            logging.WARNING if over else logging.INFO,
+            json.dumps(summary, separators=(',', ':'))
+        )
+        return response
+
+    def process_exception(self, request, exception):
+        """Stop recording when the view fails."""
+        self._finish(request)
+
+
+class RecordedCommand(BaseCommand):
+
+    """A management command whose queries are logged when asked.
+
+    With RESEARCHER_QUERY_LOG_COMMANDS set, each run writes the same
+    summary as a sampled request, labelled with the command's name.
+    With --profile the run is profiled by researcher.profiling, and with
+    --shard its project data is read from and written to one database.
+    Commands setting use_replica, and runs with --replica, read from
+    read replicas (see researcher.replicas).
+    """
+
+    use_replica = False
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--profile',
+            action='store_true',
+            dest='profile',
+            default=False,
+            help='Save a flamegraph and SQL timeline of the run.'
+        ),
+        make_option(
+            '--shard',
+            dest='shard',
+            default=None,
+            help='Use the project data of this database alias.'
+        ),
+        make_option(
+            '--replica',
+            action='store_true',
+            dest='replica',
+            default=False,
+            help='Read from read replicas.'
+        ),
+    )
+
+    def execute(self, *args, **options):
+        """Run the command on its shard and replicas, if it uses them."""
+        try:
+            with replicas.replica_reads(self.use_replica or
+                                        options.get('replica')):
+                if not options.get('shard'):
+                    return self._profile(*args, **options)
+                with shards.shard_scope(options['shard']):
+                    return self._profile(*args, **options)
+        finally:
+            versions.bump_committed()
+
+    def _profile(self, *args, **options):
+        """Run the command, profiling or recording it if asked to."""
+        label = 'command:%s' % self.__module__.rsplit('.', 1)[-1]
+        if options.get('profile'):
+            # Imported here: profiling builds on this module.
+            from researcher.profiling import profiling
+            with profiling(label) as profile:
+                result = self._execute(label, *args, **options)
+            self.stderr.write('Profile saved to %s' % profile.path)
+            return result
+        return self._execute(label, *args, **options)
+
+    def _execute(self, label, *args, **options):
+        """Run the command, recording it if asked to."""
+        if not LOG_COMMANDS:
+            return super(RecordedCommand, self).execute(*args, **options)
+        with recording(label) as recorder:
+            try:
+                return super(RecordedCommand, self).execute(*args, **options)
+            finally:
+                logger.info(json.dumps(recorder.summary(),
+                                       separators=(',', ':')))
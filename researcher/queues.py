@@ -0,0 +1,266 @@
+"""Share the queueing behind the derived checks.
+
+researcher.conflicts, researcher.sanity and researcher.gaps each keep a
+table of personas waiting to be checked again (PendingConflictCheck,
+PendingSanityCheck, PendingGapCheck), fill it from model signals, and
+work through it in batches; researcher.timeline drops cached timelines
+from the same signals.  This module holds what they share:
+
+    enqueue(name, fields, keys)   adds the keys not already queued
+    work_through(name, fields, handle)
+                                  hands the queue over a batch at a
+                                  time, dequeuing each batch in the
+                                  transaction that handles it
+    on_assertion_change(receiver) calls a function with each saved or
+                                  deleted assertion and the state it
+                                  had before, read once for every
+                                  receiver
+
+A save that leaves every WATCHED_FIELDS value as it was (a new rationale,
+say) calls no receiver.  The rows the receivers queue while handling one
+assertion are written together at the end, one query per queue, and
+unit_personas reads each unit once however many receivers ask.
+
+Exports:
+    Functions:
+        batches
+        connect_signals
+        enqueue
+        on_assertion_change
+        personas_named
+        subject_personas
+        subjects_of
+        unit_personas
+        work_through
+    Classes:
+        AssertionState
+"""
+import collections
+import threading
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+
+# Rows handled together, and ids in one IN list.
+BATCH_SIZE = 500
+
+SUBJECT_FIELDS = ('subject1_type', 'subject1', 'subject2_type', 'subject2')
+
+# Everything the derived tables and checks read from an assertion.
+WATCHED_FIELDS = SUBJECT_FIELDS + (
+    'value_role',
+    'disproved',
+    'source_id',
+    'surety_scheme_part_id',
+)
+
+AssertionState = collections.namedtuple('AssertionState', WATCHED_FIELDS)
+AssertionState.__doc__ = """An assertion's WATCHED_FIELDS before a save."""
+
+_assertion_receivers = []
+
+# What the receivers of the assertion being handled have asked for.
+_local = threading.local()
+
+
+def batches(ids):
+    """Split ids into sorted lists short enough for an IN query."""
+    ids = sorted(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def personas_named(queryset):
+    """List the personas named by the assertions in a queryset."""
+    return [
+        pk
+        for subjects in queryset.filter(
+            Q(subject1_type='P') | Q(subject2_type='P')
+        ).values_list(*SUBJECT_FIELDS)
+        for pk in subject_personas(subjects)
+    ]
+
+
+def subjects_of(assertion):
+    """Get (subject1_type, subject1, subject2_type, subject2).
+
+    Arguments:
+        assertion -- an Assertion or an AssertionState
+    """
+    return tuple(getattr(assertion, name) for name in SUBJECT_FIELDS)
+
+
+def subject_personas(subjects):
+    """List the personas among an assertion's subjects.
+
+    Arguments:
+        subjects -- (subject1_type, subject1, subject2_type, subject2)
+    Returns: a list of persona ids
+    """
+    type1, id1, type2, id2 = subjects
+    return [pk for kind, pk in ((type1, id1), (type2, id2)) if kind == 'P']
+
+
+def unit_personas(kind, unit):
+    """List the personas in an event ('E') or group ('G')."""
+    units = getattr(_local, 'units', None)
+    if units is not None and (kind, unit) in units:
+        return list(units[kind, unit])
+    if kind == 'E':
+        model, field = 'EventParticipation', 'event'
+    else:
+        model, field = 'GroupMembership', 'group'
+    found = list(apps.get_model('researcher', model).objects.filter(
+        **{field: unit}
+    ).values_list('persona', flat=True))
+    if units is not None:
+        units[kind, unit] = found
+    return list(found)
+
+
+def enqueue(name, fields, keys):
+    """Queue rows, skipping those already queued.
+
+    Arguments:
+        name -- the queue model's name, e.g. 'PendingGapCheck'
+        fields -- the names of the fields the queue is unique on, the
+            first a foreign key, e.g. ('persona', 'kind')
+        keys -- tuples of the rows' values of `fields`, ids for foreign
+            keys
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.setdefault((name, tuple(fields)), set()).update(keys)
+        return
+    _write(name, fields, keys)
+
+
+def _write(name, fields, keys):
+    """Add the rows of a queue not already queued."""
+    model = apps.get_model('researcher', name)
+    attnames = [model._meta.get_field(field).attname for field in fields]
+    for batch in batches(set(keys)):
+        queued = set(model.objects.filter(**{
+            fields[0] + '__in': set(key[0] for key in batch)
+        }).values_list(*fields))
+        missing = [
+            model(**dict(zip(attnames, key)))
+            for key in batch if key not in queued
+        ]
+        if not missing:
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(missing)
+        except IntegrityError:
+            # Another process queued some of them first; add the rest.
+            for row in missing:
+                try:
+                    with transaction.atomic():
+                        row.save(force_insert=True)
+                except IntegrityError:
+                    pass
+
+
+def work_through(name, fields, handle, limit=None):
+    """Hand a queue over a batch at a time, oldest first.
+
+    Arguments:
+        name -- the queue model's name
+        fields -- the names of the fields handed over for each row
+        handle -- called with a list of tuples of `fields` per batch
+        limit -- stop after about this many rows; None empties the queue
+    Returns: the number of rows handled
+    """
+    model = apps.get_model('researcher', name)
+    handled = 0
+    while limit is None or handled < limit:
+        pending = list(model.objects.order_by('pk').values_list(
+            'pk', *fields
+        )[:BATCH_SIZE])
+        if not pending:
+            break
+        # Dequeued first, so that changes made while handling queue
+        # again, but in the handling transaction, so that a batch whose
+        # handling fails stays queued.
+        with transaction.atomic():
+            model.objects.filter(
+                pk__in=[row[0] for row in pending]
+            ).delete()
+            handle([row[1:] for row in pending])
+        handled += len(pending)
+    return handled
+
+
+def on_assertion_change(receiver):
+    """Call a function whenever an assertion is saved or deleted.
+
+    Arguments:
+        receiver -- called as receiver(assertion, before, raw, deleted),
+            where before is the AssertionState the assertion had before
+            it was saved (None for a new or deleted assertion), raw is
+            True for rows loaded from fixtures and deleted is True once
+            the assertion has been deleted
+    """
+    if receiver not in _assertion_receivers:
+        _assertion_receivers.append(receiver)
+
+
+def _dispatch(assertion, before, raw, deleted):
+    """Hand an assertion to every receiver, then write what they queued."""
+    if getattr(_local, 'pending', None) is not None:
+        # Saved by a receiver: what it queues joins the outer handling.
+        for receiver in _assertion_receivers:
+            receiver(assertion, before, raw, deleted)
+        return
+    _local.pending = collections.OrderedDict()
+    _local.units = {}
+    try:
+        for receiver in _assertion_receivers:
+            receiver(assertion, before, raw, deleted)
+        pending = _local.pending
+    finally:
+        _local.pending = None
+        _local.units = None
+    for (name, fields), keys in pending.items():
+        _write(name, fields, keys)
+
+
+def _assertion_saving(sender, instance, raw=False, **kwargs):
+    """Signal receiver that reads an assertion's state before a save."""
+    instance._state_before = None
+    if not raw and instance.pk is not None and _assertion_receivers:
+        found = sender._default_manager.filter(
+            pk=instance.pk
+        ).values_list(*WATCHED_FIELDS).first()
+        if found is not None:
+            instance._state_before = AssertionState(*found)
+
+
+def _assertion_saved(sender, instance, created=False, raw=False, **kwargs):
+    """Signal receiver that passes a changed assertion on."""
+    before = getattr(instance, '_state_before', None)
+    instance._state_before = None
+    if (not created and before is not None and
+            before == AssertionState(*[
+                getattr(instance, name) for name in WATCHED_FIELDS
+            ])):
+        return
+    _dispatch(instance, before, raw, False)
+
+
+def _assertion_deleted(sender, instance, **kwargs):
+    """Signal receiver that passes a deleted assertion on."""
+    _dispatch(instance, None, False, True)
+
+
+def connect_signals():
+    """Pass assertion changes on to the receivers registered for them."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    uid = 'researcher.queues.Assertion'
+    pre_save.connect(_assertion_saving, sender=Assertion, dispatch_uid=uid)
+    post_save.connect(_assertion_saved, sender=Assertion, dispatch_uid=uid)
+    post_delete.connect(_assertion_deleted, sender=Assertion,
+                        dispatch_uid=uid)
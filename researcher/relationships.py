@@ -0,0 +1,980 @@
+"""Work out how two personas are related.
+
+Parentage is never stored directly.  It is concluded from Assertions
+that place personas in a lineage Event (a birth or baptism, say) or a
+family Group in a parent or a child role.  An event or group type counts
+as a lineage type when its EventTypeRoles or GroupTypeRoles include
+both a parent role and a child role, named by the settings
+RESEARCHER_PARENT_ROLES and RESEARCHER_CHILD_ROLES.  Within one such
+event or group (a "unit") every persona in a parent role is a parent of
+every persona in a child role.  Disproved assertions are ignored.
+
+Each process keeps the resulting parent/child adjacency in memory as
+tuples of persona ids, built on first use with a handful of queries.
+Saving or deleting an assertion updates the units it touches in place.
+Other processes catch up in one of two ways:
+
+    new rows     when the Assertion, Event or Group table version
+                 (researcher.versions) moves, the ids above the highest
+                 one the graph has seen are read, and only the lineage
+                 assertions among them, or naming new lineage events and
+                 groups, are folded in.  An id skipped on the way (its
+                 transaction may not have committed yet) is looked for
+                 again for GAP_TIMEOUT seconds.
+    other edits  editing or deleting a lineage assertion, changing the
+                 type of an event or group to or from a lineage type, or
+                 deleting a lineage event or group bumps the named
+                 version GRAPH_VERSION; a process that finds it differs
+                 from the one it loaded rebuilds the graph, as it does
+                 when the role tables change.
+
+So a save unrelated to parentage costs other processes one query for new
+ids, and never a rebuild.  Bulk operations that bypass model signals
+(the importer, moving a project between shards) call invalidate_graph.
+
+Relationships are found with a bidirectional breadth first search up
+the two pedigrees, which stops at the nearest common ancestors without
+visiting the rest of the network.  Relatives through only one of a
+couple are half relatives, and personas who share a child are partners,
+through whom in-laws are named.  Full ancestor sets are cached per
+persona until the graph changes.  Whenever parent/child links change,
+the named version 'lineage' (see researcher.versions) is bumped so that
+data derived from them, such as cached charts, can be rebuilt.
+
+Exports:
+    Functions:
+        connect_signals
+        describe
+        graph
+        invalidate_graph
+        lineage_assertions
+        lineage_roles
+        lineage_units
+    Classes:
+        FamilyGraph
+        Relationship
+"""
+import collections
+import gc
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from researcher import replicas
+from researcher.lookups import CHECK_INTERVAL, lookup
+from researcher.queues import batches, on_assertion_change, subjects_of
+from researcher.versions import bump_version, table_versions, version
+
+PARENT_ROLES = getattr(
+    settings,
+    'RESEARCHER_PARENT_ROLES',
+    ('Father', 'Mother', 'Parent')
+)
+
+CHILD_ROLES = getattr(
+    settings,
+    'RESEARCHER_CHILD_ROLES',
+    ('Child', 'Son', 'Daughter')
+)
+
+ANCESTOR_CACHE_SIZE = getattr(
+    settings,
+    'RESEARCHER_ANCESTOR_CACHE_SIZE',
+    10000
+)
+
+# Seconds an id skipped while catching up is looked for again, in case
+# it belonged to a transaction that had not committed yet.
+GAP_TIMEOUT = getattr(settings, 'RESEARCHER_GRAPH_GAP_TIMEOUT', 600)
+
+# The named version moved by changes that new rows do not explain.
+GRAPH_VERSION = 'family-graph'
+
+# The tables whose new rows are folded in, with the field holding the
+# type of an event or group.
+GROWING_MODELS = (
+    ('Assertion', None),
+    ('Event', 'event_type_id'),
+    ('Group', 'group_type_id'),
+)
+
+# The tables naming the lineage roles; any change rebuilds the graph.
+ROLE_MODELS = ('EventTypeRole', 'GroupTypeRole')
+
+Relationship = collections.namedtuple(
+    'Relationship',
+    'name up down common_ancestors path'
+)
+Relationship.__doc__ = """How one persona is related to another.
+
+    name -- e.g. 'parent', 'half-sibling', '2nd cousin 1 time
+        removed', 'partner' (the two share a child), 'sibling-in-law'
+        (a partner's sibling, or a sibling's partner), or None when the
+        two are related in none of these ways
+    up -- generations from the first persona to the common ancestors
+    down -- generations from the common ancestors to the second persona
+    common_ancestors -- the nearest common ancestors' persona ids
+    path -- persona ids from the first persona to the second, through
+        one of the common ancestors (or through any chain of parents and
+        children when there is no common ancestor); None if the two are
+        not connected at all
+
+    For an in-law, up, down and common_ancestors describe the blood
+    relationship between the persona and the partner; for partners they
+    are None and [].
+    """
+
+
+def _ordinal(number):
+    """Spell a number as an ordinal, e.g. 1st, 2nd, 11th, 23rd."""
+    if 10 <= number % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return '%d%s' % (number, suffix)
+
+
+def describe(up, down, half=False):
+    """Name a blood relationship.
+
+    Arguments:
+        up -- generations from the first persona up to the common ancestor
+        down -- generations from the common ancestor down to the second
+        half -- whether the two descend from only one of a couple
+    Returns: what the second persona is to the first, e.g. 'grandparent',
+        'half-niece/nephew' or '1st cousin 2 times removed'
+    """
+    if up == 0 and down == 0:
+        return 'self'
+    if down == 0:
+        return _lineal(up, 'parent')
+    if up == 0:
+        return _lineal(down, 'child')
+    prefix = 'half-' if half else ''
+    if up == 1 and down == 1:
+        return prefix + 'sibling'
+    if down == 1:
+        return prefix + 'great-' * (up - 2) + 'aunt/uncle'
+    if up == 1:
+        return prefix + 'great-' * (down - 2) + 'niece/nephew'
+    removed = abs(up - down)
+    name = '%s cousin' % _ordinal(min(up, down) - 1)
+    if half:
+        name = 'half ' + name
+    if removed:
+        name += ' %d time%s removed' % (removed, '' if removed == 1 else 's')
+    return name
+
+
+def _in_lineage(unit, role):
+    """Tell whether an assertion can make a parent or a child."""
+    return unit is not None and (role in PARENT_ROLES or role in CHILD_ROLES)
+
+
+def _lineal(generations, name):
+    """Name a direct ancestor or descendant by generations."""
+    if generations == 1:
+        return name
+    return 'great-' * (generations - 2) + 'grand' + name
+
+
+def lineage_roles():
+    """Work out which role names make a persona a parent or a child.
+
+    Returns: a dict mapping 'E' and 'G' to (lineage type ids, parent
+        role names, child role names)
+    """
+    roles = {}
+    for kind, table, type_attr in (
+            ('E', 'EventTypeRole', 'event_type_id'),
+            ('G', 'GroupTypeRole', 'group_type_id')):
+        parents = collections.defaultdict(set)
+        children = collections.defaultdict(set)
+        for role in lookup(table).all():
+            type_id = getattr(role, type_attr)
+            if role.name in PARENT_ROLES:
+                parents[type_id].add(role.name)
+            elif role.name in CHILD_ROLES:
+                children[type_id].add(role.name)
+        type_ids = set(parents) & set(children)
+        roles[kind] = (
+            type_ids,
+            set().union(*[parents[t] for t in type_ids]),
+            set().union(*[children[t] for t in type_ids]),
+        )
+    return roles
+
+
+def lineage_units(kind, roles=None):
+    """Build a queryset of the ids of lineage events or groups.
+
+    Arguments:
+        kind -- 'E' for events or 'G' for groups
+        roles -- the result of lineage_roles(), if already at hand
+    Returns: a flat values_list queryset of ids
+    """
+    type_ids = (roles or lineage_roles())[kind][0]
+    if kind == 'E':
+        return apps.get_model('researcher', 'Event').objects.filter(
+            event_type__in=type_ids
+        ).values_list('pk', flat=True)
+    return apps.get_model('researcher', 'Group').objects.filter(
+        group_type__in=type_ids
+    ).values_list('pk', flat=True)
+
+
+def lineage_assertions(extra=None, kinds=('E', 'G'), roles=None,
+                       include_disproved=False):
+    """Read the assertions placing personas in lineage events or groups.
+
+    Arguments:
+        extra -- optional Q further restricting the assertions
+        kinds -- the unit kinds to read, 'E' and/or 'G'
+        roles -- the result of lineage_roles(), if already at hand
+        include_disproved -- whether to read disproved assertions too
+    Returns: an iterator of (unit, assertion id, persona id, is_parent,
+        role name) tuples, where a unit is a (kind, id) pair
+    """
+    Assertion = apps.get_model('researcher', 'Assertion')
+    roles = roles or lineage_roles()
+    for kind in kinds:
+        type_ids, parents, children = roles[kind]
+        if not type_ids:
+            continue
+        # One shared string per role name rather than one per row.
+        names = dict((name, name) for name in parents | children)
+        units = lineage_units(kind, roles)
+        queryset = Assertion.objects.filter(
+            Q(subject1_type='P', subject2_type=kind, subject2__in=units) |
+            Q(subject2_type='P', subject1_type=kind, subject1__in=units),
+            value_role__in=parents | children,
+        )
+        if not include_disproved:
+            queryset = queryset.filter(disproved=False)
+        if extra is not None:
+            queryset = queryset.filter(extra)
+        rows = queryset.values_list(
+            'pk', 'subject1_type', 'subject1', 'subject2', 'value_role'
+        )
+        for pk, subject1_type, subject1, subject2, role in rows.iterator():
+            if subject1_type == 'P':
+                persona, unit = subject1, subject2
+            else:
+                persona, unit = subject2, subject1
+            yield (kind, unit), pk, persona, role in parents, names[role]
+
+
+class FamilyGraph(object):
+
+    """The parent/child network concluded from the assertions.
+
+    Callers get the shared instance from graph().  Ids throughout are
+    Persona primary keys.
+    """
+
+    def __init__(self):
+        """Prepare an empty graph; it loads on first use."""
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._checked = 0
+        self._clear()
+
+    def _clear(self):
+        """Forget everything loaded so far."""
+        self._parents = {}
+        self._children = {}
+        # unit -> ((assertion id, persona id, is_parent, role), ...)
+        self._units = {}
+        self._parent_units = {}
+        self._child_units = {}
+        self._ancestors = {}
+        self._graph_version = None
+        self._versions = {}
+        self._max_pks = {}
+        # model -> {skipped id: when it was first skipped}
+        self._gaps = {}
+        self._roles = None
+
+    # Roles
+
+    def _lineage_roles(self):
+        """Read (once per load) which roles make parents and children."""
+        if self._roles is None:
+            self._roles = lineage_roles()
+        return self._roles
+
+    def _unit_queryset(self, kind):
+        """Build a queryset of the ids of lineage events or groups."""
+        return lineage_units(kind, self._lineage_roles())
+
+    def _lineage_assertions(self, extra=None, kinds=('E', 'G')):
+        """Read the lineage assertions, or those matching `extra`."""
+        return lineage_assertions(extra, kinds, self._lineage_roles())
+
+    # Loading and refreshing
+
+    def _watched(self):
+        """List the model classes whose table versions are watched."""
+        return [
+            apps.get_model('researcher', name)
+            for name in [name for name, field in GROWING_MODELS] +
+            list(ROLE_MODELS)
+        ]
+
+    def _max_pk(self, model):
+        """Find the highest primary key in a table, or 0."""
+        last = model._default_manager.order_by('-pk').values_list(
+            'pk', flat=True
+        )[:1]
+        return last[0] if last else 0
+
+    def _load(self):
+        """Build the whole graph from the database."""
+        reloading = self._graph_version is not None
+        self._clear()
+        models = self._watched()
+        # Read versions first, so that changes made during the load are
+        # picked up by the next refresh rather than lost.
+        self._graph_version = version(GRAPH_VERSION)
+        self._versions = dict(zip(models, table_versions(models)))
+        for name, field in GROWING_MODELS:
+            model = apps.get_model('researcher', name)
+            self._max_pks[model] = self._max_pk(model)
+            self._gaps[model] = {}
+        units = {}
+        # The load allocates millions of small tuples, none of which can
+        # form a cycle; pausing the collector spares it repeated scans.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self._build(units)
+        finally:
+            if collecting:
+                gc.enable()
+        self._loaded = True
+        if reloading:
+            bump_version('lineage')
+
+    def _build(self, units):
+        """Fill the graph from the lineage assertions.
+
+        Arguments:
+            self
+            units -- an empty dict to collect the units in
+        """
+        for unit, pk, persona, is_parent, role in \
+                self._lineage_assertions():
+            units.setdefault(unit, []).append((pk, persona, is_parent, role))
+        parents = {}
+        children = {}
+        for unit, members in units.items():
+            self._units[unit] = tuple(members)
+            ups = set(member[1] for member in members if member[2])
+            downs = set(member[1] for member in members if not member[2])
+            for persona in ups:
+                self._parent_units[persona] = \
+                    self._parent_units.get(persona, ()) + (unit,)
+                children.setdefault(persona, set()).update(downs)
+            for persona in downs:
+                self._child_units[persona] = \
+                    self._child_units.get(persona, ()) + (unit,)
+                parents.setdefault(persona, set()).update(ups)
+        for linked, adjacency in ((parents, self._parents),
+                                  (children, self._children)):
+            for persona, others in linked.items():
+                others.discard(persona)
+                if others:
+                    adjacency[persona] = tuple(sorted(others))
+
+    def refresh(self):
+        """Bring the graph up to date with changes from other processes."""
+        now = time.time()
+        if self._loaded and now - self._checked < CHECK_INTERVAL:
+            return
+        # The graph is kept under the table versions, so it is only ever
+        # read from the primary.
+        with self._lock, replicas.primary_reads():
+            if not self._loaded:
+                self._load()
+            else:
+                models = self._watched()
+                current = dict(zip(models, table_versions(models)))
+                if version(GRAPH_VERSION) != self._graph_version or any(
+                        current[model] != self._versions[model]
+                        for model in models[len(GROWING_MODELS):]):
+                    self._load()
+                else:
+                    for name, field in GROWING_MODELS:
+                        model = apps.get_model('researcher', name)
+                        if current[model] != self._versions[model]:
+                            self._versions[model] = current[model]
+                            self._catch_up(model, field, now)
+            self._checked = now
+
+    def _catch_up(self, model, type_field, now):
+        """Fold in the rows added to a table since it was last read.
+
+        Arguments:
+            self
+            model -- Assertion, Event or Group
+            type_field -- the field holding an event's or group's type,
+                or None for assertions
+            now -- the time of the check
+        """
+        start = self._max_pks[model]
+        gaps = self._gaps[model]
+        for pk, skipped in list(gaps.items()):
+            if now - skipped > GAP_TIMEOUT:
+                del gaps[pk]
+        new = Q(pk__gt=start)
+        if gaps:
+            new |= Q(pk__in=list(gaps))
+        found = {}
+        fields = ('pk',) if type_field is None else ('pk', type_field)
+        for row in model._default_manager.filter(new).values_list(*fields):
+            found[row[0]] = row[1:]
+        if not found:
+            return
+        end = max([start] + list(found))
+        for pk in set(range(start + 1, end + 1)) - set(found):
+            gaps[pk] = now
+        for pk in found:
+            gaps.pop(pk, None)
+        self._max_pks[model] = end
+        if type_field is None:
+            self._reload(new & Q(pk__lte=end))
+            return
+        kind = 'E' if model.__name__ == 'Event' else 'G'
+        type_ids = self._lineage_roles()[kind][0]
+        units = [pk for pk, (type_id,) in found.items() if type_id in type_ids]
+        for batch in batches(units):
+            self._reload(
+                Q(subject1_type=kind, subject1__in=batch) |
+                Q(subject2_type=kind, subject2__in=batch),
+                kinds=(kind,)
+            )
+
+    def _reload(self, extra, kinds=('E', 'G'), units=()):
+        """Re-read some assertions and fold them into the graph.
+
+        Arguments:
+            self
+            extra -- a Q selecting the assertions to re-read
+            kinds -- the unit kinds they may belong to
+            units -- units to empty first, because every assertion they
+                still have is among those re-read
+        """
+        before = dict((unit, self._units.pop(unit, ())) for unit in units)
+        for unit, pk, persona, is_parent, role in \
+                self._lineage_assertions(extra, kinds):
+            members = self._units.get(unit, ())
+            before.setdefault(unit, members)
+            self._units[unit] = tuple(
+                member for member in members if member[0] != pk
+            ) + ((pk, persona, is_parent, role),)
+        self._relink_units(list(before), before)
+
+    def _relink_units(self, units, before):
+        """Rebuild the adjacency around changed units.
+
+        Arguments:
+            self
+            units -- the (kind, id) pairs of the changed units
+            before -- a dict mapping those units to their members before
+                the change
+        """
+        affected = set()
+        for unit in units:
+            old = set(member[1:3] for member in before.get(unit, ()))
+            new = set(member[1:3] for member in self._units.get(unit, ()))
+            for persona, is_parent in old - new:
+                index = self._parent_units if is_parent else self._child_units
+                remaining = tuple(
+                    other for other in index.get(persona, ()) if other != unit
+                )
+                if remaining:
+                    index[persona] = remaining
+                else:
+                    index.pop(persona, None)
+            for persona, is_parent in new - old:
+                index = self._parent_units if is_parent else self._child_units
+                if unit not in index.get(persona, ()):
+                    index[persona] = index.get(persona, ()) + (unit,)
+            if not new:
+                self._units.pop(unit, None)
+            affected.update(persona for persona, is_parent in old | new)
+        self._relink(affected)
+
+    def _relink(self, personas):
+        """Recompute the parents and children of some personas."""
+        changed = False
+        for persona in personas:
+            for units, wanted, adjacency in (
+                    (self._child_units, True, self._parents),
+                    (self._parent_units, False, self._children)):
+                linked = set()
+                for unit in units.get(persona, ()):
+                    linked.update(
+                        member[1] for member in self._units.get(unit, ())
+                        if member[2] == wanted
+                    )
+                linked.discard(persona)
+                linked = tuple(sorted(linked))
+                if linked != adjacency.get(persona, ()):
+                    changed = True
+                    if linked:
+                        adjacency[persona] = linked
+                    else:
+                        del adjacency[persona]
+        if changed:
+            self._ancestors = {}
+            bump_version('lineage')
+
+    @staticmethod
+    def _unit_of(subject1_type, subject1, subject2_type, subject2):
+        """Find the event or group an assertion places a persona in."""
+        if subject1_type == 'P' and subject2_type in ('E', 'G'):
+            return subject2_type, subject2
+        if subject2_type == 'P' and subject1_type in ('E', 'G'):
+            return subject1_type, subject1
+        return None
+
+    def assertion_changed(self, assertion, before=None, deleted=False):
+        """Apply one saved or deleted assertion to the graph.
+
+        Arguments:
+            self
+            assertion -- the Assertion
+            before -- its queues.AssertionState before an update, or
+                None if it was just inserted
+            deleted -- whether the assertion was just deleted
+        """
+        unit = self._unit_of(*subjects_of(assertion))
+        old_unit = None
+        if before is not None:
+            old_unit = self._unit_of(*subjects_of(before))
+            if any(getattr(before, name) != getattr(assertion, name)
+                   for name in ('subject1_type', 'subject1',
+                                'subject2_type', 'subject2',
+                                'value_role', 'disproved')) and (
+                    _in_lineage(old_unit, before.value_role) or
+                    _in_lineage(unit, assertion.value_role)):
+                bump_version(GRAPH_VERSION)
+        elif deleted and _in_lineage(unit, assertion.value_role):
+            bump_version(GRAPH_VERSION)
+        with self._lock:
+            if not self._loaded:
+                return
+            emptied = {}
+            for changed in set([unit, old_unit]) - set([None]):
+                members = self._units.get(changed, ())
+                if any(member[0] == assertion.pk for member in members):
+                    emptied[changed] = members
+                    self._units[changed] = tuple(
+                        member for member in members
+                        if member[0] != assertion.pk
+                    )
+            self._relink_units(list(emptied), emptied)
+            if unit is not None and not deleted:
+                self._reload(Q(pk=assertion.pk), kinds=(unit[0],))
+
+    def unit_changed(self, model, pk, old_type=None, new_type=None):
+        """Apply a retyped or deleted event or group to the graph.
+
+        Arguments:
+            self
+            model -- the Event or Group class
+            pk -- the id of the event or group
+            old_type -- its type id before the change
+            new_type -- its type id now, or None if it was deleted
+        """
+        kind = 'E' if model.__name__ == 'Event' else 'G'
+        type_ids = lineage_roles()[kind][0]
+        if old_type not in type_ids and new_type not in type_ids:
+            return
+        bump_version(GRAPH_VERSION)
+        with self._lock:
+            if not self._loaded:
+                return
+            self._reload(
+                Q(subject1_type=kind, subject1=pk) |
+                Q(subject2_type=kind, subject2=pk),
+                kinds=(kind,),
+                units=[(kind, pk)]
+            )
+
+    def clear(self):
+        """Drop this process's graph so the next use rebuilds it."""
+        with self._lock:
+            self._loaded = False
+
+    # Queries
+
+    def parents(self, persona):
+        """List the ids of a persona's parents."""
+        self.refresh()
+        return self._parents.get(persona, ())
+
+    def children(self, persona):
+        """List the ids of a persona's children."""
+        self.refresh()
+        return self._children.get(persona, ())
+
+    def parent_roles(self, persona):
+        """List a persona's parents with the roles they were named in.
+
+        Arguments:
+            self
+            persona -- the persona id
+        Returns: a sorted list of distinct (parent id, role name) pairs
+        """
+        self.refresh()
+        found = set()
+        for unit in self._child_units.get(persona, ()):
+            found.update(
+                (member[1], member[3]) for member in self._units[unit]
+                if member[2] and member[1] != persona
+            )
+        return sorted(found)
+
+    def birth_units(self, persona):
+        """List the lineage events and groups naming a persona as a child.
+
+        Arguments:
+            self
+            persona -- the persona id
+        Returns: a tuple of ('E', event id) and ('G', group id) pairs
+        """
+        self.refresh()
+        return self._child_units.get(persona, ())
+
+    def ancestors(self, persona):
+        """Find all of a persona's ancestors.
+
+        Arguments:
+            self
+            persona -- the persona id
+        Returns: a dict mapping ancestor ids to the fewest generations
+            between the persona and the ancestor
+        """
+        self.refresh()
+        found = self._ancestors.get(persona)
+        if found is None:
+            found = {}
+            level = [persona]
+            generation = 0
+            while level:
+                generation += 1
+                upper = []
+                for child in level:
+                    for parent in self._parents.get(child, ()):
+                        if parent not in found and parent != persona:
+                            found[parent] = generation
+                            upper.append(parent)
+                level = upper
+            if len(self._ancestors) >= ANCESTOR_CACHE_SIZE:
+                self._ancestors = {}
+            self._ancestors[persona] = found
+        return found
+
+    def is_ancestor(self, ancestor, persona):
+        """Report whether one persona is an ancestor of another."""
+        return ancestor in self.ancestors(persona)
+
+    def relationship(self, first, second):
+        """Work out how the second persona is related to the first.
+
+        Arguments:
+            self
+            first -- a persona id
+            second -- another persona id
+        Returns: a Relationship
+        """
+        self.refresh()
+        found = self._by_blood(first, second) or \
+            self._by_partner(first, second)
+        if found is None:
+            found = Relationship(None, None, None, [],
+                                 self.path(first, second))
+        return found
+
+    def _by_blood(self, first, second):
+        """Relate two personas through their nearest common ancestors.
+
+        Arguments:
+            self
+            first -- a persona id
+            second -- another persona id
+        Returns: a Relationship, or None if they share no ancestor
+        """
+        up, down, common = self._nearest_common_ancestors(first, second)
+        if not common:
+            return None
+        path = self._lineal_path(first, common[0], up, self._parents) + \
+            self._lineal_path(common[0], second, down, self._children)[1:]
+        # Full relatives would share the ancestor's partner too, at the
+        # same distance, so one common ancestor means half relatives,
+        # unless the other parent on either line is simply not known.
+        half = bool(
+            up and down and len(common) == 1 and
+            len(self._parents.get(path[up - 1], ())) > 1 and
+            len(self._parents.get(path[up + 1], ())) > 1
+        )
+        return Relationship(describe(up, down, half), up, down, common, path)
+
+    def _partners(self, persona):
+        """List the personas who share a child with a persona."""
+        found = set()
+        for child in self._children.get(persona, ()):
+            found.update(self._parents.get(child, ()))
+        found.discard(persona)
+        return sorted(found)
+
+    def _by_partner(self, first, second):
+        """Relate two personas through the partner of one of them.
+
+        Arguments:
+            self
+            first -- a persona id
+            second -- another persona id
+        Returns: a Relationship for partners or the nearest in-law, or
+            None if neither has a partner related to the other by blood
+        """
+        if second in self._partners(first):
+            return Relationship('partner', None, None, [],
+                                self.path(first, second))
+        best = None
+        for partner, start, end in (
+                [(partner, first, partner)
+                 for partner in self._partners(second)] +
+                [(partner, partner, second)
+                 for partner in self._partners(first)]):
+            blood = self._by_blood(start, end)
+            if blood is not None and (
+                    best is None or
+                    blood.up + blood.down < best[0].up + best[0].down):
+                best = blood, partner, start == first
+        if best is None:
+            return None
+        blood, partner, partner_second = best
+        if partner_second:
+            path = blood.path + self.path(partner, second)[1:]
+        else:
+            path = self.path(first, partner) + blood.path[1:]
+        return Relationship(blood.name + '-in-law', blood.up, blood.down,
+                            blood.common_ancestors, path)
+
+    def _nearest_common_ancestors(self, first, second):
+        """Search up both pedigrees at once for the nearest meeting.
+
+        Arguments:
+            self
+            first -- a persona id
+            second -- another persona id
+        Returns: (up, down, common ancestor ids), or (None, None, []) if
+            the two share no ancestor
+        """
+        seen = ({first: 0}, {second: 0})
+        frontier = ([first], [second])
+        depth = [0, 0]
+        best = None
+        common = []
+        if first == second:
+            return 0, 0, [first]
+        while frontier[0] or frontier[1]:
+            if best is not None and best <= min(
+                    depth[side] + 1 for side in (0, 1) if frontier[side]):
+                break
+            side = 0 if frontier[0] and (
+                not frontier[1] or len(frontier[0]) <= len(frontier[1])
+            ) else 1
+            depth[side] += 1
+            upper = []
+            for child in frontier[side]:
+                for parent in self._parents.get(child, ()):
+                    if parent in seen[side]:
+                        continue
+                    seen[side][parent] = depth[side]
+                    upper.append(parent)
+                    other = seen[1 - side].get(parent)
+                    if other is None:
+                        continue
+                    total = depth[side] + other
+                    if best is None or total < best:
+                        best, common = total, []
+                    if total == best:
+                        common.append(parent)
+            frontier[side][:] = []
+            frontier = (upper, frontier[1]) if side == 0 \
+                else (frontier[0], upper)
+        for persona in (first, second):
+            if persona in seen[0] and persona in seen[1]:
+                total = seen[0][persona] + seen[1][persona]
+                if best is None or total < best:
+                    best, common = total, [persona]
+        if best is None:
+            return None, None, []
+        # Prefer the meetings fewest generations up from the first persona.
+        common.sort(key=lambda persona: (seen[0][persona], persona))
+        up = seen[0][common[0]]
+        common = [persona for persona in common if seen[0][persona] == up]
+        return up, best - up, common
+
+    def _lineal_path(self, start, end, generations, adjacency):
+        """Trace a straight line of parents or children between two ids.
+
+        Arguments:
+            self
+            start -- where the line starts
+            end -- where it ends
+            generations -- how many steps apart they are
+            adjacency -- self._parents to go up or self._children to go
+                down
+        Returns: the ids along the line, including both ends
+        """
+        if generations == 0:
+            return [start]
+        # Search back from the end so each step is known to lead there.
+        reverse = self._children if adjacency is self._parents \
+            else self._parents
+        distance = {end: 0}
+        level = [end]
+        for step in range(1, generations + 1):
+            following = []
+            for persona in level:
+                for other in reverse.get(persona, ()):
+                    if other not in distance:
+                        distance[other] = step
+                        following.append(other)
+            level = following
+        line = [start]
+        for step in range(generations - 1, -1, -1):
+            line.append(next(
+                other for other in adjacency.get(line[-1], ())
+                if distance.get(other) == step
+            ))
+        return line
+
+    def path(self, first, second):
+        """Find the shortest chain of parents and children between two.
+
+        Arguments:
+            self
+            first -- a persona id
+            second -- another persona id
+        Returns: the persona ids along the chain, or None if the two are
+            not connected
+        """
+        self.refresh()
+        if first == second:
+            return [first]
+        came_from = ({first: None}, {second: None})
+        frontier = ([first], [second])
+        while frontier[0] and frontier[1]:
+            side = 0 if len(frontier[0]) <= len(frontier[1]) else 1
+            following = []
+            for persona in frontier[side]:
+                for other in self._parents.get(persona, ()) + \
+                        self._children.get(persona, ()):
+                    if other in came_from[side]:
+                        continue
+                    came_from[side][other] = persona
+                    if other in came_from[1 - side]:
+                        return self._join(came_from, other)
+                    following.append(other)
+            frontier = (following, frontier[1]) if side == 0 \
+                else (frontier[0], following)
+        return None
+
+    @staticmethod
+    def _join(came_from, middle):
+        """Join the two halves of a bidirectional search at `middle`."""
+        line = []
+        persona = middle
+        while persona is not None:
+            line.append(persona)
+            persona = came_from[0][persona]
+        line.reverse()
+        persona = came_from[1][middle]
+        while persona is not None:
+            line.append(persona)
+            persona = came_from[1][persona]
+        return line
+
+
+_GRAPH = FamilyGraph()
+
+
+def graph():
+    """Get this process's FamilyGraph."""
+    return _GRAPH
+
+
+def invalidate_graph():
+    """Make every process rebuild its family graph on next use.
+
+    For bulk writes to assertions, events or groups that bypass model
+    signals, after they commit.
+    """
+    bump_version(GRAPH_VERSION)
+
+
+def _assertion_changed(instance, before, raw, deleted):
+    """Assertion receiver that applies a change to the graph."""
+    _GRAPH.assertion_changed(instance, before, deleted)
+
+
+def _unit_type(model):
+    """Name the field holding an event's or group's type."""
+    return dict(GROWING_MODELS)[model.__name__]
+
+
+def _unit_saving(sender, instance, **kwargs):
+    """Signal receiver that notes the type an event or group had."""
+    if instance.pk is not None:
+        old = list(sender._default_manager.filter(
+            pk=instance.pk
+        ).values_list(_unit_type(sender), flat=True))
+        instance._family_type = old[0] if old else None
+
+
+def _unit_saved(sender, instance, created=False, **kwargs):
+    """Signal receiver for saved events and groups.
+
+    A new event or group is found by the next refresh.
+    """
+    old_type = getattr(instance, '_family_type', None)
+    new_type = getattr(instance, _unit_type(sender))
+    if not created and old_type != new_type:
+        _GRAPH.unit_changed(sender, instance.pk, old_type, new_type)
+
+
+def _unit_deleted(sender, instance, **kwargs):
+    """Signal receiver for deleted events and groups."""
+    _GRAPH.unit_changed(sender, instance.pk,
+                        getattr(instance, _unit_type(sender)))
+
+
+def _roles_changed(sender, **kwargs):
+    """Signal receiver for the event and group role tables."""
+    _GRAPH.clear()
+
+
+def connect_signals():
+    """Keep the family graph current as its source rows change."""
+    on_assertion_change(_assertion_changed)
+    for name in ('Event', 'Group'):
+        model = apps.get_model('researcher', name)
+        uid = 'researcher.relationships.%s' % name
+        pre_save.connect(_unit_saving, sender=model, dispatch_uid=uid)
+        post_save.connect(_unit_saved, sender=model, dispatch_uid=uid)
+        post_delete.connect(_unit_deleted, sender=model, dispatch_uid=uid)
+    for name in ROLE_MODELS:
+        model = apps.get_model('researcher', name)
+        uid = 'researcher.relationships.%s' % name
+        post_save.connect(_roles_changed, sender=model, dispatch_uid=uid)
+        post_delete.connect(_roles_changed, sender=model, dispatch_uid=uid)
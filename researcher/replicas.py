@@ -0,0 +1,310 @@
+"""Send reports, exports and analytics to read replicas.
+
+RESEARCHER_REPLICAS names the replicas of each database alias, the
+default database and shards alike.  Queries go to a replica only where
+stale data is acceptable:
+
+    inside replica_reads(), or through read_only(queryset)
+    in the views named in RESEARCHER_REPLICA_VIEWS (GET and HEAD only)
+    in management commands with `--replica` or use_replica set
+    in job tasks registered with @task(name, replica=True)
+
+Reads of the researcher tables are sent there; sessions, users of
+django.contrib.auth and everything else stay on the primary.  One
+replica is picked per database for a whole block, so its queries see
+one consistent state.
+
+Writes always go to the primary, including saves of instances read
+from a replica.  A thread that writes reads from the primaries for the
+next RESEARCHER_REPLICA_PIN_SECONDS, and ReplicaMiddleware carries that
+over to the session's next requests.  Set it longer than the replicas
+lag, and researchers always see their own edits.
+
+Anything cached under a table version (see researcher.versions) must
+come from the primary: a replica may lag the version it is read under,
+and the stale rows would then be served as current to everyone,
+including the writer read-your-writes is for.  Code filling such a
+cache checks reading_replicas() and then leaves the cache alone, or
+reads inside primary_reads().  The API leaves out the ETag of responses
+read from replicas for the same reason.
+
+For testing without real replication, a replica may be a local stand-in
+that refresh_standin() (`manage.py refresh_replica`) fills with a copy
+of its primary: a SQLite file, or a second PostgreSQL database on the
+same server.  It stays as stale as the last refresh.
+
+Exports:
+    Functions:
+        primary_of
+        primary_reads
+        read_only
+        reading_replicas
+        refresh_standin
+        replica_for
+        replica_reads
+    Classes:
+        ReplicaMiddleware
+        ReplicaRouter
+"""
+import contextlib
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from researcher import shards
+
+REPLICAS = getattr(settings, 'RESEARCHER_REPLICAS', {})
+
+VIEWS = frozenset(getattr(settings, 'RESEARCHER_REPLICA_VIEWS', ()))
+
+PIN_SECONDS = getattr(settings, 'RESEARCHER_REPLICA_PIN_SECONDS', 10)
+
+SESSION_KEY = 'researcher_replica_pinned_until'
+
+_PRIMARIES = dict(
+    (replica, primary)
+    for primary, replicas in REPLICAS.items()
+    for replica in replicas
+)
+
+_local = threading.local()
+
+
+def primary_of(alias):
+    """Name the primary of a replica; any other alias is its own.
+
+    Arguments:
+        alias -- a DATABASES alias
+    Returns: the primary's alias
+    """
+    return _PRIMARIES.get(alias, alias)
+
+
+def replica_for(alias):
+    """Pick the replica the current block reads a database from.
+
+    Arguments:
+        alias -- the primary's alias
+    Returns: a replica's alias, the same one for the rest of the block,
+        or the primary when it has no replicas
+    """
+    replicas = REPLICAS.get(alias)
+    if not replicas:
+        return alias
+    chosen = getattr(_local, 'chosen', None)
+    if chosen is None:
+        chosen = _local.chosen = {}
+    if alias not in chosen:
+        chosen[alias] = random.choice(replicas)
+    return chosen[alias]
+
+
+def _recently_wrote():
+    """Tell whether replicas may not have the thread's own writes yet."""
+    return time.time() < max(
+        getattr(_local, 'wrote_at', 0) + PIN_SECONDS,
+        getattr(_local, 'pinned_until', 0)
+    )
+
+
+def _on_primary():
+    """Tell whether the current thread must read from primaries."""
+    return not getattr(_local, 'reading', False) or _recently_wrote()
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    """Read the researcher tables from replicas in the block.
+
+    Arguments:
+        enabled -- False runs the block unchanged, for callers that
+            decide at run time
+    """
+    previous = (getattr(_local, 'reading', False),
+                getattr(_local, 'chosen', None))
+    if enabled:
+        _local.reading = True
+        _local.chosen = {}
+    try:
+        yield
+    finally:
+        _local.reading, _local.chosen = previous
+
+
+def reading_replicas():
+    """Tell whether the thread's reads may come from a lagging replica.
+
+    Returns: True inside replica blocks, unless the thread or session
+        wrote lately or there are no replicas
+    """
+    return bool(REPLICAS) and not _on_primary()
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Read from the primaries in the block, even inside replica blocks.
+
+    For reads whose results are kept under the current table versions.
+    """
+    previous = getattr(_local, 'reading', False)
+    _local.reading = False
+    try:
+        yield
+    finally:
+        _local.reading = previous
+
+
+def read_only(queryset):
+    """Send a queryset's reads to a replica of its database.
+
+    The queryset stays on the primary for RESEARCHER_REPLICA_PIN_SECONDS
+    after the thread or session last wrote.
+
+    Arguments:
+        queryset -- the QuerySet, not yet evaluated
+    Returns: the queryset, on a replica if it may be
+    """
+    if _recently_wrote():
+        return queryset
+    return queryset.using(replica_for(primary_of(queryset.db)))
+
+
+def _researcher_data(model):
+    """Tell whether reads of a model may go to a replica."""
+    return shards.is_project_data(model) or (
+        model._meta.app_label == 'researcher' and shards.is_shared(model)
+    )
+
+
+class ReplicaRouter(object):
+
+    """Send reads to replicas where allowed, and writes to primaries.
+
+    Comes before researcher.shards.ProjectRouter in DATABASE_ROUTERS; it
+    asks that router which primary holds a model's rows.
+    """
+
+    project_router = shards.ProjectRouter()
+
+    def _primary(self, route, model, hints):
+        """Ask the project router for a model's database, as a primary."""
+        return primary_of(route(model, **hints) or DEFAULT_DB_ALIAS)
+
+    def db_for_read(self, model, **hints):
+        """Read from a replica in replica blocks, else from the primary."""
+        if not _researcher_data(model):
+            return None
+        primary = self._primary(self.project_router.db_for_read, model,
+                                hints)
+        if _on_primary():
+            return primary
+        return replica_for(primary)
+
+    def db_for_write(self, model, **hints):
+        """Write to the primary, and read from primaries for a while."""
+        if not _researcher_data(model):
+            return None
+        _local.wrote_at = time.time()
+        return self._primary(self.project_router.db_for_write, model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Relate rows of a primary and its replicas."""
+        if primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, model):
+        """Leave replicas to replication (or refresh_standin)."""
+        if db in _PRIMARIES:
+            return False
+        return None
+
+
+class ReplicaMiddleware(object):
+
+    """Read from replicas in the designated views, but never stale edits.
+
+    Must come after the session middleware.
+    """
+
+    def process_request(self, request):
+        """Start the request on the primaries, pinned if it wrote lately."""
+        session = getattr(request, 'session', None)
+        request._replica_started = time.time()
+        _local.reading = False
+        _local.wrote_at = 0
+        _local.chosen = {}
+        _local.pinned_until = (
+            session.get(SESSION_KEY, 0) if session is not None else 0
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Read from replicas in the views of RESEARCHER_REPLICA_VIEWS."""
+        match = getattr(request, 'resolver_match', None)
+        if request.method in ('GET', 'HEAD') and match is not None and \
+                match.view_name in VIEWS:
+            _local.reading = True
+
+    def process_response(self, request, response):
+        """Pin the session to the primaries if the request wrote."""
+        wrote_at = getattr(_local, 'wrote_at', 0)
+        started = getattr(request, '_replica_started', time.time())
+        if wrote_at >= started and \
+                getattr(request, 'session', None) is not None:
+            request.session[SESSION_KEY] = wrote_at + PIN_SECONDS
+        _local.reading = False
+        _local.pinned_until = 0
+        _local.chosen = None
+        return response
+
+
+def refresh_standin(replica):
+    """Copy a primary over its local stand-in replica.
+
+    SQLite stand-ins are copied with SQLite's online backup.  PostgreSQL
+    stand-ins are dropped and created again from the primary as a
+    template, which PostgreSQL only allows while nobody else is
+    connected to the primary.
+
+    Arguments:
+        replica -- the stand-in's alias, one of RESEARCHER_REPLICAS
+    Raises: ValueError when the alias is not a replica, or the databases
+        are not both SQLite or both PostgreSQL
+    """
+    if replica not in _PRIMARIES:
+        raise ValueError('%s is not one of RESEARCHER_REPLICAS.' % replica)
+    source = connections[_PRIMARIES[replica]]
+    target = connections[replica]
+    target.close()
+    if source.vendor == target.vendor == 'sqlite':
+        source.ensure_connection()
+        copy = sqlite3.connect(target.settings_dict['NAME'])
+        try:
+            source.connection.backup(copy)
+        finally:
+            copy.close()
+        return
+    if source.vendor != 'postgresql' or target.vendor != 'postgresql':
+        raise ValueError('Only SQLite and PostgreSQL stand-ins are copied.')
+    source.close()
+    # A template cannot be copied from a session connected to either
+    # database, so connect to the server's maintenance database.
+    server = type(target)(
+        dict(target.settings_dict, NAME='postgres'),
+        alias='%s-maintenance' % replica
+    )
+    quote = server.ops.quote_name
+    try:
+        with server.cursor() as cursor:
+            cursor.execute('DROP DATABASE IF EXISTS %s' %
+                           quote(target.settings_dict['NAME']))
+            cursor.execute('CREATE DATABASE %s TEMPLATE %s' % (
+                quote(target.settings_dict['NAME']),
+                quote(source.settings_dict['NAME'])
+            ))
+    finally:
+        server.close()
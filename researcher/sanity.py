@@ -0,0 +1,611 @@
+"""Find genealogical impossibilities in what the assertions say.
+
+Unlike a conflict (see researcher.conflicts), which is two assertions
+that disagree, a sanity problem is a persona whose assertions together
+describe something that cannot have happened: a child born after its
+mother died, a bride of nine, a baptism in a parish founded fifty years
+later.  The rules:
+
+    death-before-birth -- every death date is before every birth date
+    birth-after-mother-death -- the persona was born after its mother
+        died
+    early-marriage -- the persona married, in one of SPOUSE_ROLES,
+        before MIN_MARRIAGE_AGE
+    event-outside-place -- an event falls wholly outside its place's
+        existence dates
+    event-outside-source -- an event falls wholly outside the
+        subject_date range of the source of the assertion placing the
+        persona in it
+
+Each rule runs over a batch of personas at once: the lifespan rules over
+the event and parent groups loaded for researcher.conflicts, the place
+and source rules as one query each comparing the dates in the database.
+A rule is an object with a `name` and a check(personas, facts) method;
+add one with register().  The problems found are stored as
+SanityProblem rows, replacing those found before for the same personas.
+
+Saving or deleting an assertion, event, place or source queues the
+personas it concerns as PendingSanityCheck rows; check_pending()
+rechecks them and their children (whose births may now come after their
+mother's death).  validate_project() checks every persona of a project,
+split across worker processes.  problems() lists a project's problems
+from a per-project cache that is current whenever a check has run.
+
+Exports:
+    Functions:
+        check_pending
+        connect_signals
+        evaluate
+        problems
+        project_personas
+        queue
+        register
+        rules
+        validate_project
+    Classes:
+        BirthAfterMotherDeathRule
+        DeathBeforeBirthRule
+        EarlyMarriageRule
+        EventOutsidePlaceRule
+        EventOutsideSourceRule
+        Facts
+        SanityRule
+"""
+import collections
+import multiprocessing
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+
+from researcher import replicas
+from researcher.charts import MOTHER_ROLES
+from researcher.conflicts import GROUP_LOADERS, SINGLE_EVENT_ROLES
+from researcher.queues import (
+    batches,
+    enqueue,
+    on_assertion_change,
+    subject_personas,
+    subjects_of,
+    work_through,
+)
+from researcher.relationships import lineage_roles
+from researcher.versions import bump_table_version, table_versions
+
+MARRIAGE_EVENT_TYPES = getattr(
+    settings,
+    'RESEARCHER_MARRIAGE_EVENT_TYPES',
+    ('Marriage',)
+)
+
+# The roles of the couple in a marriage, rather than its witnesses.
+SPOUSE_ROLES = getattr(
+    settings,
+    'RESEARCHER_SPOUSE_ROLES',
+    ('Groom', 'Bride', 'Spouse')
+)
+
+MIN_MARRIAGE_AGE = getattr(settings, 'RESEARCHER_MIN_MARRIAGE_AGE', 12)
+
+WORKERS = getattr(settings, 'RESEARCHER_SANITY_WORKERS', None)
+
+CACHE_TIMEOUT = getattr(settings, 'RESEARCHER_SANITY_CACHE_TIMEOUT', 86400)
+
+# Personas checked together, and ids in one IN list.
+BATCH_SIZE = 500
+
+# The tables a project's cached problem list is derived from.
+SOURCE_MODELS = ('SanityProblem', 'ResearcherProject')
+
+
+def _add_years(date, years):
+    """Move a date on by whole years; 29 February becomes the 28th."""
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        return date.replace(year=date.year + years, day=28)
+
+
+class Facts(object):
+
+    """What the rules need to know about a batch of personas.
+
+    Each kind of fact is loaded for the whole batch the first time a
+    rule asks for it, so rules that share facts share the queries.
+
+    Instance Variables:
+        personas -- The ids of the personas being checked.
+    """
+
+    def __init__(self, personas):
+        """Start with nothing loaded.
+
+        Arguments:
+            self
+            personas -- the persona ids
+        """
+        self.personas = personas
+        self._loaded = {}
+
+    def _load(self, name, loader):
+        """Load a kind of fact once."""
+        if name not in self._loaded:
+            self._loaded[name] = loader()
+        return self._loaded[name]
+
+    def events(self):
+        """Get the event groups, by (persona, event type name)."""
+        return self._load('E', lambda: GROUP_LOADERS['E'](self.personas))
+
+    def parents(self):
+        """Get the parents, as Member lists by persona."""
+        return self._load('L', lambda: dict(
+            (persona, members) for (persona, key), members in
+            GROUP_LOADERS['L'](self.personas).items()
+        ))
+
+    def vitals(self, personas=None):
+        """Get the birth and death date bounds of personas.
+
+        Arguments:
+            self
+            personas -- other personas to load them for; None for the
+                batch's own
+        Returns: a dict of (birth members, death members) by persona,
+            each a list of the events' Members in the once-only roles
+        """
+        if personas is None:
+            groups = self.events()
+        else:
+            groups = GROUP_LOADERS['E'](personas)
+        found = collections.defaultdict(lambda: ([], []))
+        for (persona, key), members in groups.items():
+            for index, name in enumerate(('Birth', 'Death')):
+                if key == name:
+                    found[persona][index].extend(
+                        member for member in members
+                        if member.role in SINGLE_EVENT_ROLES.get(name, ())
+                    )
+        return found
+
+
+class SanityRule(object):
+
+    """A check run over a batch of personas.
+
+    Class Variables:
+        name -- The name the rule's problems are stored under.
+    """
+
+    name = None
+
+    def check(self, personas, facts):
+        """Find the problems of some personas.
+
+        Arguments:
+            self
+            personas -- the persona ids
+            facts -- the batch's Facts
+        Returns: an iterable of (persona id, description, event id or
+            None) tuples
+        """
+        raise NotImplementedError
+
+
+class DeathBeforeBirthRule(SanityRule):
+
+    """Every death date is before every birth date."""
+
+    name = 'death-before-birth'
+
+    def check(self, personas, facts):
+        """Compare the latest death with the earliest birth."""
+        for persona, (births, deaths) in facts.vitals().items():
+            if births and deaths and max(
+                    d.date_end for d in deaths) < min(
+                    b.date_start for b in births):
+                yield (
+                    persona,
+                    'Died %s, before being born %s' % (
+                        max(d.date_end for d in deaths),
+                        min(b.date_start for b in births)
+                    ),
+                    deaths[0].subject
+                )
+
+
+class BirthAfterMotherDeathRule(SanityRule):
+
+    """Born after every date the mother may have died."""
+
+    name = 'birth-after-mother-death'
+
+    def check(self, personas, facts):
+        """Compare each birth with the deaths of the mothers named."""
+        mothers = dict(
+            (persona, set(
+                member.subject for member in members
+                if member.role in MOTHER_ROLES
+            ))
+            for persona, members in facts.parents().items()
+        )
+        vitals = facts.vitals()
+        theirs = facts.vitals(
+            set().union(*mothers.values()) if mothers else ()
+        )
+        for persona, found in sorted(mothers.items()):
+            births = vitals[persona][0] if persona in vitals else []
+            if not births:
+                continue
+            born = min(member.date_start for member in births)
+            for mother in sorted(found):
+                deaths = theirs[mother][1] if mother in theirs else []
+                if deaths and max(d.date_end for d in deaths) < born:
+                    yield (
+                        persona,
+                        'Born %s, after mother (persona %d) died %s' % (
+                            born,
+                            mother,
+                            max(d.date_end for d in deaths)
+                        ),
+                        births[0].subject
+                    )
+
+
+class EarlyMarriageRule(SanityRule):
+
+    """Married, as a spouse, before MIN_MARRIAGE_AGE on every date."""
+
+    name = 'early-marriage'
+
+    def check(self, personas, facts):
+        """Compare marriages with the earliest possible birth."""
+        vitals = facts.vitals()
+        for (persona, key), members in sorted(facts.events().items()):
+            if key not in MARRIAGE_EVENT_TYPES or persona not in vitals:
+                continue
+            births = vitals[persona][0]
+            if not births:
+                continue
+            born = min(member.date_start for member in births)
+            for member in members:
+                if member.role not in SPOUSE_ROLES:
+                    continue
+                if member.date_end < _add_years(born, MIN_MARRIAGE_AGE):
+                    yield (
+                        persona,
+                        '%s %s, before the age of %d (born %s)' % (
+                            key,
+                            member.date_end,
+                            MIN_MARRIAGE_AGE,
+                            born
+                        ),
+                        member.subject
+                    )
+
+
+def _outside(prefix, start, end):
+    """Build the condition for an event wholly outside a date range.
+
+    Arguments:
+        prefix -- the lookup path from EventParticipation to the event
+        start -- the lookup path to the range's start
+        end -- the lookup path to the range's end
+    Returns: a Q object
+    """
+    return Q(**{
+        prefix + 'date_start__lt': F(start),
+        prefix + 'date_end__lt': F(start),
+    }) | Q(**{
+        prefix + 'date_start__gt': F(end),
+        prefix + 'date_end__gt': F(end),
+    })
+
+
+class EventOutsidePlaceRule(SanityRule):
+
+    """An event wholly outside its place's existence dates."""
+
+    name = 'event-outside-place'
+
+    def check(self, personas, facts):
+        """Compare the dates in one query."""
+        EventParticipation = apps.get_model('researcher',
+                                            'EventParticipation')
+        for persona, event, name, start, end in \
+                EventParticipation.objects.filter(
+                    _outside('event__',
+                             'event__place__existence_date_start',
+                             'event__place__existence_date_end'),
+                    persona__in=personas,
+                    disproved=False).values_list(
+                        'persona', 'event', 'event__name',
+                        'event__place__existence_date_start',
+                        'event__place__existence_date_end').distinct():
+            yield (
+                persona,
+                '%s falls outside its place\'s existence, %s to %s' % (
+                    name, start, end
+                ),
+                event
+            )
+
+
+class EventOutsideSourceRule(SanityRule):
+
+    """An event wholly outside the subject dates of its source."""
+
+    name = 'event-outside-source'
+
+    def check(self, personas, facts):
+        """Compare the dates in one query."""
+        EventParticipation = apps.get_model('researcher',
+                                            'EventParticipation')
+        for persona, event, name, source, start, end in \
+                EventParticipation.objects.filter(
+                    _outside('event__',
+                             'assertion__source__subject_date_start',
+                             'assertion__source__subject_date_end'),
+                    persona__in=personas,
+                    disproved=False).values_list(
+                        'persona', 'event', 'event__name',
+                        'assertion__source',
+                        'assertion__source__subject_date_start',
+                        'assertion__source__subject_date_end').distinct():
+            yield (
+                persona,
+                '%s falls outside the dates of source %d, %s to %s' % (
+                    name, source, start, end
+                ),
+                event
+            )
+
+
+_RULES = [
+    DeathBeforeBirthRule(),
+    BirthAfterMotherDeathRule(),
+    EarlyMarriageRule(),
+    EventOutsidePlaceRule(),
+    EventOutsideSourceRule(),
+]
+
+
+def register(rule):
+    """Add a rule to those every check runs.
+
+    Arguments:
+        rule -- a SanityRule instance
+    """
+    _RULES.append(rule)
+
+
+def rules():
+    """List the registered rules."""
+    return list(_RULES)
+
+
+def evaluate(personas):
+    """Check some personas and store the problems found.
+
+    Arguments:
+        personas -- persona ids
+    Returns: the number of problems found
+    """
+    SanityProblem = apps.get_model('researcher', 'SanityProblem')
+    found = 0
+    for batch in batches(set(personas)):
+        facts = Facts(batch)
+        rows = [
+            SanityProblem(
+                persona_id=persona,
+                rule=rule.name,
+                description=description,
+                event_id=event
+            )
+            for rule in rules()
+            for persona, description, event in rule.check(batch, facts)
+        ]
+        with transaction.atomic():
+            SanityProblem.objects.filter(persona__in=batch).delete()
+            SanityProblem.objects.bulk_create(rows)
+        found += len(rows)
+    bump_table_version(SanityProblem)
+    return found
+
+
+def _children(personas):
+    """Find the children of some personas.
+
+    Arguments:
+        personas -- persona ids
+    Returns: a set of persona ids
+    """
+    found = set()
+    roles = lineage_roles()
+    for kind, table, unit_field in (
+            ('E', 'EventParticipation', 'event'),
+            ('G', 'GroupMembership', 'group')):
+        type_ids, parent_roles, child_roles = roles[kind]
+        if not type_ids:
+            continue
+        model = apps.get_model('researcher', table)
+        for batch in batches(personas):
+            units = model.objects.filter(
+                persona__in=batch,
+                role__in=parent_roles
+            ).values(unit_field)
+            found.update(model.objects.filter(**{
+                '%s__in' % unit_field: units,
+                'role__in': child_roles}).values_list('persona', flat=True))
+    return found
+
+
+def queue(personas):
+    """Queue some personas to be checked.
+
+    Arguments:
+        personas -- persona ids
+    """
+    enqueue('PendingSanityCheck', ('persona',), [
+        (persona,) for persona in personas
+    ])
+
+
+def _check_queued(pending):
+    """Check a batch of queued personas and their children."""
+    personas = set(row[0] for row in pending)
+    evaluate(personas | _children(personas))
+
+
+def check_pending(limit=None):
+    """Check the queued personas and their children.
+
+    Arguments:
+        limit -- stop after about this many queued personas; None checks
+            them all
+    Returns: the number of queued personas checked
+    """
+    return work_through(
+        'PendingSanityCheck',
+        ('persona',),
+        _check_queued,
+        limit
+    )
+
+
+def project_personas(project):
+    """Find the personas named by the assertions of a project.
+
+    Arguments:
+        project -- the Project or its id
+    Returns: a sorted list of persona ids
+    """
+    Assertion = apps.get_model('researcher', 'Assertion')
+    ResearcherProject = apps.get_model('researcher', 'ResearcherProject')
+    assertions = Assertion.objects.filter(
+        researcher__in=ResearcherProject.objects.filter(
+            project=project
+        ).values('researcher')
+    )
+    personas = set()
+    for field in ('subject1', 'subject2'):
+        personas.update(assertions.filter(**{
+            field + '_type': 'P'
+        }).values_list(field, flat=True).distinct())
+    return sorted(personas)
+
+
+def _evaluate_chunk(personas):
+    """Check a chunk of personas in a worker process."""
+    return evaluate(personas)
+
+
+def validate_project(project, workers=None):
+    """Check every persona of a project.
+
+    Arguments:
+        project -- the Project or its id
+        workers -- the number of worker processes; None takes
+            RESEARCHER_SANITY_WORKERS, or one per CPU
+    Returns: the number of problems found
+    """
+    personas = project_personas(project)
+    chunks = [
+        personas[start:start + BATCH_SIZE]
+        for start in range(0, len(personas), BATCH_SIZE)
+    ]
+    workers = workers or WORKERS or multiprocessing.cpu_count()
+    if workers < 2 or len(chunks) < 2:
+        return sum(evaluate(chunk) for chunk in chunks)
+    # Forked workers must open their own connections.
+    for connection in connections.all():
+        connection.close()
+    pool = multiprocessing.Pool(min(workers, len(chunks)))
+    try:
+        return sum(pool.map(_evaluate_chunk, chunks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def problems(project):
+    """List the sanity problems of a project's personas.
+
+    Arguments:
+        project -- the Project or its id
+    Returns: a list of (persona id, rule, description, event id) tuples,
+        by persona and rule, from the cache when it is current
+    """
+    SanityProblem = apps.get_model('researcher', 'SanityProblem')
+    key = 'researcher:sanity:%d' % getattr(project, 'pk', project)
+    versions = table_versions([
+        apps.get_model('researcher', name) for name in SOURCE_MODELS
+    ])
+    found = cache.get(key)
+    if found is not None and found[0] == versions:
+        return found[1]
+    rows = []
+    for batch in batches(project_personas(project)):
+        rows.extend(SanityProblem.objects.filter(
+            persona__in=batch
+        ).values_list('persona', 'rule', 'description', 'event'))
+    rows.sort(key=lambda row: row[:3])
+    if not replicas.reading_replicas():
+        cache.set(key, (versions, rows), CACHE_TIMEOUT)
+    return rows
+
+
+def _participants(**kwargs):
+    """List the personas taking part in the events matching a filter."""
+    return apps.get_model('researcher', 'EventParticipation').objects.filter(
+        **kwargs
+    ).values_list('persona', flat=True)
+
+
+def _assertion_changed(instance, before, raw, deleted):
+    """Queue the personas an assertion names, and those it named."""
+    if raw:
+        return
+    queue(subject_personas(subjects_of(instance)) + (
+        subject_personas(subjects_of(before)) if before is not None else []
+    ))
+
+
+def _event_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved events."""
+    if not raw:
+        queue(_participants(event=instance.pk))
+
+
+def _place_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved places."""
+    if not raw:
+        queue(_participants(event__place=instance.pk))
+
+
+def _source_changed(sender, instance, raw=False, **kwargs):
+    """Signal receiver for saved sources."""
+    if not raw:
+        queue(_participants(assertion__source=instance.pk))
+
+
+def connect_signals():
+    """Queue checks as the rows the rules read change.
+
+    Deleting an event, place or source deletes the participations that
+    pointed at it, and the problems naming its events, so only saves are
+    watched for those.
+    """
+    on_assertion_change(_assertion_changed)
+    for name, receiver in (
+            ('Event', _event_changed),
+            ('Place', _place_changed),
+            ('Source', _source_changed)):
+        post_save.connect(
+            receiver,
+            sender=apps.get_model('researcher', name),
+            dispatch_uid='researcher.sanity.%s' % name
+        )
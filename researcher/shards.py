@@ -0,0 +1,997 @@
+"""Keep each project's data in a database of its own.
+
+A project's researcher data (assertions, sources, personas, events,
+places, activities and the tables derived from them) lives in one of
+the RESEARCHER_SHARDS databases: the default database unless a
+ProjectShard row says otherwise.  ProjectRouter sends the queries of
+project data to the database of the current project, which
+ProjectShardMiddleware sets for each request (the session's project,
+chosen with `?researcher_project=<id>` on any page, or else the signed-in
+researcher's only project), jobs set from a `project` argument, and
+management commands set with `--shard`.  An instance read from one
+database is saved back to it, so the admin works unchanged.
+
+The shared tables (researchers and projects, surety schemes and the
+*Type tables, and the users researchers belong to) are written to the
+default database and copied to every other shard as they are saved or
+deleted, so that foreign keys to them hold in every shard.  A
+researcher's address place is copied with the researcher.
+
+Each shard hands out primary keys from its own range of
+RESEARCHER_SHARD_ID_SPAN ids (the Nth alias of RESEARCHER_SHARDS from
+N * span), so rows keep their ids when projects move and never collide.
+prepare_shard() sets the ranges up on PostgreSQL and SQLite.
+
+move_project() moves a project while it stays in use.  It records every
+change made in the project's scope while it copies the project's rows,
+replays the changes on the new database until few are left, then
+freezes the project (writes in its scope raise ProjectMoving, which the
+middleware answers with 503) for the last replay, switches it over and
+deletes its rows from the old database, keeping any that other projects
+there still use.  Bulk writes outside the project's scope (imports, the
+synthetic generator) are not recorded; do not run them against a
+project being moved.  Projects sharing researchers share data, so they
+must be on the same database and are refused a move alone.
+
+Exports:
+    Functions:
+        activate
+        connect_signals
+        current_project
+        deactivate
+        is_project_data
+        is_shared
+        move_project
+        prepare_shard
+        project_alias
+        project_scope
+        shard_scope
+    Classes:
+        ProjectMoving
+        ProjectRouter
+        ProjectShardMiddleware
+"""
+import collections
+import contextlib
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    connections,
+    transaction,
+)
+from django.db.models import AutoField
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+)
+
+from researcher.history import VERSIONED_MODELS
+from researcher.versions import bump_table_version
+
+BATCH_SIZE = 500
+
+SHARDS = list(getattr(settings, 'RESEARCHER_SHARDS', [DEFAULT_DB_ALIAS]))
+
+ID_SPAN = getattr(settings, 'RESEARCHER_SHARD_ID_SPAN', 10 ** 8)
+
+# Seconds a process may go on routing by a ProjectShard row that changed.
+REFRESH = getattr(settings, 'RESEARCHER_SHARD_REFRESH', 1.0)
+
+# Seconds a move waits after freezing, for writes already under way.
+FREEZE_GRACE = getattr(settings, 'RESEARCHER_SHARD_FREEZE_GRACE', 5.0)
+
+# Replays while the project is still writable before it is frozen.
+CATCH_UP_ROUNDS = 5
+
+SESSION_KEY = 'researcher_project'
+
+# Written to the default database and copied to every shard, in an order
+# that keeps their foreign keys satisfied.
+SHARED_MODELS = (
+    'SuretyScheme',
+    'SuretySchemePart',
+    'Project',
+    'Researcher',
+    'ResearcherProject',
+    'EventType',
+    'EventTypeRole',
+    'CharacteristicPartType',
+    'GroupType',
+    'GroupTypeRole',
+    'PlacePartType',
+    'CitationPartType',
+    'RepresentationType',
+)
+
+# Kept in the default database only.
+DIRECTORY_MODELS = ('Job', 'ProjectShard', 'ShardChange')
+
+# A project's tables, in an order rows can be inserted in.
+PROJECT_MODELS = (
+    'Place',
+    'PlacePart',
+    'Repository',
+    'SourceGroup',
+    'Source',
+    'CitationPart',
+    'Representation',
+    'Activity',
+    'AdministrativeTask',
+    'RepositorySource',
+    'Search',
+    'ResearchObjective',
+    'Persona',
+    'Event',
+    'Characteristic',
+    'CharacteristicPart',
+    'Group',
+    'Assertion',
+    'AssertionAssertion',
+    'EventParticipation',
+    'GroupMembership',
+    'Conflict',
+    'PendingConflictCheck',
+    'SanityProblem',
+    'PendingSanityCheck',
+    'ResearchGap',
+    'PendingGapCheck',
+    'KinshipCoefficient',
+    'InbreedingCoefficient',
+    'Revision',
+    'ArchiveBatch',
+    'ArchivedAssertion',
+)
+
+# The assertion subject type codes of the models assertions name.
+SUBJECT_TYPES = (
+    ('P', 'Persona'),
+    ('E', 'Event'),
+    ('C', 'Characteristic'),
+    ('G', 'Group'),
+)
+
+_local = threading.local()
+
+_assignments = {'checked': 0, 'shards': {}}
+
+_owners = {}
+
+
+class ProjectMoving(DatabaseError):
+
+    """A write to a project frozen for the last step of a move."""
+
+
+def _model(name):
+    """Return a researcher model by name."""
+    return apps.get_model('researcher', name)
+
+
+def _is_user_model(model):
+    """Tell whether a model is the user model researchers belong to."""
+    return '%s.%s' % (
+        model._meta.app_label, model._meta.object_name
+    ) == settings.AUTH_USER_MODEL
+
+
+def is_shared(model):
+    """Tell whether a model is copied to every shard.
+
+    Arguments:
+        model -- the model class
+    Returns: True for the shared tables and the user model
+    """
+    return _is_user_model(model) or (
+        model._meta.app_label == 'researcher' and
+        model._meta.object_name in SHARED_MODELS
+    )
+
+
+def is_project_data(model):
+    """Tell whether a model's rows belong to projects.
+
+    Arguments:
+        model -- the model class
+    Returns: True for the researcher models neither shared nor kept in
+        the default database only
+    """
+    return (
+        model._meta.app_label == 'researcher' and
+        model._meta.object_name not in SHARED_MODELS and
+        model._meta.object_name not in DIRECTORY_MODELS
+    )
+
+
+def _shards(refresh=False):
+    """Return the ProjectShard rows as {project id: (alias, state, target)}.
+
+    The small table is read again every REFRESH seconds.  It is not
+    gated on a table version: with a per-process cache other processes
+    would never see a move, and would go on writing to the old database.
+    """
+    now = time.time()
+    if refresh or now - _assignments['checked'] >= REFRESH:
+        ProjectShard = _model('ProjectShard')
+        try:
+            rows = dict(
+                (project, (alias, state, target))
+                for project, alias, state, target in
+                ProjectShard.objects.using(DEFAULT_DB_ALIAS).values_list(
+                    'project', 'alias', 'state', 'target'
+                )
+            )
+        except DatabaseError:
+            # Not migrated yet: every project is in the default one.
+            rows = {}
+        _assignments.update(checked=now, shards=rows)
+    return _assignments['shards']
+
+
+def project_alias(project):
+    """Name the database holding a project's data.
+
+    Arguments:
+        project -- the Project or its id; None for no project
+    Returns: the DATABASES alias
+    """
+    if project is None:
+        return DEFAULT_DB_ALIAS
+    found = _shards().get(getattr(project, 'pk', project))
+    return found[0] if found else DEFAULT_DB_ALIAS
+
+
+def activate(project):
+    """Route the current thread's project data to a project's database.
+
+    Arguments:
+        project -- the Project or its id; None for the default database
+    """
+    _local.project = getattr(project, 'pk', project)
+    _local.alias = None
+
+
+def deactivate():
+    """Route the current thread's project data to the default database."""
+    _local.project = None
+    _local.alias = None
+
+
+def current_project():
+    """Return the id of the current thread's project, or None."""
+    return getattr(_local, 'project', None)
+
+
+def _current_alias():
+    """Name the database the current thread's project data goes to."""
+    return getattr(_local, 'alias', None) or project_alias(current_project())
+
+
+@contextlib.contextmanager
+def project_scope(project):
+    """Route the block's project data to a project's database.
+
+    Arguments:
+        project -- the Project or its id; None for the default database
+    Yields: the database alias
+    """
+    previous = current_project(), getattr(_local, 'alias', None)
+    activate(project)
+    try:
+        yield _current_alias()
+    finally:
+        _local.project, _local.alias = previous
+
+
+@contextlib.contextmanager
+def shard_scope(alias):
+    """Route the block's project data to one database, whatever project.
+
+    Arguments:
+        alias -- the DATABASES alias
+    Yields: the alias
+    """
+    previous = current_project(), getattr(_local, 'alias', None)
+    _local.project, _local.alias = None, alias
+    try:
+        yield alias
+    finally:
+        _local.project, _local.alias = previous
+
+
+class ProjectRouter(object):
+
+    """Send project data to its project's database.
+
+    Shared tables are written to the default database, which the signal
+    handlers copy to the other shards, and read from wherever the
+    instance asking for them came from.
+    """
+
+    def _route(self, model, hints):
+        """Pick the database of a model's rows, or None for the default."""
+        if model._meta.object_name in DIRECTORY_MODELS and \
+                model._meta.app_label == 'researcher':
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if is_shared(model):
+            return instance._state.db if instance is not None else None
+        if not is_project_data(model):
+            return None
+        if instance is not None and instance._state.db and \
+                is_project_data(type(instance)):
+            return instance._state.db
+        return _current_alias()
+
+    def db_for_read(self, model, **hints):
+        """Read project data from the current project's database."""
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        """Write project data to its database, and shared rows to default.
+
+        Raises: ProjectMoving when the current project is frozen
+        """
+        if is_shared(model):
+            return DEFAULT_DB_ALIAS
+        if is_project_data(model):
+            found = _shards().get(current_project())
+            if found is not None and found[1] == 'frozen':
+                raise ProjectMoving(
+                    'Project %d is being moved to %s.' % (
+                        current_project(), found[2]
+                    )
+                )
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations within a database, and to shared rows."""
+        if obj1._state.db == obj2._state.db or \
+                is_shared(type(obj1)) or is_shared(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, model):
+        """Keep the directory tables in the default database only."""
+        if model._meta.app_label == 'researcher' and \
+                model._meta.object_name in DIRECTORY_MODELS:
+            return db == DEFAULT_DB_ALIAS
+        return None
+
+
+def _may_use(user, project):
+    """Tell whether a user may work in a project."""
+    if user is None or not user.is_authenticated():
+        return False
+    return user.is_superuser or _model('ResearcherProject').objects.filter(
+        researcher__user=user,
+        project=project
+    ).exists()
+
+
+class ProjectShardMiddleware(object):
+
+    """Route each request's project data to its project's database.
+
+    Must come after the session and authentication middleware.
+    """
+
+    def process_request(self, request):
+        """Pick the request's project, or switch the session to one.
+
+        Only members of a project (and superusers) may switch to it.
+        """
+        session = getattr(request, 'session', None)
+        user = getattr(request, 'user', None)
+        chosen = request.GET.get(SESSION_KEY)
+        if chosen is not None and session is not None:
+            chosen = int(chosen) if chosen.isdigit() else None
+            if chosen is not None and not _may_use(user, chosen):
+                return HttpResponseForbidden(
+                    'You are not a researcher of project %d.' % chosen
+                )
+            session[SESSION_KEY] = chosen
+            query = request.GET.copy()
+            del query[SESSION_KEY]
+            return HttpResponseRedirect(request.path + (
+                '?' + query.urlencode() if query else ''
+            ))
+        project = session.get(SESSION_KEY) if session is not None else None
+        if project is None and user is not None and \
+                user.is_authenticated():
+            found = list(_model('ResearcherProject').objects.filter(
+                researcher__user=user
+            ).values_list('project', flat=True)[:2])
+            if len(found) == 1:
+                project = found[0]
+                if session is not None:
+                    session[SESSION_KEY] = project
+        activate(project)
+
+    def process_response(self, request, response):
+        """Forget the request's project."""
+        deactivate()
+        return response
+
+    def process_exception(self, request, exception):
+        """Ask writers to a project being moved to come back shortly."""
+        if isinstance(exception, ProjectMoving):
+            response = HttpResponse(
+                'This project is being moved; try again in a moment.',
+                status=503,
+                content_type='text/plain'
+            )
+            response['Retry-After'] = str(int(FREEZE_GRACE) + 5)
+            return response
+
+
+def _batches(values):
+    """Split values, sorted, into BATCH_SIZE lists."""
+    values = sorted(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def _links(model):
+    """List a model's own many-to-many fields with automatic tables."""
+    return [
+        field for field in model._meta.local_many_to_many
+        if field.rel.through._meta.auto_created
+    ]
+
+
+def _chain(model):
+    """List the models whose tables hold a model's rows, parents first."""
+    return list(reversed(model._meta.get_parent_list())) + [model]
+
+
+def _select(alias, model, lookup, values, attname='pk'):
+    """Collect a column of the rows whose `lookup` is one of some values."""
+    found = set()
+    for batch in _batches(values):
+        found.update(model._base_manager.using(alias).filter(**{
+            lookup + '__in': batch
+        }).values_list(attname, flat=True))
+    found.discard(None)
+    return found
+
+
+def _insert(alias, model, rows):
+    """Insert rows of a model's own table, as values_list gave them."""
+    connection = connections[alias]
+    fields = model._meta.local_concrete_fields
+    quote = connection.ops.quote_name
+    params = [
+        [
+            field.get_db_prep_save(value, connection=connection)
+            for field, value in zip(fields, row)
+        ]
+        for row in rows
+    ]
+    if not params:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote(model._meta.db_table),
+                ', '.join(quote(field.column) for field in fields),
+                ', '.join(['%s'] * len(fields))
+            ),
+            params
+        )
+
+
+def _rows(alias, model, **filters):
+    """Read rows of a model's own table as values for _insert."""
+    return model._base_manager.using(alias).filter(**filters).values_list(
+        *[field.attname for field in model._meta.local_concrete_fields]
+    )
+
+
+def _copy(model, pks, source, target, links=True):
+    """Copy rows of a model's own table, and their many-to-many links."""
+    for batch in _batches(pks):
+        _insert(target, model, _rows(source, model, pk__in=batch))
+        for field in (_links(model) if links else ()):
+            through = field.rel.through
+            _insert(target, through, _rows(source, through, **{
+                field.m2m_field_name() + '__in': batch
+            }))
+
+
+def _remove(model, pks, alias, links=True):
+    """Delete rows of a model's own table and their links, not cascading."""
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for batch in _batches(pks):
+            marks = ', '.join(['%s'] * len(batch))
+            for field in (_links(model) if links else ()):
+                through = field.rel.through
+                cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                    quote(through._meta.db_table),
+                    quote(through._meta.get_field_by_name(
+                        field.m2m_field_name()
+                    )[0].column),
+                    marks
+                ), batch)
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                quote(model._meta.db_table),
+                quote(model._meta.pk.column),
+                marks
+            ), batch)
+
+
+def _plan(project, alias):
+    """Find a project's rows in its database.
+
+    Returns: an OrderedDict of id sets by model name, in PROJECT_MODELS
+        order
+    """
+    get = _model
+    researchers = set(get('ResearcherProject').objects.filter(
+        project=project
+    ).values_list('researcher', flat=True))
+    found = dict((name, set()) for name in PROJECT_MODELS)
+
+    Assertion = get('Assertion')
+    found['Assertion'] = _select(alias, Assertion, 'researcher', researchers)
+    found['AssertionAssertion'] = (
+        _select(alias, get('AssertionAssertion'), 'assertion_low',
+                found['Assertion']) |
+        _select(alias, get('AssertionAssertion'), 'assertion_high',
+                found['Assertion'])
+    )
+    ArchivedAssertion = get('ArchivedAssertion')
+    found['ArchivedAssertion'] = _select(alias, ArchivedAssertion,
+                                         'researcher', researchers)
+    for code, name in SUBJECT_TYPES:
+        named = set()
+        for model in (Assertion, ArchivedAssertion):
+            for field in ('subject1', 'subject2'):
+                named.update(model._base_manager.using(alias).filter(**{
+                    'researcher__in': researchers,
+                    field + '_type': code,
+                }).values_list(field, flat=True).distinct())
+        found[name] = _select(alias, get(name), 'pk', named)
+    found['CharacteristicPart'] = _select(
+        alias, get('CharacteristicPart'), 'characteristic',
+        found['Characteristic']
+    )
+
+    found['ResearchObjective'] = set(
+        get('ResearchObjective')._base_manager.using(alias).filter(
+            project=project
+        ).values_list('pk', flat=True)
+    )
+    activities = get('ResearchObjective')._meta.get_field_by_name(
+        'activities'
+    )[0]
+    found['Activity'] = (
+        _select(alias, get('Activity'), 'researcher', researchers) |
+        _select(alias, activities.rel.through, activities.m2m_field_name(),
+                found['ResearchObjective'],
+                activities.m2m_reverse_field_name())
+    )
+    found['Source'] = (
+        _select(alias, get('Source'), 'researcher', researchers) |
+        _select(alias, Assertion, 'pk', found['Assertion'], 'source') |
+        _select(alias, ArchivedAssertion, 'pk', found['ArchivedAssertion'],
+                'source')
+    )
+    RepositorySource = get('RepositorySource')
+    Search = get('Search')
+    searches = _select(alias, Search, 'pk', found['Activity'])
+    found['RepositorySource'] = (
+        _select(alias, RepositorySource, 'source', found['Source']) |
+        _select(alias, Search, 'pk', searches, 'source') |
+        _select(alias, Search, 'pk', searches, 'repository')
+    )
+    found['Source'] |= _select(alias, RepositorySource, 'pk',
+                               found['RepositorySource'], 'source')
+    found['Activity'] |= _select(alias, RepositorySource, 'pk',
+                                 found['RepositorySource'], 'activity')
+    found['Search'] = _select(alias, Search, 'pk', found['Activity'])
+    found['AdministrativeTask'] = _select(
+        alias, get('AdministrativeTask'), 'pk', found['Activity']
+    )
+    found['Repository'] = _select(alias, RepositorySource, 'pk',
+                                  found['RepositorySource'], 'repository')
+    higher = found['Source']
+    while higher:
+        higher = _select(alias, get('Source'), 'pk', higher,
+                         'higher_source') - found['Source']
+        found['Source'] |= higher
+    groups = get('Source')._meta.get_field_by_name('source_group')[0]
+    found['SourceGroup'] = _select(
+        alias, groups.rel.through, groups.m2m_field_name(), found['Source'],
+        groups.m2m_reverse_field_name()
+    )
+    for name in ('CitationPart', 'Representation'):
+        found[name] = _select(alias, get(name), 'source', found['Source'])
+
+    for name, fields in (
+            ('Event', ['place']),
+            ('Characteristic', ['place']),
+            ('Group', ['place']),
+            ('Source', ['subject_place', 'jurisdiction_place']),
+            ('Repository', ['place'])):
+        for field in fields:
+            found['Place'] |= _select(alias, get(name), 'pk', found[name],
+                                      field)
+    found['PlacePart'] = _select(alias, get('PlacePart'), 'place',
+                                 found['Place'])
+
+    for name in ('EventParticipation', 'GroupMembership'):
+        found[name] = _select(alias, get(name), 'assertion',
+                              found['Assertion'])
+    for name in ('Conflict', 'PendingConflictCheck', 'SanityProblem',
+                 'PendingSanityCheck', 'ResearchGap', 'PendingGapCheck'):
+        found[name] = _select(alias, get(name), 'persona', found['Persona'])
+    for name in ('KinshipCoefficient', 'InbreedingCoefficient'):
+        found[name] = set(get(name)._base_manager.using(alias).filter(
+            project=project
+        ).values_list('pk', flat=True))
+    found['ArchiveBatch'] = _select(alias, ArchivedAssertion, 'pk',
+                                    found['ArchivedAssertion'], 'batch')
+    Revision = get('Revision')
+    found['Revision'] = _select(alias, Revision, 'researcher', researchers)
+    for name in VERSIONED_MODELS:
+        pks = found[name]
+        if name == 'Assertion':
+            pks = pks | found['ArchivedAssertion']
+        for batch in _batches(pks):
+            found['Revision'].update(Revision._base_manager.using(
+                alias
+            ).filter(model=name, object_id__in=batch).values_list(
+                'pk', flat=True
+            ))
+    return collections.OrderedDict(
+        (name, found[name]) for name in PROJECT_MODELS
+    )
+
+
+def _still_used(model, pks, alias):
+    """Find which of some rows other rows of a database still refer to."""
+    used = set()
+    for relation in model._meta.get_all_related_objects(include_hidden=True):
+        field = relation.field
+        if relation.model is not model:
+            used |= _select(alias, relation.model, field.name, pks,
+                            field.attname)
+            continue
+        # Rows deleted together do not keep each other.
+        for batch in _batches(pks):
+            used.update(
+                value for pk, value in model._base_manager.using(
+                    alias
+                ).filter(**{
+                    field.name + '__in': batch
+                }).values_list('pk', field.attname)
+                if pk not in pks
+            )
+    for relation in model._meta.get_all_related_many_to_many_objects():
+        through = relation.field.rel.through
+        if through._meta.auto_created:
+            name = relation.field.m2m_reverse_field_name()
+            used |= _select(alias, through, name, pks, name)
+    subject = dict((name, code) for code, name in SUBJECT_TYPES).get(
+        model._meta.object_name
+    )
+    if subject is not None:
+        Assertion = _model('Assertion')
+        for field in ('subject1', 'subject2'):
+            for batch in _batches(pks):
+                used.update(Assertion._base_manager.using(alias).filter(**{
+                    field + '_type': subject,
+                    field + '__in': batch,
+                }).values_list(field, flat=True))
+    return used
+
+
+def _sync(model, pk, source, target):
+    """Make one row, and its links, on the target match the source."""
+    chain = _chain(model)
+    for table in reversed(chain):
+        _remove(table, [pk], target)
+    if model._base_manager.using(source).filter(pk=pk).exists():
+        for table in chain:
+            _copy(table, [pk], source, target)
+
+
+def _replay(project, source, target):
+    """Apply the changes recorded for a moving project to the target.
+
+    Returns: the set of (model name, id) synced
+    """
+    ShardChange = _model('ShardChange')
+    changes = list(ShardChange.objects.filter(
+        project=project
+    ).values_list('pk', 'model', 'object_id'))
+    synced = set((name, pk) for change, name, pk in changes)
+    with transaction.atomic(using=target):
+        for name, pk in sorted(synced):
+            _sync(_model(name), pk, source, target)
+    for batch in _batches([change for change, name, pk in changes]):
+        ShardChange.objects.filter(pk__in=batch).delete()
+    return synced
+
+
+def _settle():
+    """Wait until every process routes by the ProjectShard rows just set."""
+    time.sleep(2 * REFRESH)
+    _shards(refresh=True)
+
+
+def _set_shard(project, **values):
+    """Update or create a project's ProjectShard row."""
+    ProjectShard = _model('ProjectShard')
+    ProjectShard.objects.update_or_create(project_id=project,
+                                          defaults=values)
+
+
+def move_project(project, target, report=None):
+    """Move a project's data to another database while it is in use.
+
+    Arguments:
+        project -- the Project or its id
+        target -- the alias, one of RESEARCHER_SHARDS, to move it to
+        report -- called as report(message) at each step, if given
+    Returns: the number of rows copied
+    Raises: ValueError when the target is not a shard or already holds
+        the project, or when a project on the same database shares its
+        researchers
+    """
+    # relationships reads through the lookups, which route with shards.
+    from researcher.relationships import invalidate_graph
+
+    project = getattr(project, 'pk', project)
+    report = report or (lambda message: None)
+    if target not in SHARDS:
+        raise ValueError('%s is not one of RESEARCHER_SHARDS.' % target)
+    source = _shards(refresh=True).get(project, (DEFAULT_DB_ALIAS,))[0]
+    if source == target:
+        raise ValueError('Project %d is already on %s.' % (project, target))
+    ResearcherProject = _model('ResearcherProject')
+    sharing = set(ResearcherProject.objects.filter(
+        researcher__in=ResearcherProject.objects.filter(
+            project=project
+        ).values('researcher')
+    ).exclude(project=project).values_list('project', flat=True))
+    sharing = [other for other in sharing if project_alias(other) == source]
+    if sharing:
+        raise ValueError(
+            'Projects %s on %s share researchers with project %d.' % (
+                ', '.join(str(other) for other in sorted(sharing)),
+                source,
+                project
+            )
+        )
+
+    _model('ShardChange').objects.filter(project=project).delete()
+    _set_shard(project, alias=source, state='copying', target=target)
+    copied = 0
+    try:
+        _settle()
+        plan = _plan(project, source)
+        for name, pks in plan.items():
+            model = _model(name)
+            with transaction.atomic(using=target):
+                # Left behind by an earlier move that failed.
+                _remove(model, pks, target)
+                _copy(model, pks, source, target)
+            copied += len(pks)
+            report('Copied %d %s rows' % (len(pks), name))
+        for attempt in range(CATCH_UP_ROUNDS):
+            synced = _replay(project, source, target)
+            report('Replayed %d changes' % len(synced))
+            for name, pk in synced:
+                plan.setdefault(name, set()).add(pk)
+            if len(synced) < BATCH_SIZE:
+                break
+
+        _set_shard(project, alias=source, state='frozen', target=target)
+        report('Frozen for the last changes')
+        _settle()
+        time.sleep(FREEZE_GRACE)
+        for name, pk in _replay(project, source, target):
+            plan.setdefault(name, set()).add(pk)
+        _set_shard(project, alias=target, state='active', target='')
+    except BaseException:
+        _set_shard(project, alias=source, state='active', target='')
+        raise
+    _settle()
+    report('Moved to %s' % target)
+
+    for name in reversed(PROJECT_MODELS):
+        model = _model(name)
+        pks = plan.get(name, set())
+        with transaction.atomic(using=source):
+            _remove(model, pks - _still_used(model, pks, source), source)
+    _model('ShardChange').objects.filter(project=project).delete()
+    for name in PROJECT_MODELS:
+        bump_table_version(_model(name))
+    invalidate_graph()
+    report('Removed from %s' % source)
+    return copied
+
+
+def _reserve_ids(alias):
+    """Start a shard's id sequences at the beginning of its own range."""
+    floor = SHARDS.index(alias) * ID_SPAN
+    connection = connections[alias]
+    if not floor or connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in apps.get_app_config('researcher').get_models(
+                include_auto_created=True):
+            if not is_project_data(model) or \
+                    not isinstance(model._meta.pk, AutoField):
+                continue
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT setval(pg_get_serial_sequence(%%s, %%s), '
+                    'GREATEST(COALESCE(MAX(%s), 0), %%s)) FROM %s' % (
+                        quote(model._meta.pk.column), quote(table)
+                    ),
+                    [table, model._meta.pk.column, floor]
+                )
+                continue
+            cursor.execute(
+                'UPDATE sqlite_sequence SET seq = MAX(seq, %s) '
+                'WHERE name = %s',
+                [floor, table]
+            )
+            if not cursor.rowcount:
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                    [table, floor]
+                )
+
+
+def _replicate_all(alias):
+    """Copy every shared row, and researchers' addresses, to a shard."""
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    addresses = set(_model('Researcher').objects.using(
+        DEFAULT_DB_ALIAS
+    ).values_list('address', flat=True))
+    # (model, ids or None for all, whether to copy many-to-many links)
+    steps = [
+        (User, None, False),
+        (_model('PlacePartType'), None, True),
+        (_model('Place'), addresses, True),
+        (_model('PlacePart'), _select(DEFAULT_DB_ALIAS, _model('PlacePart'),
+                                      'place', addresses), True),
+    ] + [
+        (_model(name), None, True)
+        for name in SHARED_MODELS if name != 'PlacePartType'
+    ]
+    copied = 0
+    with transaction.atomic(using=alias):
+        for model, pks, links in steps:
+            if pks is None:
+                pks = set(model._base_manager.using(
+                    DEFAULT_DB_ALIAS
+                ).values_list('pk', flat=True))
+            _remove(model, pks, alias, links)
+            _copy(model, pks, DEFAULT_DB_ALIAS, alias, links)
+            copied += len(pks)
+    return copied
+
+
+def prepare_shard(alias):
+    """Ready a migrated database to hold projects.
+
+    Copies the shared rows to it and starts its id sequences at its own
+    range.  Run it again after restoring a shard from a backup or
+    loading fixtures of shared rows, which are not copied as they load.
+
+    Arguments:
+        alias -- one of RESEARCHER_SHARDS other than the default
+    Returns: the number of shared rows copied
+    Raises: ValueError when the alias is not a shard, or is the default
+    """
+    if alias not in SHARDS or alias == DEFAULT_DB_ALIAS:
+        raise ValueError('%s is not a shard besides the default database.'
+                         % alias)
+    copied = _replicate_all(alias)
+    _reserve_ids(alias)
+    return copied
+
+
+def _copy_shared(sender, instance, using, raw=False, **kwargs):
+    """Signal receiver that copies a saved shared row to every shard."""
+    if raw or using != DEFAULT_DB_ALIAS or not is_shared(sender):
+        return
+    links = not _is_user_model(sender)
+    for alias in SHARDS:
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        with transaction.atomic(using=alias):
+            if sender is _model('Researcher'):
+                for model, lookup in ((_model('Place'), 'pk'),
+                                      (_model('PlacePart'), 'place')):
+                    pks = _select(DEFAULT_DB_ALIAS, model, lookup,
+                                  [instance.address_id])
+                    _remove(model, pks, alias)
+                    _copy(model, pks, DEFAULT_DB_ALIAS, alias)
+            _remove(sender, [instance.pk], alias, links)
+            _copy(sender, [instance.pk], DEFAULT_DB_ALIAS, alias, links)
+
+
+def _delete_shared(sender, instance, using, **kwargs):
+    """Signal receiver that deletes a deleted shared row from every shard."""
+    if using != DEFAULT_DB_ALIAS or not is_shared(sender):
+        return
+    for alias in SHARDS:
+        if alias != DEFAULT_DB_ALIAS:
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def _record(model, pk, using):
+    """Record a change of project data made in a moving project's scope."""
+    project = current_project()
+    found = _shards().get(project)
+    if found is None or found[1] == 'active' or found[0] != using:
+        return
+    _model('ShardChange').objects.create(
+        project_id=project,
+        model=model._meta.object_name,
+        object_id=pk
+    )
+
+
+def _record_change(sender, instance, using, **kwargs):
+    """Signal receiver recording saves and deletes of moving projects."""
+    if is_project_data(sender) and current_project() is not None:
+        _record(sender, instance.pk, using)
+
+
+def _record_links(sender, instance, action, reverse, pk_set, using,
+                  **kwargs):
+    """Signal receiver recording link changes of moving projects."""
+    if action not in ('post_add', 'post_remove', 'post_clear') or \
+            current_project() is None:
+        return
+    if not _owners:
+        for model in apps.get_app_config('researcher').get_models():
+            for field in _links(model):
+                _owners[field.rel.through] = model
+    owner = _owners.get(sender)
+    if owner is None or not is_project_data(owner):
+        return
+    if not reverse:
+        _record(owner, instance.pk, using)
+        return
+    for pk in pk_set or ():
+        _record(owner, pk, using)
+
+
+def connect_signals():
+    """Copy shared rows to the shards, and record moving projects' changes.
+
+    Does nothing with only the default database.
+    """
+    if SHARDS == [DEFAULT_DB_ALIAS]:
+        return
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for model in [User] + [_model(name) for name in SHARED_MODELS]:
+        uid = 'researcher.shards.%s' % model.__name__
+        post_save.connect(_copy_shared, sender=model, dispatch_uid=uid)
+        post_delete.connect(_delete_shared, sender=model, dispatch_uid=uid)
+    for model in apps.get_app_config('researcher').get_models():
+        if is_project_data(model):
+            uid = 'researcher.shards.changes.%s' % model.__name__
+            post_save.connect(_record_change, sender=model, dispatch_uid=uid)
+            post_delete.connect(_record_change, sender=model,
+                                dispatch_uid=uid)
+    m2m_changed.connect(_record_links,
+                        dispatch_uid='researcher.shards.links')
@@ -0,0 +1,481 @@
+"""Capture slow queries, explain them, and suggest the indexes they lack.
+
+The database backends in researcher.backends wrap Django's own
+PostgreSQL and SQLite backends; with one of them as a database's ENGINE
+and RESEARCHER_SLOW_QUERY_MS set, every statement taking that long or
+longer (executemany batches included, with their row count) is
+appended, with the project code it came from, as a JSON line to
+RESEARCHER_SLOW_QUERY_LOG.  The parameters hold researchers' data, so
+they are only logged with RESEARCHER_SLOW_QUERY_PARAMS set; without
+them, statements that take parameters cannot be explained.  The log is
+rotated to a single `.1` file when it reaches
+RESEARCHER_SLOW_QUERY_LOG_BYTES.  Without RESEARCHER_SLOW_QUERY_MS the
+backends behave exactly like Django's.
+
+Nothing is explained while a request waits.  offenders() reads the log
+and groups the statements by their querylog signature, slowest total
+first; explain() runs EXPLAIN (EXPLAIN QUERY PLAN on SQLite, and with
+`analyze` EXPLAIN ANALYZE on PostgreSQL, inside a transaction that is
+rolled back) for an offender's slowest sample; suggest() reads the plan
+for full table scans and proposes an index over the columns the
+statement compares on that table, equalities first, named as the
+researcher model and fields (`Activity.researcher+status`).
+Indexes that already exist are not suggested again.  operations()
+writes the suggestions as migration operations.  `manage.py
+slow_queries` puts the four together.
+
+Exports:
+    Functions:
+        capture
+        explain
+        offenders
+        operations
+        suggest
+    Classes:
+        Offender
+        Plan
+        SlowQueryMixin
+        Suggestion
+"""
+import collections
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+
+from researcher import querylog
+
+try:
+    from django.db.backends.utils import CursorWrapper
+except ImportError:
+    from django.db.backends.util import CursorWrapper
+
+SLOW_QUERY_MS = getattr(settings, 'RESEARCHER_SLOW_QUERY_MS', None)
+
+SLOW_QUERY_LOG = getattr(
+    settings,
+    'RESEARCHER_SLOW_QUERY_LOG',
+    os.path.join(tempfile.gettempdir(), 'researcher-slow-queries.jsonl')
+)
+
+SLOW_QUERY_LOG_BYTES = getattr(settings, 'RESEARCHER_SLOW_QUERY_LOG_BYTES',
+                               10 * 1024 * 1024)
+
+SLOW_QUERY_PARAMS = getattr(settings, 'RESEARCHER_SLOW_QUERY_PARAMS', False)
+
+# Columns a suggested index covers at most.
+MAX_INDEX_COLUMNS = 3
+
+querylog.INSTRUMENTATION_FILES.add(__file__)
+
+_lock = threading.Lock()
+
+_RELATIONS = re.compile(
+    r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?"?(\w+)"?)?',
+    re.IGNORECASE
+)
+_KEYWORDS = set(['ON', 'WHERE', 'INNER', 'LEFT', 'OUTER', 'JOIN', 'ORDER',
+                 'GROUP', 'LIMIT', 'HAVING', 'UNION', 'AS'])
+_EQUALITIES = set(['=', 'IN', 'IS'])
+
+Offender = collections.namedtuple(
+    'Offender',
+    'signature count total_ms max_ms sample origins'
+)
+Offender.__doc__ = """Slow runs of one statement signature.
+
+    signature -- the statement with its literals reduced to ?
+    count -- the slow runs logged
+    total_ms -- their milliseconds together
+    max_ms -- the slowest run's milliseconds
+    sample -- the slowest run's log entry, with its sql and params
+    origins -- (origin, runs) pairs of where the runs came from
+    """
+
+Plan = collections.namedtuple('Plan', 'lines scans')
+Plan.__doc__ = """What EXPLAIN said about a statement.
+
+    lines -- the plan as text lines, for reading
+    scans -- the tables or aliases read in full
+    """
+
+
+class Suggestion(collections.namedtuple('Suggestion',
+                                        'model fields table columns')):
+
+    """An index a slow statement could have used.
+
+    model -- the model class of the table, or None
+    fields -- the field names, in index order (the columns, if no field
+        has them)
+    table -- the table
+    columns -- the columns, in index order
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        """Name the index as Model.field+field."""
+        if self.model is None:
+            return '%s(%s)' % (self.table, ', '.join(self.columns))
+        return '%s.%s' % (self.model.__name__, '+'.join(self.fields))
+
+
+def capture(alias, sql, params, duration, rows=None):
+    """Append one slow statement to the log.
+
+    Arguments:
+        alias -- the database alias it ran on
+        sql -- the statement, with placeholders
+        params -- its parameters, logged only with SLOW_QUERY_PARAMS
+        duration -- seconds it took
+        rows -- the parameter sets of an executemany, if counted
+    """
+    entry = {
+        'when': datetime.datetime.utcnow().isoformat(),
+        'alias': alias,
+        'ms': round(duration * 1000, 2),
+        'sql': sql,
+        'from': querylog.origin(),
+    }
+    if SLOW_QUERY_PARAMS:
+        entry['params'] = params
+    if rows is not None:
+        entry['rows'] = rows
+    entry = json.dumps(entry, default=str, separators=(',', ':'))
+    with _lock:
+        try:
+            if os.path.getsize(SLOW_QUERY_LOG) >= SLOW_QUERY_LOG_BYTES:
+                os.rename(SLOW_QUERY_LOG, SLOW_QUERY_LOG + '.1')
+        except OSError:
+            pass
+        with open(SLOW_QUERY_LOG, 'a') as stream:
+            stream.write(entry + '\n')
+
+
+class _SlowCursor(CursorWrapper):
+
+    """A cursor that logs the statements slower than SLOW_QUERY_MS."""
+
+    def execute(self, sql, params=None):
+        """Run a statement, logging it if it is slow."""
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            duration = time.time() - start
+            if duration * 1000 >= SLOW_QUERY_MS:
+                capture(self.db.alias, sql,
+                        list(params) if isinstance(params, (list, tuple))
+                        else params, duration)
+
+    def executemany(self, sql, param_list):
+        """Run a statement for many parameter sets, logging it if slow."""
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            duration = time.time() - start
+            if duration * 1000 >= SLOW_QUERY_MS:
+                capture(self.db.alias, sql, None, duration,
+                        len(param_list) if hasattr(param_list, '__len__')
+                        else None)
+
+
+class SlowQueryMixin(object):
+
+    """Give a DatabaseWrapper cursors that log slow statements."""
+
+    def cursor(self):
+        """Return a cursor, wrapped when slow queries are captured."""
+        cursor = super(SlowQueryMixin, self).cursor()
+        if SLOW_QUERY_MS is None:
+            return cursor
+        return _SlowCursor(cursor, self)
+
+
+def offenders(path=None, top=20):
+    """Group the logged slow statements by signature.
+
+    Arguments:
+        path -- the log to read; None for SLOW_QUERY_LOG and its .1
+        top -- how many offenders to return
+    Returns: a list of Offenders, the most total time first
+    """
+    paths = [path] if path else [SLOW_QUERY_LOG + '.1', SLOW_QUERY_LOG]
+    groups = {}
+    for name in paths:
+        if not os.path.exists(name):
+            continue
+        with open(name) as stream:
+            for line in stream:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                groups.setdefault(querylog.signature(entry['sql']),
+                                  []).append(entry)
+    found = []
+    for signature, entries in groups.items():
+        slowest = max(entries, key=lambda entry: entry['ms'])
+        found.append(Offender(
+            signature,
+            len(entries),
+            sum(entry['ms'] for entry in entries),
+            slowest['ms'],
+            slowest,
+            collections.Counter(
+                entry['from'][0] if entry['from'] else '?'
+                for entry in entries
+            ).most_common(3),
+        ))
+    found.sort(key=lambda offender: -offender.total_ms)
+    return found[:top]
+
+
+class _Rollback(Exception):
+
+    """Raised to undo what EXPLAIN ANALYZE ran."""
+
+
+def _walk_postgresql(node, depth, lines, scans):
+    """Describe a PostgreSQL plan node and its children."""
+    description = node['Node Type']
+    if 'Relation Name' in node:
+        description += ' on %s' % node['Relation Name']
+        if node.get('Alias', node['Relation Name']) != node['Relation Name']:
+            description += ' %s' % node['Alias']
+    description += ' (rows=%s' % node.get('Plan Rows')
+    if 'Actual Total Time' in node:
+        description += ', actual %.1f ms, %s rows' % (
+            node['Actual Total Time'], node.get('Actual Rows')
+        )
+    description += ')'
+    if 'Filter' in node:
+        description += ' filter: %s' % node['Filter']
+    lines.append('  ' * depth + description)
+    if node['Node Type'] == 'Seq Scan':
+        scans.append(node.get('Alias') or node['Relation Name'])
+    for child in node.get('Plans', ()):
+        _walk_postgresql(child, depth + 1, lines, scans)
+
+
+def _explain_postgresql(cursor, sql, params, analyze):
+    """EXPLAIN a statement on PostgreSQL."""
+    cursor.execute('EXPLAIN (%sFORMAT JSON) %s' % (
+        'ANALYZE, ' if analyze else '', sql
+    ), params)
+    found = cursor.fetchone()[0]
+    if not isinstance(found, list):
+        found = json.loads(found)
+    lines, scans = [], []
+    _walk_postgresql(found[0]['Plan'], 0, lines, scans)
+    return Plan(lines, scans)
+
+
+def _explain_sqlite(cursor, sql, params):
+    """EXPLAIN QUERY PLAN a statement on SQLite."""
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    lines, scans = [], []
+    for row in cursor.fetchall():
+        detail = row[-1]
+        lines.append(detail)
+        words = detail.split()
+        if words[:1] != ['SCAN'] or 'USING' in words:
+            continue
+        words = words[2:] if words[1:2] == ['TABLE'] else words[1:]
+        if 'AS' in words:
+            scans.append(words[words.index('AS') + 1])
+        elif words:
+            scans.append(words[0])
+    return Plan(lines, scans)
+
+
+def explain(offender, analyze=False):
+    """EXPLAIN an offender's slowest sample where it ran.
+
+    Arguments:
+        offender -- the Offender
+        analyze -- run the statement for actual timings; PostgreSQL
+            only, SELECTs only, and rolled back
+    Returns: a Plan, or None on databases it cannot explain and for
+        statements logged without the parameters they take
+    """
+    sample = offender.sample
+    connection = connections[sample['alias']]
+    sql = sample['sql']
+    params = sample.get('params')
+    if (params is None and '%s' in sql) or 'rows' in sample:
+        return None
+    analyze = analyze and sql.lstrip().upper().startswith('SELECT')
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            return _explain_sqlite(cursor, sql, params)
+        if connection.vendor != 'postgresql':
+            return None
+        if not analyze:
+            return _explain_postgresql(cursor, sql, params, False)
+        found = []
+        try:
+            with transaction.atomic(using=sample['alias']):
+                found.append(_explain_postgresql(cursor, sql, params, True))
+                raise _Rollback()
+        except _Rollback:
+            pass
+        return found[0]
+
+
+def _aliases(sql):
+    """Map the names a statement gives its tables to the tables."""
+    found = {}
+    for table, alias in _RELATIONS.findall(sql):
+        found[table] = table
+        if alias and alias.upper() not in _KEYWORDS:
+            found[alias] = table
+    return found
+
+
+def _compared_columns(sql, name):
+    """Find the columns of a table a statement compares, equalities first.
+
+    Arguments:
+        sql -- the statement
+        name -- the table or its alias, as the statement qualifies columns
+    Returns: a list of column names
+    """
+    column = r'(?:"%s"|\b%s)\."(?P<column>\w+)"' % (re.escape(name),
+                                                    re.escape(name))
+    operator = (r'(?P<operator>=|<>|!=|<=|>=|<|>|'
+                r'\bIN\b|\bIS\b|\bLIKE\b|\bBETWEEN\b)')
+    equalities, ranges = [], []
+    for pattern in (column + r'\s*' + operator,
+                    operator + r'\s*' + column):
+        for match in re.finditer(pattern, sql, re.IGNORECASE):
+            if match.group('operator').upper() in _EQUALITIES:
+                equalities.append(match.group('column'))
+            else:
+                ranges.append(match.group('column'))
+    found = []
+    for column in equalities + ranges:
+        if column not in found:
+            found.append(column)
+    return found
+
+
+def _fields_by_column():
+    """Map (table, column) to (model, field name) for every model."""
+    found = {}
+    for model in apps.get_models():
+        for field in model._meta.local_fields:
+            found[(model._meta.db_table, field.column)] = (model, field.name)
+    return found
+
+
+def _indexed(connection, table, columns):
+    """Whether an index of the table starts with the columns."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    columns = list(columns)
+    return any(
+        (constraint['index'] or constraint['primary_key'] or
+         constraint['unique']) and
+        list(constraint['columns'][:len(columns)]) == columns
+        for constraint in constraints.values()
+    )
+
+
+def suggest(offender, plan):
+    """Propose indexes for the tables an offender's plan reads in full.
+
+    Arguments:
+        offender -- the Offender
+        plan -- its Plan
+    Returns: a list of Suggestions
+    """
+    sql = offender.sample['sql']
+    connection = connections[offender.sample['alias']]
+    names = _aliases(sql)
+    fields = _fields_by_column()
+    found = []
+    for name in plan.scans:
+        table = names.get(name, name)
+        columns = tuple(_compared_columns(sql, name)[:MAX_INDEX_COLUMNS])
+        if not columns or _indexed(connection, table, columns):
+            continue
+        model = fields.get((table, columns[0]), (None, None))[0]
+        found.append(Suggestion(
+            model,
+            tuple(fields.get((table, column), (None, column))[1]
+                  for column in columns),
+            table,
+            columns
+        ))
+    return found
+
+
+def _field_source(field):
+    """Write a field, with an index, as migration source."""
+    name, path, args, kwargs = field.deconstruct()
+    kwargs['db_index'] = True
+    if path.startswith('django.db.models.'):
+        path = 'models.' + path.rsplit('.', 1)[-1]
+    return '%s(%s)' % (path, ', '.join(
+        [repr(arg) for arg in args] +
+        ['%s=%r' % item for item in sorted(kwargs.items())]
+    ))
+
+
+def operations(suggestions):
+    """Write suggestions for the researcher models as migration operations.
+
+    A single field gains db_index; several fields join the model's
+    index_together.
+
+    Arguments:
+        suggestions -- Suggestions, from suggest()
+    Returns: the operations' source, one string each
+    """
+    written = []
+    together = collections.OrderedDict()
+    for suggestion in suggestions:
+        model = suggestion.model
+        if model is None or model._meta.app_label != 'researcher':
+            continue
+        if len(suggestion.fields) == 1:
+            field = model._meta.get_field(suggestion.fields[0])
+            if field.db_index:
+                continue
+            source = (
+                'migrations.AlterField(\n'
+                '    model_name=%r,\n'
+                '    name=%r,\n'
+                '    field=%s,\n'
+                '),' % (model._meta.model_name, field.name,
+                        _field_source(field))
+            )
+        else:
+            current = together.setdefault(
+                model, set(tuple(fields)
+                           for fields in model._meta.index_together)
+            )
+            current.add(suggestion.fields)
+            continue
+        if source not in written:
+            written.append(source)
+    for model, index_together in together.items():
+        written.append(
+            'migrations.AlterIndexTogether(\n'
+            '    name=%r,\n'
+            '    index_together=set([%s]),\n'
+            '),' % (model._meta.model_name,
+                    ', '.join(repr(fields)
+                              for fields in sorted(index_together)))
+        )
+    return written
@@ -0,0 +1,459 @@
+"""Generate synthetic research data for benchmarks.
+
+generate() fills the database with a seeded, reproducible project shaped
+like real client work: families over many generations, each persona
+born, given a sex and usually married and buried; deep chains of sources
+(archive, series, volume, page, entry), each level with citation parts;
+places of four parts; and many searches, each with its repository
+source.  The same seed and scale always produce the same rows.
+
+At scale 1.0 there are 150,000 personas and about a million assertions;
+the volumes grow linearly with the scale.  Rows are written with
+bulk_create, BATCH_SIZE at a time, with primary keys handed out here so
+that rows can point at each other before they are written; the whole
+run is one transaction, and the sequences are reset at the end, when
+the histories of the versioned rows are started (see
+researcher.history).  The participation and membership rows of the new
+assertions are written afterwards.
+
+Exports:
+    Functions:
+        generate
+        volumes
+    Classes:
+        Volumes
+"""
+import collections
+import datetime
+import random
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from researcher import history
+from researcher.participation import refresh_participation
+from researcher.versions import bump_table_version
+
+# Rows written by one INSERT.
+BATCH_SIZE = 500
+
+Volumes = collections.namedtuple(
+    'Volumes',
+    'personas generations places sources source_depth citation_parts '
+    'searches researchers'
+)
+Volumes.__doc__ = """How much data to generate.
+
+    personas -- personas, spread evenly over the generations
+    generations -- generations of families
+    places -- places of four parts each
+    sources -- chains of sources, each source_depth deep
+    source_depth -- levels in a chain of sources
+    citation_parts -- citation parts on each source
+    searches -- searches, each with its repository source
+    researchers -- researchers on the project
+    """
+
+GIVEN_NAMES = {
+    'M': ('John', 'William', 'James', 'George', 'Thomas', 'Henry',
+          'Charles', 'Samuel', 'Joseph', 'Robert'),
+    'F': ('Mary', 'Elizabeth', 'Sarah', 'Anna', 'Margaret', 'Martha',
+          'Hannah', 'Catherine', 'Jane', 'Susan'),
+}
+SURNAMES = ('Smith', 'Brown', 'Miller', 'Jones', 'Wilson', 'Taylor',
+            'Clark', 'Walker', 'Wright', 'Baker', 'Young', 'Allen',
+            'King', 'Scott', 'Green', 'Adams', 'Hill', 'Moore')
+PLACE_PARTS = (
+    ('Country', ('United States', 'Canada', 'England', 'Ireland')),
+    ('State', ('Virginia', 'Ohio', 'Kentucky', 'Ontario', 'Kent', 'Cork')),
+    ('County', ('Augusta', 'Franklin', 'Greene', 'Clark', 'Wayne',
+                'Hamilton', 'Marion', 'Jackson')),
+    ('Town', ('Springfield', 'Salem', 'Fairview', 'Madison', 'Clinton',
+              'Georgetown', 'Greenville', 'Bristol', 'Dover', 'Oxford')),
+)
+SOURCE_LEVELS = ('Archive', 'Series', 'Volume', 'Page', 'Entry')
+CITATION_PART_TYPES = ('Title', 'Author', 'Publisher', 'Date', 'Page',
+                       'Film', 'Item')
+EVENT_TYPES = (
+    ('Birth', ('Child', 'Father', 'Mother')),
+    ('Death', ('Deceased',)),
+    ('Marriage', ('Groom', 'Bride', 'Witness')),
+)
+GROUP_TYPES = (('Household', ('Head', 'Wife', 'Child')),)
+SURETY_PARTS = ('1', '2', '3', '4')
+
+
+def volumes(scale=1.0):
+    """Work out how much data a scale means.
+
+    Arguments:
+        scale -- 1.0 for about a million assertions
+    Returns: a Volumes
+    """
+    def scaled(count, least=1):
+        """Scale a count at 1.0, keeping at least `least`."""
+        return max(least, int(count * scale))
+    return Volumes(
+        personas=scaled(150000, 20),
+        generations=12,
+        places=scaled(4000),
+        sources=scaled(20000),
+        source_depth=len(SOURCE_LEVELS),
+        citation_parts=3,
+        searches=scaled(100000),
+        researchers=scaled(20),
+    )
+
+
+class _Writer(object):
+
+    """Hands out primary keys and writes rows in batches."""
+
+    def __init__(self):
+        """Start with empty buffers."""
+        self.buffers = collections.OrderedDict()
+        self.first_ids = {}
+        self.next_ids = {}
+        self.written = collections.Counter()
+
+    def model(self, name):
+        """Get a model class by name."""
+        return apps.get_model('researcher', name)
+
+    def new_id(self, model):
+        """Hand out the next primary key of a table."""
+        if model not in self.next_ids:
+            self.next_ids[model] = (
+                model.objects.aggregate(top=Max('pk'))['top'] or 0
+            ) + 1
+            self.first_ids[model] = self.next_ids[model]
+        pk = self.next_ids[model]
+        self.next_ids[model] += 1
+        return pk
+
+    def add(self, model_name, **values):
+        """Queue a row, and return its primary key."""
+        model = self.model(model_name)
+        attname = model._meta.pk.attname
+        if attname not in values:
+            values[attname] = self.new_id(model)
+        pk = values[attname]
+        buffer = self.buffers.setdefault(model, [])
+        buffer.append(model(**values))
+        if len(buffer) >= BATCH_SIZE:
+            self.flush(model)
+        return pk
+
+    def flush(self, model=None):
+        """Write the queued rows of one table, or of all of them."""
+        for target in [model] if model else list(self.buffers):
+            rows = self.buffers.get(target)
+            if rows:
+                target.objects.bulk_create(rows)
+                self.written[target._meta.object_name] += len(rows)
+                self.buffers[target] = []
+
+
+def _lookups(writer):
+    """Create the type tables the data refers to.
+
+    Returns: a dict of ids by (table, name)
+    """
+    ids = {}
+
+    def add(table, name, **values):
+        """Create one lookup row."""
+        ids[table, name] = writer.add(table, name=name, **values)
+        return ids[table, name]
+
+    for name in ('Original', 'Photocopy', 'Transcript'):
+        add('RepresentationType', name)
+    for name in CITATION_PART_TYPES:
+        add('CitationPartType', name)
+    for name, values in PLACE_PARTS:
+        add('PlacePartType', name)
+    for name in ('Sex', 'Occupation'):
+        add('CharacteristicPartType', name)
+    for name, roles in EVENT_TYPES:
+        event_type = add('EventType', name)
+        for role in roles:
+            ids['EventTypeRole', name, role] = writer.add(
+                'EventTypeRole', event_type_id=event_type, name=role
+            )
+    for name, roles in GROUP_TYPES:
+        group_type = add('GroupType', name)
+        for number, role in enumerate(roles):
+            ids['GroupTypeRole', name, role] = writer.add(
+                'GroupTypeRole', group_type_id=group_type, name=role,
+                sequence_number=number
+            )
+    scheme = add('SuretyScheme', 'Synthetic')
+    for number, name in enumerate(SURETY_PARTS):
+        ids['SuretySchemePart', name] = writer.add(
+            'SuretySchemePart', surety_scheme_id=scheme, name=name,
+            sequence_number=number + 1
+        )
+    return ids
+
+
+def _date(rng, year):
+    """Pick a day in a year."""
+    return datetime.date(year, 1, 1) + datetime.timedelta(rng.randrange(365))
+
+
+def generate(scale=1.0, seed=1, name='Synthetic project'):
+    """Fill the database with a synthetic project.
+
+    Arguments:
+        scale -- see volumes()
+        seed -- the random seed; the same seed gives the same data
+        name -- the project's name
+    Returns: (the Project, a dict of rows written by model name)
+    """
+    rng = random.Random(seed)
+    size = volumes(scale)
+    writer = _Writer()
+    User = get_user_model()
+    with transaction.atomic():
+        ids = _lookups(writer)
+        surety = [ids['SuretySchemePart', name] for name in SURETY_PARTS]
+
+        places = []
+        for index in range(size.places):
+            start = 1600 + rng.randrange(150)
+            place = writer.add(
+                'Place',
+                existence_date_start=datetime.date(start, 1, 1),
+                existence_date_end=datetime.date(2000, 12, 31),
+                sort_order='D'
+            )
+            for number, (part_type, names) in enumerate(PLACE_PARTS):
+                writer.add(
+                    'PlacePart',
+                    place_id=place,
+                    place_part_type_id=ids['PlacePartType', part_type],
+                    name='%s %d' % (rng.choice(names), index % 97)
+                    if part_type == 'Town' else rng.choice(names),
+                    sequence_number=number
+                )
+            places.append(place)
+
+        project = writer.add('Project', name=name,
+                             surety_scheme_id=ids['SuretyScheme',
+                                                  'Synthetic'])
+        researchers = []
+        first_user = User.objects.aggregate(top=Max('pk'))['top'] or 0
+        for index in range(size.researchers):
+            user = User.objects.create(**{
+                User.USERNAME_FIELD: 'synthetic-%d-%d-%d' % (
+                    seed, first_user, index
+                )
+            })
+            researcher = writer.add(
+                'Researcher',
+                name='Researcher %d' % index,
+                address_id=rng.choice(places),
+                user_id=user.pk
+            )
+            writer.add('ResearcherProject', researcher_id=researcher,
+                       project_id=project, role='Researcher')
+            researchers.append(researcher)
+
+        # Chains of sources, each level citing the one above; the top
+        # of a chain is its own higher source.
+        leaves = []
+        for chain in range(size.sources):
+            higher = None
+            start = 1700 + rng.randrange(280)
+            place = rng.choice(places)
+            for depth in range(size.source_depth):
+                model = writer.model('Source')
+                pk = writer.new_id(model)
+                writer.add(
+                    'Source',
+                    id=pk,
+                    higher_source_id=higher or pk,
+                    subject_place_id=place,
+                    jurisdiction_place_id=place,
+                    researcher_id=rng.choice(researchers),
+                    subject_date_start=datetime.date(start, 1, 1),
+                    subject_date_end=datetime.date(start + 20, 12, 31),
+                    comment=''
+                )
+                for number in range(size.citation_parts):
+                    part_type = CITATION_PART_TYPES[
+                        (depth + number) % len(CITATION_PART_TYPES)
+                    ]
+                    writer.add(
+                        'CitationPart',
+                        source_id=pk,
+                        citation_part_type_id=ids['CitationPartType',
+                                                  part_type],
+                        value='%s %d.%d' % (SOURCE_LEVELS[depth % len(
+                            SOURCE_LEVELS)], chain, number)
+                    )
+                higher = pk
+            leaves.append(higher)
+
+        repositories = [
+            writer.add('Repository', place_id=rng.choice(places),
+                       name='Repository %d' % index)
+            for index in range(max(1, size.sources // 200))
+        ]
+        # A search and its repository source point at each other; both
+        # are written in this transaction, so the keys are only checked
+        # (where the database checks them) at its end.
+        Search = writer.model('Search')
+        searches = []
+        for index in range(size.searches):
+            activity = writer.add(
+                'Activity',
+                researcher_id=rng.choice(researchers),
+                scheduled_date=_date(rng, 2010 + rng.randrange(10)),
+                completed_date=_date(rng, 2020),
+                typecode='S',
+                status=rng.choice(('Planned', 'Done', 'On hold')),
+                description='Search %d' % index,
+                priority=rng.randrange(1, 6)
+            )
+            held = writer.add(
+                'RepositorySource',
+                repository_id=rng.choice(repositories),
+                source_id=rng.choice(leaves),
+                activity_id=activity,
+                call_number='CN-%d' % index
+            )
+            searches.append(Search(
+                activity_id=activity,
+                source_id=held,
+                repository_id=held,
+                searched_for=rng.choice(SURNAMES)
+            ))
+        writer.flush()
+        # bulk_create cannot write a multi-table inherited model; a raw
+        # save writes the search's own table only.
+        for search in searches:
+            search.save_base(raw=True, force_insert=True)
+        writer.written['Search'] += len(searches)
+
+        def assert_(subject1_type, subject1, subject2_type, subject2,
+                    role='', source=None):
+            """Queue one assertion."""
+            return writer.add(
+                'Assertion',
+                surety_scheme_part_id=rng.choice(surety),
+                researcher_id=rng.choice(researchers),
+                source_id=source or rng.choice(leaves),
+                subject1_type=subject1_type,
+                subject1=subject1,
+                subject2_type=subject2_type,
+                subject2=subject2,
+                value_role=role,
+                rationale='Synthetic',
+                disproved=rng.random() < 0.02
+            )
+
+        per_generation = max(2, size.personas // size.generations)
+        previous = {'M': [], 'F': []}
+        for generation in range(size.generations):
+            year = 1700 + 25 * generation
+            current = {'M': [], 'F': []}
+            for index in range(per_generation):
+                sex = rng.choice('MF')
+                surname = rng.choice(SURNAMES)
+                persona = writer.add(
+                    'Persona',
+                    name='%s %s' % (rng.choice(GIVEN_NAMES[sex]), surname),
+                    description_comments=''
+                )
+                current[sex].append(persona)
+                place = rng.choice(places)
+                born = _date(rng, year + rng.randrange(-5, 6))
+                birth = writer.add(
+                    'Event',
+                    event_type_id=ids['EventType', 'Birth'],
+                    place_id=place,
+                    name='Birth of %d' % persona,
+                    date_start=born,
+                    date_end=born
+                )
+                source = rng.choice(leaves)
+                first = assert_('P', persona, 'E', birth, 'Child', source)
+                if previous['M'] and previous['F']:
+                    for role, parent in (
+                            ('Father', rng.choice(previous['M'])),
+                            ('Mother', rng.choice(previous['F']))):
+                        assert_('P', parent, 'E', birth, role, source)
+                characteristic = writer.add(
+                    'Characteristic',
+                    place_id=place,
+                    date_start=born,
+                    date_end=born,
+                    sort_order='A'
+                )
+                writer.add(
+                    'CharacteristicPart',
+                    characteristic_id=characteristic,
+                    characteristic_part_type_id=ids[
+                        'CharacteristicPartType', 'Sex'],
+                    name='Male' if sex == 'M' else 'Female'
+                )
+                second = assert_('P', persona, 'C', characteristic)
+                # A conclusion drawn from the birth and sex assertions.
+                conclusion = assert_('P', persona, 'C', characteristic)
+                for number, low in enumerate((first, second)):
+                    writer.add('AssertionAssertion', assertion_low_id=low,
+                               assertion_high_id=conclusion,
+                               sequence_number=number)
+                if rng.random() < 0.8:
+                    died = _date(rng, born.year + rng.randrange(1, 90))
+                    death = writer.add(
+                        'Event',
+                        event_type_id=ids['EventType', 'Death'],
+                        place_id=place,
+                        name='Death of %d' % persona,
+                        date_start=died,
+                        date_end=died
+                    )
+                    assert_('P', persona, 'E', death, 'Deceased')
+            for groom, bride in zip(current['M'], current['F']):
+                married = _date(rng, year + 20 + rng.randrange(10))
+                marriage = writer.add(
+                    'Event',
+                    event_type_id=ids['EventType', 'Marriage'],
+                    place_id=rng.choice(places),
+                    name='Marriage of %d and %d' % (groom, bride),
+                    date_start=married,
+                    date_end=married
+                )
+                source = rng.choice(leaves)
+                assert_('P', groom, 'E', marriage, 'Groom', source)
+                assert_('P', bride, 'E', marriage, 'Bride', source)
+            previous = current
+        writer.flush()
+
+        models = [writer.model(name) for name in writer.written]
+        with connection.cursor() as cursor:
+            for statement in connection.ops.sequence_reset_sql(no_style(),
+                                                               models):
+                cursor.execute(statement)
+        for model in models:
+            if model._meta.object_name in history.VERSIONED_MODELS:
+                history.record_created(model, range(
+                    writer.first_ids.get(model, 0),
+                    writer.next_ids.get(model, 0)
+                ))
+    for model in models:
+        bump_table_version(model)
+    Assertion = writer.model('Assertion')
+    refresh_participation(range(
+        writer.first_ids.get(Assertion, 0),
+        writer.next_ids.get(Assertion, 0)
+    ))
+    return (
+        writer.model('Project').objects.get(pk=project),
+        dict(writer.written)
+    )
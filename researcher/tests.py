@@ -1,3 +1,1668 @@
-from django.test import TestCase
+"""Test the researcher application's paging, caching, routing and queues."""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from researcher import (
+    archive,
+    charts,
+    conflicts,
+    history,
+    importer,
+    jobs,
+    kinship,
+    loaders,
+    models,
+    network,
+    participation,
+    profiling,
+    querylog,
+    queues,
+    relationships,
+    replicas,
+    sanity,
+    shards,
+    slowqueries,
+    synthetic,
+    timeline,
+)
+from researcher.lookups import LOOKUP_MODELS, lookup
+from researcher.pagination import AFTER_VAR, BEFORE_VAR, _boundary
+from researcher.versions import (
+    bump_table_version,
+    check_shared_cache,
+    table_version,
+)
+
+DAY = datetime.date(1850, 1, 1)
+
+
+@jobs.task('tests.echo')
+def _echo(job, **arguments):
+    """Return a job's arguments, as a task for the job tests."""
+    return arguments
+
+
+class ResearchData(object):
+
+    """Build a researcher, a project and a source to hang tests on."""
+
+    def setUp(self):
+        """Create the rows every test needs."""
+        User = get_user_model()
+        self.user = User.objects.create_user('staff', 'staff@example.com',
+                                             'secret')
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.place = models.Place.objects.create(
+            existence_date_start=DAY,
+            existence_date_end=DAY
+        )
+        self.researcher = models.Researcher.objects.create(
+            name='Staff',
+            address=self.place,
+            user=self.user
+        )
+        scheme = models.SuretyScheme.objects.create(name='Scheme')
+        self.surety = models.SuretySchemePart.objects.create(
+            surety_scheme=scheme,
+            name='A'
+        )
+        self.project = models.Project.objects.create(
+            name='Project',
+            surety_scheme=scheme
+        )
+        models.ResearcherProject.objects.create(
+            researcher=self.researcher,
+            project=self.project
+        )
+        # A top-level source is its own higher source.
+        self.source = models.Source.objects.create(
+            id=1,
+            higher_source_id=1,
+            subject_place=self.place,
+            jurisdiction_place=self.place,
+            researcher=self.researcher,
+            subject_date_start=DAY,
+            subject_date_end=DAY
+        )
+        self.persona = models.Persona.objects.create(
+            name='Ann',
+            description_comments=''
+        )
+        # Rows rolled back after earlier tests left the table versions
+        # where they were, so nothing in memory can be trusted.
+        relationships.graph().clear()
+        for name in LOOKUP_MODELS:
+            lookup(name).clear()
+
+    def named(self, name):
+        """Save a persona."""
+        return models.Persona.objects.create(name=name,
+                                             description_comments='')
+
+    def assertion(self, **values):
+        """Save an assertion about the test persona."""
+        fields = dict(
+            surety_scheme_part=self.surety,
+            researcher=self.researcher,
+            source=self.source,
+            subject1_type='P',
+            subject1=self.persona.pk,
+            subject2_type='P',
+            subject2=self.persona.pk,
+            rationale='Seen'
+        )
+        fields.update(values)
+        return models.Assertion.objects.create(**fields)
+
+    def event(self, type_name, roles, date=DAY, **values):
+        """Save an event and the assertions placing personas in it.
+
+        Arguments:
+            self
+            type_name -- the name of the event type, made if missing
+            roles -- (role name, persona) pairs; the type gets each role
+            date -- when the event happened
+            values -- further fields for the assertions
+        Returns: the Event
+        """
+        event_type = models.EventType.objects.get_or_create(
+            name=type_name
+        )[0]
+        for role, persona in roles:
+            models.EventTypeRole.objects.get_or_create(event_type=event_type,
+                                                       name=role)
+        event = models.Event.objects.create(
+            event_type=event_type,
+            place=self.place,
+            name=type_name,
+            date_start=date,
+            date_end=date
+        )
+        for role, persona in roles:
+            self.assertion(subject1=persona.pk, subject2_type='E',
+                           subject2=event.pk, value_role=role, **values)
+        return event
+
+    def birth(self, child, father=None, mother=None, date=DAY):
+        """Save the birth of a child to the parents given."""
+        event_type = models.EventType.objects.get_or_create(name='Birth')[0]
+        for role in ('Father', 'Mother', 'Child'):
+            models.EventTypeRole.objects.get_or_create(event_type=event_type,
+                                                       name=role)
+        roles = [('Child', child)]
+        if father is not None:
+            roles.append(('Father', father))
+        if mother is not None:
+            roles.append(('Mother', mother))
+        return self.event('Birth', roles, date)
+
+
+class SyntheticTests(TestCase):
+
+    """The synthetic-data generator behind the benchmarks."""
+
+    def test_generate_at_a_tiny_scale(self):
+        """A tiny project is written, with the rows it reports."""
+        project, written = synthetic.generate(scale=0.0001)
+        self.assertEqual(project.name, 'Synthetic project')
+        self.assertEqual(models.Persona.objects.count(),
+                         written['Persona'])
+        self.assertTrue(models.Assertion.objects.exists())
+        self.assertEqual(
+            models.Source.objects.filter(
+                higher_source=F('pk')
+            ).count(),
+            synthetic.volumes(0.0001).sources
+        )
+
+
+class PaginationTests(ResearchData, TestCase):
+
+    """Keyset paging of the large admin changelists."""
+
+    def setUp(self):
+        """Add citation parts to page through, and log in."""
+        super(PaginationTests, self).setUp()
+        kind = models.CitationPartType.objects.create(name='Title')
+        self.parts = [
+            models.CitationPart.objects.create(
+                source=self.source,
+                citation_part_type=kind,
+                value=value
+            ).pk
+            for value in ('B', 'A', 'B')
+        ]
+        self.client.login(username='staff', password='secret')
+        self.url = reverse('admin:researcher_citationpart_changelist')
+
+    def shown(self, **params):
+        """Get a changelist page, and the ids it shows."""
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        changelist = response.context['cl']
+        self.assertTrue(changelist.keyset)
+        return [part.pk for part in changelist.result_list]
+
+    def test_boundary_must_be_an_id(self):
+        """Anything but digits starts from the first page."""
+        factory = RequestFactory()
+        for value, expected in (('12', 12), ('', None), ('abc', None),
+                                ('-3', None), ('1.5', None)):
+            request = factory.get('/', {AFTER_VAR: value})
+            self.assertEqual(_boundary(request, AFTER_VAR), expected)
+
+    def test_bad_boundary_shows_first_page(self):
+        """A non-numeric boundary is not a server error."""
+        response = self.client.get(self.url, {AFTER_VAR: 'abc'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_after_seeks_past_the_boundary(self):
+        """A page after an id holds only the rows past it."""
+        first, second, third = self.parts
+        self.assertEqual(self.shown(), [third, second, first])
+        self.assertEqual(self.shown(**{AFTER_VAR: third}), [second, first])
+        self.assertEqual(self.shown(**{BEFORE_VAR: first}), [third, second])
+
+    def test_sorted_column_seeks_with_pk_tie_breaker(self):
+        """Sorting by a column still seeks, past ties on the column."""
+        first, second, third = self.parts
+        self.assertEqual(self.shown(o='1'), [second, third, first])
+        self.assertEqual(self.shown(o='1', **{AFTER_VAR: second}),
+                         [third, first])
+        self.assertEqual(self.shown(o='1', **{AFTER_VAR: third}), [first])
+        self.assertEqual(self.shown(o='1', **{BEFORE_VAR: first}),
+                         [second, third])
+
+
+class InlineTests(ResearchData, TestCase):
+
+    """Admin inlines that show and save one page of children."""
+
+    def setUp(self):
+        """Give the source more citation parts than fit on a page."""
+        super(InlineTests, self).setUp()
+        kind = models.CitationPartType.objects.create(name='Title')
+        self.parts = [
+            models.CitationPart.objects.create(
+                source=self.source,
+                citation_part_type=kind,
+                value='Part %d' % number
+            ).pk
+            for number in range(25)
+        ]
+        self.client.login(username='staff', password='secret')
+        self.url = reverse('admin:researcher_source_change',
+                           args=(self.source.pk,))
+
+    def formset(self, response):
+        """Find the citation part formset on a change form."""
+        for inline in response.context['inline_admin_formsets']:
+            if inline.formset.model is models.CitationPart:
+                return inline.formset
+
+    def form_data(self, response):
+        """Collect the values a browser would post back for a change form."""
+        data = {}
+        forms = [response.context['adminform'].form]
+        for inline in response.context['inline_admin_formsets']:
+            forms.append(inline.formset.management_form)
+            forms.extend(inline.formset.forms)
+            data[inline.formset.add_prefix('page')] = inline.formset.page
+        for form in forms:
+            for field in form:
+                value = field.value()
+                if value is None or value is False:
+                    continue
+                data[field.html_name] = value
+        return data
+
+    def test_page_of_children(self):
+        """A page number in the query string picks the children shown."""
+        response = self.client.get(self.url)
+        formset = self.formset(response)
+        self.assertEqual([form.instance.pk for form in formset.forms],
+                         self.parts[:20])
+        prefix = formset.prefix
+        response = self.client.get(self.url, {prefix + '-page': 2})
+        formset = self.formset(response)
+        self.assertEqual((formset.page, formset.num_pages), (2, 2))
+        self.assertEqual([form.instance.pk for form in formset.forms],
+                         self.parts[20:])
+        response = self.client.get(
+            reverse('admin:researcher_source_inline_page',
+                    args=(self.source.pk, prefix)),
+            {prefix + '-page': 2}
+        )
+        self.assertContains(response, 'Part 24')
+        self.assertNotContains(response, 'Part 19')
+
+    def test_saving_a_page_saves_only_the_edited_child(self):
+        """Editing one child of the second page leaves the others alone."""
+        prefix = self.formset(self.client.get(self.url)).prefix
+        response = self.client.get(self.url, {prefix + '-page': 2})
+        data = self.form_data(response)
+        data['%s-1-value' % prefix] = 'Edited'
+        before = dict(models.CitationPart.objects.values_list('pk', 'value'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+        after = dict(models.CitationPart.objects.values_list('pk', 'value'))
+        before[self.parts[21]] = 'Edited'
+        self.assertEqual(after, before)
+        self.assertEqual(
+            len([query for query in queries.captured_queries
+                 if 'UPDATE "researcher_citationpart"' in query['sql']]),
+            1
+        )
+
+
+class VersionTests(TransactionTestCase):
+
+    """Table versions, bumped on every write and again after commit."""
+
+    def test_save_bumps_version(self):
+        """Saving a row moves its table's version on."""
+        before = table_version(models.Persona)
+        models.Persona.objects.create(name='Ann', description_comments='')
+        self.assertNotEqual(table_version(models.Persona), before)
+
+    def test_bumped_again_after_commit(self):
+        """A version read inside a transaction is stale after it commits."""
+        with transaction.atomic():
+            models.Persona.objects.create(name='Ann',
+                                          description_comments='')
+            inside = table_version(models.Persona)
+        self.assertNotEqual(table_version(models.Persona), inside)
+
+
+class LookupTests(TestCase):
+
+    """The in-memory copies of the lookup tables."""
+
+    def test_miss_reloads_a_changed_table(self):
+        """A row another process has just added is found at once."""
+        table = lookup('PlacePartType')
+        models.PlacePartType.objects.create(name='Country')
+        self.assertEqual([row.name for row in table.all()], ['Country'])
+        # bulk_create sends no signals; the version bump stands for the
+        # one a save in another process makes.
+        models.PlacePartType.objects.bulk_create([
+            models.PlacePartType(name='Town')
+        ])
+        bump_table_version(models.PlacePartType)
+        town = models.PlacePartType.objects.get(name='Town')
+        self.assertEqual(table.get(town.pk).name, 'Town')
+        self.assertEqual(table.get_by_name('Town').pk, town.pk)
+
+    def test_miss_on_unchanged_table_does_not_reload(self):
+        """A missing row of an unchanged table costs no query."""
+        table = lookup('PlacePartType')
+        models.PlacePartType.objects.create(name='Country')
+        table.all()
+        with self.assertNumQueries(0):
+            with self.assertRaises(models.PlacePartType.DoesNotExist):
+                table.get(999999)
+            with self.assertRaises(models.PlacePartType.DoesNotExist):
+                table.get_by_name('Parish')
+
+    def test_missing_row_raises(self):
+        """A row that is not in the database either does not exist."""
+        with self.assertRaises(models.PlacePartType.DoesNotExist):
+            lookup('PlacePartType').get(999999)
+        with self.assertRaises(models.PlacePartType.DoesNotExist):
+            lookup('PlacePartType').get_by_name('Parish')
+
+
+class ApiTests(ResearchData, TestCase):
+
+    """Bounds, ETags and query budgets of the JSON API."""
+
+    def setUp(self):
+        """Log in as staff."""
+        super(ApiTests, self).setUp()
+        self.client.login(username='staff', password='secret')
+        self.personas = reverse('api:api_list', args=['personas'])
+
+    def data(self, response):
+        """Read the rows of a JSON response."""
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode())['data']
+
+    def test_limit_is_clamped(self):
+        """Limits below one show one row; above MAX_LIMIT, MAX_LIMIT."""
+        models.Persona.objects.create(name='Bob', description_comments='')
+        for limit in ('0', '-5'):
+            response = self.client.get(self.personas, {'limit': limit})
+            self.assertEqual(len(self.data(response)), 1)
+        response = self.client.get(self.personas, {'limit': '100000'})
+        self.assertEqual(len(self.data(response)), 2)
+
+    def test_bad_limit_is_a_bad_request(self):
+        """A limit that is not a number is a 400, not a 500."""
+        response = self.client.get(self.personas, {'limit': 'ten'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_timeline_not_modified_before_building(self):
+        """A repeated timeline request is answered from its ETag."""
+        url = reverse('api:api_timeline', args=[self.persona.pk])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        with querylog.recording() as full:
+            self.client.get(url)
+        with querylog.recording() as cached:
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertLess(cached.count, full.count)
+
+    def test_assertion_subjects_are_included(self):
+        """An assertion's subjects are returned and can be included."""
+        event = self.event('Birth', [('Child', self.persona)])
+        url = reverse('api:api_list', args=['assertions'])
+        response = self.client.get(url, {
+            'fields': 'value_role',
+            'include': 'subject1,subject2',
+        })
+        body = json.loads(response.content.decode())
+        row = [row for row in body['data'] if row['value_role'] == 'Child'][0]
+        self.assertEqual(
+            (row['subject1_type'], row['subject1'],
+             row['subject2_type'], row['subject2']),
+            ('P', self.persona.pk, 'E', event.pk)
+        )
+        self.assertEqual([row['id'] for row in body['included']['events']],
+                         [event.pk])
+        self.assertEqual(
+            [row['id'] for row in body['included']['personas']],
+            [self.persona.pk]
+        )
+        response = self.client.get(url, {'include': 'subject2.place'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_within_budget(self):
+        """The list view keeps to its RESEARCHER_QUERY_BUDGETS budget."""
+        for number in range(20):
+            models.Persona.objects.create(name='P%d' % number,
+                                          description_comments='')
+        with querylog.query_budget(querylog.BUDGETS.get('api:api_list', 8),
+                                   'api:api_list'):
+            response = self.client.get(self.personas, {'limit': '20'})
+        self.assertEqual(response.status_code, 200)
+
+
+class SharedCacheCheckTests(TestCase):
+
+    """The system check for a cache every process shares."""
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_local_memory_cache_is_an_error(self):
+        """A per-process cache is reported."""
+        errors = check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['researcher.E001'])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'researcher_cache',
+    }})
+    def test_database_cache_passes(self):
+        """A cache in the database is shared."""
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class LoaderTests(ResearchData, TestCase):
+
+    """Batched loads through a LoaderContext, and what uses them."""
+
+    def setUp(self):
+        """Add two places of two parts, an event and a characteristic."""
+        super(LoaderTests, self).setUp()
+        country = models.PlacePartType.objects.create(name='Country')
+        town = models.PlacePartType.objects.create(name='Town')
+        self.places = []
+        for name in ('Salem', 'Dover'):
+            place = models.Place.objects.create(
+                existence_date_start=DAY,
+                existence_date_end=DAY
+            )
+            models.PlacePart.objects.create(place=place, name='England',
+                                            place_part_type=country,
+                                            sequence_number=1)
+            models.PlacePart.objects.create(place=place, name=name,
+                                            place_part_type=town,
+                                            sequence_number=2)
+            self.places.append(place)
+        birth = models.EventType.objects.create(name='Birth')
+        self.event = models.Event.objects.create(
+            event_type=birth,
+            place=self.places[0],
+            name='Birth of Ann',
+            date_start=DAY,
+            date_end=DAY
+        )
+        occupation = models.CharacteristicPartType.objects.create(
+            name='Occupation'
+        )
+        self.characteristic = models.Characteristic.objects.create(
+            place=self.places[1],
+            date_start=DAY + datetime.timedelta(days=7000),
+            date_end=DAY + datetime.timedelta(days=7000),
+            sort_order='A'
+        )
+        models.CharacteristicPart.objects.create(
+            characteristic=self.characteristic,
+            characteristic_part_type=occupation,
+            name='Weaver',
+            sequence_number=1
+        )
+        title = models.CitationPartType.objects.create(name='Title')
+        models.CitationPart.objects.create(source=self.source,
+                                           citation_part_type=title,
+                                           value='Register')
+
+    def test_to_one_loader_keys_by_column(self):
+        """A loader on a ForeignKey finds rows by the related id."""
+        loader = loaders.LoaderContext().loader(models.PlacePart, 'place')
+        pending = [loader.load(place.pk) for place in self.places]
+        with self.assertNumQueries(1):
+            found = [value.get() for value in pending]
+        self.assertEqual([part.place_id for part in found],
+                         [place.pk for place in self.places])
+
+    def test_walk_primes_reverse_relations(self):
+        """Walked children are read from memory afterwards."""
+        places = list(models.Place.objects.filter(
+            pk__in=[place.pk for place in self.places]
+        ).order_by('pk'))
+        lookup('PlacePartType').all()
+        with self.assertNumQueries(1):
+            loaders.LoaderContext().walk(places, 'placepart_set')
+        with self.assertNumQueries(0):
+            self.assertEqual([str(place) for place in places],
+                             ['England, Salem', 'England, Dover'])
+            self.assertEqual(places[0].labelled_parts(),
+                             [('Country', 'England'), ('Town', 'Salem')])
+
+    def test_missing_subject_is_none_either_way(self):
+        """A missing subject is None with or without a context."""
+        assertion = self.assertion(subject2_type='E', subject2=999999)
+        self.assertIsNone(assertion.get_subject2())
+        loaders.activate(loaders.LoaderContext())
+        try:
+            self.assertIsNone(assertion.get_subject2())
+            self.assertEqual(assertion.get_subject1(), self.persona)
+        finally:
+            loaders.deactivate()
+
+    def test_persona_assertions_are_loaded_once(self):
+        """A persona's assertions cost one query per context."""
+        first = self.assertion()
+        second = self.assertion(subject2_type='E', subject2=self.event.pk)
+        loaders.activate(loaders.LoaderContext())
+        try:
+            with self.assertNumQueries(1):
+                self.assertEqual(self.persona.assertions(), [first, second])
+                self.assertEqual(self.persona.assertions(), [first, second])
+        finally:
+            loaders.deactivate()
+
+    def test_timeline(self):
+        """A timeline lists events and characteristics, with citations."""
+        self.assertion(subject2_type='E', subject2=self.event.pk,
+                       value_role='Child')
+        self.assertion(subject2_type='C', subject2=self.characteristic.pk)
+        self.assertion(subject2_type='E', subject2=self.event.pk,
+                       disproved=True, value_role='Witness')
+        for name in timeline.NAMED_LOOKUPS:
+            lookup(name).all()
+        with self.assertNumQueries(5):
+            entries = timeline._assemble(self.persona.pk)
+        self.assertEqual(
+            [(entry.kind, entry.type, entry.description, entry.roles,
+              entry.sources) for entry in entries],
+            [('E', 'Birth', 'Birth of Ann', ('Child',),
+              ((self.source.pk, 'Title: Register'),)),
+             ('C', 'Occupation', 'Weaver', (),
+              ((self.source.pk, 'Title: Register'),))]
+        )
+
+    def test_api_includes_share_a_batch(self):
+        """Relations to one model at one level cost a single query."""
+        self.client.login(username='staff', password='secret')
+        url = reverse('api:api_list', args=['sources'])
+        with querylog.recording() as recorded:
+            response = self.client.get(url, {
+                'include': 'subject_place.place_parts,jurisdiction_place,'
+                           'citation_parts'
+            })
+        self.assertEqual(response.status_code, 200)
+        included = json.loads(response.content.decode())['included']
+        self.assertEqual([row['id'] for row in included['places']],
+                         [self.place.pk])
+        self.assertEqual(len(included['citation_parts']), 1)
+        tables = [query.sql.split(' FROM ')[1].split()[0]
+                  for query in recorded.queries
+                  if ' FROM "researcher_place' in query.sql or
+                  ' FROM "researcher_citationpart' in query.sql]
+        self.assertEqual(sorted(tables), [
+            '"researcher_citationpart"',
+            '"researcher_place"',
+            '"researcher_placepart"',
+        ])
+
+    def test_admin_lists_load_in_batches(self):
+        """Subjects, citations and place parts cost a query a page."""
+        self.client.login(username='staff', password='secret')
+        for number in range(10):
+            self.assertion(subject2_type='E', subject2=self.event.pk)
+        pages = {}
+        for name in ('assertion', 'source', 'place'):
+            url = reverse('admin:researcher_%s_changelist' % name)
+            with querylog.recording() as recorded:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages[name] = recorded
+        self.assertContains(response, 'Town: Dover')
+        for name, recorded in pages.items():
+            self.assertFalse(recorded.storms(), name)
+
+
+class RelationshipTests(ResearchData, TestCase):
+
+    """Naming relationships in the family graph."""
+
+    def setUp(self):
+        """Build three generations, with a half-sibling and partners.
+
+        Grandfather and Grandmother have Alice and Bob.  Alice and Sam
+        have Carl, who has Eve with Cora; Bob has Dora with Beth and Gus
+        with Fay.
+        """
+        super(RelationshipTests, self).setUp()
+        people = ('Grandfather', 'Grandmother', 'Alice', 'Bob', 'Sam',
+                  'Carl', 'Beth', 'Dora', 'Fay', 'Gus', 'Cora', 'Eve')
+        for name in people:
+            setattr(self, name.lower(), self.named(name))
+        self.birth(self.alice, self.grandfather, self.grandmother)
+        self.birth(self.bob, self.grandfather, self.grandmother)
+        self.birth(self.carl, self.sam, self.alice)
+        self.birth(self.dora, self.bob, self.beth)
+        self.birth(self.gus, self.bob, self.fay)
+        self.birth(self.eve, self.carl, self.cora)
+        self.graph = relationships.graph()
+
+    def name(self, first, second):
+        """Name what the second persona is to the first."""
+        return self.graph.relationship(first.pk, second.pk).name
+
+    def test_describe(self):
+        """Blood relationships are named by generations up and down."""
+        for up, down, half, name in (
+                (0, 0, False, 'self'),
+                (2, 0, False, 'grandparent'),
+                (0, 3, False, 'great-grandchild'),
+                (2, 1, False, 'aunt/uncle'),
+                (1, 3, False, 'great-niece/nephew'),
+                (2, 2, False, '1st cousin'),
+                (3, 3, False, '2nd cousin'),
+                (3, 2, False, '1st cousin 1 time removed'),
+                (2, 4, False, '1st cousin 2 times removed'),
+                (1, 1, True, 'half-sibling'),
+                (2, 2, True, 'half 1st cousin')):
+            self.assertEqual(relationships.describe(up, down, half), name)
+
+    def test_cousins(self):
+        """Cousins are found through both grandparents."""
+        found = self.graph.relationship(self.carl.pk, self.dora.pk)
+        self.assertEqual(found.name, '1st cousin')
+        self.assertEqual((found.up, found.down), (2, 2))
+        self.assertEqual(found.common_ancestors,
+                         [self.grandfather.pk, self.grandmother.pk])
+        self.assertEqual(found.path, [self.carl.pk, self.alice.pk,
+                                      self.grandfather.pk, self.bob.pk,
+                                      self.dora.pk])
+        self.assertEqual(self.name(self.eve, self.dora),
+                         '1st cousin 1 time removed')
+        self.assertEqual(self.name(self.dora, self.alice), 'aunt/uncle')
+
+    def test_half_siblings(self):
+        """Children of one shared parent are half-siblings."""
+        self.assertEqual(self.name(self.dora, self.gus), 'half-sibling')
+        self.assertEqual(self.name(self.alice, self.bob), 'sibling')
+        self.assertEqual(self.name(self.carl, self.gus), '1st cousin')
+
+    def test_in_laws(self):
+        """Partners link in-laws on either side."""
+        self.assertEqual(self.name(self.alice, self.sam), 'partner')
+        found = self.graph.relationship(self.bob.pk, self.sam.pk)
+        self.assertEqual(found.name, 'sibling-in-law')
+        self.assertEqual(found.path, [self.bob.pk, self.grandfather.pk,
+                                      self.alice.pk, self.carl.pk,
+                                      self.sam.pk])
+        self.assertEqual(self.name(self.sam, self.grandmother),
+                         'parent-in-law')
+        self.assertEqual(self.name(self.grandmother, self.sam),
+                         'child-in-law')
+
+    def test_path_without_a_relationship(self):
+        """Personas linked only by a chain are given the chain."""
+        found = self.graph.relationship(self.sam.pk, self.beth.pk)
+        self.assertIsNone(found.name)
+        self.assertEqual(found.path, [self.sam.pk, self.carl.pk,
+                                      self.alice.pk, found.path[3],
+                                      self.bob.pk, self.dora.pk,
+                                      self.beth.pk])
+        self.assertIn(found.path[3],
+                      [self.grandfather.pk, self.grandmother.pk])
+        self.assertIsNone(self.graph.path(self.sam.pk, self.persona.pk))
+
+
+class GraphRefreshTests(ResearchData, TransactionTestCase):
+
+    """Catching up with the changes made by other processes."""
+
+    def setUp(self):
+        """Load a graph that no signal reaches, as another process would."""
+        super(GraphRefreshTests, self).setUp()
+        self.father = self.named('Father')
+        self.child = self.named('Child')
+        self.birth(self.child, self.father)
+        self.graph = relationships.FamilyGraph()
+        self.assertEqual(self.graph.parents(self.child.pk),
+                         (self.father.pk,))
+        self.loads = []
+        load = self.graph._load
+        self.graph._load = lambda: (self.loads.append(1), load())
+
+    def children(self):
+        """Read the father's children after the next check is due."""
+        self.graph._checked = 0
+        return self.graph.children(self.father.pk)
+
+    def test_new_rows_are_folded_in(self):
+        """Unrelated saves and new births are read without a rebuild."""
+        with transaction.atomic():
+            self.assertion(rationale='Unrelated')
+        second = self.named('Second')
+        self.birth(second, self.father)
+        self.assertEqual(self.children(), (self.child.pk, second.pk))
+        self.assertEqual(self.loads, [])
+
+    def test_skipped_id_is_read_later(self):
+        """A row committed after a higher id is still folded in."""
+        second = self.named('Second')
+        event = self.birth(second)
+        last = models.Assertion.objects.order_by('-pk')[0].pk
+        self.assertion(id=last + 2, rationale='Committed first')
+        self.assertEqual(self.children(), (self.child.pk,))
+        self.assertion(id=last + 1, subject1=self.father.pk,
+                       subject2_type='E', subject2=event.pk,
+                       value_role='Father')
+        self.assertEqual(self.children(), (self.child.pk, second.pk))
+        self.assertEqual(self.loads, [])
+
+    def test_edit_rebuilds(self):
+        """Disproving a parent rebuilds the graph without the link."""
+        assertion = models.Assertion.objects.get(value_role='Father')
+        assertion.disproved = True
+        assertion.save()
+        self.assertEqual(self.children(), ())
+        self.assertEqual(self.loads, [1])
+
+
+class ChartTests(ResearchData, TestCase):
+
+    """Ahnentafel-numbered pedigrees and d'Aboville-numbered descendants."""
+
+    def numbers(self, chart):
+        """Map each entry's number to the name of its persona."""
+        return dict((entry.number, entry.name) for entry in chart.entries)
+
+    def test_pedigree_numbers(self):
+        """Fathers are 2n and mothers 2n + 1; missing parents are gaps."""
+        people = dict((name, self.named(name))
+                      for name in ('Root', 'Dad', 'Mum', 'Grandad', 'Nan'))
+        self.birth(people['Root'], people['Dad'], people['Mum'])
+        self.birth(people['Dad'], people['Grandad'])
+        self.birth(people['Mum'], mother=people['Nan'])
+        chart = charts.pedigree(people['Root'].pk, 3)
+        self.assertEqual(self.numbers(chart), {
+            1: 'Root', 2: 'Dad', 3: 'Mum', 4: 'Grandad', 7: 'Nan',
+        })
+        self.assertEqual(
+            [(entry.number, entry.parent) for entry in chart.entries],
+            [(1, None), (2, 1), (3, 1), (4, 2), (7, 3)]
+        )
+
+    def test_descendant_numbers(self):
+        """Children are numbered in order of birth, below their parent."""
+        root, elder, younger, grandchild = [
+            self.named(name)
+            for name in ('Root', 'Elder', 'Younger', 'Grandchild')
+        ]
+        self.birth(younger, root, date=datetime.date(1852, 1, 1))
+        self.birth(elder, root, date=datetime.date(1850, 1, 1))
+        self.birth(grandchild, mother=elder)
+        chart = charts.descendants(root.pk, 3)
+        self.assertEqual(self.numbers(chart), {
+            '1': 'Root',
+            '1.1': 'Elder',
+            '1.2': 'Younger',
+            '1.1.1': 'Grandchild',
+        })
+        self.assertEqual(chart.entries[1].born, datetime.date(1850, 1, 1))
+
+    def test_descendant_loop_stops_at_the_depth(self):
+        """A loop of parentage repeats down to the depth asked for."""
+        first, second = self.named('First'), self.named('Second')
+        self.birth(second, first)
+        self.birth(first, second)
+        chart = charts.descendants(first.pk, 4)
+        self.assertEqual(
+            [(entry.number, entry.name) for entry in chart.entries],
+            [('1', 'First'), ('1.1', 'Second'), ('1.1.1', 'First'),
+             ('1.1.1.1', 'Second')]
+        )
+
+    def test_depth_out_of_range(self):
+        """Charts deeper than RESEARCHER_CHART_MAX_GENERATIONS fail."""
+        with self.assertRaises(ValueError):
+            charts.pedigree(self.persona.pk, charts.MAX_GENERATIONS + 1)
+
+
+class NetworkData(ResearchData):
+
+    """Save family networks in a directory of their own."""
+
+    def setUp(self):
+        """Point RESEARCHER_NETWORK_DIR at a fresh directory."""
+        super(NetworkData, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.addCleanup(setattr, network, 'NETWORK_DIR', network.NETWORK_DIR)
+        network.NETWORK_DIR = directory
+
+    def baptism(self, child, *parents):
+        """Save a baptism naming every parent in the role 'Parent'."""
+        return self.event('Baptism', [('Child', child)] +
+                          [('Parent', parent) for parent in parents])
+
+
+class NetworkTests(NetworkData, TestCase):
+
+    """A project's family network as CSR arrays."""
+
+    def setUp(self):
+        """Save two families: a grandparent line and a parent and child."""
+        super(NetworkTests, self).setUp()
+        self.people = dict(
+            (name, self.named(name)) for name in 'ABCDEF'
+        )
+        people = self.people
+        self.birth(people['C'], people['A'], people['B'])
+        self.birth(people['D'], people['C'])
+        self.birth(people['F'], people['E'])
+
+    def by_name(self, family, values):
+        """Map the persona names to a per-node array's values."""
+        return dict(
+            (name, int(values[family.node(persona.pk)]))
+            for name, persona in self.people.items()
+        )
+
+    def test_components(self):
+        """Each family is one component, labelled by its first node."""
+        family = network.build_network(self.project)
+        self.assertEqual(family.component_sizes(), [
+            (self.people['A'].pk, 4),
+            (self.people['E'].pk, 2),
+        ])
+        self.assertEqual(family.parents(self.people['C'].pk),
+                         [self.people['A'].pk, self.people['B'].pk])
+        self.assertEqual(family.children(self.people['C'].pk),
+                         [self.people['D'].pk])
+
+    def test_generations(self):
+        """Generations count down from the earliest ancestors."""
+        family = network.build_network(self.project)
+        self.assertEqual(self.by_name(family, family.generations()), {
+            'A': 0, 'B': 0, 'C': 1, 'D': 2, 'E': 0, 'F': 1,
+        })
+
+    def test_loop_has_no_generation(self):
+        """Personas in a loop of parentage, and below it, get -1."""
+        self.birth(self.people['A'], self.people['D'])
+        family = network.build_network(self.project)
+        generations = self.by_name(family, family.generations())
+        self.assertEqual(
+            [generations[name] for name in 'ABCD'], [-1, 0, -1, -1]
+        )
+
+    def test_rebuild_swaps_the_network(self):
+        """A rebuild replaces the saved network; open copies still read."""
+        old = network.build_network(self.project)
+        self.birth(self.named('G'), self.people['F'])
+        new = network.build_network(self.project)
+        self.assertEqual(new.size, old.size + 1)
+        self.assertEqual(old.ids.tolist(), sorted(
+            persona.pk for persona in self.people.values()
+        ))
+        self.assertEqual(network.network(self.project).path, new.path)
+        self.assertEqual(len(os.listdir(network.NETWORK_DIR)), 2)
+
+
+class KinshipTests(NetworkData, TestCase):
+
+    """Inbreeding and kinship coefficients."""
+
+    def inbreeding(self, persona):
+        """Compute the project's coefficients and read a persona's."""
+        kinship.compute_inbreeding(self.project, workers=1)
+        return models.InbreedingCoefficient.objects.get(
+            project=self.project,
+            persona=persona
+        ).coefficient
+
+    def test_half_sibling_mating(self):
+        """The child of half-siblings has F = 1/8."""
+        father, first, second = [self.named(name) for name in 'FAB']
+        son, daughter, child = [self.named(name) for name in 'SDC']
+        self.birth(son, father, first)
+        self.birth(daughter, father, second)
+        self.birth(child, son, daughter)
+        self.assertAlmostEqual(self.inbreeding(child), 0.125)
+
+    def test_full_sibling_mating_with_two_parent_roles(self):
+        """Two parents both named 'Parent' count; full-sib mating is 1/4."""
+        one, two, son, daughter, child = [
+            self.named(name) for name in ('One', 'Two', 'S', 'D', 'C')
+        ]
+        self.baptism(son, one, two)
+        self.baptism(daughter, one, two)
+        self.baptism(child, son, daughter)
+        self.assertAlmostEqual(self.inbreeding(child), 0.25)
+
+    def test_threads_agree_with_one(self):
+        """Kinship computed in threads matches kinship computed serially."""
+        people = [self.named('P%d' % number) for number in range(8)]
+        self.birth(people[2], people[0], people[1])
+        self.birth(people[3], people[0], people[1])
+        self.birth(people[4], people[2], people[3])
+        self.birth(people[5], people[3], people[4])
+        self.birth(people[6], people[4], people[5])
+        self.birth(people[7], people[2], people[6])
+        pairs = [(first.pk, second.pk) for first in people
+                 for second in people]
+        self.addCleanup(setattr, kinship, 'BATCH_COLUMNS',
+                        kinship.BATCH_COLUMNS)
+        kinship.BATCH_COLUMNS = 1
+        family = network.network(self.project)
+        serial = kinship.KinshipCalculator(family, workers=1).kinship(pairs)
+        threaded = kinship.KinshipCalculator(family, workers=4).kinship(pairs)
+        self.assertEqual(serial.tolist(), threaded.tolist())
+        self.assertAlmostEqual(serial[pairs.index((people[2].pk,
+                                                   people[3].pk))], 0.25)
+
+
+class ParticipationTests(ResearchData, TestCase):
+
+    """Event participation derived from assertions."""
+
+    def test_missing_event_makes_no_participation(self):
+        """An assertion naming a deleted event saves without one."""
+        self.assertion(subject2_type='E', subject2=999999, value_role='Child')
+        self.assertFalse(models.EventParticipation.objects.exists())
+
+    def test_event_saved_after_its_assertion(self):
+        """An event saved after the assertion naming it gets its row."""
+        assertion = self.assertion(subject2_type='E', subject2=999999,
+                                   value_role='Child')
+        event_type = models.EventType.objects.create(name='Birth')
+        models.Event.objects.create(id=999999, event_type=event_type,
+                                    place=self.place, name='Birth',
+                                    date_start=DAY, date_end=DAY)
+        self.assertEqual(
+            list(models.EventParticipation.objects.values_list(
+                'assertion', 'persona', 'event', 'role'
+            )),
+            [(assertion.pk, self.persona.pk, 999999, 'Child')]
+        )
+
+
+class MembershipTests(ResearchData, TestCase):
+
+    """Group membership looked up by the dates the group existed."""
+
+    def setUp(self):
+        """Make a persona a member of a group of the 1850s."""
+        super(MembershipTests, self).setUp()
+        group_type = models.GroupType.objects.create(name='Household')
+        self.group = models.Group.objects.create(
+            group_type=group_type, place=self.place, name='Household',
+            date_start=datetime.date(1850, 1, 1),
+            date_end=datetime.date(1860, 12, 31), criteria='Census'
+        )
+        self.membership = self.assertion(
+            subject2_type='G', subject2=self.group.pk, value_role='Member'
+        )
+
+    def members(self, when):
+        """Return the assertions of the group's members at a time."""
+        return [row.assertion_id
+                for row in participation.members(self.group, when=when)]
+
+    def test_member_at_a_date(self):
+        """A date inside the group's dates finds the member."""
+        self.assertEqual(self.members(datetime.date(1855, 6, 1)),
+                         [self.membership.pk])
+        self.assertEqual(self.members(datetime.date(1870, 1, 1)), [])
+
+    def test_member_in_a_year(self):
+        """A year overlapping the group's last year finds the member."""
+        self.assertEqual(self.members(1860), [self.membership.pk])
+        self.assertEqual(self.members(1870), [])
+
+    def test_open_ended_periods(self):
+        """Either end of a period may be left open."""
+        self.assertEqual(self.members((datetime.date(1858, 1, 1), None)),
+                         [self.membership.pk])
+        self.assertEqual(self.members((datetime.date(1861, 1, 1), None)), [])
+        self.assertEqual(self.members((None, datetime.date(1850, 1, 1))),
+                         [self.membership.pk])
+        self.assertEqual(self.members((None, datetime.date(1849, 12, 31))),
+                         [])
+
+    def test_memberships_of_a_persona(self):
+        """A persona's memberships are filtered the same way."""
+        self.assertEqual(
+            [row.group_id for row in participation.memberships(
+                self.persona, role='Member', when=(None, None)
+            )],
+            [self.group.pk]
+        )
+        self.assertFalse(participation.memberships(
+            self.persona, when=datetime.date(1849, 1, 1)
+        ).exists())
+
+
+class TimelineTests(ResearchData, TestCase):
+
+    """A persona's cached timeline, and what moves it on."""
+
+    def test_entries_in_date_order(self):
+        """Entries are sorted by date, whatever order they were saved in."""
+        self.event('Census', [('Head', self.persona)],
+                   datetime.date(1860, 1, 1))
+        self.event('Birth', [('Child', self.persona)])
+        self.event('Death', [('Deceased', self.persona)],
+                   datetime.date(1870, 1, 1))
+        self.assertEqual(
+            [entry.type for entry in timeline.timeline(self.persona.pk)],
+            ['Birth', 'Census', 'Death']
+        )
+
+    def test_event_edit_is_seen(self):
+        """Renaming an event moves the cached timeline on."""
+        event = self.event('Birth', [('Child', self.persona)])
+        timeline.timeline(self.persona.pk)
+        event.name = 'Birth of Ann'
+        event.save()
+        self.assertEqual(timeline.timeline(self.persona.pk)[0].description,
+                         'Birth of Ann')
+
+    def test_citation_part_edit_is_seen(self):
+        """Changing a citation part of a cited source is seen."""
+        page = models.CitationPartType.objects.create(name='Page')
+        part = models.CitationPart.objects.create(
+            source=self.source,
+            citation_part_type=page,
+            value='1'
+        )
+        self.event('Birth', [('Child', self.persona)])
+        self.assertEqual(timeline.timeline(self.persona.pk)[0].sources,
+                         ((self.source.pk, 'Page: 1'),))
+        part.value = '2'
+        part.save()
+        self.assertEqual(timeline.timeline(self.persona.pk)[0].sources,
+                         ((self.source.pk, 'Page: 2'),))
+
+    def test_place_edit_is_seen(self):
+        """Renaming a place part moves only that place's name on."""
+        town = models.PlacePartType.objects.create(name='Town')
+        part = models.PlacePart.objects.create(
+            place=self.place,
+            place_part_type=town,
+            name='Exeter',
+            sequence_number=1
+        )
+        self.event('Birth', [('Child', self.persona)])
+        self.assertEqual(timeline.timeline(self.persona.pk)[0].place,
+                         'Exeter')
+        part.name = 'Topsham'
+        part.save()
+        self.assertEqual(timeline.timeline(self.persona.pk)[0].place,
+                         'Topsham')
+
+
+class ConflictTests(ResearchData, TestCase):
+
+    """The conflict rules, and the checks queued as rows change."""
+
+    def conflicts(self, persona):
+        """Check a persona's queued groups and name the rules it breaks."""
+        conflicts.check_pending()
+        return set(models.Conflict.objects.filter(
+            persona=persona
+        ).values_list('rule', flat=True))
+
+    def characteristic(self, type_name, value):
+        """Save a characteristic of the test persona with one part."""
+        part_type = models.CharacteristicPartType.objects.get_or_create(
+            name=type_name
+        )[0]
+        characteristic = models.Characteristic.objects.create(
+            place=self.place,
+            date_start=DAY,
+            date_end=DAY,
+            sort_order='A'
+        )
+        models.CharacteristicPart.objects.create(
+            characteristic=characteristic,
+            characteristic_part_type=part_type,
+            name=value,
+            sequence_number=1
+        )
+        self.assertion(subject2_type='C', subject2=characteristic.pk)
+        return characteristic
+
+    def test_births_at_different_dates(self):
+        """Two births apart are reported; two on the same day are not."""
+        self.event('Birth', [('Child', self.persona)])
+        self.event('Birth', [('Child', self.persona)])
+        self.assertNotIn('event-dates', self.conflicts(self.persona))
+        self.event('Birth', [('Child', self.persona)],
+                   datetime.date(1840, 1, 1))
+        self.assertIn('event-dates', self.conflicts(self.persona))
+
+    def test_characteristic_values(self):
+        """Values differing only in case agree; other values do not."""
+        self.characteristic('Sex', 'Female')
+        self.characteristic('Sex', ' female')
+        self.characteristic('Occupation', 'Weaver')
+        self.characteristic('Occupation', 'Miner')
+        self.assertEqual(self.conflicts(self.persona), set())
+        self.characteristic('Sex', 'Male')
+        self.assertEqual(self.conflicts(self.persona),
+                         {'characteristic-value'})
+
+    def test_two_fathers(self):
+        """Two different fathers are reported."""
+        self.birth(self.persona, father=self.named('Tom'))
+        self.assertNotIn('parents', self.conflicts(self.persona))
+        self.birth(self.persona, father=self.named('Bob'))
+        self.assertIn('parents', self.conflicts(self.persona))
+        self.assertTrue(models.Conflict.objects.filter(
+            persona=self.persona, rule='parents',
+            description__startswith='Different fathers'
+        ).exists())
+
+    def test_more_than_two_parents(self):
+        """A third parent is reported when no role is doubled."""
+        self.event('Baptism', [('Child', self.persona),
+                               ('Parent', self.named('Tom')),
+                               ('Parent', self.named('Ann'))])
+        self.assertNotIn('parents', self.conflicts(self.persona))
+        self.event('Baptism', [('Child', self.persona),
+                               ('Parent', self.named('Bob'))])
+        self.assertIn('parents', self.conflicts(self.persona))
+
+    def test_deleted_event_is_checked_again(self):
+        """Deleting the second birth clears the conflict it caused."""
+        self.event('Birth', [('Child', self.persona)])
+        second = self.event('Birth', [('Child', self.persona)],
+                            datetime.date(1840, 1, 1))
+        self.assertIn('event-dates', self.conflicts(self.persona))
+        second.delete()
+        self.assertNotIn('event-dates', self.conflicts(self.persona))
+
+
+class SanityTests(ResearchData, TestCase):
+
+    """The sanity rules, each run over one persona."""
+
+    def problems(self, persona):
+        """Check a persona and name the rules it breaks."""
+        sanity.evaluate([persona.pk])
+        return set(models.SanityProblem.objects.filter(
+            persona=persona
+        ).values_list('rule', flat=True))
+
+    def test_death_before_birth(self):
+        """A death dated before the birth is reported."""
+        self.event('Birth', [('Child', self.persona)])
+        self.event('Death', [('Deceased', self.persona)],
+                   datetime.date(1840, 1, 1))
+        self.assertIn('death-before-birth', self.problems(self.persona))
+
+    def test_birth_after_mother_death(self):
+        """A birth after the mother's death is reported."""
+        mother = self.named('Mother')
+        self.event('Death', [('Deceased', mother)], datetime.date(1840, 1, 1))
+        self.birth(self.persona, mother=mother)
+        self.assertIn('birth-after-mother-death',
+                      self.problems(self.persona))
+
+    def test_early_marriage(self):
+        """A bride of five is reported, but not a witness of five."""
+        witness = self.named('Witness')
+        groom = self.named('Groom')
+        for persona in (self.persona, witness):
+            self.event('Birth', [('Child', persona)])
+        self.event('Marriage', [('Bride', self.persona), ('Groom', groom),
+                                ('Witness', witness)],
+                   datetime.date(1855, 1, 1))
+        self.assertIn('early-marriage', self.problems(self.persona))
+        self.assertNotIn('early-marriage', self.problems(witness))
+
+    def test_event_outside_place(self):
+        """An event after its place stopped existing is reported."""
+        self.source.subject_date_end = datetime.date(1950, 1, 1)
+        self.source.save()
+        self.event('Census', [('Head', self.persona)],
+                   datetime.date(1900, 1, 1))
+        self.assertEqual(self.problems(self.persona),
+                         {'event-outside-place'})
+
+    def test_event_outside_source(self):
+        """An event after the dates its source covers is reported."""
+        self.place.existence_date_end = datetime.date(1950, 1, 1)
+        self.place.save()
+        self.event('Census', [('Head', self.persona)],
+                   datetime.date(1900, 1, 1))
+        self.assertEqual(self.problems(self.persona),
+                         {'event-outside-source'})
+
+
+class QueueTests(ResearchData, TestCase):
+
+    """The pending-check queues shared by conflicts, sanity and gaps."""
+
+    def test_enqueue_skips_queued_rows(self):
+        """Queueing a persona twice leaves one row."""
+        queues.enqueue('PendingGapCheck', ('persona',),
+                       [(self.persona.pk,)])
+        queues.enqueue('PendingGapCheck', ('persona',),
+                       [(self.persona.pk,), (self.persona.pk,)])
+        self.assertEqual(models.PendingGapCheck.objects.count(), 1)
+
+    def test_failed_batch_stays_queued(self):
+        """A batch whose handling raises is not dequeued."""
+        queues.enqueue('PendingGapCheck', ('persona',),
+                       [(self.persona.pk,)])
+
+        def fail(pending):
+            """Fail to handle a batch."""
+            raise RuntimeError('failed')
+
+        with self.assertRaises(RuntimeError):
+            queues.work_through('PendingGapCheck', ('persona',), fail)
+        self.assertEqual(models.PendingGapCheck.objects.count(), 1)
+        handled = []
+        self.assertEqual(queues.work_through(
+            'PendingGapCheck', ('persona',), handled.extend
+        ), 1)
+        self.assertEqual(handled, [(self.persona.pk,)])
+        self.assertFalse(models.PendingGapCheck.objects.exists())
+
+    def test_rationale_edit_queues_nothing(self):
+        """Saving an assertion with only its rationale changed is free."""
+        assertion = self.assertion()
+        for name in ('PendingConflictCheck', 'PendingSanityCheck',
+                     'PendingGapCheck'):
+            getattr(models, name).objects.all().delete()
+        assertion.rationale = 'Seen again'
+        with CaptureQueriesContext(connection) as queries:
+            assertion.save()
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'pending' in query['sql']
+                          or 'participation' in query['sql']])
+        self.assertFalse(models.PendingGapCheck.objects.exists())
+
+    def test_subject_edit_queues_both_personas(self):
+        """Moving an assertion queues the persona it left and joined."""
+        assertion = self.assertion()
+        other = models.Persona.objects.create(name='Bob',
+                                              description_comments='')
+        models.PendingGapCheck.objects.all().delete()
+        assertion.subject2 = other.pk
+        assertion.save()
+        self.assertEqual(
+            set(models.PendingGapCheck.objects.values_list('persona_id',
+                                                           flat=True)),
+            {self.persona.pk, other.pk}
+        )
+
+
+class ProfileTests(TestCase):
+
+    """Profiles taken on request or by sampling, and their rotation."""
+
+    def setUp(self):
+        """Write profiles to a directory of their own."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        for name, value in (('PROFILE_DIR', self.directory),
+                            ('PROFILE_TOKEN', None),
+                            ('PROFILE_SAMPLE_RATE', 0.0)):
+            self.addCleanup(setattr, profiling, name,
+                            getattr(profiling, name))
+            setattr(profiling, name, value)
+
+    def respond(self, **headers):
+        """Pass a request through the middleware and return the response."""
+        middleware = profiling.ProfileMiddleware()
+        request = RequestFactory().get('/researcher/', **headers)
+        middleware.process_request(request)
+        return middleware.process_response(request, HttpResponse())
+
+    def saved(self):
+        """List the flamegraph files written, oldest first."""
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith('.folded'))
+
+    def test_samples_the_running_code(self):
+        """The flamegraph holds the stacks of the profiled function."""
+        with profiling.profiling('busy', self.directory) as profile:
+            finish = time.time() + 0.1
+            while time.time() < finish:
+                sum(range(1000))
+        with open(profile.path) as stream:
+            self.assertIn('test_samples_the_running_code', stream.read())
+        with open(profile.path[:-len('.folded')] + '.json') as stream:
+            self.assertEqual(json.load(stream)['label'], 'busy')
+
+    def test_unprofiled_by_default(self):
+        """With no token and no sample rate nothing is profiled."""
+        self.assertNotIn('X-Researcher-Profile', self.respond())
+        self.assertEqual(self.saved(), [])
+
+    def test_token_asks_for_a_profile(self):
+        """Only the matching token profiles a request."""
+        profiling.PROFILE_TOKEN = 'secret'
+        response = self.respond(HTTP_X_RESEARCHER_PROFILE='guess')
+        self.assertNotIn('X-Researcher-Profile', response)
+        response = self.respond(HTTP_X_RESEARCHER_PROFILE='secret')
+        self.assertEqual(self.saved(), [response['X-Researcher-Profile']])
+
+    def test_sampled_requests(self):
+        """A sample rate profiles that share of the requests."""
+        profiling.PROFILE_SAMPLE_RATE = 1.0
+        self.assertIn('X-Researcher-Profile', self.respond())
+        profiling.PROFILE_SAMPLE_RATE = 0.5
+        self.addCleanup(setattr, profiling.random, 'random',
+                        profiling.random.random)
+        profiling.random.random = lambda: 0.75
+        self.assertNotIn('X-Researcher-Profile', self.respond())
+        self.assertEqual(len(self.saved()), 1)
+
+    def test_old_profiles_rotated(self):
+        """Only the newest PROFILE_KEEP profiles are kept."""
+        self.addCleanup(setattr, profiling, 'PROFILE_KEEP',
+                        profiling.PROFILE_KEEP)
+        profiling.PROFILE_KEEP = 2
+        for label in ('first', 'second', 'third'):
+            with profiling.profiling(label):
+                pass
+        self.assertEqual(
+            [name.rsplit('-', 1)[-1] for name in self.saved()],
+            ['second.folded', 'third.folded']
+        )
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+
+class SlowQueryTests(TestCase):
+
+    """The slow-query log, and the indexes suggested from it."""
+
+    def setUp(self):
+        """Log slow queries to a file of their own."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, 'slow.jsonl')
+        self.addCleanup(setattr, slowqueries, 'SLOW_QUERY_LOG',
+                        slowqueries.SLOW_QUERY_LOG)
+        slowqueries.SLOW_QUERY_LOG = self.path
+
+    def offender(self, sql):
+        """Log one slow statement and read it back as an Offender."""
+        slowqueries.capture('default', sql, None, 0.5)
+        return slowqueries.offenders(self.path)[0]
+
+    def test_literals_share_a_signature(self):
+        """Statements differing only in literals are one offender."""
+        for pk, seconds in ((1, 0.2), (22, 0.5), (333, 0.1)):
+            slowqueries.capture(
+                'default',
+                'SELECT "name" FROM "researcher_persona" '
+                'WHERE "id" = %d AND "name" IN (\'a\', \'b\')' % pk,
+                None, seconds
+            )
+        slowqueries.capture('default', 'SELECT 1', None, 0.1)
+        found = slowqueries.offenders(self.path)
+        self.assertEqual(
+            [(offender.signature, offender.count) for offender in found],
+            [('SELECT "name" FROM "researcher_persona" '
+              'WHERE "id" = ? AND "name" IN (...)', 3),
+             ('SELECT ?', 1)]
+        )
+        self.assertEqual(found[0].max_ms, 500)
+        self.assertIn('= 22 ', found[0].sample['sql'])
+        self.assertNotIn('params', found[0].sample)
+
+    def test_scan_gets_an_index(self):
+        """A full scan filtered on an unindexed column suggests it."""
+        offender = self.offender(
+            'SELECT "researcher_persona"."id" FROM "researcher_persona" '
+            'WHERE "researcher_persona"."name" = \'Ann\''
+        )
+        suggestions = slowqueries.suggest(offender,
+                                          slowqueries.explain(offender))
+        self.assertEqual([str(found) for found in suggestions],
+                         ['Persona.name'])
+        self.assertIn("name='name'",
+                      slowqueries.operations(suggestions)[0])
+        self.assertIn('db_index=True',
+                      slowqueries.operations(suggestions)[0])
+
+    def test_indexed_lookup_gets_none(self):
+        """A statement that uses an index suggests nothing."""
+        offender = self.offender(
+            'SELECT "researcher_persona"."name" FROM "researcher_persona" '
+            'WHERE "researcher_persona"."id" = 1'
+        )
+        plan = slowqueries.explain(offender)
+        self.assertEqual(plan.scans, [])
+        self.assertEqual(slowqueries.suggest(offender, plan), [])
+
+    def test_statement_without_params_is_not_explained(self):
+        """Placeholders logged without their values cannot be explained."""
+        offender = self.offender(
+            'SELECT "name" FROM "researcher_persona" WHERE "id" = %s'
+        )
+        self.assertIsNone(slowqueries.explain(offender))
+
+
+class JobTests(ResearchData, TestCase):
+
+    """Claiming, running and requeuing jobs."""
+
+    def test_claim_and_run(self):
+        """A claimed job runs once and keeps its result."""
+        job = jobs.enqueue('tests.echo', value=1)
+        claimed = jobs.claim('one')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(jobs.claim('two'))
+        self.assertEqual(jobs.run(claimed), 'done')
+        job = models.Job.objects.get(pk=job.pk)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(json.loads(job.result), {'value': 1})
+
+    def test_requeued_job_keeps_the_new_result(self):
+        """A worker whose job was requeued does not record its end."""
+        job = jobs.enqueue('tests.echo', value=2)
+        stale = jobs.claim('one')
+        models.Job.objects.filter(pk=job.pk).update(
+            heartbeat=timezone.now() - datetime.timedelta(days=1)
+        )
+        self.assertEqual(jobs.requeue_stale(), 1)
+        fresh = jobs.claim('two')
+        self.assertEqual(fresh.pk, job.pk)
+        self.assertIsNone(jobs.run(stale))
+        self.assertEqual(models.Job.objects.get(pk=job.pk).status,
+                         'running')
+        self.assertEqual(jobs.run(fresh), 'done')
+        self.assertEqual(models.Job.objects.get(pk=job.pk).worker, 'two')
+
+
+class ImportTests(ResearchData, TestCase):
+
+    """Reserved id blocks of the parallel importer."""
+
+    def setUp(self):
+        """Write a small CSV file to import."""
+        super(ImportTests, self).setUp()
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as stream:
+            stream.write('id,name,birth_date,birth_place\n'
+                         '1,Ann,1850,"Salem, England"\n'
+                         '2,Bob,1852,"Dover, England"\n')
+        self.addCleanup(os.remove, self.path)
+
+    def test_reserved_ids_are_not_taken(self):
+        """Rows saved after a reservation take ids past the block."""
+        first = importer._reserve(models.Place, 3)
+        place = models.Place.objects.create(existence_date_start=DAY,
+                                            existence_date_end=DAY)
+        self.assertGreaterEqual(place.pk, first + 3)
+        self.assertGreaterEqual(importer._reserve(models.Place, 1),
+                                place.pk + 1)
+
+    def test_failed_import_deletes_only_its_rows(self):
+        """Rows others write while an import fails are kept."""
+        before = dict(
+            (model, set(model.objects.values_list('pk', flat=True)))
+            for model in (models.Place, models.Source, models.Persona)
+        )
+        others = []
+
+        def report(done, total, message):
+            """Save a place as another writer, then fail."""
+            others.append(models.Place.objects.create(
+                existence_date_start=DAY,
+                existence_date_end=DAY
+            ).pk)
+            if message == 'Writing':
+                raise RuntimeError('failed')
+
+        with self.assertRaises(RuntimeError):
+            importer.import_file(self.path, self.researcher, workers=1,
+                                 report=report)
+        self.assertEqual(
+            set(models.Place.objects.values_list('pk', flat=True)),
+            before[models.Place] | set(others)
+        )
+        for model in (models.Source, models.Persona):
+            self.assertEqual(set(model.objects.values_list('pk', flat=True)),
+                             before[model])
+
+    def test_import(self):
+        """A CSV file's people, and the places they name, are written."""
+        source, written = importer.import_file(self.path, self.researcher,
+                                               workers=1)
+        self.assertEqual(written['Persona'], 2)
+        self.assertEqual(written['Place'], 3)
+        self.assertEqual(
+            sorted(models.Persona.objects.values_list('name', flat=True)),
+            ['Ann', 'Ann', 'Bob']
+        )
+        self.assertEqual(source.higher_source_id, source.pk)
+
+
+class RoutingTests(ResearchData, TestCase):
+
+    """Which database reads and writes go to, and who may switch."""
+
+    def test_without_replicas_reads_stay_on_primary(self):
+        """Replica blocks read from the primary when there are none."""
+        router = replicas.ReplicaRouter()
+        with replicas.replica_reads():
+            self.assertFalse(replicas.reading_replicas())
+            self.assertEqual(router.db_for_read(models.Assertion),
+                             'default')
+
+    def test_project_data_follows_the_project(self):
+        """Project data goes to the current project's database."""
+        router = shards.ProjectRouter()
+        with shards.project_scope(self.project.pk):
+            self.assertEqual(router.db_for_write(models.Assertion),
+                             shards.project_alias(self.project.pk))
+
+    def _switch(self, user, project):
+        """Ask the middleware to switch a user's session to a project."""
+        request = RequestFactory().get('/', {shards.SESSION_KEY: project})
+        request.user = user
+        request.session = SessionStore()
+        response = shards.ProjectShardMiddleware().process_request(request)
+        return request, response
+
+    def test_members_may_switch_project(self):
+        """A project's researcher may switch to it."""
+        self.user.is_superuser = False
+        self.user.save()
+        request, response = self._switch(self.user, str(self.project.pk))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(request.session[shards.SESSION_KEY],
+                         self.project.pk)
+
+    def test_others_may_not_switch_project(self):
+        """Anyone else is refused."""
+        outsider = get_user_model().objects.create_user('outsider')
+        request, response = self._switch(outsider, str(self.project.pk))
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn(shards.SESSION_KEY, request.session)
+
+
+class HistoryTests(ResearchData, TestCase):
+
+    """Revisions of the versioned models."""
+
+    def test_revisions_hold_changes(self):
+        """Each save adds a revision; later ones hold only the change."""
+        assertion = self.assertion()
+        created = timezone.now()
+        assertion.rationale = 'Seen again'
+        assertion.save()
+        revisions = history.history(models.Assertion, assertion.pk)
+        self.assertEqual([revision.version for revision, state in revisions],
+                         [1, 2])
+        self.assertEqual(json.loads(revisions[1][0].delta),
+                         {'rationale': 'Seen again'})
+        self.assertEqual(revisions[0][1].rationale, 'Seen')
+        self.assertEqual(revisions[1][1].rationale, 'Seen again')
+        self.assertEqual(revisions[1][0].researcher_id, self.researcher.pk)
+        then = history.as_of(models.Assertion, created, pks=[assertion.pk])
+        self.assertEqual(then[assertion.pk].rationale, 'Seen')
+
+    def test_unchanged_save_adds_nothing(self):
+        """Saving a row as it was adds no revision."""
+        assertion = self.assertion()
+        assertion.save()
+        self.assertEqual(
+            len(history.history(models.Assertion, assertion.pk)), 1
+        )
+
+
+class ArchiveTests(ResearchData, TestCase):
+
+    """Archiving disproved assertions and bringing them back."""
+
+    def test_archive_and_rehydrate(self):
+        """Disproved reasoning leaves the live table and comes back."""
+        live = self.assertion()
+        disproved = self.assertion(disproved=True, rationale='Wrong')
+        self.assertEqual(archive.archive(days=0), (1, 0))
+        self.assertFalse(
+            models.Assertion.objects.filter(pk=disproved.pk).exists()
+        )
+        self.assertTrue(models.Assertion.objects.filter(pk=live.pk).exists())
+        self.assertTrue(
+            models.ArchivedAssertion.objects.filter(pk=disproved.pk).exists()
+        )
+        self.assertEqual(archive.load([disproved.pk])[disproved.pk].rationale,
+                         'Wrong')
+        self.assertEqual(archive.rehydrate([disproved.pk]), 1)
+        self.assertEqual(
+            models.Assertion.objects.get(pk=disproved.pk).rationale, 'Wrong'
+        )
+        self.assertFalse(models.ArchivedAssertion.objects.exists())
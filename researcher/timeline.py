@@ -0,0 +1,345 @@
+"""Assemble a persona's timeline of events and characteristics.
+
+A timeline lists every Event and Characteristic (occupations,
+residences, names) that a persona is tied to by an assertion that is not
+disproved, ordered by date, each with the roles, assertions and source
+citations behind it.  An event or characteristic named by several
+assertions appears once.
+
+Assembling one costs a fixed set of IN queries however many assertions
+the persona has: the assertions, their events, their characteristics,
+the characteristics' parts and the sources' citation parts, all through
+the request's loader context (see researcher.loaders).  Type names
+come from the in-memory lookup tables and place names from a per-place
+cache of display names, which needs one query for the places it does
+not hold.  Dates are sorted by their normalized bounds (the earlier of
+date_start and date_end first).
+
+Timelines are cached per persona, under a key holding the persona's
+named version 'timeline:<id>' (see researcher.versions).  Saving or
+deleting an assertion, or an event, characteristic, characteristic part
+or citation part a timeline shows, bumps only the versions of the
+personas concerned.  Place names are cached the same way under
+'place:<id>' and looked up afresh on every call, so a renamed place
+moves only its own name on.  A version bumped inside a transaction is
+bumped again after it commits, so a timeline rebuilt from the old rows
+in the meantime is never read.
+
+Exports:
+    Functions:
+        connect_signals
+        invalidate
+        place_names
+        timeline
+    Classes:
+        TimelineEntry
+"""
+import collections
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+from researcher import loaders, replicas
+from researcher.lookups import lookup
+from researcher.queues import (
+    batches,
+    on_assertion_change,
+    personas_named,
+    subject_personas,
+    subjects_of,
+)
+from researcher.versions import (
+    bump_version,
+    named_versions,
+    table_versions,
+    version,
+)
+
+CACHE_TIMEOUT = getattr(settings, 'RESEARCHER_TIMELINE_CACHE_TIMEOUT', 86400)
+
+# The lookup tables whose names are copied into cached timelines.
+NAMED_LOOKUPS = ('EventType', 'CharacteristicPartType', 'CitationPartType')
+
+# Every table a timeline is built from.
+SOURCE_MODELS = NAMED_LOOKUPS + (
+    'Persona',
+    'Assertion',
+    'Event',
+    'Characteristic',
+    'CharacteristicPart',
+    'CitationPart',
+    'Place',
+    'PlacePart',
+)
+
+TimelineEntry = collections.namedtuple(
+    'TimelineEntry',
+    'kind id type description roles date_start date_end place_id place '
+    'assertions sources'
+)
+TimelineEntry.__doc__ = """One event or characteristic in a timeline.
+
+    kind -- 'E' for an event or 'C' for a characteristic
+    id -- the event's or characteristic's id
+    type -- the event type name, or the type name of the
+        characteristic's first part (e.g. 'Occupation')
+    description -- the event name, or the characteristic's parts
+    roles -- the distinct roles the assertions give the persona
+    date_start -- the earlier date bound
+    date_end -- the later date bound
+    place_id -- the place's id
+    place -- the place's display name
+    assertions -- the ids of the assertions naming it
+    sources -- (source id, citation) pairs of those assertions
+    """
+
+
+def _timeline_key(persona):
+    """Build the cache key holding a persona's current timeline."""
+    return 'researcher:timeline:%d:%d' % (
+        persona, version('timeline:%d' % persona)
+    )
+
+
+def _place_keys(places):
+    """Build the cache keys holding places' current display names.
+
+    Arguments:
+        places -- place ids
+    Returns: a dict of keys by place id
+    """
+    places = list(places)
+    return dict(
+        (place, 'researcher:place-name:%d:%d' % (place, current))
+        for place, current in zip(places, named_versions(
+            ['place:%d' % place for place in places]
+        ))
+    )
+
+
+def place_names(places):
+    """Find the display names of places, as Place.__str__ gives them.
+
+    Arguments:
+        places -- place ids
+    Returns: a dict of display names by place id; one query for the
+        places not already cached
+    """
+    keys = _place_keys(set(places) - set([None]))
+    found = cache.get_many(list(keys.values()))
+    names = dict(
+        (place, found[key]) for place, key in keys.items() if key in found
+    )
+    missing = [place for place in keys if place not in names]
+    if missing:
+        PlacePart = apps.get_model('researcher', 'PlacePart')
+        parts = collections.defaultdict(list)
+        descending = set()
+        for batch in batches(missing):
+            for place, number, name, order in PlacePart.objects.filter(
+                    place__in=batch).values_list(
+                        'place_id', 'sequence_number', 'name',
+                        'place__sort_order'):
+                parts[place].append((number, name))
+                if order == 'D':
+                    descending.add(place)
+        fresh = {}
+        for place in missing:
+            names[place] = ', '.join(
+                name for number, name in
+                sorted(parts[place], reverse=place in descending)
+            )
+            fresh[keys[place]] = names[place]
+        if not replicas.reading_replicas():
+            cache.set_many(fresh, CACHE_TIMEOUT)
+    return names
+
+
+def _assemble(persona):
+    """Build a persona's timeline entries, without place names.
+
+    Arguments:
+        persona -- the persona's id
+    Returns: a list of TimelineEntry, in date order
+    """
+    Source = apps.get_model('researcher', 'Source')
+    context = loaders.current() or loaders.LoaderContext()
+
+    subjects = collections.OrderedDict()
+    for assertion in context.persona_assertions([persona])[persona]:
+        sides = (
+            (assertion.subject1_type, assertion.subject1),
+            (assertion.subject2_type, assertion.subject2),
+        )
+        if assertion.disproved or ('P', persona) not in sides:
+            continue
+        subject = sides[1] if sides[0] == ('P', persona) else sides[0]
+        if subject[0] not in ('E', 'C'):
+            continue
+        found = subjects.setdefault(subject, ([], [], []))
+        found[0].append(assertion.pk)
+        role = assertion.value_role
+        if role and role not in found[1]:
+            found[1].append(role)
+        source = assertion.source_id
+        if source is not None and source not in found[2]:
+            found[2].append(source)
+
+    # Every load is queued before any is read, so that each kind of
+    # subject, and then the characteristics' parts, cost one query.
+    pending = [
+        (subject, context.load(
+            'researcher.' + loaders.SUBJECT_MODELS[subject[0]], subject[1]
+        ))
+        for subject in subjects
+    ]
+    loaded = dict((subject, value.get()) for subject, value in pending)
+    context.walk(
+        [obj for (kind, pk), obj in loaded.items() if kind == 'C'],
+        'characteristicpart_set'
+    )
+    details = {}
+    for (kind, pk), obj in loaded.items():
+        if obj is None:
+            continue
+        if kind == 'E':
+            details[kind, pk] = (
+                lookup('EventType').get(obj.event_type_id).name,
+                obj.name, obj.date_start, obj.date_end, obj.place_id
+            )
+        else:
+            ordered = obj.ordered_characteristic_parts()
+            details[kind, pk] = (
+                ordered[0].characteristic_part_type_name if ordered
+                else '',
+                str(obj), obj.date_start, obj.date_end, obj.place_id
+            )
+
+    sources = set()
+    for assertions, roles, cited in subjects.values():
+        sources.update(cited)
+    parts = context.loader('researcher.CitationPart', 'source', many=True)
+    pending = [(source, parts.load(source)) for source in sources]
+    citations = dict(
+        (source, Source.format_citation(value.get()))
+        for source, value in pending
+    )
+
+    entries = []
+    for (kind, pk), (assertions, roles, cited) in subjects.items():
+        if (kind, pk) not in details:
+            continue
+        type_name, description, start, end, place = details[kind, pk]
+        entries.append(TimelineEntry(
+            kind, pk, type_name, description, tuple(roles),
+            min(start, end), max(start, end), place, None,
+            tuple(assertions),
+            tuple((source, citations[source]) for source in cited)
+        ))
+    entries.sort(key=lambda entry: (
+        entry.date_start, entry.date_end, entry.kind, entry.id
+    ))
+    return entries
+
+
+def timeline(persona):
+    """Build a persona's timeline, from the cache when it is current.
+
+    Arguments:
+        persona -- the persona's id
+    Returns: a list of TimelineEntry, in date order
+    """
+    key = _timeline_key(persona)
+    versions = table_versions([
+        apps.get_model('researcher', name) for name in NAMED_LOOKUPS
+    ])
+    found = cache.get(key)
+    if found is not None and found[0] == versions:
+        entries = found[1]
+    else:
+        entries = _assemble(persona)
+        if not replicas.reading_replicas():
+            cache.set(key, (versions, entries), CACHE_TIMEOUT)
+    names = place_names(entry.place_id for entry in entries)
+    return [
+        entry._replace(place=names.get(entry.place_id, ''))
+        for entry in entries
+    ]
+
+
+def invalidate(personas):
+    """Move the cached timelines of some personas out of use.
+
+    Arguments:
+        personas -- persona ids
+    """
+    for persona in set(personas):
+        bump_version('timeline:%d' % persona)
+
+
+def _personas_of(kind, pk):
+    """List the personas tied by assertions to an event or characteristic."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    return personas_named(Assertion.objects.filter(
+        Q(subject1_type=kind, subject1=pk) |
+        Q(subject2_type=kind, subject2=pk)
+    ))
+
+
+def _assertion_changed(instance, before, raw, deleted):
+    """Drop the timelines of the personas an assertion names or named."""
+    invalidate(subject_personas(subjects_of(instance)) + (
+        subject_personas(subjects_of(before)) if before is not None else []
+    ))
+
+
+def _event_changed(sender, instance, **kwargs):
+    """Signal receiver for saved and deleted events."""
+    invalidate(_personas_of('E', instance.pk))
+
+
+def _characteristic_changed(sender, instance, **kwargs):
+    """Signal receiver for saved and deleted characteristics."""
+    invalidate(_personas_of('C', instance.pk))
+
+
+def _characteristic_part_changed(sender, instance, **kwargs):
+    """Signal receiver for saved and deleted characteristic parts."""
+    invalidate(_personas_of('C', instance.characteristic_id))
+
+
+def _citation_part_changed(sender, instance, **kwargs):
+    """Signal receiver for saved and deleted citation parts."""
+    Assertion = apps.get_model('researcher', 'Assertion')
+    invalidate(personas_named(
+        Assertion.objects.filter(source=instance.source_id)
+    ))
+
+
+def _place_changed(sender, instance, **kwargs):
+    """Signal receiver for saved and deleted places."""
+    bump_version('place:%d' % instance.pk)
+
+
+def _place_part_changed(sender, instance, **kwargs):
+    """Signal receiver for saved and deleted place parts."""
+    bump_version('place:%d' % instance.place_id)
+
+
+def connect_signals():
+    """Drop cached timelines and place names as their rows change."""
+    on_assertion_change(_assertion_changed)
+    for name, receiver in (
+            ('Event', _event_changed),
+            ('Characteristic', _characteristic_changed),
+            ('CharacteristicPart', _characteristic_part_changed),
+            ('CitationPart', _citation_part_changed),
+            ('Place', _place_changed),
+            ('PlacePart', _place_part_changed)):
+        model = apps.get_model('researcher', name)
+        uid = 'researcher.timeline.%s' % name
+        post_save.connect(receiver, sender=model, dispatch_uid=uid)
+        post_delete.connect(receiver, sender=model, dispatch_uid=uid)
@@ -0,0 +1,23 @@
+"""Route the researcher JSON API."""
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns(
+    'researcher.api',
+    url(
+        r'^personas/(?P<pk>\d+)/(?P<kind>pedigree|descendants)/$',
+        'chart_view',
+        name='api_chart'
+    ),
+    url(
+        r'^personas/(?P<pk>\d+)/timeline/$',
+        'timeline_view',
+        name='api_timeline'
+    ),
+    url(r'^projects/(?P<pk>\d+)/gaps/$', 'gaps_view', name='api_gaps'),
+    url(r'^(?P<resource_name>\w+)/$', 'list_view', name='api_list'),
+    url(
+        r'^(?P<resource_name>\w+)/(?P<pk>\d+)/$',
+        'detail_view',
+        name='api_detail'
+    ),
+)
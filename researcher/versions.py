@@ -0,0 +1,230 @@
+"""Track a version number for each researcher table.
+
+Every save or delete of a researcher model bumps a counter for its table
+in the Django cache.  Anything derived from a table (an in-memory copy,
+an HTTP ETag, a cached report) can record the version it was built from
+and rebuild when the version moves.  Bulk operations that bypass model
+signals (QuerySet.update, bulk_create) must call bump_table_version
+themselves.  Named counters (version, bump_version) work the same way
+for derived data that only changes on some writes to a table.
+
+A bump inside a transaction is seen by other processes before the
+transaction commits, so one of them may read the old rows and keep them
+under the new version.  Counters bumped inside a transaction are
+therefore bumped again once no transaction is open: at the end of each
+request (with VersionMiddleware), job and command, at the next bump or
+read after it, or when bump_committed is called.
+
+The counters, and the timelines, charts and worklists cached under them,
+must be seen by every process, so CACHES['default'] has to be shared
+between them (memcached, the database cache, ...).  A local-memory cache
+gives each process counters of its own, and one process would answer
+with an ETag or a cached page another process has already changed; the
+check_shared_cache system check reports it as researcher.E001.
+
+Exports:
+    Functions:
+        bump_committed
+        bump_table_version
+        bump_version
+        check_shared_cache
+        connect_signals
+        named_versions
+        table_version
+        table_versions
+        version
+    Classes:
+        VersionMiddleware
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.core import checks
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+
+_local = threading.local()
+
+
+def _version_key(model):
+    """Build the cache key holding a table's version."""
+    return 'researcher:version:%s' % model._meta.db_table
+
+
+def _initial_version():
+    """Start a counter somewhere no earlier counter could have reached.
+
+    A counter evicted from the cache restarts at the current time in
+    milliseconds, so readers holding a version from before the eviction
+    still see it change.
+    """
+    return int(time.time() * 1000)
+
+
+def _in_transaction():
+    """Tell whether the thread has a transaction open on any database."""
+    return any(connections[alias].in_atomic_block for alias in connections)
+
+
+def _settle():
+    """Bump again the counters of transactions that have ended."""
+    pending = getattr(_local, 'pending', None)
+    if not pending or _in_transaction():
+        return
+    _local.pending = set()
+    for key in pending:
+        _move(key)
+
+
+def bump_committed():
+    """Bump again the counters bumped inside transactions now ended.
+
+    Call after committing a transaction that saved researcher rows, if
+    readers should not wait for the end of the request, job or command.
+    """
+    _settle()
+
+
+def _read(key):
+    """Read a counter, starting it if it is not in the cache."""
+    _settle()
+    version = cache.get(key)
+    if version is None:
+        version = _initial_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _move(key):
+    """Move a counter on, restarting it if it is not in the cache."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), None)
+
+
+def _increment(key):
+    """Move a counter on, and again after the open transaction ends."""
+    _settle()
+    _move(key)
+    if _in_transaction():
+        if getattr(_local, 'pending', None) is None:
+            _local.pending = set()
+        _local.pending.add(key)
+
+
+def table_version(model):
+    """Read the current version of a model's table.
+
+    Arguments:
+        model -- the model class
+    Returns: the version number
+    """
+    return _read(_version_key(model))
+
+
+def table_versions(models):
+    """Read the current versions of several tables at once.
+
+    Arguments:
+        models -- the model classes
+    Returns: a list of version numbers, in the order of `models`
+    """
+    _settle()
+    keys = [_version_key(model) for model in models]
+    found = cache.get_many(keys)
+    return [
+        found[key] if key in found else table_version(model)
+        for key, model in zip(keys, models)
+    ]
+
+
+def bump_table_version(model):
+    """Record that a model's table has changed.
+
+    Arguments:
+        model -- the model class
+    """
+    _increment(_version_key(model))
+
+
+def version(name):
+    """Read the current version of a named counter.
+
+    Arguments:
+        name -- the counter's name, e.g. 'lineage'
+    Returns: the version number
+    """
+    return _read('researcher:version:@%s' % name)
+
+
+def named_versions(names):
+    """Read the current versions of several named counters at once.
+
+    Arguments:
+        names -- the counters' names
+    Returns: a list of version numbers, in the order of `names`
+    """
+    _settle()
+    keys = ['researcher:version:@%s' % name for name in names]
+    found = cache.get_many(keys)
+    return [found[key] if key in found else _read(key) for key in keys]
+
+
+def bump_version(name):
+    """Record that the data behind a named counter has changed.
+
+    Arguments:
+        name -- the counter's name
+    """
+    _increment('researcher:version:@%s' % name)
+
+
+def _bump(sender, **kwargs):
+    """Signal receiver that bumps the sender's table version."""
+    bump_table_version(sender)
+
+
+def connect_signals():
+    """Bump table versions whenever a researcher model row changes."""
+    for model in apps.get_app_config('researcher').get_models():
+        uid = 'researcher.versions.%s' % model.__name__
+        post_save.connect(_bump, sender=model, dispatch_uid=uid)
+        post_delete.connect(_bump, sender=model, dispatch_uid=uid)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """Report a default cache that other processes cannot see.
+
+    Arguments:
+        app_configs -- the applications being checked, or None for all
+    Returns: a list of checks.Error
+    """
+    if not isinstance(caches['default'], LocMemCache):
+        return []
+    return [checks.Error(
+        'The default cache is local to each process, so table versions '
+        'and the data cached under them differ between processes.',
+        hint='Set CACHES[\'default\'] to a cache shared by every process, '
+             'such as memcached; with a single process, add '
+             '\'researcher.E001\' to SILENCED_SYSTEM_CHECKS.',
+        obj='CACHES',
+        id='researcher.E001',
+    )]
+
+
+class VersionMiddleware(object):
+
+    """Bump again, after the request, the versions its transactions bumped.
+
+    Comes first, so that it runs after ATOMIC_REQUESTS has committed.
+    """
+
+    def process_response(self, request, response):
+        """Settle the versions bumped during the request."""
+        _settle()
+        return response
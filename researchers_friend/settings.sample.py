@@ -40,13 +40,20 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'researcher.versions.VersionMiddleware',
+    'researcher.profiling.ProfileMiddleware',
+    'researcher.querylog.QueryLogMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'researcher.shards.ProjectShardMiddleware',
+    'researcher.replicas.ReplicaMiddleware',
+    'researcher.history.HistoryMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'researcher.loaders.LoaderMiddleware',
 )
 
 ROOT_URLCONF = 'researchers_friend.urls'
@@ -57,6 +64,8 @@ WSGI_APPLICATION = 'researchers_friend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
 
+# To capture slow queries (see RESEARCHER_SLOW_QUERY_MS), use the ENGINE
+# 'researcher.backends.postgresql_psycopg2' or 'researcher.backends.sqlite3'.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -67,6 +76,53 @@ DATABASES = {
     }
 }
 
+# Projects can be kept in databases of their own (see researcher.shards).
+# List the DATABASES aliases that may hold projects, default first; add a
+# database, run `manage.py prepare_shard <alias>`, then move projects
+# with `manage.py move_project <project_id> <alias>`.  For example, a
+# SQLite file for one project:
+#
+#     DATABASES['shard1'] = {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': os.path.join(BASE_DIR, 'shard1.sqlite3'),
+#     }
+#     RESEARCHER_SHARDS = ['default', 'shard1']
+RESEARCHER_SHARDS = ['default']
+
+# Each shard hands out ids from its own range of this many (the Nth shard
+# from N times it); the default database must stay below it.
+RESEARCHER_SHARD_ID_SPAN = 10 ** 8
+
+# Seconds a process may go on using the old database of a moved project,
+# and seconds a move waits, with the project frozen, for writes under way.
+RESEARCHER_SHARD_REFRESH = 1.0
+RESEARCHER_SHARD_FREEZE_GRACE = 5.0
+
+# Read replicas of each database alias (see researcher.replicas), read by
+# the views named below, by reporting commands and by analytics jobs.  A
+# local stand-in, refreshed by `manage.py refresh_replica replica`:
+#
+#     DATABASES['replica'] = {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+#     }
+#     RESEARCHER_REPLICAS = {'default': ['replica']}
+RESEARCHER_REPLICAS = {}
+RESEARCHER_REPLICA_VIEWS = (
+    'api:api_chart',
+    'api:api_timeline',
+    'api:api_gaps',
+)
+
+# Seconds a session reads from the primaries after it writes; longer than
+# the replicas lag.
+RESEARCHER_REPLICA_PIN_SECONDS = 10
+
+DATABASE_ROUTERS = [
+    'researcher.replicas.ReplicaRouter',
+    'researcher.shards.ProjectRouter',
+]
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
@@ -92,3 +148,186 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Template files
 TEMPLATE_DIRS = [os.path.join(BASE_DIR, 'templates')]
+
+# Researcher's Friend
+
+# Above this many rows (by planner estimate), large admin changelists show
+# an approximate count instead of running COUNT(*).
+RESEARCHER_APPROXIMATE_COUNT_THRESHOLD = 100000
+
+# Table version counters (researcher.versions), and the ETags, timelines,
+# charts and worklists kept under them, live in the default cache, which
+# every process must share: the checks refuse a local-memory cache.  The
+# database cache (after `manage.py createcachetable`) is shared too, but
+# costs queries of its own that the RESEARCHER_QUERY_BUDGETS below leave
+# no room for:
+#     'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+#     'LOCATION': 'researcher_cache',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
+
+# Lookup tables (place part types, citation part types, ...) are kept in
+# memory by every worker and reloaded when their version counter changes.
+# Seconds a worker trusts its copy before checking the version counter.
+RESEARCHER_LOOKUP_CACHE_CHECK_INTERVAL = 1.0
+
+# Role names that make a persona a parent or a child of the others named in
+# the same birth/baptism event or family group (see researcher.relationships).
+RESEARCHER_PARENT_ROLES = ('Father', 'Mother', 'Parent')
+RESEARCHER_CHILD_ROLES = ('Child', 'Son', 'Daughter')
+# Personas whose ancestor sets each worker keeps in memory.
+RESEARCHER_ANCESTOR_CACHE_SIZE = 10000
+
+# Pedigree charts number a child's father 2n and mother 2n + 1 by these
+# roles (see researcher.charts).
+RESEARCHER_FATHER_ROLES = ('Father',)
+RESEARCHER_MOTHER_ROLES = ('Mother',)
+RESEARCHER_CHART_MAX_GENERATIONS = 16
+# Seconds a built chart stays in the cache (it is rebuilt sooner if the
+# family links, personas or events change).
+RESEARCHER_CHART_CACHE_TIMEOUT = 86400
+
+# Where `manage.py build_network` saves projects' family network arrays
+# (researcher.network, which needs NumPy).
+RESEARCHER_NETWORK_DIR = os.path.join(BASE_DIR, 'network')
+
+# Seconds a persona's timeline stays in the cache (it is dropped sooner when
+# the assertions, events or characteristics it shows change).
+RESEARCHER_TIMELINE_CACHE_TIMEOUT = 86400
+
+# Threads researcher.kinship computes kinship and inbreeding coefficients
+# with (it needs NumPy and SciPy); None uses one per CPU.
+RESEARCHER_KINSHIP_WORKERS = None
+
+# Event types researcher.conflicts expects a persona to take part in only
+# once in the given roles; events at dates that do not overlap conflict.
+RESEARCHER_SINGLE_EVENT_ROLES = {
+    'Birth': ('Child', 'Principal'),
+    'Death': ('Deceased', 'Principal'),
+}
+
+# Characteristic part types a persona has only one value of.
+RESEARCHER_SINGLE_VALUED_CHARACTERISTICS = ('Sex',)
+
+# Event types researcher.sanity treats as marriages, the roles of the
+# couple in them, and the age below which a persona marrying is reported.
+RESEARCHER_MARRIAGE_EVENT_TYPES = ('Marriage',)
+RESEARCHER_SPOUSE_ROLES = ('Groom', 'Bride', 'Spouse')
+RESEARCHER_MIN_MARRIAGE_AGE = 12
+
+# Processes researcher.sanity.validate_project checks a project with; None
+# uses one per CPU.
+RESEARCHER_SANITY_WORKERS = None
+
+# Seconds a project's list of sanity problems stays in the cache (it is
+# rebuilt sooner whenever a check runs).
+RESEARCHER_SANITY_CACHE_TIMEOUT = 86400
+
+# researcher.gaps reports personas cited by fewer sources than this, and
+# those whose surest assertion ranks above this surety sequence number.
+RESEARCHER_GAP_MIN_SOURCES = 2
+RESEARCHER_GAP_LOW_SURETY_RANK = 2
+
+# Seconds a project's research-gap worklist stays in the cache (it is
+# rebuilt sooner whenever gaps are refreshed).
+RESEARCHER_GAP_CACHE_TIMEOUT = 86400
+
+# Share of requests researcher.querylog.QueryLogMiddleware records, from 0
+# to 1; each writes a JSON summary of its queries, their repeated statements
+# and where those came from to the 'researcher.queries' logger.
+RESEARCHER_QUERY_SAMPLE_RATE = 0.0
+
+# Queries a view may make, by URL name; a recorded request over its budget
+# is logged as a warning.
+RESEARCHER_QUERY_BUDGETS = {
+    'admin:researcher_assertion_changelist': 12,
+    'admin:researcher_persona_changelist': 12,
+    'admin:researcher_citationpart_changelist': 12,
+    'admin:researcher_search_changelist': 12,
+    'admin:researcher_source_change': 20,
+    'admin:researcher_assertion_change': 20,
+    'admin:researcher_place_change': 20,
+    'api:api_list': 8,
+    'api:api_timeline': 8,
+    'api:api_gaps': 8,
+}
+
+# Record every request and fail those over their budget instead of logging
+# them; for test settings.
+RESEARCHER_QUERY_BUDGET_STRICT = False
+
+# Log the queries of every run of the researcher management commands.
+RESEARCHER_QUERY_LOG_COMMANDS = False
+
+# Repeats of one statement that researcher.querylog reports as a storm.
+RESEARCHER_QUERY_DUPLICATE_THRESHOLD = 5
+
+# researcher.profiling.ProfileMiddleware profiles requests whose
+# X-Researcher-Profile header matches this token, and a share (0 to 1) of
+# all requests; with neither it does nothing.
+RESEARCHER_PROFILE_TOKEN = None
+RESEARCHER_PROFILE_SAMPLE_RATE = 0.0
+
+# Where profiles (flamegraph .folded files and SQL timelines) are written,
+# how many of the newest are kept, and the seconds between stack samples.
+RESEARCHER_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+RESEARCHER_PROFILE_KEEP = 100
+RESEARCHER_PROFILE_INTERVAL = 0.005
+
+# With a researcher.backends ENGINE, statements taking this many
+# milliseconds or more are appended to the slow-query log, which is rotated
+# at the given size; `manage.py slow_queries` explains them and suggests
+# indexes.  None captures nothing.
+RESEARCHER_SLOW_QUERY_MS = None
+RESEARCHER_SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'slow-queries.jsonl')
+RESEARCHER_SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024
+# Log slow statements' parameters too (researchers' data, in plain text);
+# needed to explain statements that take parameters.
+RESEARCHER_SLOW_QUERY_PARAMS = False
+
+# researcher.jobs: the times a job may be started, the seconds before a
+# failed job is retried (doubled at each attempt), the seconds after which
+# a job whose worker stopped answering is queued again, and the seconds an
+# idle worker waits between looks at the queue.
+RESEARCHER_JOB_MAX_ATTEMPTS = 3
+RESEARCHER_JOB_RETRY_DELAY = 60
+RESEARCHER_JOB_STALE_SECONDS = 300
+RESEARCHER_JOB_POLL_INTERVAL = 2
+
+# The file the workers of one machine lock while claiming a job on
+# databases without SKIP LOCKED (SQLite).
+RESEARCHER_JOB_LOCK_FILE = os.path.join(BASE_DIR, 'jobs.lock')
+
+# researcher.importer: the processes that parse and write an import (None
+# for one per CPU), the GEDCOM event tags of individuals and families with
+# the event types and roles they become, and the place part types, largest
+# first, of a comma-separated GEDCOM place.
+RESEARCHER_IMPORT_WORKERS = None
+RESEARCHER_IMPORT_EVENTS = {
+    'BIRT': ('Birth', 'Child'),
+    'CHR': ('Christening', 'Child'),
+    'BAPM': ('Baptism', 'Child'),
+    'DEAT': ('Death', 'Deceased'),
+    'BURI': ('Burial', 'Deceased'),
+}
+RESEARCHER_IMPORT_FAMILY_EVENTS = {
+    'MARR': ('Marriage', 'Groom', 'Bride'),
+}
+RESEARCHER_IMPORT_PLACE_PARTS = ('Country', 'State', 'County', 'Town')
+
+# researcher.history: every this many revisions of a row hold all its
+# fields, so rebuilding a row's past state reads at most this many.
+RESEARCHER_HISTORY_KEYFRAME = 16
+
+# researcher.archive: disproved assertions unchanged for this many days
+# are moved to compressed archive batches (`manage.py archive_assertions`),
+# this many to a batch, and batches this many days old are moved to files
+# in the directory below (None keeps them in the database).
+RESEARCHER_ARCHIVE_AFTER_DAYS = 365
+RESEARCHER_ARCHIVE_BATCH = 2000
+RESEARCHER_ARCHIVE_FILE_AFTER_DAYS = None
+RESEARCHER_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')